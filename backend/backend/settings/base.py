@@ -1,4 +1,5 @@
 import json
+import sys
 from pathlib import Path
 from .env_config import EnvironmentConfig
 
@@ -36,7 +37,7 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -45,8 +46,8 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'common.throttles.AnonRateThrottle',
+        'common.throttles.UserRateThrottle',
     ] if EnvironmentConfig.is_production() else [],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '120/minute',
@@ -72,7 +73,7 @@ SPECTACULAR_SETTINGS = {
     'DESCRIPTION': 'API documentation for the e-commerce system',
     'VERSION': '1.0.0',
     'SERVE_PERMISSIONS': ['rest_framework.permissions.IsAdminUser'] if EnvironmentConfig.is_production() else ['rest_framework.permissions.AllowAny'],
-    'SERVE_AUTHENTICATION': ['rest_framework_simplejwt.authentication.JWTAuthentication'] if EnvironmentConfig.is_production() else None,
+    'SERVE_AUTHENTICATION': ['users.authentication.CachedJWTAuthentication'] if EnvironmentConfig.is_production() else None,
     'SCHEMA_PATH_PREFIX': r'/api',
     'CONTACT': {
         'name': 'API Support',
@@ -227,6 +228,13 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 图片衍生图：宽度档位、编码质量、生成方式（thread 后台线程 / inline 提交后同步 / command 仅由 build_image_variants 生成）
+MEDIA_IMAGE_VARIANT_WIDTHS = [
+    int(width) for width in EnvironmentConfig.get_env('MEDIA_IMAGE_VARIANT_WIDTHS', '240,480,960').split(',') if width.strip()
+]
+MEDIA_IMAGE_VARIANT_QUALITY = int(EnvironmentConfig.get_env('MEDIA_IMAGE_VARIANT_QUALITY', '80'))
+MEDIA_IMAGE_VARIANT_MODE = EnvironmentConfig.get_env('MEDIA_IMAGE_VARIANT_MODE', 'thread')
+
 # Default file storage: local filesystem for development;
 # override in production to use CDN-backed storage via env or settings.production
 DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
@@ -242,6 +250,54 @@ CACHES = {
     }
 }
 
+# 客服消息推送：广播器（默认按会话轮询数据库，跨 worker/主机可用；同机多 worker 也可用
+# support.events.LocalSocketChatBroker）、数据库轮询间隔、SSE 心跳与单次连接时长
+# （WSGI 下另有上限，避免长时间占用 worker 线程）、长轮询最长等待秒数
+SUPPORT_CHAT_BROKER = EnvironmentConfig.get_env('SUPPORT_CHAT_BROKER', 'support.events.DatabaseChatBroker')
+SUPPORT_CHAT_DB_POLL_INTERVAL = float(EnvironmentConfig.get_env('SUPPORT_CHAT_DB_POLL_INTERVAL', '2'))
+SUPPORT_CHAT_SOCKET_DIR = EnvironmentConfig.get_env('SUPPORT_CHAT_SOCKET_DIR', '/tmp/support-chat')
+SUPPORT_CHAT_STREAM_HEARTBEAT = int(EnvironmentConfig.get_env('SUPPORT_CHAT_STREAM_HEARTBEAT', '15'))
+SUPPORT_CHAT_STREAM_MAX_SECONDS = int(EnvironmentConfig.get_env('SUPPORT_CHAT_STREAM_MAX_SECONDS', '300'))
+SUPPORT_CHAT_WSGI_STREAM_MAX_SECONDS = int(EnvironmentConfig.get_env('SUPPORT_CHAT_WSGI_STREAM_MAX_SECONDS', '25'))
+SUPPORT_CHAT_POLL_TIMEOUT = int(EnvironmentConfig.get_env('SUPPORT_CHAT_POLL_TIMEOUT', '25'))
+
+# 接口限流计数存储：生产默认使用 THROTTLE_SQLITE_PATH 下的 SQLite 文件，所有 worker 共享
+# （Compose 中以 throttle_data 卷挂载，重启不丢失）；开发环境单进程，使用默认缓存。
+# 改用 CacheThrottleStore 时 THROTTLE_CACHE_ALIAS 必须是共享缓存，生产环境指向本地内存缓存会启动失败。
+# 计数存储异常时放行请求，不返回 500
+THROTTLE_STORE = EnvironmentConfig.get_env(
+    'THROTTLE_STORE',
+    'common.throttle_store.SQLiteThrottleStore' if EnvironmentConfig.is_production()
+    else 'common.throttle_store.CacheThrottleStore',
+)
+THROTTLE_SQLITE_PATH = EnvironmentConfig.get_env('THROTTLE_SQLITE_PATH', str(BASE_DIR / 'var' / 'throttle.sqlite3'))
+THROTTLE_CACHE_ALIAS = EnvironmentConfig.get_env('THROTTLE_CACHE_ALIAS', 'default')
+
+# JWT 认证用户信息缓存：有效期（秒）内请求不查询用户表，停用/改角色最迟在有效期后生效；
+# 多机部署可指向共享缓存，使失效立即对所有 worker 生效
+AUTH_PRINCIPAL_CACHE_TTL = int(EnvironmentConfig.get_env('AUTH_PRINCIPAL_CACHE_TTL', '60'))
+AUTH_PRINCIPAL_CACHE_ALIAS = EnvironmentConfig.get_env('AUTH_PRINCIPAL_CACHE_ALIAS', 'default')
+
+# 分类树进程内缓存的最长使用时间（秒）；默认缓存跨进程共享时分类变化会立即生效
+CATEGORY_TREE_TTL = int(EnvironmentConfig.get_env('CATEGORY_TREE_TTL', '60'))
+
+# 相关商品索引：每个商品保留的近邻数、每个分类取的候选数、共同购买统计天数；
+# 刷新方式 thread（默认，影响得分的字段变化后提交时交给后台线程刷新）/ inline（同上，改为同步刷新）/ command（仅由 build_related_products 重建）
+# manage.py test 下默认 command，避免后台线程在测试用例之外读写测试库
+RELATED_PRODUCTS_TOP_N = int(EnvironmentConfig.get_env('RELATED_PRODUCTS_TOP_N', '40'))
+RELATED_PRODUCTS_CANDIDATES = int(EnvironmentConfig.get_env('RELATED_PRODUCTS_CANDIDATES', '200'))
+RELATED_PRODUCTS_COPURCHASE_DAYS = int(EnvironmentConfig.get_env('RELATED_PRODUCTS_COPURCHASE_DAYS', '180'))
+RELATED_PRODUCTS_REFRESH_MODE = EnvironmentConfig.get_env(
+    'RELATED_PRODUCTS_REFRESH_MODE',
+    'command' if sys.argv[1:2] == ['test'] else 'thread',
+)
+
+# 共同购买推荐：每个商品保留的近邻数、最低共同订单数、提升度收缩系数、个性化推荐参考的最近购买商品数
+RECOMMENDATION_TOP_K = int(EnvironmentConfig.get_env('RECOMMENDATION_TOP_K', '30'))
+RECOMMENDATION_MIN_SUPPORT = int(EnvironmentConfig.get_env('RECOMMENDATION_MIN_SUPPORT', '2'))
+RECOMMENDATION_SHRINKAGE = float(EnvironmentConfig.get_env('RECOMMENDATION_SHRINKAGE', '5'))
+RECOMMENDATION_RECENT_PURCHASES = int(EnvironmentConfig.get_env('RECOMMENDATION_RECENT_PURCHASES', '20'))
+
 # Logging configuration
 from common.logging_config import get_logging_config
 LOGGING = get_logging_config()
@@ -249,6 +305,9 @@ LOGGING = get_logging_config()
 # WeChat Mini Program Configuration
 WECHAT_APPID = EnvironmentConfig.get_env('WECHAT_APPID', '')
 WECHAT_SECRET = EnvironmentConfig.get_env('WECHAT_SECRET', '')
+# access_token 接口地址与提前刷新秒数（所有进程共用 integrations.WeChatAccessToken 中的凭证）
+WECHAT_TOKEN_URL = EnvironmentConfig.get_env('WECHAT_TOKEN_URL', 'https://api.weixin.qq.com/cgi-bin/token')
+WECHAT_ACCESS_TOKEN_REFRESH_MARGIN = int(EnvironmentConfig.get_env('WECHAT_ACCESS_TOKEN_REFRESH_MARGIN', '300'))
 # Subscription message templates: JSON string or comma-separated key:template pairs
 def _load_subscribe_templates():
     raw = EnvironmentConfig.get_env('WECHAT_SUBSCRIBE_TEMPLATES', '')
@@ -283,6 +342,14 @@ WECHAT_SHIPPING_ORDER_NUMBER_TYPE = int(EnvironmentConfig.get_env('WECHAT_SHIPPI
 WECHAT_SHIPPING_LOGISTICS_TYPE = int(EnvironmentConfig.get_env('WECHAT_SHIPPING_LOGISTICS_TYPE', '1'))
 WECHAT_SHIPPING_DELIVERY_MODE = int(EnvironmentConfig.get_env('WECHAT_SHIPPING_DELIVERY_MODE', '1'))
 WECHAT_SHIPPING_RETRY_INTERVAL_MINUTES = int(EnvironmentConfig.get_env('WECHAT_SHIPPING_RETRY_INTERVAL_MINUTES', '10'))
+# 失败重试按重试次数指数退避（带抖动），上限 WECHAT_SHIPPING_RETRY_MAX_MINUTES；WORKERS 为单进程并发上传数
+WECHAT_SHIPPING_RETRY_MAX_MINUTES = int(EnvironmentConfig.get_env('WECHAT_SHIPPING_RETRY_MAX_MINUTES', '720'))
+WECHAT_SHIPPING_RETRY_WORKERS = int(EnvironmentConfig.get_env('WECHAT_SHIPPING_RETRY_WORKERS', '4'))
+# 店铺分账渠道客户端（点分路径，如 orders.profit_sharing_settlement.WechatProfitSharingClient），留空则分账结算停用、仅人工结算；
+# WORKERS 为单进程并发请求数，SHARE_LIMIT 为后台“分账”接口单次请求最多认领的流水数
+PROFIT_SHARING_CLIENT = EnvironmentConfig.get_env('PROFIT_SHARING_CLIENT', '')
+PROFIT_SHARING_WORKERS = int(EnvironmentConfig.get_env('PROFIT_SHARING_WORKERS', '4'))
+PROFIT_SHARING_SHARE_LIMIT = int(EnvironmentConfig.get_env('PROFIT_SHARING_SHARE_LIMIT', '200'))
 
 # WeChat Pay Configuration (for future use)
 WECHAT_PAY_MCHID = EnvironmentConfig.get_env('WECHAT_PAY_MCHID', '')
@@ -312,6 +379,9 @@ HAIER_SEND_TO_CODE = EnvironmentConfig.get_env('HAIER_SEND_TO_CODE', '')
 HAIER_SUPPLIER_CODE = EnvironmentConfig.get_env('HAIER_SUPPLIER_CODE', '')
 HAIER_PASSWORD = EnvironmentConfig.get_env('HAIER_PASSWORD', '')
 HAIER_SELLER_PASSWORD = EnvironmentConfig.get_env('HAIER_SELLER_PASSWORD', '')
+# 海尔库存查询结果缓存秒数与下单时并发预取的线程数
+HAIER_STOCK_CACHE_SECONDS = int(EnvironmentConfig.get_env('HAIER_STOCK_CACHE_SECONDS', '30'))
+HAIER_STOCK_PREFETCH_WORKERS = int(EnvironmentConfig.get_env('HAIER_STOCK_PREFETCH_WORKERS', '4'))
 
 # ============================================================================
 # YLH System API Configuration (for order operations)
@@ -330,6 +400,12 @@ YLH_SHOP_NAME = EnvironmentConfig.get_env('YLH_SHOP_NAME', '默认店铺')
 YLH_CALLBACK_APP_KEY = EnvironmentConfig.get_env('YLH_CALLBACK_APP_KEY', '')
 YLH_CALLBACK_SECRET = EnvironmentConfig.get_env('YLH_CALLBACK_SECRET', '')
 
+# 回调收件箱处理方式：thread（进程内后台线程）、inline（提交后同步处理）、command（仅由 process_callback_inbox 命令处理）
+CALLBACK_INBOX_MODE = EnvironmentConfig.get_env('CALLBACK_INBOX_MODE', 'thread')
+# 处理失败的回调由 process_callback_inbox 自动重试：首次间隔秒数（之后每次翻倍）与最多处理次数
+CALLBACK_INBOX_RETRY_SECONDS = int(EnvironmentConfig.get_env('CALLBACK_INBOX_RETRY_SECONDS', '60'))
+CALLBACK_INBOX_MAX_ATTEMPTS = int(EnvironmentConfig.get_env('CALLBACK_INBOX_MAX_ATTEMPTS', '8'))
+
 # INTEGRATIONS_API_DEBUG = EnvironmentConfig.get_env('INTEGRATIONS_API_DEBUG', 'False').lower() in ('1', 'true', 'yes', 'on')
 # INTEGRATIONS_CALLBACK_DEBUG = EnvironmentConfig.get_env('INTEGRATIONS_CALLBACK_DEBUG', 'False').lower() in ('1', 'true', 'yes', 'on')
 
@@ -337,3 +413,5 @@ INTEGRATIONS_API_DEBUG = True
 INTEGRATIONS_CALLBACK_DEBUG = True
 
 ORDER_PAYMENT_TIMEOUT_MINUTES = int(EnvironmentConfig.get_env('ORDER_PAYMENT_TIMEOUT_MINUTES', '1440'))
+# 共同购买推荐只统计创建超过该时长的订单，默认与支付超时一致
+RECOMMENDATION_SETTLE_MINUTES = int(EnvironmentConfig.get_env('RECOMMENDATION_SETTLE_MINUTES', str(ORDER_PAYMENT_TIMEOUT_MINUTES)))
@@ -61,9 +61,10 @@ class ProductSKUAdmin(admin.ModelAdmin):
 
 @admin.register(MediaImage)
 class MediaImageAdmin(admin.ModelAdmin):
-    list_display = ("id", "original_name", "content_type", "size", "created_at")
-    readonly_fields = ("created_at",)
+    list_display = ("id", "original_name", "content_type", "size", "variants_status", "created_at")
+    readonly_fields = ("created_at", "width", "height", "variants", "variants_updated_at")
     search_fields = ("original_name",)
+    list_filter = ("variants_status",)
 
 
 @admin.register(SearchLog)
@@ -0,0 +1,129 @@
+"""分类树进程内缓存
+
+分类数量少、读多写少，整张表按 (order, id) 读一次构建成内存树，回答"某分类的全部
+下级"和"某分类的面包屑"都不再查库。树按全局版本号缓存：分类保存/删除后递增版本号
+（立即一次、事务提交后再一次），各进程下次访问时发现版本变化再重建。默认缓存不是
+跨进程共享时，其他进程的树最迟在 CATEGORY_TREE_TTL 秒后重建。
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Category
+
+CATEGORY_TREE_VERSION_KEY = 'catalog_category_tree:ver'
+
+
+class CategoryNode:
+    __slots__ = ('id', 'store_id', 'parent_id', 'name', 'order', 'logo', 'level', 'children')
+
+    def __init__(self, row):
+        for name, value in zip(CategoryTree.FIELDS, row):
+            setattr(self, name, value)
+        self.children = []
+
+
+class CategoryTree:
+    FIELDS = ('id', 'store_id', 'parent_id', 'name', 'order', 'logo', 'level')
+
+    def __init__(self, rows):
+        self.nodes = {}
+        for row in rows:
+            node = CategoryNode(row)
+            self.nodes[node.id] = node
+        # rows 已按 (order, id) 排序，子节点顺序与之一致
+        for node in self.nodes.values():
+            parent = self.nodes.get(node.parent_id)
+            if parent is not None:
+                parent.children.append(node)
+        self._subtrees = {}
+
+    @classmethod
+    def load(cls):
+        return cls(Category.objects.order_by('order', 'id').values_list(*cls.FIELDS))
+
+    def get(self, category_id):
+        return self.nodes.get(category_id)
+
+    def children(self, category_id):
+        node = self.nodes.get(category_id)
+        return node.children if node is not None else []
+
+    def subtree_ids(self, category_id):
+        """本分类及全部下级分类ID；未知分类只返回自身"""
+        ids = self._subtrees.get(category_id)
+        if ids is None:
+            collected = [category_id]
+            stack = list(self.children(category_id))
+            while stack:
+                node = stack.pop()
+                collected.append(node.id)
+                stack.extend(node.children)
+            ids = frozenset(collected)
+            self._subtrees[category_id] = ids
+        return ids
+
+    def ancestor_ids(self, category_id):
+        """本分类及全部上级分类ID"""
+        ids = set()
+        node = self.nodes.get(category_id)
+        while node is not None and node.id not in ids:
+            ids.add(node.id)
+            node = self.nodes.get(node.parent_id)
+        return ids
+
+    def breadcrumb(self, category_id):
+        """从根分类到本分类的节点列表"""
+        trail = []
+        node = self.nodes.get(category_id)
+        while node is not None and node not in trail:
+            trail.append(node)
+            node = self.nodes.get(node.parent_id)
+        trail.reverse()
+        return trail
+
+
+_tree = None
+_tree_lock = threading.Lock()
+
+
+def _tree_version():
+    version = cache.get(CATEGORY_TREE_VERSION_KEY)
+    if version is None:
+        cache.add(CATEGORY_TREE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATEGORY_TREE_VERSION_KEY)
+    return version
+
+
+def bump_category_tree():
+    """分类变化后让各进程的分类树失效；事务提交后再失效一次，
+    避免提交前并发请求用旧数据建出的树沿用新版本号。"""
+
+    def _bump():
+        cache.set(CATEGORY_TREE_VERSION_KEY, time.time_ns(), None)
+
+    _bump()
+    transaction.on_commit(_bump, robust=True)
+
+
+def get_category_tree() -> CategoryTree:
+    global _tree
+    version = _tree_version()
+    now = time.monotonic()
+    entry = _tree
+    if entry is not None and entry[0] == version and now < entry[1]:
+        return entry[2]
+    tree = CategoryTree.load()
+    with _tree_lock:
+        _tree = (version, now + getattr(settings, 'CATEGORY_TREE_TTL', 60), tree)
+    return tree
+
+
+def subtree_q(category_id, field='category'):
+    """匹配某分类及其全部下级分类的 Q（field 为指向 Category 的外键名）"""
+    return Q(**{f'{field}_id__in': sorted(get_category_tree().subtree_ids(category_id))})
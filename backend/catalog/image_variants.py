@@ -0,0 +1,297 @@
+"""
+Image derivative pipeline for MediaImage.
+
+Uploads store the original file only. Width-bucketed WebP and JPEG variants are
+produced afterwards by a background worker (or the ``build_image_variants``
+command), and serializers expose them as ``srcset`` strings. When a row turns
+ready, the stores whose products show it get their content version bumped so
+cached storefront payloads pick up the new srcset.
+
+Settings:
+- MEDIA_IMAGE_VARIANT_WIDTHS: width buckets in pixels
+- MEDIA_IMAGE_VARIANT_QUALITY: WebP/JPEG encoder quality
+- MEDIA_IMAGE_VARIANT_MODE: ``thread`` (in-process worker after commit),
+  ``inline`` (generate in the on_commit callback) or ``command`` (leave rows
+  pending for ``manage.py build_image_variants``)
+"""
+import io
+import logging
+import os
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from stores.content_cache import bump_content_version
+
+from .media_cleanup import media_file_name_from_url, is_local_media_url
+from .models import MediaImage, Product
+
+try:
+    from PIL import Image, ImageOps  # type: ignore
+except Exception:
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANT_WIDTHS = (240, 480, 960)
+VARIANT_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpeg', 'JPEG'),
+)
+# a row left in "processing" this long is assumed to belong to a dead worker
+STALE_PROCESSING_MINUTES = 15
+
+
+def variant_widths():
+    widths = getattr(settings, 'MEDIA_IMAGE_VARIANT_WIDTHS', DEFAULT_VARIANT_WIDTHS)
+    return sorted({int(width) for width in widths if int(width) > 0})
+
+
+def variant_name(file_name, width, fmt):
+    stem, _ = os.path.splitext(file_name)
+    ext = 'jpg' if fmt == 'jpeg' else fmt
+    return f'{stem}_w{width}.{ext}'
+
+
+def _target_widths(original_width):
+    widths = [width for width in variant_widths() if width < original_width]
+    # originals narrower than the smallest bucket still get a re-encoded copy
+    return widths or [original_width]
+
+
+def _encode(image, fmt, pil_format, quality):
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    elif fmt == 'webp' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    buf = io.BytesIO()
+    save_kwargs = {'quality': quality}
+    if fmt == 'jpeg':
+        save_kwargs.update(optimize=True, progressive=True)
+    else:
+        save_kwargs['method'] = 4
+    image.save(buf, format=pil_format, **save_kwargs)
+    return buf.getvalue()
+
+
+def build_variants(media):
+    """
+    Generate the variant files for ``media`` and return the row fields to update.
+
+    Existing variant files are replaced; the original file is never modified.
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is not installed')
+    storage = media.file.storage
+    with media.file.open('rb') as fh:
+        image = Image.open(fh)
+        image.load()
+    if getattr(image, 'is_animated', False):
+        return {
+            'width': image.width,
+            'height': image.height,
+            'variants': [],
+            'variants_status': MediaImage.VARIANTS_SKIPPED,
+        }
+    image = ImageOps.exif_transpose(image)
+    original_width, original_height = image.size
+    quality = int(getattr(settings, 'MEDIA_IMAGE_VARIANT_QUALITY', 80))
+
+    variants = []
+    for width in _target_widths(original_width):
+        height = max(1, round(original_height * width / original_width))
+        resized = image if width == original_width else image.resize((width, height), Image.LANCZOS)
+        for fmt, pil_format in VARIANT_FORMATS:
+            content = _encode(resized, fmt, pil_format, quality)
+            name = variant_name(media.file.name, width, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            saved = storage.save(name, ContentFile(content))
+            variants.append({'name': saved, 'width': width, 'height': height, 'format': fmt, 'size': len(content)})
+    return {
+        'width': original_width,
+        'height': original_height,
+        'variants': variants,
+        'variants_status': MediaImage.VARIANTS_READY,
+    }
+
+
+def delete_variant_files(media):
+    storage = media.file.storage
+    for variant in media.variants or []:
+        name = variant.get('name') if isinstance(variant, dict) else None
+        if not name:
+            continue
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.warning('Failed to delete image variant %s', name)
+
+
+def _claim(media_id, reclaim_failed=False):
+    statuses = [MediaImage.VARIANTS_PENDING]
+    if reclaim_failed:
+        statuses.append(MediaImage.VARIANTS_FAILED)
+    stale_before = timezone.now() - timedelta(minutes=STALE_PROCESSING_MINUTES)
+    claimable = Q(variants_status__in=statuses) | Q(
+        variants_status=MediaImage.VARIANTS_PROCESSING,
+        variants_updated_at__lt=stale_before,
+    )
+    return MediaImage.objects.filter(claimable, pk=media_id).update(
+        variants_status=MediaImage.VARIANTS_PROCESSING,
+        variants_updated_at=timezone.now(),
+    ) == 1
+
+
+def process_media_variants(media_id, reclaim_failed=False):
+    """
+    Build variants for one image if no other worker has claimed it.
+
+    Returns the resulting status, or ``None`` when the row was not claimable.
+    """
+    if not _claim(media_id, reclaim_failed=reclaim_failed):
+        return None
+    media = MediaImage.objects.filter(pk=media_id).first()
+    if media is None:
+        return None
+    previous = list(media.variants or [])
+    try:
+        fields = build_variants(media)
+        fields['variants_error'] = ''
+    except Exception as exc:
+        logger.warning('Image variant generation failed for media %s: %s', media_id, exc)
+        fields = {'variants_status': MediaImage.VARIANTS_FAILED, 'variants_error': str(exc)[:255]}
+    fields['variants_updated_at'] = timezone.now()
+    MediaImage.objects.filter(pk=media_id).update(**fields)
+    kept = {variant['name'] for variant in fields.get('variants', [])}
+    stale = [variant for variant in previous if isinstance(variant, dict) and variant.get('name') not in kept]
+    if stale and 'variants' in fields:
+        media.variants = stale
+        delete_variant_files(media)
+    if fields['variants_status'] == MediaImage.VARIANTS_READY:
+        _bump_owning_stores(media)
+    return fields['variants_status']
+
+
+def _bump_owning_stores(media):
+    """Invalidate cached storefronts whose product images now have a srcset."""
+    if not media.file.name:
+        return
+    store_ids = (
+        Product.objects
+        .filter(main_images__icontains=media.file.name)
+        .values_list('store_id', flat=True)
+        .distinct()
+    )
+    for store_id in store_ids:
+        bump_content_version(store_id)
+
+
+def iter_pending_media_ids(chunk_size=100, reclaim_failed=False):
+    """Yield ids of images that still need variants, in id order, chunk by chunk."""
+    statuses = [MediaImage.VARIANTS_PENDING, MediaImage.VARIANTS_PROCESSING]
+    if reclaim_failed:
+        statuses.append(MediaImage.VARIANTS_FAILED)
+    last_id = 0
+    while True:
+        ids = list(
+            MediaImage.objects
+            .filter(variants_status__in=statuses, pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+class _VariantWorker:
+    """Single daemon thread that drains a queue of MediaImage ids."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, media_id):
+        self._queue.put(media_id)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='image-variants', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            media_id = self._queue.get()
+            try:
+                process_media_variants(media_id)
+            except Exception as exc:
+                logger.error('Image variant worker error for media %s: %s', media_id, exc)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+_worker = _VariantWorker()
+
+
+def schedule_media_variants(media_id):
+    """Queue variant generation for ``media_id`` once the current transaction commits."""
+    mode = getattr(settings, 'MEDIA_IMAGE_VARIANT_MODE', 'thread')
+    if mode == 'command':
+        return
+    if mode == 'inline':
+        transaction.on_commit(lambda: process_media_variants(media_id), robust=True)
+    else:
+        transaction.on_commit(lambda: _worker.submit(media_id), robust=True)
+
+
+def load_variant_index(urls):
+    """Map local media URLs to their ready MediaImage variants with one query."""
+    names = {}
+    for url in urls:
+        if url and is_local_media_url(url):
+            name = media_file_name_from_url(url)
+            if name:
+                names.setdefault(name, []).append(url)
+    if not names:
+        return {}
+    index = {}
+    rows = MediaImage.objects.filter(
+        file__in=list(names),
+        variants_status=MediaImage.VARIANTS_READY,
+    ).values_list('file', 'width', 'height', 'variants')
+    for name, width, height, variants in rows:
+        for url in names.get(name, []):
+            index[url] = {'width': width, 'height': height, 'variants': variants or []}
+    return index
+
+
+def build_srcset(variants, build_url):
+    """Return ``{'webp': 'url 240w, ...', 'jpeg': ...}`` for the stored variants."""
+    srcset = {}
+    for fmt, _ in VARIANT_FORMATS:
+        entries = sorted(
+            (variant for variant in variants if variant.get('format') == fmt and variant.get('name')),
+            key=lambda variant: variant.get('width') or 0,
+        )
+        if entries:
+            srcset[fmt] = ', '.join(f"{build_url(variant['name'])} {variant['width']}w" for variant in entries)
+    return srcset
@@ -0,0 +1,125 @@
+"""
+Benchmark the co-purchase recommendation builder on synthetic order histories.
+
+Seeds products with a long-tail popularity curve and completed orders of 1-5
+items, then times a full build, an incremental build over a further slice of
+orders, and personalized lookups. Everything runs inside a transaction that is
+rolled back at the end (unless --keep); existing counts are recounted from
+scratch inside that transaction.
+
+Usage:
+    python manage.py benchmark_recommendations
+    python manage.py benchmark_recommendations --orders 200000 --products 5000
+"""
+import random
+import time
+from decimal import Decimal
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Brand, Category, CoPurchaseCount, Product, ProductRecommendation
+from catalog.recommendations import CoPurchaseBuilder, personal_recommendation_ids
+from orders.models import Order, OrderItem
+from users.models import User
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time full and incremental co-purchase recommendation builds on synthetic orders (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50_000, help='Synthetic orders for the full build')
+        parser.add_argument('--incremental', type=int, default=5_000, help='Orders added before the incremental build')
+        parser.add_argument('--products', type=int, default=2000, help='Synthetic products')
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic buyers')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Orders counted per transaction')
+        parser.add_argument('--seed', type=int, default=7, help='Random seed')
+        parser.add_argument('--keep', action='store_true', help='Commit the synthetic data instead of rolling back')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self._run(options)
+                if not options['keep']:
+                    raise _Rollback
+        except _Rollback:
+            self.stdout.write('Synthetic data rolled back')
+
+    def _run(self, options):
+        started = time.monotonic()
+        category = Category.objects.create(name='benchmark', level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(name='benchmark-recommendations')
+        self.products = Product.objects.bulk_create([
+            Product(name=f'benchmark-{i:05d}', category=category, brand=brand, price=Decimal('100.00'))
+            for i in range(options['products'])
+        ])
+        # long-tail popularity: product i is picked with weight 1 / (i + 1)
+        self.cum_weights = list(accumulate(1 / (i + 1) for i in range(len(self.products))))
+        self.users = User.objects.bulk_create([
+            User(username=f'benchmark-recommendations-{i}') for i in range(options['users'])
+        ])
+        self._seed_orders(options['orders'], prefix='BENCHREC')
+        self.stdout.write(f'Seeded {options["orders"]} orders in {time.monotonic() - started:.1f}s')
+
+        CoPurchaseBuilder.reset()
+        self._timed('full build', options)
+        self._seed_orders(options['incremental'], prefix='BENCHINC')
+        self._timed('incremental build', options)
+
+        timings = []
+        for user in self.random.sample(self.users, min(100, len(self.users))):
+            started = time.monotonic()
+            personal_recommendation_ids(user)
+            timings.append(time.monotonic() - started)
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f'personal lookup: n={len(timings)} p50={timings[len(timings) // 2] * 1000:.1f}ms '
+            f'max={timings[-1] * 1000:.1f}ms'
+        ))
+        self.stdout.write(
+            f'pair rows={CoPurchaseCount.objects.count()} recommendation rows={ProductRecommendation.objects.count()}'
+        )
+
+    def _timed(self, label, options):
+        started = time.monotonic()
+        stats = CoPurchaseBuilder(chunk_size=options['chunk_size'], settle_minutes=0).run()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            '{label}: {elapsed:.2f}s orders={orders} baskets={baskets} products={products} rows={rows}'.format(
+                label=label, elapsed=elapsed, **stats
+            )
+        ))
+
+    def _seed_orders(self, total, prefix, batch_size=5000):
+        for offset in range(0, total, batch_size):
+            count = min(batch_size, total - offset)
+            orders = Order.objects.bulk_create([
+                Order(
+                    user=self.random.choice(self.users),
+                    order_number=f'{prefix}{offset + i:012d}',
+                    status='completed',
+                    total_amount=Decimal('100.00'),
+                    actual_amount=Decimal('100.00'),
+                )
+                for i in range(count)
+            ])
+            items = []
+            for order in orders:
+                basket = set(self.random.choices(self.products, cum_weights=self.cum_weights, k=self.random.randint(1, 5)))
+                items.extend(
+                    OrderItem(
+                        order=order,
+                        product=product,
+                        product_name=product.name,
+                        unit_price=Decimal('100.00'),
+                        actual_amount=Decimal('100.00'),
+                    )
+                    for product in basket
+                )
+            OrderItem.objects.bulk_create(items, batch_size=batch_size)
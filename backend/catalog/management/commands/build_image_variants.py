@@ -0,0 +1,41 @@
+"""
+Generate thumbnail / WebP variants for media images that do not have them yet.
+
+Usage:
+    python manage.py build_image_variants
+    python manage.py build_image_variants --chunk-size 200 --limit 1000
+    python manage.py build_image_variants --retry-failed
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from catalog.image_variants import iter_pending_media_ids, process_media_variants
+
+
+class Command(BaseCommand):
+    help = 'Backfill width-bucketed WebP/JPEG variants for media images, chunk by chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100, help='Images loaded per query')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many images (0 = no limit)')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry images whose variants failed')
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        retry_failed = options['retry_failed']
+        stats = {'processed': 0, 'ready': 0, 'skipped': 0, 'failed': 0, 'busy': 0}
+        for ids in iter_pending_media_ids(options['chunk_size'], reclaim_failed=retry_failed):
+            for media_id in ids:
+                if limit and stats['processed'] >= limit:
+                    break
+                result = process_media_variants(media_id, reclaim_failed=retry_failed)
+                stats['processed'] += 1
+                stats[result or 'busy'] += 1
+            close_old_connections()
+            if limit and stats['processed'] >= limit:
+                break
+        self.stdout.write(self.style.SUCCESS(
+            'Image variants: processed={processed} ready={ready} skipped={skipped} '
+            'failed={failed} busy={busy}'.format(**stats)
+        ))
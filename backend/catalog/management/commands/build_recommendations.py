@@ -0,0 +1,36 @@
+"""
+Fold new orders into the co-purchase counts and re-rank the affected products.
+
+Only orders after the stored watermark are read, so the command is cheap to run
+on a schedule.
+
+Usage:
+    python manage.py build_recommendations
+    python manage.py build_recommendations --chunk-size 5000
+    python manage.py build_recommendations --rebuild          # recount all history
+"""
+
+from django.core.management.base import BaseCommand
+
+from catalog.recommendations import CoPurchaseBuilder
+
+
+class Command(BaseCommand):
+    help = 'Incrementally build item-to-item co-purchase recommendations from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Orders counted per transaction')
+        parser.add_argument(
+            '--settle-minutes', type=int, default=None,
+            help='Skip orders younger than this (default: RECOMMENDATION_SETTLE_MINUTES)',
+        )
+        parser.add_argument('--rebuild', action='store_true', help='Drop counts and watermark, then recount everything')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            CoPurchaseBuilder.reset()
+        builder = CoPurchaseBuilder(chunk_size=options['chunk_size'], settle_minutes=options['settle_minutes'])
+        stats = builder.run()
+        self.stdout.write(self.style.SUCCESS(
+            'Recommendations: orders={orders} baskets={baskets} products={products} rows={rows}'.format(**stats)
+        ))
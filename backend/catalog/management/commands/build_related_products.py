@@ -0,0 +1,44 @@
+"""
+Rebuild the precomputed related-products index.
+
+Usage:
+    python manage.py build_related_products
+    python manage.py build_related_products --chunk-size 200 --after-id 50000
+    python manage.py build_related_products --product-id 12 --product-id 34
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from catalog.models import RelatedProduct
+from catalog.related_index import RelatedIndexBuilder, iter_product_id_chunks
+
+
+class Command(BaseCommand):
+    help = 'Recompute the top-N related products of every active product, chunk by chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Products scored per batch')
+        parser.add_argument('--after-id', type=int, default=0, help='Resume after this product id')
+        parser.add_argument('--product-id', type=int, action='append', default=[], help='Only rebuild these products')
+
+    def handle(self, *args, **options):
+        builder = RelatedIndexBuilder()
+        if options['product_id']:
+            rows = builder.build(options['product_id'])
+            self.stdout.write(self.style.SUCCESS(f'Related products: products={len(set(options["product_id"]))} rows={rows}'))
+            return
+
+        products = rows = 0
+        last_id = options['after_id']
+        for ids in iter_product_id_chunks(options['chunk_size'], after_id=last_id):
+            rows += builder.build(ids)
+            products += len(ids)
+            last_id = ids[-1]
+            close_old_connections()
+            self.stdout.write(f'  indexed {products} products (last id {last_id})')
+        # products taken off the shelf by bulk updates never fired the refresh signal
+        pruned, _ = RelatedProduct.objects.filter(product__is_active=False).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Related products: products={products} rows={rows} pruned={pruned}'
+        ))
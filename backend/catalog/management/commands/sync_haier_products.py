@@ -1,10 +1,19 @@
 """
 同步海尔商品数据的管理命令
+
+用法:
+    python manage.py sync_haier_products --sync-prices --sync-stock
+    python manage.py sync_haier_products --stale-since last
+    python manage.py sync_haier_products --resume
 """
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from catalog.models import Product, Category, Brand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from catalog.models import Category, Brand
 from integrations.haierapi import HaierAPI
+from integrations.haier_sync import HAIER_SYNC_BATCH_SIZE, HaierCatalogSync, latest_resumable_log
+from integrations.models import HaierSyncLog
 import logging
 
 logger = logging.getLogger(__name__)
@@ -46,6 +55,22 @@ class Command(BaseCommand):
             default='110101',
             help='区域编码（用于库存查询，默认北京东城区）'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=HAIER_SYNC_BATCH_SIZE,
+            help=f'每批同步的商品数（最大 {HAIER_SYNC_BATCH_SIZE}）'
+        )
+        parser.add_argument(
+            '--stale-since',
+            type=str,
+            help='只同步该时间之后没有同步过的商品，跳过此后已同步的（ISO 时间，或 last 表示上次成功同步的开始时间）'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='从最近一次未完成的同步断点继续'
+        )
 
     def handle(self, *args, **options):
         # 初始化海尔API
@@ -60,17 +85,17 @@ class Command(BaseCommand):
             'password': settings.HAIER_PASSWORD,
             'seller_password': settings.HAIER_SELLER_PASSWORD,
         }
-        
+
         haier_api = HaierAPI(config)
-        
+
         # 认证
         self.stdout.write('正在认证...')
         if not haier_api.authenticate():
             self.stdout.write(self.style.ERROR('认证失败'))
             return
-        
+
         self.stdout.write(self.style.SUCCESS('认证成功'))
-        
+
         # 获取分类和品牌
         category = None
         if options['category']:
@@ -79,7 +104,7 @@ class Command(BaseCommand):
                 self.stdout.write(f"使用分类: {category.name}")
             except Category.DoesNotExist:
                 self.stdout.write(self.style.WARNING(f"分类不存在: {options['category']}"))
-        
+
         brand = None
         if options['brand']:
             try:
@@ -87,69 +112,54 @@ class Command(BaseCommand):
                 self.stdout.write(f"使用品牌: {brand.name}")
             except Brand.DoesNotExist:
                 self.stdout.write(self.style.WARNING(f"品牌不存在: {options['brand']}"))
-        
-        # 查询商品
-        product_codes = options.get('product_codes')
-        self.stdout.write(f"正在查询商品... {product_codes or '全部'}")
-        
-        products_data = haier_api.get_products(product_codes=product_codes)
-        
-        if not products_data:
-            self.stdout.write(self.style.WARNING('未查询到商品'))
-            return
-        
-        self.stdout.write(f"查询到 {len(products_data)} 个商品")
-        
-        # 同步商品
-        synced_count = 0
-        for product_data in products_data:
-            try:
-                product_code = product_data.get('productCode')
-                
-                # 同步价格信息
-                if options['sync_prices']:
-                    self.stdout.write(f"正在查询价格: {product_code}")
-                    prices = haier_api.get_product_prices([product_code])
-                    if prices:
-                        product_data.update(prices[0])
-                
-                # 同步商品
-                product = Product.sync_from_haier(product_data, category, brand)
-                
-                if product:
-                    self.stdout.write(
-                        self.style.SUCCESS(f"✓ 同步成功: {product.name} ({product_code})")
-                    )
-                    
-                    # 同步库存信息
-                    if options['sync_stock']:
-                        self.stdout.write(f"  正在查询库存...")
-                        stock_data = haier_api.check_stock(
-                            product_code,
-                            options['county_code']
-                        )
-                        if stock_data:
-                            product.update_stock_from_haier(stock_data)
-                            self.stdout.write(
-                                self.style.SUCCESS(f"  ✓ 库存更新: {product.stock}件")
-                            )
-                        else:
-                            self.stdout.write(
-                                self.style.WARNING(f"  ! 库存查询失败")
-                            )
-                    
-                    synced_count += 1
-                else:
-                    self.stdout.write(
-                        self.style.WARNING(f"✗ 同步失败: {product_code}")
-                    )
-                    
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f"✗ 错误: {product_code} - {str(e)}")
-                )
-                logger.exception(f"同步商品失败: {product_code}")
-        
+
+        pipeline_options = {
+            'category': category,
+            'brand': brand,
+            'batch_size': options['batch_size'],
+            'progress': lambda log: self.stdout.write(log.message),
+        }
+
+        if options['resume']:
+            log = latest_resumable_log()
+            if log is None:
+                self.stdout.write(self.style.WARNING('没有可续跑的同步任务'))
+                return
+            offset = log.checkpoint.get('offset', 0)
+            self.stdout.write(f"续跑同步任务 #{log.id}: 已处理 {offset}/{log.total_count}")
+            log = HaierCatalogSync.resume(haier_api, log=log, **pipeline_options)
+        else:
+            stale_since = self._parse_stale_since(options.get('stale_since'))
+            product_codes = options.get('product_codes')
+            self.stdout.write(f"正在查询商品... {product_codes or '全部'}")
+            log = HaierCatalogSync(
+                haier_api,
+                sync_prices=options['sync_prices'],
+                sync_stock=options['sync_stock'],
+                county_code=options['county_code'],
+                **pipeline_options,
+            ).start(product_codes=product_codes, stale_since=stale_since)
+
         # 总结
         self.stdout.write('')
-        self.stdout.write(self.style.SUCCESS(f"同步完成: {synced_count}/{len(products_data)} 个商品"))
+        for failure in log.checkpoint.get('failures', [])[:20]:
+            self.stdout.write(self.style.WARNING(f"✗ 同步失败: {failure['code']} - {failure['error']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"同步完成: {log.success_count}/{log.total_count} 个商品，失败 {log.failed_count} 个，"
+            f"速率 {log.throughput or 0} 条/秒"
+        ))
+
+    def _parse_stale_since(self, value):
+        if not value:
+            return None
+        if value == 'last':
+            last = HaierSyncLog.objects.filter(sync_type='products', status='success').first()
+            if last is None:
+                raise CommandError('没有成功的同步记录，无法使用 --stale-since last')
+            return last.started_at
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'无效的时间: {value}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
@@ -0,0 +1,39 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0042_product_product_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_buckets',
+            field=models.PositiveSmallIntegerField(default=0, help_text='大于0时库存由分桶行承载，用于秒杀热点商品', verbose_name='库存分桶数'),
+        ),
+        migrations.AddField(
+            model_name='productsku',
+            name='stock_buckets',
+            field=models.PositiveSmallIntegerField(default=0, help_text='大于0时库存由分桶行承载，用于秒杀热点SKU', verbose_name='库存分桶数'),
+        ),
+        migrations.CreateModel(
+            name='StockBucket',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('bucket', models.PositiveSmallIntegerField(verbose_name='分桶序号')),
+                ('stock', models.PositiveIntegerField(default=0, verbose_name='库存')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_bucket_rows', to='catalog.product', verbose_name='商品')),
+                ('sku', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_bucket_rows', to='catalog.productsku', verbose_name='SKU')),
+            ],
+            options={
+                'verbose_name': '分桶库存',
+                'verbose_name_plural': '分桶库存',
+                'ordering': ['product_id', 'sku_id', 'bucket'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('sku__isnull', True)), fields=('product', 'bucket'), name='unique_stock_bucket_product'), models.UniqueConstraint(condition=models.Q(('sku__isnull', False)), fields=('sku', 'bucket'), name='unique_stock_bucket_sku')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0043_stock_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='原图高度'),
+        ),
+        migrations.AddField(
+            model_name='mediaimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=list, verbose_name='衍生图'),
+        ),
+        migrations.AddField(
+            model_name='mediaimage',
+            name='variants_error',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='衍生图错误'),
+        ),
+        migrations.AddField(
+            model_name='mediaimage',
+            name='variants_status',
+            field=models.CharField(choices=[('pending', '待生成'), ('processing', '生成中'), ('ready', '已生成'), ('failed', '生成失败'), ('skipped', '无需生成')], default='pending', max_length=20, verbose_name='衍生图状态'),
+        ),
+        migrations.AddField(
+            model_name='mediaimage',
+            name='variants_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='衍生图更新时间'),
+        ),
+        migrations.AddField(
+            model_name='mediaimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='原图宽度'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaimage',
+            index=models.Index(fields=['variants_status', 'id'], name='catalog_med_variant_8ad578_idx'),
+        ),
+    ]
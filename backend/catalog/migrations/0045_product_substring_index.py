@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from common.search import AddSubstringIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0044_media_image_variants'),
+    ]
+
+    operations = [
+        AddSubstringIndex(model_name='product', fields=['name']),
+    ]
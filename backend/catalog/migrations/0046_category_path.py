@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:42
+
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def path_of(category_id, seen=()):
+        if category_id not in paths:
+            parent_id = parents.get(category_id)
+            prefix = path_of(parent_id, seen + (category_id,)) if parent_id and parent_id not in seen else '/'
+            paths[category_id] = f'{prefix}{category_id}/'
+        return paths[category_id]
+
+    categories = list(Category.objects.only('id', 'path'))
+    for category in categories:
+        category.path = path_of(category.id)
+    Category.objects.bulk_update(categories, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0045_product_substring_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255, verbose_name='类别路径'),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0046_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='排名')),
+                ('score', models.FloatField(default=0, verbose_name='得分')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_index', to='catalog.product', verbose_name='商品')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.product', verbose_name='相关商品')),
+            ],
+            options={
+                'verbose_name': '相关商品索引',
+                'verbose_name_plural': '相关商品索引',
+                'ordering': ['product_id', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('product', 'rank'), name='unique_related_product_rank'), models.UniqueConstraint(fields=('product', 'related'), name='unique_related_product_pair')],
+            },
+        ),
+    ]
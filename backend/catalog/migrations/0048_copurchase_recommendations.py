@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0047_related_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationBuildState',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='名称')),
+                ('last_order_id', models.BigIntegerField(default=0, verbose_name='已处理订单ID')),
+                ('basket_count', models.PositiveIntegerField(default=0, verbose_name='累计订单数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '推荐构建进度',
+                'verbose_name_plural': '推荐构建进度',
+            },
+        ),
+        migrations.CreateModel(
+            name='CoPurchaseCount',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('baskets', models.PositiveIntegerField(default=0, verbose_name='订单数')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.product', verbose_name='共同购买商品')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='copurchase_counts', to='catalog.product', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '共同购买计数',
+                'verbose_name_plural': '共同购买计数',
+                'constraints': [models.UniqueConstraint(fields=('product', 'other'), name='unique_copurchase_pair')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='排名')),
+                ('score', models.FloatField(default=0, verbose_name='得分')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='catalog.product', verbose_name='商品')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.product', verbose_name='推荐商品')),
+            ],
+            options={
+                'verbose_name': '商品推荐',
+                'verbose_name_plural': '商品推荐',
+                'ordering': ['product_id', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('product', 'rank'), name='unique_product_recommendation_rank'), models.UniqueConstraint(fields=('product', 'recommended'), name='unique_product_recommendation_pair')],
+            },
+        ),
+    ]
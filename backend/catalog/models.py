@@ -1,5 +1,6 @@
 from django.db import models
 from django.db.models import Q
+from django.db.models.functions import Concat, Substr
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from stores.models import get_main_store_pk
@@ -22,6 +23,8 @@ class Category(models.Model):
     ]
     level = models.CharField(max_length=10, choices=LEVEL_CHOICES, default=LEVEL_MAJOR, verbose_name='层级')
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.PROTECT, related_name='children', verbose_name='父类别')
+    # 物化路径：根到自身的ID序列，如 /3/17/52/；子树查询用 path__startswith
+    path = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False, verbose_name='类别路径')
 
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True, verbose_name='更新时间')
@@ -86,6 +89,25 @@ class Category(models.Model):
         # 确保模型校验执行
         self.full_clean()
         super().save(*args, **kwargs)
+        self._sync_path()
+
+    def _sync_path(self):
+        """保存后维护物化路径；更换父类别时整棵子树的路径一并改写"""
+        parent_path = self.parent.path if self.parent_id else '/'
+        path = f'{parent_path}{self.pk}/'
+        if path == self.path:
+            return
+        old_path = self.path
+        Category.objects.filter(pk=self.pk).update(path=path)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(models.Value(path), Substr('path', len(old_path) + 1), output_field=models.CharField()),
+            )
+        self.path = path
+
+    def subtree_q(self, field='category'):
+        """匹配本类别及全部下级类别的 Q（field 为指向 Category 的外键名）"""
+        return Q(**{f'{field}__path__startswith': self.path}) if self.path else Q(**{field: self})
 
 
 class Brand(models.Model):
@@ -156,6 +178,7 @@ class Product(models.Model):
     )
 
     stock = models.PositiveIntegerField(default=0, verbose_name='库存数量')
+    stock_buckets = models.PositiveSmallIntegerField(default=0, verbose_name='库存分桶数', help_text='大于0时库存由分桶行承载，用于秒杀热点商品')
     
     # 海尔API相关字段
     product_code = models.CharField(max_length=50, unique=True, blank=True, null=True, verbose_name='海尔产品编码')
@@ -231,6 +254,41 @@ class Product(models.Model):
         if errors:
             raise ValidationError(errors)
 
+    # 海尔价格字段 -> 商品字段，接口未返回的价格不覆盖本地值
+    HAIER_PRICE_FIELDS = (
+        ('supply_price', 'supplyPrice'),
+        # 海尔返回的市场价（用于商户对外售价的参考）
+        ('market_price', 'marketPrice'),
+        ('invoice_price', 'invoicePrice'),
+        ('stock_rebate', 'stockRebatePolicy'),
+        ('rebate_money', 'rebateMoney'),
+    )
+
+    @classmethod
+    def haier_field_values(cls, haier_data: dict) -> dict:
+        """把海尔商品数据映射为商品字段值（不含分类、品牌和对外售价）"""
+        values = {
+            'product_model': haier_data.get('productModel', ''),
+            'product_group': haier_data.get('productGroupNamd', ''),
+            'product_image_url': haier_data.get('productImageUrl', ''),
+            'product_page_urls': haier_data.get('productLageUrls', []),
+            'is_sales': haier_data.get('isSales', '1'),
+            'no_sales_reason': haier_data.get('noSalesReason', ''),
+        }
+        for field, key in cls.HAIER_PRICE_FIELDS:
+            if key in haier_data:
+                values[field] = haier_data.get(key)
+        return values
+
+    def apply_haier_sale_price(self):
+        """商户对外售价：优先使用市场价；否则初始为供价（后续可由商户调整）"""
+        try:
+            if self.price in (None, 0):
+                self.price = self.market_price or self.supply_price or 0
+        except Exception:
+            # 兼容旧数据类型
+            self.price = self.market_price or self.supply_price or 0
+
     @classmethod
     def sync_from_haier(cls, haier_data: dict, category=None, brand=None):
         """
@@ -263,35 +321,9 @@ class Product(models.Model):
         )
         
         # 更新商品信息
-        product.product_model = haier_data.get('productModel', '')
-        product.product_group = haier_data.get('productGroupNamd', '')
-        product.product_image_url = haier_data.get('productImageUrl', '')
-        product.product_page_urls = haier_data.get('productLageUrls', [])
-        product.is_sales = haier_data.get('isSales', '1')
-        product.no_sales_reason = haier_data.get('noSalesReason', '')
-        
-        # 更新价格信息（如果有）
-        if 'supplyPrice' in haier_data:
-            product.supply_price = haier_data.get('supplyPrice')
-        # 海尔返回的市场价（用于商户对外售价的参考）
-        if 'marketPrice' in haier_data:
-            product.market_price = haier_data.get('marketPrice')
-        if 'invoicePrice' in haier_data:
-            product.invoice_price = haier_data.get('invoicePrice')
-        if 'stockRebatePolicy' in haier_data:
-            product.stock_rebate = haier_data.get('stockRebatePolicy')
-        if 'rebateMoney' in haier_data:
-            product.rebate_money = haier_data.get('rebateMoney')
-
-        # 商户对外售价：优先使用市场价；否则初始为供价（后续可由商户调整）
-        try:
-            if product.price in (None, 0):
-                base_sale_price = product.market_price or product.supply_price or 0
-                product.price = base_sale_price
-        except Exception:
-            # 兼容旧数据类型
-            base_sale_price = product.market_price or product.supply_price or 0
-            product.price = base_sale_price
+        for field, value in cls.haier_field_values(haier_data).items():
+            setattr(product, field, value)
+        product.apply_haier_sale_price()
         
         # 更新品牌（如果海尔数据中有）
         if haier_data.get('productBrandName') and not brand:
@@ -343,6 +375,7 @@ class ProductSKU(models.Model):
     specs = models.JSONField(default=dict, blank=True, verbose_name='规格参数')
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name='售价')
     stock = models.PositiveIntegerField(default=0, verbose_name='库存')
+    stock_buckets = models.PositiveSmallIntegerField(default=0, verbose_name='库存分桶数', help_text='大于0时库存由分桶行承载，用于秒杀热点SKU')
     image = models.URLField(max_length=500, blank=True, default='', verbose_name='SKU主图')
     is_active = models.BooleanField(default=True, verbose_name='是否启用')
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True, verbose_name='创建时间')
@@ -367,6 +400,137 @@ class ProductSKU(models.Model):
         return ' / '.join([f'{k}:{v}' for k, v in self.specs.items()])
 
 
+class StockBucket(models.Model):
+    """
+    分桶库存
+
+    秒杀等热点场景下把一个商品/SKU 的库存拆到多行，下单时随机命中其中一行做条件扣减，
+    避免所有买家在同一行上排队。分桶期间主表 stock 仅作展示，由分桶合计回写。
+    """
+    id = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_bucket_rows', verbose_name='商品')
+    sku = models.ForeignKey(
+        'catalog.ProductSKU',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='stock_bucket_rows',
+        verbose_name='SKU'
+    )
+    bucket = models.PositiveSmallIntegerField(verbose_name='分桶序号')
+    stock = models.PositiveIntegerField(default=0, verbose_name='库存')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '分桶库存'
+        verbose_name_plural = '分桶库存'
+        ordering = ['product_id', 'sku_id', 'bucket']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'bucket'],
+                condition=Q(sku__isnull=True),
+                name='unique_stock_bucket_product',
+            ),
+            models.UniqueConstraint(
+                fields=['sku', 'bucket'],
+                condition=Q(sku__isnull=False),
+                name='unique_stock_bucket_sku',
+            ),
+        ]
+
+    def __str__(self):
+        target = f'sku:{self.sku_id}' if self.sku_id else f'product:{self.product_id}'
+        return f'{target}#{self.bucket}={self.stock}'
+
+
+class RelatedProduct(models.Model):
+    """
+    相关商品索引
+
+    由 catalog.related_index 离线计算（同分类、同品牌、价格带、共同购买），每个商品只保留
+    得分最高的前 N 个，详情页相关商品按 rank 直接读取。
+    """
+    id = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_index', verbose_name='商品')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='相关商品')
+    rank = models.PositiveSmallIntegerField(verbose_name='排名')
+    score = models.FloatField(default=0, verbose_name='得分')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '相关商品索引'
+        verbose_name_plural = '相关商品索引'
+        ordering = ['product_id', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_related_product_rank'),
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_related_product_pair'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}->{self.related_id}#{self.rank}'
+
+
+class CoPurchaseCount(models.Model):
+    """
+    共同购买计数
+
+    由 catalog.recommendations 按订单增量累加，两个方向各存一行；product 与 other 相同的行
+    记录该商品出现过的订单数，用于计算提升度。
+    """
+    id = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='copurchase_counts', verbose_name='商品')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='共同购买商品')
+    baskets = models.PositiveIntegerField(default=0, verbose_name='订单数')
+
+    class Meta:
+        verbose_name = '共同购买计数'
+        verbose_name_plural = '共同购买计数'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='unique_copurchase_pair'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}+{self.other_id}={self.baskets}'
+
+
+class ProductRecommendation(models.Model):
+    """商品推荐近邻：按共同购买提升度排序的前 K 个商品"""
+    id = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations', verbose_name='商品')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='推荐商品')
+    rank = models.PositiveSmallIntegerField(verbose_name='排名')
+    score = models.FloatField(default=0, verbose_name='得分')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '商品推荐'
+        verbose_name_plural = '商品推荐'
+        ordering = ['product_id', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_product_recommendation_rank'),
+            models.UniqueConstraint(fields=['product', 'recommended'], name='unique_product_recommendation_pair'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}->{self.recommended_id}#{self.rank}'
+
+
+class RecommendationBuildState(models.Model):
+    """推荐构建进度：已处理到的订单ID与累计订单数，增量构建从这里继续"""
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=50, unique=True, verbose_name='名称')
+    last_order_id = models.BigIntegerField(default=0, verbose_name='已处理订单ID')
+    basket_count = models.PositiveIntegerField(default=0, verbose_name='累计订单数')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '推荐构建进度'
+        verbose_name_plural = '推荐构建进度'
+
+    def __str__(self):
+        return f'{self.name}@{self.last_order_id}'
+
+
 class MediaImage(models.Model):
     """
     媒体图片模型
@@ -380,12 +544,38 @@ class MediaImage(models.Model):
     size = models.PositiveIntegerField(default=0, verbose_name='文件大小(字节)')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
 
+    # 衍生图（按宽度分档的 WebP/JPEG 缩略图），由后台任务生成，见 catalog.image_variants
+    VARIANTS_PENDING = 'pending'
+    VARIANTS_PROCESSING = 'processing'
+    VARIANTS_READY = 'ready'
+    VARIANTS_FAILED = 'failed'
+    VARIANTS_SKIPPED = 'skipped'
+    VARIANTS_STATUS_CHOICES = [
+        (VARIANTS_PENDING, '待生成'),
+        (VARIANTS_PROCESSING, '生成中'),
+        (VARIANTS_READY, '已生成'),
+        (VARIANTS_FAILED, '生成失败'),
+        (VARIANTS_SKIPPED, '无需生成'),
+    ]
+    width = models.PositiveIntegerField(null=True, blank=True, verbose_name='原图宽度')
+    height = models.PositiveIntegerField(null=True, blank=True, verbose_name='原图高度')
+    variants = models.JSONField(default=list, blank=True, verbose_name='衍生图')
+    variants_status = models.CharField(
+        max_length=20,
+        choices=VARIANTS_STATUS_CHOICES,
+        default=VARIANTS_PENDING,
+        verbose_name='衍生图状态',
+    )
+    variants_error = models.CharField(max_length=255, blank=True, default='', verbose_name='衍生图错误')
+    variants_updated_at = models.DateTimeField(null=True, blank=True, verbose_name='衍生图更新时间')
+
     class Meta:
         verbose_name = '媒体图片'
         verbose_name_plural = '媒体图片'
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at']),
+            models.Index(fields=['variants_status', 'id']),
         ]
 
     def __str__(self):
@@ -572,7 +762,7 @@ class HomeStoreCardCategory(models.Model):
         if self.category_id and self.category.level != Category.LEVEL_MAJOR:
             errors['category'] = '卡片分类必须是一级分类'
         if self.category_id and not Product.objects.filter(store_id=self.category.store_id, is_active=True).filter(
-            Q(category=self.category) | Q(category__parent=self.category) | Q(category__parent__parent=self.category)
+            self.category.subtree_q()
         ).exists():
             errors['category'] = '卡片分类下必须存在上架商品'
         if errors:
@@ -0,0 +1,272 @@
+"""共同购买推荐
+
+"猜你喜欢"原先按 view_count 排序，而浏览次数从未累加，结果近乎随机。这里离线统计商品
+两两出现在同一订单中的次数，按提升度为每个商品保留前 RECOMMENDATION_TOP_K 个近邻，
+个性化推荐合并用户最近购买商品的近邻。
+
+- 订单口径：结算时主订单（无 parent_order）的订单项就是整笔购物篮；子订单和 SubOrder 按
+  店铺+商品拆分，只含单个商品，不产生商品对。只统计已支付/已发货/已完成的订单。
+- 增量：RecommendationBuildState 记录已处理到的订单ID，每次只处理其后的订单。待支付订单
+  最终状态未定，只处理创建时间早于 RECOMMENDATION_SETTLE_MINUTES（默认等于
+  ORDER_PAYMENT_TIMEOUT_MINUTES）的订单。每批订单在一个事务里累加计数并推进进度，
+  进度行加锁，多个构建进程不会重复计数。
+- 得分：提升度 n_ab * N / (n_a * n_b) 乘以 n_ab / (n_ab + RECOMMENDATION_SHRINKAGE)，
+  压低只共同出现过一两次的偶然组合；共同订单数低于 RECOMMENDATION_MIN_SUPPORT 的组合不推荐。
+  增量构建只重排本次涉及的商品。
+
+构建命令 ``python manage.py build_recommendations``（建议定时执行），基准测试
+``python manage.py benchmark_recommendations``。
+"""
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CoPurchaseCount, Product, ProductRecommendation, RecommendationBuildState
+from .related_index import COPURCHASE_ORDER_STATUSES
+
+STATE_NAME = 'co_purchase'
+# 个性化推荐中越早的购买权重越低
+RECENCY_DECAY = 0.85
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _batches(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def lift_score(together, count_a, count_b, total):
+    """共同购买提升度，按共同订单数收缩"""
+    if not (together and count_a and count_b and total):
+        return 0.0
+    lift = together * total / (count_a * count_b)
+    shrinkage = _setting('RECOMMENDATION_SHRINKAGE', 5)
+    return lift * together / (together + shrinkage)
+
+
+def count_pairs(baskets):
+    """{(商品A, 商品B): 订单数}，两个方向各计一次；(A, A) 为商品A出现的订单数"""
+    counts = Counter()
+    for products in baskets:
+        products = sorted(set(products))
+        for index, product_id in enumerate(products):
+            counts[(product_id, product_id)] += 1
+            for other_id in products[index + 1:]:
+                counts[(product_id, other_id)] += 1
+                counts[(other_id, product_id)] += 1
+    return counts
+
+
+def _upsert_pair_counts(connection, counts, batch_size):
+    qn = connection.ops.quote_name
+    meta = CoPurchaseCount._meta
+    table = qn(meta.db_table)
+    product, other, baskets = (qn(meta.get_field(name).column) for name in ('product', 'other', 'baskets'))
+    # 按主键顺序写入，并发构建在 PostgreSQL 上不会互相死锁
+    rows = sorted(counts.items())
+    for batch in _batches(rows, batch_size):
+        placeholders = ', '.join(['(%s, %s, %s)'] * len(batch))
+        params = [value for (product_id, other_id), delta in batch for value in (product_id, other_id, delta)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({product}, {other}, {baskets}) VALUES {placeholders} '
+                f'ON CONFLICT ({product}, {other}) DO UPDATE SET {baskets} = {table}.{baskets} + EXCLUDED.{baskets}',
+                params,
+            )
+
+
+def apply_pair_counts(counts, batch_size=500):
+    """把增量累加进 CoPurchaseCount（调用方负责事务）"""
+    connection = connections[router.db_for_write(CoPurchaseCount)]
+    if connection.vendor in ('postgresql', 'sqlite'):
+        # 单条 upsert 语句累加，不必先读出已有计数
+        _upsert_pair_counts(connection, counts, batch_size)
+        return
+    by_product = defaultdict(dict)
+    for (product_id, other_id), delta in counts.items():
+        by_product[product_id][other_id] = delta
+    for product_ids in _batches(sorted(by_product), batch_size):
+        other_ids = {other_id for product_id in product_ids for other_id in by_product[product_id]}
+        existing = {
+            (row.product_id, row.other_id): row
+            for row in CoPurchaseCount.objects.filter(product_id__in=product_ids, other_id__in=other_ids)
+        }
+        changed, created = [], []
+        for product_id in product_ids:
+            for other_id, delta in by_product[product_id].items():
+                row = existing.get((product_id, other_id))
+                if row is None:
+                    created.append(CoPurchaseCount(product_id=product_id, other_id=other_id, baskets=delta))
+                else:
+                    row.baskets += delta
+                    changed.append(row)
+        CoPurchaseCount.objects.bulk_update(changed, ['baskets'], batch_size=batch_size)
+        CoPurchaseCount.objects.bulk_create(created, batch_size=batch_size)
+
+
+class CoPurchaseBuilder:
+    """按订单ID分批累加共同购买计数，再重排受影响商品的推荐近邻"""
+
+    def __init__(self, chunk_size=1000, settle_minutes=None, top_k=None, min_support=None):
+        self.chunk_size = chunk_size
+        if settle_minutes is None:
+            settle_minutes = _setting(
+                'RECOMMENDATION_SETTLE_MINUTES',
+                _setting('ORDER_PAYMENT_TIMEOUT_MINUTES', 1440),
+            )
+        self.cutoff = timezone.now() - timedelta(minutes=settle_minutes)
+        self.top_k = top_k or _setting('RECOMMENDATION_TOP_K', 30)
+        self.min_support = min_support or _setting('RECOMMENDATION_MIN_SUPPORT', 2)
+
+    @staticmethod
+    def _locked_state():
+        RecommendationBuildState.objects.get_or_create(name=STATE_NAME)
+        return RecommendationBuildState.objects.select_for_update().get(name=STATE_NAME)
+
+    @classmethod
+    def reset(cls):
+        """清空计数与进度，下次构建从头处理全部订单"""
+        with transaction.atomic():
+            state = cls._locked_state()
+            CoPurchaseCount.objects.all().delete()
+            ProductRecommendation.objects.all().delete()
+            state.last_order_id = 0
+            state.basket_count = 0
+            state.save(update_fields=['last_order_id', 'basket_count', 'updated_at'])
+
+    def _next_orders(self, after_id):
+        from orders.models import Order
+
+        return list(
+            Order.objects
+            .filter(parent_order__isnull=True, id__gt=after_id, created_at__lte=self.cutoff)
+            .order_by('id')
+            .values_list('id', flat=True)[:self.chunk_size]
+        )
+
+    @staticmethod
+    def _baskets(order_ids):
+        from orders.models import OrderItem
+
+        baskets = defaultdict(set)
+        rows = OrderItem.objects.filter(
+            order_id__in=order_ids,
+            order__status__in=COPURCHASE_ORDER_STATUSES,
+        ).values_list('order_id', 'product_id')
+        for order_id, product_id in rows:
+            baskets[order_id].add(product_id)
+        return list(baskets.values())
+
+    def accumulate(self):
+        """处理进度之后的全部已结束订单，返回 (处理订单数, 购物篮数, 涉及商品ID集合)"""
+        orders = baskets_total = 0
+        touched = set()
+        while True:
+            with transaction.atomic():
+                state = self._locked_state()
+                order_ids = self._next_orders(state.last_order_id)
+                if not order_ids:
+                    break
+                baskets = self._baskets(order_ids)
+                apply_pair_counts(count_pairs(baskets))
+                state.last_order_id = order_ids[-1]
+                state.basket_count += len(baskets)
+                state.save(update_fields=['last_order_id', 'basket_count', 'updated_at'])
+            orders += len(order_ids)
+            baskets_total += len(baskets)
+            for products in baskets:
+                touched.update(products)
+        return orders, baskets_total, touched
+
+    def rank(self, product_ids, batch_size=200):
+        """重排这些商品的推荐近邻，返回写入行数"""
+        state = RecommendationBuildState.objects.filter(name=STATE_NAME).first()
+        total = state.basket_count if state else 0
+        written = 0
+        for chunk in _batches(sorted(product_ids), batch_size):
+            own, pairs = {}, defaultdict(list)
+            rows = CoPurchaseCount.objects.filter(product_id__in=chunk).values_list('product_id', 'other_id', 'baskets')
+            for product_id, other_id, together in rows:
+                if product_id == other_id:
+                    own[product_id] = together
+                elif together >= self.min_support:
+                    pairs[product_id].append((other_id, together))
+            other_ids = {other_id for candidates in pairs.values() for other_id, _ in candidates}
+            totals = {}
+            for batch in _batches(sorted(other_ids), 1000):
+                totals.update(
+                    CoPurchaseCount.objects
+                    .filter(product_id__in=batch, other_id=F('product_id'))
+                    .values_list('product_id', 'baskets')
+                )
+            active = set()
+            for batch in _batches(sorted(other_ids), 1000):
+                active.update(Product.objects.filter(id__in=batch, is_active=True).values_list('id', flat=True))
+
+            objs = []
+            for product_id in chunk:
+                scored = [
+                    (other_id, lift_score(together, own.get(product_id, 0), totals.get(other_id, 0), total))
+                    for other_id, together in pairs.get(product_id, ())
+                    if other_id in active
+                ]
+                scored.sort(key=lambda item: (-item[1], item[0]))
+                for rank, (other_id, score) in enumerate(scored[:self.top_k], start=1):
+                    objs.append(ProductRecommendation(product_id=product_id, recommended_id=other_id, rank=rank, score=score))
+            with transaction.atomic():
+                ProductRecommendation.objects.filter(product_id__in=chunk).delete()
+                ProductRecommendation.objects.bulk_create(objs, batch_size=1000)
+            written += len(objs)
+        return written
+
+    def run(self):
+        orders, baskets, touched = self.accumulate()
+        rows = self.rank(touched) if touched else 0
+        return {'orders': orders, 'baskets': baskets, 'products': len(touched), 'rows': rows}
+
+
+def recent_purchases(user, limit=None):
+    """用户最近购买的商品ID（去重，新的在前）"""
+    from orders.models import OrderItem
+
+    limit = limit or _setting('RECOMMENDATION_RECENT_PURCHASES', 20)
+    rows = (
+        OrderItem.objects
+        .filter(
+            order__user=user,
+            order__parent_order__isnull=True,
+            order__status__in=COPURCHASE_ORDER_STATUSES,
+        )
+        .order_by('-order_id', 'id')
+        .values_list('product_id', flat=True)[:limit * 5]
+    )
+    seen = []
+    for product_id in rows:
+        if product_id not in seen:
+            seen.append(product_id)
+            if len(seen) >= limit:
+                break
+    return seen
+
+
+def personal_recommendation_ids(user):
+    """合并最近购买商品的近邻，按加权得分排序的商品ID；已买过的商品不再推荐"""
+    purchased = recent_purchases(user)
+    if not purchased:
+        return []
+    weights = {product_id: RECENCY_DECAY ** position for position, product_id in enumerate(purchased)}
+    merged = Counter()
+    rows = ProductRecommendation.objects.filter(product_id__in=purchased).values_list('product_id', 'recommended_id', 'score')
+    for product_id, recommended_id, score in rows:
+        if recommended_id not in weights:
+            merged[recommended_id] += weights[product_id] * score
+    return [product_id for product_id, _ in sorted(merged.items(), key=lambda item: (-item[1], item[0]))]
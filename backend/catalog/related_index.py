@@ -0,0 +1,267 @@
+"""相关商品索引
+
+详情页"相关商品"原先实时查询同分类全部上架商品，大分类下每次返回上千个商品。这里
+离线为每个商品计算前 RELATED_PRODUCTS_TOP_N 个近邻写入 RelatedProduct，接口按 rank
+分页读取。
+
+候选集：同分类销量前 RELATED_PRODUCTS_CANDIDATES 个、上级分类子树销量前
+RELATED_PRODUCTS_CANDIDATES 个，以及近 RELATED_PRODUCTS_COPURCHASE_DAYS 天内与其
+出现在同一订单中的商品；只取同店铺的上架商品。得分由以下信号相加：
+
+- 同分类 / 同上级分类
+- 同品牌
+- 价格带：价格相差一倍以内按对数距离线性衰减
+- 共同购买：同时出现的订单数取对数
+- 销量：仅用于打破平分
+
+全量重建用 ``python manage.py build_related_products``（建议定时执行）。商品新增或
+影响得分的字段变化后，RELATED_PRODUCTS_REFRESH_MODE 控制增量刷新方式：
+thread（默认，事务提交后交给进程内后台线程）、inline（提交后同步刷新）、command
+（仅由命令重建，测试运行时的默认值）。增量刷新只重算该商品及索引中引用它的商品；新商品进入其他商品的列表要等下次
+全量重建。
+"""
+
+import logging
+import math
+import queue
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .category_tree import get_category_tree, subtree_q
+from .models import Product, RelatedProduct
+
+logger = logging.getLogger(__name__)
+
+# 计入共同购买的订单状态
+COPURCHASE_ORDER_STATUSES = ('paid', 'shipped', 'completed')
+# 这些字段变化会影响商品自身及引用它的商品的得分
+INDEXED_FIELDS = frozenset({'store', 'category', 'brand', 'price', 'is_active'})
+
+WEIGHT_SAME_CATEGORY = 4.0
+WEIGHT_SIBLING_CATEGORY = 1.5
+WEIGHT_SAME_BRAND = 1.0
+WEIGHT_PRICE_BAND = 1.0
+WEIGHT_COPURCHASE = 2.0
+WEIGHT_SALES = 0.01
+PRICE_BAND_RATIO = 2.0
+
+_FIELDS = ('id', 'store_id', 'category_id', 'brand_id', 'price', 'sales_count')
+
+
+def _setting(name, default):
+    return int(getattr(settings, name, default))
+
+
+class _Row:
+    __slots__ = _FIELDS
+
+    def __init__(self, values):
+        for name, value in zip(_FIELDS, values):
+            setattr(self, name, value)
+
+
+class RelatedIndexBuilder:
+    """计算并写入一批商品的相关商品；同一次构建内分类候选集只查询一次"""
+
+    def __init__(self, top_n=None, candidates=None, copurchase_days=None):
+        self.top_n = top_n or _setting('RELATED_PRODUCTS_TOP_N', 40)
+        self.candidates = candidates or _setting('RELATED_PRODUCTS_CANDIDATES', 200)
+        days = copurchase_days if copurchase_days is not None else _setting('RELATED_PRODUCTS_COPURCHASE_DAYS', 180)
+        self.copurchase_since = timezone.now() - timedelta(days=days)
+        self.tree = get_category_tree()
+        self._rows = {}
+        self._category_candidates = {}
+        self._subtree_candidates = {}
+
+    @staticmethod
+    def _active():
+        return Product.objects.filter(is_active=True).order_by()
+
+    def _remember(self, rows):
+        result = []
+        for values in rows:
+            row = _Row(values)
+            self._rows[row.id] = row
+            result.append(row)
+        return result
+
+    def _category_rows(self, category_id):
+        rows = self._category_candidates.get(category_id)
+        if rows is None:
+            rows = self._remember(
+                self._active()
+                .filter(category_id=category_id)
+                .order_by('-sales_count', 'id')
+                .values_list(*_FIELDS)[:self.candidates]
+            )
+            self._category_candidates[category_id] = rows
+        return rows
+
+    def _subtree_rows(self, category_id):
+        rows = self._subtree_candidates.get(category_id)
+        if rows is None:
+            rows = self._remember(
+                self._active()
+                .filter(subtree_q(category_id))
+                .order_by('-sales_count', 'id')
+                .values_list(*_FIELDS)[:self.candidates]
+            )
+            self._subtree_candidates[category_id] = rows
+        return rows
+
+    def _copurchases(self, product_ids):
+        """{商品ID: Counter({共同购买商品ID: 订单数})}，一次查询覆盖整批商品"""
+        from orders.models import OrderItem
+
+        pairs = (
+            OrderItem.objects
+            .filter(
+                order__items__product_id__in=product_ids,
+                order__status__in=COPURCHASE_ORDER_STATUSES,
+                order__created_at__gte=self.copurchase_since,
+            )
+            .values_list('order__items__product_id', 'product_id')
+            .annotate(orders=Count('order_id', distinct=True))
+            .order_by()
+        )
+        result = defaultdict(Counter)
+        for product_id, other_id, orders in pairs:
+            if product_id != other_id:
+                result[product_id][other_id] = orders
+        return result
+
+    def _load(self, product_ids):
+        missing = [pk for pk in product_ids if pk not in self._rows]
+        if missing:
+            self._remember(self._active().filter(id__in=missing).values_list(*_FIELDS))
+        return {pk: self._rows[pk] for pk in product_ids if pk in self._rows}
+
+    def _score(self, row, other, copurchased, sibling_ids):
+        score = 0.0
+        if other.category_id == row.category_id:
+            score += WEIGHT_SAME_CATEGORY
+        elif other.category_id in sibling_ids:
+            score += WEIGHT_SIBLING_CATEGORY
+        if other.brand_id == row.brand_id:
+            score += WEIGHT_SAME_BRAND
+        if row.price and other.price:
+            distance = abs(math.log(float(other.price) / float(row.price))) / math.log(PRICE_BAND_RATIO)
+            score += WEIGHT_PRICE_BAND * max(0.0, 1.0 - distance)
+        if copurchased:
+            score += WEIGHT_COPURCHASE * math.log1p(copurchased)
+        return score + WEIGHT_SALES * math.log1p(other.sales_count or 0)
+
+    def neighbours(self, row, copurchases):
+        """返回 [(相关商品ID, 得分)]，按得分从高到低，最多 top_n 个"""
+        node = self.tree.get(row.category_id)
+        parent_id = node.parent_id if node is not None else None
+        sibling_ids = self.tree.subtree_ids(parent_id) if parent_id else frozenset()
+
+        candidates = {other.id: other for other in self._category_rows(row.category_id)}
+        if parent_id:
+            candidates.update((other.id, other) for other in self._subtree_rows(parent_id))
+        candidates.update(self._load(list(copurchases)))
+        candidates.pop(row.id, None)
+
+        scored = [
+            (other.id, self._score(row, other, copurchases.get(other.id, 0), sibling_ids))
+            for other in candidates.values()
+            if other.store_id == row.store_id
+        ]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:self.top_n]
+
+    def build(self, product_ids):
+        """重算 product_ids 的索引；已下架或不存在的商品清空索引。返回写入行数"""
+        product_ids = sorted(set(product_ids))
+        if not product_ids:
+            return 0
+        rows = self._load(product_ids)
+        copurchases = self._copurchases(list(rows))
+        objs = []
+        for product_id, row in rows.items():
+            for rank, (related_id, score) in enumerate(self.neighbours(row, copurchases.get(product_id, {})), start=1):
+                objs.append(RelatedProduct(product_id=product_id, related_id=related_id, rank=rank, score=score))
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product_id__in=product_ids).delete()
+            RelatedProduct.objects.bulk_create(objs)
+        return len(objs)
+
+
+def iter_product_id_chunks(chunk_size, after_id=0):
+    """按主键分批返回上架商品ID"""
+    while True:
+        ids = list(
+            Product.objects.filter(is_active=True, id__gt=after_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def refresh_related_products(product_ids):
+    """增量刷新：重算这些商品及索引中引用了它们的商品"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    referencing = RelatedProduct.objects.filter(related_id__in=product_ids).values_list('product_id', flat=True)
+    return RelatedIndexBuilder().build(product_ids | set(referencing))
+
+
+class _RefreshWorker:
+    """进程内后台线程；排队期间到达的商品合并为一次刷新"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, product_id):
+        self._queue.put(product_id)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='related-products', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                refresh_related_products(batch)
+            except Exception as exc:
+                logger.error('Related products refresh failed for %s: %s', sorted(set(batch)), exc)
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+_worker = _RefreshWorker()
+
+
+def schedule_related_refresh(product_id):
+    """事务提交后按 RELATED_PRODUCTS_REFRESH_MODE 刷新商品的相关商品索引"""
+    mode = getattr(settings, 'RELATED_PRODUCTS_REFRESH_MODE', 'thread')
+    if mode == 'command':
+        return
+    if mode == 'inline':
+        transaction.on_commit(lambda: refresh_related_products([product_id]), robust=True)
+    else:
+        transaction.on_commit(lambda: _worker.submit(product_id), robust=True)
@@ -12,8 +12,9 @@ from common.serializers import (
 )
 from stores.models import Store
 from stores.permissions import get_active_memberships, is_platform_admin, is_support_user
-from django.db.models import Q
 from drf_spectacular.utils import extend_schema_field
+from .category_tree import get_category_tree
+from .image_variants import build_srcset, load_variant_index
 
 
 def _is_absolute_url(url: str) -> bool:
@@ -90,6 +91,18 @@ def _build_media_file_url(file_field, request=None) -> str:
         return ''
 
 
+def _media_storage_url(name: str) -> str:
+    return MediaImage._meta.get_field('file').storage.url(name)
+
+
+def _price_resolver(context, product):
+    """序列化上下文中批量预解析的价格（orders.services.PriceResolver），未覆盖该商品时返回 None"""
+    resolver = context.get('_price_resolver')
+    if resolver is not None and resolver.covers(product):
+        return resolver
+    return None
+
+
 def _ensure_https(url: str, request=None) -> str:
     """Upgrade to HTTPS only when the request is HTTPS."""
     if not url:
@@ -114,10 +127,11 @@ class CategorySerializer(serializers.ModelSerializer):
         required=False
     )
     children = serializers.SerializerMethodField()
+    breadcrumb = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
-        fields = ["id", "store", "store_id", "name", "order", "logo", "level", "parent_id", "children"]
+        fields = ["id", "store", "store_id", "name", "order", "logo", "level", "parent_id", "children", "breadcrumb"]
         read_only_fields = ["store"]
         # Disable default validators to allow custom duplicate check in validate()
         validators = []
@@ -138,12 +152,21 @@ class CategorySerializer(serializers.ModelSerializer):
         else:
             self.fields['parent_id'].queryset = Category.objects.filter(id__isnull=False)
 
+    def _category_tree(self):
+        # 同一次序列化（含列表）共用一棵树，只检查一次版本
+        tree = self.context.get('_category_tree')
+        if tree is None:
+            tree = get_category_tree()
+            if isinstance(self.context, dict):
+                self.context['_category_tree'] = tree
+        return tree
+
     @extend_schema_field(serializers.ListField(child=serializers.DictField()))
     def get_children(self, obj: Category):
         # 返回直接子节点（避免无限嵌套）
         if obj.level not in {Category.LEVEL_MAJOR, Category.LEVEL_MINOR}:
             return []
-        qs = obj.children.all().order_by('order', 'id')
+        # 走进程内分类树，列表渲染不再逐个节点查询
         return [
             {
                 'id': c.id,
@@ -154,7 +177,15 @@ class CategorySerializer(serializers.ModelSerializer):
                 'store': c.store_id,
                 'parent_id': obj.id,
             }
-            for c in qs
+            for c in self._category_tree().children(obj.id)
+        ]
+
+    @extend_schema_field(serializers.ListField(child=serializers.DictField()))
+    def get_breadcrumb(self, obj: Category):
+        # 从品类到当前分类的路径
+        return [
+            {'id': node.id, 'name': node.name, 'level': node.level}
+            for node in self._category_tree().breadcrumb(obj.id)
         ]
 
     def to_representation(self, instance):
@@ -321,15 +352,21 @@ class ProductSKUSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(serializers.DecimalField(max_digits=10, decimal_places=2))
     def get_display_price(self, obj: ProductSKU):
+        resolver = _price_resolver(self.context, obj.product)
+        if resolver is not None:
+            return resolver.base_price(obj.product, sku=obj)
         request = self.context.get('request')
         user = getattr(request, 'user', None)
         return resolve_base_price(user, obj.product, sku=obj)
 
     @extend_schema_field(serializers.DecimalField(max_digits=10, decimal_places=2))
     def get_discounted_price(self, obj: ProductSKU):
+        base_price = self.get_display_price(obj)
+        resolver = _price_resolver(self.context, obj.product)
+        if resolver is not None:
+            return base_price - resolver.discount_amount(obj.product, base_price)
         request = self.context.get('request')
         user = getattr(request, 'user', None)
-        base_price = self.get_display_price(obj)
         amount = get_best_active_discount(user, obj.product, base_price=base_price)
         return base_price - amount
 
@@ -534,10 +571,13 @@ class ProductSerializer(serializers.ModelSerializer):
         local_main = self._get_full_image_urls(instance.main_images)
         if local_main:
             rep['main_images'] = local_main
+            rep['main_image_variants'] = self._get_image_variants(instance.main_images)
         elif instance.product_image_url:
             rep['main_images'] = [instance.product_image_url]
+            rep['main_image_variants'] = []
         else:
             rep['main_images'] = []
+            rep['main_image_variants'] = []
 
         # 处理详情图：优先使用海尔拉页，其次使用本地上传的详情图
         detail_images = []
@@ -652,6 +692,45 @@ class ProductSerializer(serializers.ModelSerializer):
         
         return result
     
+    def _get_image_variants(self, images):
+        """主图衍生图：与 main_images 一一对应，src 为原图，srcset 按格式给出各宽度档位"""
+        images = [img for img in (images or []) if img]
+        index = self._image_variant_index(images)
+        request = self.context.get('request')
+        result = []
+        for img_url, src in zip(images, self._get_full_image_urls(images)):
+            entry = index.get(img_url)
+            if not entry:
+                result.append({'src': src, 'width': None, 'height': None, 'srcset': {}})
+                continue
+            result.append({
+                'src': src,
+                'width': entry['width'],
+                'height': entry['height'],
+                'srcset': build_srcset(entry['variants'], lambda name: _build_media_url(_media_storage_url(name), request)),
+            })
+        return result
+
+    def _image_variant_index(self, images):
+        """按列表批量查询衍生图，结果缓存在 context 中，整页商品只查询一次"""
+        index = self.context.setdefault('_image_variant_index', {})
+        missing = [img for img in images if img not in index]
+        if not missing:
+            return index
+        parent = getattr(self, 'parent', None)
+        loaded_lists = self.context.setdefault('_image_variant_lists', set())
+        if isinstance(parent, serializers.ListSerializer) and id(parent) not in loaded_lists:
+            loaded_lists.add(id(parent))
+            for product in parent.instance or []:
+                missing.extend(
+                    img for img in (getattr(product, 'main_images', None) or [])
+                    if img and img not in index
+                )
+        found = load_variant_index(missing)
+        for img in missing:
+            index[img] = found.get(img)
+        return index
+
     @extend_schema_field(serializers.BooleanField())
     def get_is_haier_product(self, obj: Product):
         """判断是否为海尔产品"""
@@ -691,6 +770,9 @@ class ProductSerializer(serializers.ModelSerializer):
     @extend_schema_field(serializers.DecimalField(max_digits=10, decimal_places=2))
     def get_discounted_price(self, obj: Product):
         """获取折扣价"""
+        resolver = _price_resolver(self.context, obj)
+        if resolver is not None:
+            return resolver.discounted_price(obj)
         request = self.context.get('request')
         user = getattr(request, 'user', None)
 
@@ -704,11 +786,17 @@ class ProductSerializer(serializers.ModelSerializer):
     @extend_schema_field(serializers.DecimalField(max_digits=10, decimal_places=2))
     def get_display_price(self, obj: Product):
         """获取展示价（经销商优先经销价，空/0回退零售价）"""
+        resolver = _price_resolver(self.context, obj)
+        if resolver is not None:
+            return resolver.base_price(obj)
         request = self.context.get('request')
         user = getattr(request, 'user', None)
         return resolve_base_price(user, obj)
 
     def get_customer_group_context(self, obj: Product):
+        resolver = _price_resolver(self.context, obj)
+        if resolver is not None:
+            return resolver.customer_group_context(obj)
         request = self.context.get('request')
         user = getattr(request, 'user', None)
         try:
@@ -727,8 +815,13 @@ class ProductSerializer(serializers.ModelSerializer):
         skus = getattr(obj, 'skus', None)
         if skus is None:
             return []
+        if 'skus' in getattr(obj, '_prefetched_objects_cache', {}):
+            # 已预取时在内存中过滤，避免逐个商品查询
+            active_skus = [sku for sku in skus.all() if sku.is_active]
+        else:
+            active_skus = skus.filter(is_active=True)
         serializer = ProductSKUSerializer(
-            skus.filter(is_active=True),
+            active_skus,
             many=True,
             context=self.context
         )
@@ -772,8 +865,11 @@ class MediaImageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = MediaImage
-        fields = ['id', 'file', 'url', 'original_name', 'content_type', 'size', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = [
+            'id', 'file', 'url', 'original_name', 'content_type', 'size',
+            'width', 'height', 'variants_status', 'created_at',
+        ]
+        read_only_fields = ['id', 'width', 'height', 'variants_status', 'created_at']
 
     @extend_schema_field(serializers.CharField())
     def get_url(self, obj: MediaImage):
@@ -793,6 +889,14 @@ class MediaImageSerializer(serializers.ModelSerializer):
         url = self.get_url(instance)
         rep['file'] = url
         rep['url'] = url
+        request = self.context.get('request')
+        if instance.variants_status == MediaImage.VARIANTS_READY:
+            rep['srcset'] = build_srcset(
+                instance.variants or [],
+                lambda name: _build_media_url(_media_storage_url(name), request),
+            )
+        else:
+            rep['srcset'] = {}
         return rep
     
     def create(self, validated_data):
@@ -1009,9 +1113,7 @@ class HomeStoreCardSerializer(serializers.ModelSerializer):
         invalid_category_ids = [
             category.id
             for category in categories
-            if not Product.objects.filter(store=store, is_active=True).filter(
-                Q(category=category) | Q(category__parent=category) | Q(category__parent__parent=category)
-            ).exists()
+            if not Product.objects.filter(store=store, is_active=True).filter(category.subtree_q()).exists()
         ]
         if invalid_category_ids:
             raise serializers.ValidationError({'category_ids': '所选一级分类下必须存在上架商品'})
@@ -1,16 +1,28 @@
 from __future__ import annotations
 
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 
+from stores.content_cache import bump_content_version
+
+from .category_tree import bump_category_tree
+from .image_variants import delete_variant_files, schedule_media_variants
 from .media_cleanup import cleanup_media_image, cleanup_product_images, cleanup_media_by_url
-from .models import MediaImage, HomeBanner, SpecialZoneCover, Case, CaseDetailBlock, Product, Category, Brand, ProductSKU
+from .models import MediaImage, HomeBanner, SpecialZone, SpecialZoneCover, Case, CaseDetailBlock, Product, Category, Brand, ProductSKU
+from .related_index import INDEXED_FIELDS, schedule_related_refresh
+
+
+@receiver(post_save, sender=MediaImage)
+def queue_media_variants(sender, instance: MediaImage, created: bool, raw: bool = False, **kwargs):
+    if created and not raw and instance.variants_status == MediaImage.VARIANTS_PENDING:
+        schedule_media_variants(instance.pk)
 
 
 @receiver(post_delete, sender=MediaImage)
 def delete_media_file(sender, instance: MediaImage, **kwargs):
     file_field = getattr(instance, 'file', None)
     if file_field:
+        delete_variant_files(instance)
         try:
             file_field.delete(save=False)
         except Exception:
@@ -59,3 +71,63 @@ def cleanup_brand_logo(sender, instance: Brand, **kwargs):
 def cleanup_sku_image(sender, instance: ProductSKU, **kwargs):
     if instance and instance.image:
         cleanup_media_by_url(instance.image)
+
+
+STORE_CONTENT_MODELS = (Product, Category, Brand, HomeBanner, SpecialZone)
+
+
+def _bump_store_content(sender, instance, **kwargs):
+    bump_content_version(getattr(instance, 'store_id', None))
+
+
+def _bump_sku_store_content(sender, instance: ProductSKU, **kwargs):
+    try:
+        store_id = instance.product.store_id
+    except Product.DoesNotExist:
+        # 商品级联删除 SKU 时，商品本身的删除信号已经递增过版本
+        return
+    bump_content_version(store_id)
+
+
+for _model in STORE_CONTENT_MODELS:
+    post_save.connect(_bump_store_content, sender=_model, dispatch_uid=f'store_content_save_{_model.__name__}')
+    post_delete.connect(_bump_store_content, sender=_model, dispatch_uid=f'store_content_delete_{_model.__name__}')
+
+post_save.connect(_bump_sku_store_content, sender=ProductSKU, dispatch_uid='store_content_save_ProductSKU')
+post_delete.connect(_bump_sku_store_content, sender=ProductSKU, dispatch_uid='store_content_delete_ProductSKU')
+
+
+def _bump_category_tree(sender, instance, **kwargs):
+    bump_category_tree()
+
+
+post_save.connect(_bump_category_tree, sender=Category, dispatch_uid='category_tree_save')
+post_delete.connect(_bump_category_tree, sender=Category, dispatch_uid='category_tree_delete')
+
+
+_INDEXED_ATTNAMES = tuple(Product._meta.get_field(name).attname for name in sorted(INDEXED_FIELDS))
+
+
+def _indexed_snapshot(instance):
+    # 只读已加载的字段，避免触发延迟字段的查询
+    return {name: instance.__dict__[name] for name in _INDEXED_ATTNAMES if name in instance.__dict__}
+
+
+@receiver(post_init, sender=Product)
+def remember_indexed_fields(sender, instance, **kwargs):
+    instance._indexed_snapshot = _indexed_snapshot(instance)
+
+
+@receiver(post_save, sender=Product)
+def refresh_related_index(sender, instance: Product, created: bool, raw: bool = False, update_fields=None, **kwargs):
+    # 只有影响得分的字段（分类、品牌、价格、上下架、店铺）变化时才刷新；
+    # 加载时未取到的字段按已变化处理
+    previous = getattr(instance, '_indexed_snapshot', {})
+    snapshot = _indexed_snapshot(instance)
+    instance._indexed_snapshot = snapshot
+    if raw:
+        return
+    if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    if created or any(name not in previous or previous[name] != value for name, value in snapshot.items()):
+        schedule_related_refresh(instance.pk)
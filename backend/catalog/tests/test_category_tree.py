@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from catalog.category_tree import get_category_tree
+from catalog.models import Brand, Category, Product
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.appliance = Category.objects.create(name='家电', level=Category.LEVEL_MAJOR)
+        self.kitchen = Category.objects.create(name='厨电', level=Category.LEVEL_MAJOR)
+        self.fridge = Category.objects.create(name='冰箱', level=Category.LEVEL_MINOR, parent=self.appliance)
+        self.double_door = Category.objects.create(name='双门', level=Category.LEVEL_ITEM, parent=self.fridge)
+        self.brand = Brand.objects.create(name='树品牌')
+
+    def make_product(self, name, category):
+        return Product.objects.create(name=name, category=category, brand=self.brand, price=Decimal('10.00'), stock=1)
+
+    def list_categories(self, **params):
+        response = self.client.get('/api/catalog/categories/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data['results'] if isinstance(response.data, dict) else response.data
+
+    def test_path_follows_moves_of_a_subtree(self):
+        self.assertEqual(self.double_door.path, f'/{self.appliance.id}/{self.fridge.id}/{self.double_door.id}/')
+
+        self.fridge.parent = self.kitchen
+        self.fridge.save()
+
+        self.double_door.refresh_from_db()
+        self.assertEqual(self.double_door.path, f'/{self.kitchen.id}/{self.fridge.id}/{self.double_door.id}/')
+        tree = get_category_tree()
+        self.assertEqual(tree.subtree_ids(self.kitchen.id), {self.kitchen.id, self.fridge.id, self.double_door.id})
+        self.assertEqual(tree.subtree_ids(self.appliance.id), {self.appliance.id})
+        self.assertEqual([node.name for node in tree.breadcrumb(self.double_door.id)], ['厨电', '冰箱', '双门'])
+
+    def test_category_list_query_count_does_not_grow_with_nodes(self):
+        self.list_categories()
+        with CaptureQueriesContext(connection) as few:
+            rows = self.list_categories(level=Category.LEVEL_MAJOR)
+        appliance = next(row for row in rows if row['id'] == self.appliance.id)
+        self.assertEqual([child['id'] for child in appliance['children']], [self.fridge.id])
+
+        for index in range(5):
+            major = Category.objects.create(name=f'品类{index}', level=Category.LEVEL_MAJOR)
+            Category.objects.create(name=f'子品类{index}', level=Category.LEVEL_MINOR, parent=major)
+        self.list_categories()
+        with CaptureQueriesContext(connection) as many:
+            rows = self.list_categories(level=Category.LEVEL_MAJOR)
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(len(many), len(few))
+
+        item = next(row for row in self.list_categories(level=Category.LEVEL_ITEM) if row['id'] == self.double_door.id)
+        self.assertEqual([crumb['id'] for crumb in item['breadcrumb']], [self.appliance.id, self.fridge.id, self.double_door.id])
+
+    def test_products_by_brand_include_descendant_categories(self):
+        in_item = self.make_product('双门冰箱', self.double_door)
+        in_minor = self.make_product('冰箱', self.fridge)
+        other_minor = Category.objects.create(name='烟机', level=Category.LEVEL_MINOR, parent=self.kitchen)
+        self.make_product('烟机', other_minor)
+
+        response = self.client.get('/api/catalog/products/by_brand/', {'category_id': self.appliance.id})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual({row['id'] for row in response.data['results']}, {in_item.id, in_minor.id})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/catalog/products/by_brand/', {'category_id': self.appliance.id})
+        product_sql = [q['sql'] for q in queries.captured_queries if 'FROM "catalog_product"' in q['sql']]
+        self.assertTrue(product_sql)
+        self.assertFalse(any('"catalog_category"' in sql.split('WHERE', 1)[-1] for sql in product_sql))
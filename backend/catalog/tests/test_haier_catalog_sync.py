@@ -0,0 +1,123 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from catalog.models import Brand, Category, Product
+from integrations.haier_sync import HaierCatalogSync, latest_resumable_log
+from integrations.models import HaierSyncLog
+from stores.models import Store, get_main_store_pk
+
+
+def _haier_row(code, model="Model"):
+    return {
+        "productCode": code,
+        "productModel": f"{model}-{code}",
+        "productGroupNamd": "Fridge",
+        "productBrandName": "Haier",
+        "isSales": "1",
+    }
+
+
+class HaierCatalogSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.store = Store.objects.get(pk=get_main_store_pk())
+        self.category = Category.objects.create(store=self.store, name="Fridges", level=Category.LEVEL_MAJOR)
+        self.brand = Brand.objects.create(store=self.store, name="Default")
+        self.api = MagicMock()
+        self.api.get_products.side_effect = lambda product_codes=None: [_haier_row(code) for code in product_codes]
+        self.api.get_product_prices.side_effect = lambda codes: [
+            {"productCode": code, "supplyPrice": 80.5, "marketPrice": 100} for code in codes
+        ]
+
+    def _pipeline(self, **kwargs):
+        kwargs.setdefault("category", self.category)
+        kwargs.setdefault("sync_prices", True)
+        return HaierCatalogSync(self.api, **kwargs)
+
+    def test_sync_batches_requests_and_bulk_creates_products(self):
+        codes = [f"C{index:02d}" for index in range(45)]
+
+        log = self._pipeline().start(product_codes=codes)
+
+        self.assertEqual(log.status, "success")
+        self.assertEqual((log.total_count, log.success_count, log.failed_count), (45, 45, 0))
+        self.assertEqual(self.api.get_products.call_count, 3)
+        self.assertEqual(self.api.get_product_prices.call_count, 3)
+        product = Product.objects.get(product_code="C00")
+        self.assertEqual(product.source, Product.SOURCE_HAIER)
+        self.assertEqual(product.supply_price, Decimal("80.50"))
+        self.assertEqual(product.price, Decimal("100.00"))
+        self.assertEqual(product.brand.name, "Haier")
+        self.assertEqual(Brand.objects.filter(name="Haier").count(), 1)
+
+    def test_unchanged_products_are_not_rewritten(self):
+        self._pipeline().start(product_codes=["C1", "C2"])
+        Product.objects.filter(product_code="C1").update(name="Merchant name")
+        before = dict(Product.objects.values_list("product_code", "updated_at"))
+
+        self.api.get_product_prices.side_effect = lambda codes: [
+            {"productCode": code, "supplyPrice": 90 if code == "C2" else 80.5, "marketPrice": 100} for code in codes
+        ]
+        self._pipeline().start(product_codes=["C1", "C2"])
+
+        after = {product.product_code: product for product in Product.objects.all()}
+        self.assertEqual(after["C1"].updated_at, before["C1"])
+        self.assertEqual(after["C1"].name, "Merchant name")
+        self.assertNotEqual(after["C2"].updated_at, before["C2"])
+        self.assertEqual(after["C2"].supply_price, Decimal("90.00"))
+
+    @patch("integrations.haier_sync.prefetch_haier_stock")
+    def test_stock_failures_are_recorded_and_skipped(self, prefetch):
+        prefetch.side_effect = lambda keys, use_cache=True: {
+            key: (None if key[0] == "C2" else {"data": [{"secCode": "WH", "stock": 6, "warehouseGrade": "0"}]})
+            for key in keys
+        }
+
+        log = self._pipeline(sync_stock=True).start(product_codes=["C1", "C2"])
+
+        self.assertEqual(log.status, "partial")
+        self.assertEqual(log.checkpoint["failures"], [{"code": "C2", "error": "库存查询失败"}])
+        self.assertEqual(Product.objects.get(product_code="C1").stock, 6)
+        self.assertFalse(Product.objects.filter(product_code="C2").exists())
+
+    def test_interrupted_sync_resumes_from_checkpoint(self):
+        codes = [f"C{index:02d}" for index in range(30)]
+
+        def interrupt(log):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            self._pipeline(batch_size=10, progress=interrupt).start(product_codes=codes)
+
+        log = latest_resumable_log()
+        self.assertEqual(log.status, "processing")
+        self.assertEqual(log.checkpoint["offset"], 10)
+
+        self.api.get_products.reset_mock()
+        resumed = HaierCatalogSync.resume(self.api, category=self.category, batch_size=10)
+
+        self.assertEqual(resumed.pk, log.pk)
+        self.assertEqual(resumed.status, "success")
+        self.assertEqual(resumed.success_count, 30)
+        self.assertEqual(self.api.get_products.call_count, 2)
+        self.assertEqual(Product.objects.filter(product_code__in=codes).count(), 30)
+        self.assertIsNone(latest_resumable_log())
+
+    def test_stale_since_skips_recently_synced_products(self):
+        self._pipeline().start(product_codes=["C1", "C2"])
+        Product.objects.filter(product_code="C1").update(last_sync_at=timezone.now() - timedelta(days=2))
+
+        log = self._pipeline().start(
+            product_codes=["C1", "C2"],
+            stale_since=timezone.now() - timedelta(days=1),
+        )
+
+        self.assertEqual(log.total_count, 1)
+        self.assertEqual(log.checkpoint["product_codes"], ["C1"])
+        self.assertEqual(HaierSyncLog.objects.count(), 2)
@@ -0,0 +1,156 @@
+import io
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from catalog.image_variants import process_media_variants
+from catalog.models import Brand, Category, MediaImage, Product
+from catalog.serializers import ProductSerializer
+from stores.models import Store
+
+
+def image_bytes(width=1200, height=600, fmt='PNG'):
+    buf = io.BytesIO()
+    Image.new('RGBA', (width, height), (200, 30, 30, 128)).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+class ImageVariantPipelineTests(TestCase):
+    def setUp(self):
+        self.media_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_dir,
+            MEDIA_URL='/media/',
+            MEDIA_IMAGE_VARIANT_WIDTHS=[240, 480, 960],
+            MEDIA_IMAGE_VARIANT_MODE='inline',
+        )
+        self.settings_override.enable()
+        self.store = Store.objects.get(code=Store.MAIN_STORE_CODE)
+        major = Category.objects.create(name='Appliance', level=Category.LEVEL_MAJOR, store=self.store)
+        self.category = Category.objects.create(
+            name='Refrigerator',
+            level=Category.LEVEL_MINOR,
+            parent=major,
+            store=self.store,
+        )
+        self.brand = Brand.objects.create(name='Variant Brand', store=self.store)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_dir, ignore_errors=True)
+
+    def create_media(self, name='2025/01/01/sample.png', **size):
+        media = MediaImage(original_name='sample.png', content_type='image/png')
+        media.file.save(name, ContentFile(image_bytes(**size)), save=False)
+        media.size = media.file.size
+        with self.captureOnCommitCallbacks(execute=True):
+            media.save()
+        media.refresh_from_db()
+        return media
+
+    def test_upload_stores_original_and_builds_variants_after_commit(self):
+        admin = get_user_model().objects.create_superuser(username='variant-admin', password='password')
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = ContentFile(image_bytes(), name='photo.png')
+        upload.content_type = 'image/png'
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = client.post('/api/catalog/media-images/', {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(response.data['variants_status'], MediaImage.VARIANTS_PENDING)
+        media = MediaImage.objects.get(pk=response.data['id'])
+        self.assertTrue(media.file.name.endswith('.png'))
+        self.assertEqual(media.variants_status, MediaImage.VARIANTS_READY)
+        self.assertEqual((media.width, media.height), (1200, 600))
+        self.assertEqual(
+            sorted((variant['format'], variant['width']) for variant in media.variants),
+            [('jpeg', 240), ('jpeg', 480), ('jpeg', 960), ('webp', 240), ('webp', 480), ('webp', 960)],
+        )
+        smallest = next(v for v in media.variants if v['format'] == 'webp' and v['width'] == 240)
+        with default_storage.open(smallest['name']) as fh:
+            self.assertEqual(Image.open(fh).size, (240, 120))
+
+        detail = client.get(f'/api/catalog/media-images/{media.id}/')
+        self.assertIn('_w480.webp 480w', detail.data['srcset']['webp'])
+
+    def test_product_list_emits_srcset_with_one_variant_query(self):
+        first = self.create_media('2025/01/01/first.png')
+        second = self.create_media('2025/01/01/second.png', width=200, height=100)
+        for index, media in enumerate((first, second)):
+            Product.objects.create(
+                store=self.store,
+                name=f'Fridge {index}',
+                category=self.category,
+                brand=self.brand,
+                price=Decimal('100.00'),
+                stock=1,
+                main_images=[f'/media/{media.file.name}', 'https://cdn.example.com/remote.jpg'],
+            )
+        products = list(Product.objects.filter(brand=self.brand).order_by('id'))
+
+        with CaptureQueriesContext(connection) as queries:
+            data = ProductSerializer(products, many=True).data
+        media_queries = [q for q in queries.captured_queries if 'catalog_mediaimage' in q['sql']]
+        self.assertEqual(len(media_queries), 1)
+
+        variants = data[0]['main_image_variants']
+        self.assertEqual(variants[0]['src'], f'/media/{first.file.name}')
+        self.assertEqual(variants[0]['width'], 1200)
+        self.assertTrue(variants[0]['srcset']['webp'].endswith('first_w960.webp 960w'))
+        self.assertIn('first_w240.jpg 240w', variants[0]['srcset']['jpeg'])
+        self.assertEqual(variants[1]['srcset'], {})
+        # narrower than every bucket: a single re-encoded copy at the original width
+        self.assertTrue(data[1]['main_image_variants'][0]['srcset']['webp'].endswith('second_w200.webp 200w'))
+
+    def test_ready_variants_bump_owning_store_content_version(self):
+        with override_settings(MEDIA_IMAGE_VARIANT_MODE='command'):
+            media = self.create_media()
+        Product.objects.create(
+            store=self.store,
+            name='Fridge',
+            category=self.category,
+            brand=self.brand,
+            price=Decimal('100.00'),
+            stock=1,
+            main_images=[f'/media/{media.file.name}'],
+        )
+        other = Store.objects.create(name='Other Store', code='variant-other')
+        self.store.refresh_from_db()
+        version = self.store.content_version
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_media_variants(media.pk), MediaImage.VARIANTS_READY)
+
+        self.store.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.store.content_version, version + 1)
+        self.assertEqual(other.content_version, 0)
+
+    def test_backfill_command_processes_pending_images(self):
+        with override_settings(MEDIA_IMAGE_VARIANT_MODE='command'):
+            media = self.create_media()
+        self.assertEqual(media.variants_status, MediaImage.VARIANTS_PENDING)
+
+        out = io.StringIO()
+        call_command('build_image_variants', '--chunk-size', '1', stdout=out)
+
+        media.refresh_from_db()
+        self.assertEqual(media.variants_status, MediaImage.VARIANTS_READY)
+        self.assertIn('ready=1', out.getvalue())
+
+        variant_names = [variant['name'] for variant in media.variants]
+        media.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in variant_names))
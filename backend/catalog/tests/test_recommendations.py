@@ -0,0 +1,103 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from catalog.models import Brand, Category, CoPurchaseCount, Product, ProductRecommendation, RecommendationBuildState
+from catalog.recommendations import STATE_NAME, CoPurchaseBuilder
+from orders.models import Order, OrderItem
+
+
+@override_settings(RECOMMENDATION_MIN_SUPPORT=1)
+class CoPurchaseRecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        User = get_user_model()
+        self.buyer = User.objects.create_user(username='rec-buyer', password='x')
+        self.other_buyer = User.objects.create_user(username='rec-other', password='x')
+        category = Category.objects.create(name='推荐', level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(name='推荐品牌')
+        self.washer, self.dryer, self.detergent, self.tv, self.fridge = [
+            Product.objects.create(name=name, category=category, brand=brand, price=Decimal('10.00'), stock=5, sales_count=sales)
+            for name, sales in (('洗衣机', 1), ('烘干机', 2), ('洗衣液', 3), ('电视', 4), ('冰箱', 100))
+        ]
+        self.sequence = 0
+
+    def place(self, user, *products, status='completed', child_of=None):
+        self.sequence += 1
+        order = Order.objects.create(
+            user=user, total_amount=Decimal('10.00'), order_number=f'REC{self.sequence:05d}',
+            status=status, parent_order=child_of,
+        )
+        for product in products:
+            OrderItem.objects.create(
+                order=order, product=product, product_name=product.name,
+                unit_price=Decimal('10.00'), actual_amount=Decimal('10.00'),
+            )
+        return order
+
+    def build(self):
+        return CoPurchaseBuilder(chunk_size=2, settle_minutes=0).run()
+
+    def recommended(self, product):
+        return list(
+            ProductRecommendation.objects.filter(product=product).order_by('rank').values_list('recommended_id', flat=True)
+        )
+
+    def test_counts_baskets_incrementally(self):
+        main = self.place(self.other_buyer, self.washer, self.dryer)
+        # child orders are per product and must not be counted twice
+        self.place(self.other_buyer, self.washer, child_of=main)
+        self.place(self.other_buyer, self.washer, self.dryer)
+        self.place(self.other_buyer, self.washer, self.detergent)
+        self.place(self.other_buyer, self.washer, self.tv, status='cancelled')
+
+        stats = self.build()
+        self.assertEqual(stats['baskets'], 3)
+        state = RecommendationBuildState.objects.get(name=STATE_NAME)
+        self.assertEqual(state.basket_count, 3)
+        self.assertEqual(CoPurchaseCount.objects.get(product=self.washer, other=self.washer).baskets, 3)
+        self.assertEqual(CoPurchaseCount.objects.get(product=self.dryer, other=self.washer).baskets, 2)
+        self.assertEqual(self.recommended(self.washer), [self.dryer.id, self.detergent.id])
+
+        # a second run only reads orders after the watermark
+        self.place(self.other_buyer, self.washer, self.detergent)
+        self.place(self.other_buyer, self.washer, self.detergent)
+        stats = self.build()
+        self.assertEqual((stats['orders'], stats['baskets']), (2, 2))
+        self.assertEqual(CoPurchaseCount.objects.get(product=self.washer, other=self.detergent).baskets, 3)
+        self.assertEqual(self.recommended(self.washer), [self.detergent.id, self.dryer.id])
+
+        with override_settings(RECOMMENDATION_MIN_SUPPORT=3):
+            CoPurchaseBuilder(settle_minutes=0).rank([self.washer.id])
+        self.assertEqual(self.recommended(self.washer), [self.detergent.id])
+
+    def test_recent_orders_wait_until_settled(self):
+        self.place(self.other_buyer, self.washer, self.dryer, status='pending')
+
+        stats = CoPurchaseBuilder().run()
+        self.assertEqual(stats['orders'], 0)
+        self.assertFalse(RecommendationBuildState.objects.filter(name=STATE_NAME, last_order_id__gt=0).exists())
+
+    def test_personal_recommendations_merge_recent_purchases(self):
+        for _ in range(2):
+            self.place(self.other_buyer, self.washer, self.detergent)
+            self.place(self.other_buyer, self.tv, self.dryer)
+        self.place(self.buyer, self.washer)
+        self.build()
+
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        response = client.get('/api/catalog/products/recommendations/', {'limit': 3})
+        self.assertEqual(response.status_code, 200, response.content)
+        ids = [row['id'] for row in response.data]
+        # co-purchase neighbour first, then best sellers; the purchased washer itself is not repeated
+        self.assertEqual(ids[0], self.detergent.id)
+        self.assertEqual(ids[1], self.fridge.id)
+        self.assertEqual(len(ids), 3)
+
+        anonymous = APIClient().get('/api/catalog/products/recommendations/', {'limit': 1})
+        self.assertEqual([row['id'] for row in anonymous.data], [self.fridge.id])
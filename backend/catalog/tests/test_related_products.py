@@ -0,0 +1,116 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from catalog.models import Brand, Category, Product, RelatedProduct
+from catalog.related_index import RelatedIndexBuilder
+from orders.models import Order, OrderItem
+
+
+@override_settings(RELATED_PRODUCTS_REFRESH_MODE='inline')
+class RelatedProductIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.appliance = Category.objects.create(name='家电', level=Category.LEVEL_MAJOR)
+        self.fridge = Category.objects.create(name='冰箱', level=Category.LEVEL_MINOR, parent=self.appliance)
+        self.kitchen = Category.objects.create(name='厨电', level=Category.LEVEL_MAJOR)
+        self.brand = Brand.objects.create(name='相关品牌')
+        self.other_brand = Brand.objects.create(name='其他品牌')
+        self.product = self.make_product('双门冰箱', self.fridge, self.brand, '1000.00')
+        self.twin = self.make_product('三门冰箱', self.fridge, self.brand, '1100.00')
+        self.cheap = self.make_product('迷你冰箱', self.fridge, self.other_brand, '200.00', sales_count=50)
+        self.hood = self.make_product('油烟机', self.kitchen, self.other_brand, '3000.00')
+        self.inactive = self.make_product('下架冰箱', self.fridge, self.brand, '1000.00', is_active=False)
+        buyer = get_user_model().objects.create_user(username='related-buyer', password='x')
+        for index in range(3):
+            order = Order.objects.create(
+                user=buyer, total_amount=Decimal('4000.00'), order_number=f'REL{index:04d}', status='completed',
+            )
+            for product in (self.product, self.hood):
+                OrderItem.objects.create(
+                    order=order, product=product, product_name=product.name,
+                    unit_price=product.price, actual_amount=product.price,
+                )
+
+    @staticmethod
+    def make_product(name, category, brand, price, **extra):
+        return Product.objects.create(name=name, category=category, brand=brand, price=Decimal(price), stock=5, **extra)
+
+    def related_ids(self, product, **params):
+        response = self.client.get(f'/api/catalog/products/{product.id}/related/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['id'] for row in response.data['results']], response.data
+
+    def test_builder_ranks_signals_and_skips_inactive(self):
+        RelatedIndexBuilder().build([self.product.id, self.inactive.id])
+
+        ranked = list(
+            RelatedProduct.objects.filter(product=self.product).order_by('rank').values_list('related_id', flat=True)
+        )
+        # same category, brand and price band rank first; the hood only qualifies through co-purchases
+        self.assertEqual(ranked[0], self.twin.id)
+        self.assertIn(self.hood.id, ranked)
+        self.assertNotIn(self.inactive.id, ranked)
+        self.assertFalse(RelatedProduct.objects.filter(product=self.inactive).exists())
+
+        with override_settings(RELATED_PRODUCTS_TOP_N=2):
+            RelatedIndexBuilder().build([self.product.id])
+        self.assertEqual(RelatedProduct.objects.filter(product=self.product).count(), 2)
+
+        # the full rebuild also prunes products taken off the shelf by bulk updates
+        RelatedIndexBuilder().build([self.twin.id])
+        self.assertTrue(RelatedProduct.objects.filter(product=self.twin).exists())
+        Product.objects.filter(pk=self.twin.pk).update(is_active=False)
+        call_command('build_related_products', stdout=StringIO())
+        self.assertFalse(RelatedProduct.objects.filter(product=self.twin).exists())
+        self.assertTrue(RelatedProduct.objects.filter(product=self.hood).exists())
+
+    def test_endpoint_pages_with_cursor_and_caps_limit(self):
+        RelatedIndexBuilder().build([self.product.id])
+        expected = list(
+            RelatedProduct.objects.filter(product=self.product).order_by('rank').values_list('related_id', flat=True)
+        )
+
+        first, data = self.related_ids(self.product, limit=2)
+        self.assertEqual(first, expected[:2])
+        self.assertTrue(data['has_next'])
+        rest, data = self.related_ids(self.product, limit=2, cursor=data['next_cursor'])
+        self.assertEqual(rest, expected[2:4])
+
+        _, data = self.related_ids(self.product, limit=500)
+        self.assertLessEqual(len(data['results']), 50)
+
+        # not indexed yet: one bounded page of same-category best sellers
+        fallback, data = self.related_ids(self.twin, limit=1)
+        self.assertEqual(fallback, [self.cheap.id])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_product_changes_refresh_the_index_incrementally(self):
+        RelatedIndexBuilder().build([self.product.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.twin.is_active = False
+            self.twin.save()
+        related = set(RelatedProduct.objects.filter(product=self.product).values_list('related_id', flat=True))
+        self.assertNotIn(self.twin.id, related)
+        self.assertFalse(RelatedProduct.objects.filter(product=self.twin).exists())
+
+        # statistics-only saves do not trigger a refresh
+        with mock.patch('catalog.signals.schedule_related_refresh') as schedule:
+            self.cheap.sales_count = 99
+            self.cheap.save(update_fields=['sales_count'])
+            self.cheap.price = Decimal('250.00')
+            self.cheap.save(update_fields=['price', 'updated_at'])
+            # a full save that only touches display fields is skipped too
+            self.hood.name = '侧吸油烟机'
+            self.hood.save()
+            Product.objects.get(pk=self.hood.pk).save()
+        schedule.assert_called_once_with(self.cheap.id)
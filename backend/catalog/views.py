@@ -1,5 +1,5 @@
 from rest_framework import viewsets, permissions, status
-from .models import Product, ProductSKU, Category, MediaImage, Brand, SearchLog, InventoryLog, HomeBanner, SpecialZone, SpecialZoneProduct, SpecialZoneCover, HomeStoreCard, Case
+from .models import Product, ProductSKU, Category, MediaImage, Brand, SearchLog, InventoryLog, HomeBanner, SpecialZone, SpecialZoneProduct, SpecialZoneCover, HomeStoreCard, Case, RelatedProduct
 from .serializers import ProductSerializer, ProductSKUSerializer, CategorySerializer, MediaImageSerializer, BrandSerializer, SearchLogSerializer, InventoryLogSerializer, HomeBannerSerializer, SpecialZoneSerializer, SpecialZoneProductSerializer, SpecialZoneCoverSerializer, HomeStoreCardSerializer, ActivitySummarySerializer, CaseSerializer
 from rest_framework.decorators import action, throttle_classes
 from rest_framework.response import Response
@@ -9,16 +9,15 @@ from django.core.files.storage import default_storage
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.exceptions import ValidationError as DRFValidationError
 from django.core.files.uploadedfile import UploadedFile
-from django.core.files.base import ContentFile
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from django.conf import settings
 from common.permissions import IsAdminOrReadOnly, IsAdmin, IsStoreStaffOrAdmin
 from common.excel import build_excel_response
 from common.utils import to_bool, parse_decimal, parse_int
-from common.pagination import LargeResultsSetPagination
+from common.pagination import LargeResultsSetPagination, RankCursorPagination
 from common.throttles import CatalogBrowseAnonRateThrottle, CatalogBrowseRateThrottle
-from stores.models import Store
+from stores.models import Store, get_main_store_id
 from stores.permissions import (
     PERMISSION_CATALOG_MANAGE,
     PERMISSION_STORE_CONTENT_MANAGE,
@@ -30,19 +29,15 @@ from stores.permissions import (
     get_requested_store,
     is_support_user,
 )
+from .category_tree import subtree_q
+from .recommendations import personal_recommendation_ids
 from .search import ProductSearchService
 from decimal import Decimal
 import uuid
-import io
 from urllib.parse import unquote, urlparse
 from drf_spectacular.utils import extend_schema, extend_schema_field, OpenApiParameter, OpenApiTypes
 from drf_spectacular.types import OpenApiTypes as OT
 
-try:
-    from PIL import Image  # type: ignore
-except Exception:
-    Image = None
-
 # Higher limits for read-only browse endpoints (products, categories, brands, home, etc.)
 class BrowseThrottleMixin:
     browse_throttle_classes = [CatalogBrowseAnonRateThrottle, CatalogBrowseRateThrottle]
@@ -855,11 +850,7 @@ class ProductViewSet(StoreScopedCreateMixin, BrowseThrottleMixin, viewsets.Model
         else:
             products = self.get_queryset()
         if category_id is not None:
-            products = products.filter(
-                Q(category_id=category_id)
-                | Q(category__parent_id=category_id)
-                | Q(category__parent__parent_id=category_id)
-            )
+            products = products.filter(subtree_q(category_id))
         is_store_member = request.user.is_authenticated and get_active_memberships(request.user).exists()
         if not is_platform_admin(request.user) and not is_store_member:
             products = products.filter(is_active=True)
@@ -900,7 +891,7 @@ class ProductViewSet(StoreScopedCreateMixin, BrowseThrottleMixin, viewsets.Model
     @extend_schema(
         operation_id='products_recommendations',
         parameters=[
-            OpenApiParameter('type', OT.STR, OpenApiParameter.QUERY, description='Recommendation type: popular, category, trending (default: popular)'),
+            OpenApiParameter('type', OT.STR, OpenApiParameter.QUERY, description='Recommendation type: personal, popular, category, trending (default: personal when signed in, otherwise popular)'),
             OpenApiParameter('limit', OT.INT, OpenApiParameter.QUERY, description='Maximum number of recommendations (default: 10, max: 50)'),
             OpenApiParameter('category_id', OT.INT, OpenApiParameter.QUERY, description='Category ID for category-based recommendations (optional)'),
         ],
@@ -912,14 +903,17 @@ class ProductViewSet(StoreScopedCreateMixin, BrowseThrottleMixin, viewsets.Model
         Get product recommendations.
         
         Query Parameters:
-        - type: Recommendation type (popular, category, trending) - default: popular
+        - type: Recommendation type (personal, popular, category, trending) - default: personal
+          for signed-in users, popular otherwise. ``personal`` merges the co-purchase neighbours
+          of the user's recent purchases (catalog.recommendations) and tops up with best sellers.
         - limit: Maximum number of recommendations (default: 10, max: 50)
         - category_id: Category ID for category-based recommendations (optional)
         
         Returns:
         - List of recommended products
         """
-        rec_type = request.query_params.get('type', 'popular').lower()
+        signed_in = bool(getattr(request.user, 'is_authenticated', False))
+        rec_type = request.query_params.get('type', 'personal' if signed_in else 'popular').lower()
         
         try:
             limit = int(request.query_params.get('limit', 10))
@@ -929,7 +923,17 @@ class ProductViewSet(StoreScopedCreateMixin, BrowseThrottleMixin, viewsets.Model
         
         queryset = self.get_queryset().filter(is_active=True)
         
-        if rec_type == 'popular':
+        if rec_type == 'personal':
+            products = []
+            if signed_in:
+                ranked_ids = personal_recommendation_ids(request.user)[:limit * 3]
+                found = queryset.in_bulk(ranked_ids)
+                products = [found[product_id] for product_id in ranked_ids if product_id in found][:limit]
+            if len(products) < limit:
+                chosen = [product.id for product in products]
+                products += list(queryset.exclude(id__in=chosen).order_by('-sales_count')[:limit - len(products)])
+
+        elif rec_type == 'popular':
             # Recommend by sales count
             products = queryset.order_by('-sales_count')[:limit]
         
@@ -968,29 +972,45 @@ class ProductViewSet(StoreScopedCreateMixin, BrowseThrottleMixin, viewsets.Model
 
     @extend_schema(
         operation_id='products_related',
-        description='Get all products related to a specific product from the same category.',
+        description='Get related products from the precomputed related-products index, cursor-paginated (limit capped at 50).',
     )
     @action(detail=True, methods=['get'])
     def related(self, request, pk=None):
         """
         Get products related to a specific product.
         
-        Returns all active products from the same category, excluding the current product.
+        Serves the precomputed index (catalog.related_index) in rank order.
+        Products that are not indexed yet fall back to one page of best sellers
+        from the same category.
+        
+        Query Parameters:
+        - limit: Page size (default: 10, max: 50)
+        - cursor: ``next_cursor`` from the previous page
         
         Returns:
-        - List of related products
+        - results, has_next, next_cursor, next, previous
         """
         product = self.get_object()
+        visible = self.get_queryset().filter(is_active=True)
+        paginator = RankCursorPagination()
+        entries = RelatedProduct.objects.filter(product_id=product.id, related__in=visible.values('id'))
+        page = paginator.paginate_queryset(entries, request, view=self)
+
+        if not page and not request.query_params.get(paginator.cursor_query_param):
+            fallback = (
+                visible.filter(category_id=product.category_id)
+                .exclude(id=product.id)
+                .order_by('-sales_count', 'id')[:paginator.get_page_size(request)]
+            )
+            serializer = self.get_serializer(fallback, many=True)
+            return Response({'results': serializer.data, 'has_next': False, 'next_cursor': None, 'next': None, 'previous': None})
 
-        # Get products from the same category (by ID), excluding current product
-        # Use select_related to optimize queries
-        related_products = self.get_queryset().filter(
-            category_id=product.category_id,
-            is_active=True
-        ).exclude(id=product.id).order_by('-sales_count')
-        
-        serializer = self.get_serializer(related_products, many=True)
-        return Response(serializer.data)
+        products = visible.in_bulk([entry.related_id for entry in page])
+        serializer = self.get_serializer(
+            [products[entry.related_id] for entry in page if entry.related_id in products],
+            many=True,
+        )
+        return paginator.get_paginated_response(serializer.data)
     
     @extend_schema(
         operation_id='products_sync_haier_stock',
@@ -1013,19 +1033,11 @@ class ProductViewSet(StoreScopedCreateMixin, BrowseThrottleMixin, viewsets.Model
             )
         
         try:
-            from integrations.haierapi import HaierAPI
-            haier_api = HaierAPI.from_settings()
-            
-            # 认证
-            if not haier_api.authenticate():
-                return Response(
-                    {'detail': '海尔API认证失败'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+            from integrations.haier_stock import fetch_haier_stock
             
-            # 查询库存
+            # 查询库存（跳过缓存取最新数据，结果回写缓存供下单复用）
             county_code = request.data.get('county_code', '110101')
-            stock_data = haier_api.check_stock(product.product_code, county_code)
+            stock_data = fetch_haier_stock(product.product_code, county_code, use_cache=False)
             
             if not stock_data:
                 return Response(
@@ -1471,12 +1483,10 @@ class MediaImageViewSet(viewsets.ModelViewSet):
     - File validation (extension, size, MIME type)
     - Secure UUID-based filename generation
     - Original filename preservation
-    - Optional image compression and format conversion
+    - Width-bucketed WebP/JPEG variants generated in the background
     
     Upload Parameters:
     - file: Required. The image file to upload
-    - format: Optional. Target format (webp, jpeg, png)
-    - compress: Optional. Whether to compress the image (1/true/yes/y)
     """
     queryset = MediaImage.objects.all().order_by('-created_at')
     serializer_class = MediaImageSerializer
@@ -1549,8 +1559,6 @@ class MediaImageViewSet(viewsets.ModelViewSet):
     @extend_schema(
         operation_id='media_images_create',
         parameters=[
-            OpenApiParameter('format', OT.STR, OpenApiParameter.QUERY, description='Target format: webp, jpeg, png'),
-            OpenApiParameter('compress', OT.BOOL, OpenApiParameter.QUERY, description='Whether to compress the image'),
             OpenApiParameter('product_id', OT.INT, OpenApiParameter.QUERY, description='Product ID to update (optional)'),
             OpenApiParameter('field_name', OT.STR, OpenApiParameter.QUERY, description='Field name: main_images or detail_images (optional)'),
         ],
@@ -1564,7 +1572,7 @@ class MediaImageViewSet(viewsets.ModelViewSet):
         - File validation through serializer
         - Secure UUID-based filename generation
         - Original filename preservation
-        - Optional image compression and format conversion
+        - Variant generation queued after commit (the original is stored as uploaded)
         
         Args:
             request: HTTP request with file in FILES
@@ -1579,51 +1587,10 @@ class MediaImageViewSet(viewsets.ModelViewSet):
         if not file:
             raise ValidationError('缺少文件: file')
         
-        # Optional compression and format conversion parameters
-        convert_to = (request.data.get('format') or request.query_params.get('format') or '').lower()
-        compress_flag_raw = request.data.get('compress', request.query_params.get('compress'))
-        compress_flag = str(compress_flag_raw).lower() in {'1', 'true', 'yes', 'y'}
-
-        # Validate target format
-        target_format = convert_to if convert_to in {'webp', 'jpeg', 'png'} else None
-
-        # Get original content type
+        # 原图直接落盘；缩略图/WebP 衍生图由后台任务生成（catalog.image_variants）
         content_type = getattr(file, 'content_type', '') or ''
         original_ext = self._get_extension_from_mime(content_type)
 
-        # If Pillow is available and compression/conversion is requested
-        if Image is not None and (compress_flag or target_format is not None):
-            try:
-                image = Image.open(file)
-                save_format = (
-                    'WEBP' if target_format == 'webp' else
-                    'JPEG' if target_format == 'jpeg' else
-                    'PNG' if target_format == 'png' else image.format
-                )
-                buf = io.BytesIO()
-                save_kwargs = {}
-                if save_format in {'JPEG', 'WEBP'} and compress_flag:
-                    save_kwargs['quality'] = 85
-                image.save(buf, format=save_format, **save_kwargs)
-                buf.seek(0)
-                ext = 'webp' if save_format == 'WEBP' else ('jpg' if save_format == 'JPEG' else 'png')
-                
-                # Generate secure filename
-                secure_name = self._build_secure_filename(ext)
-                
-                media = MediaImage(
-                    original_name=getattr(file, 'name', ''),
-                    content_type=f"image/{'jpeg' if ext == 'jpg' else ext}",
-                )
-                media.file.save(secure_name, ContentFile(buf.read()), save=False)
-                media.size = media.file.size
-                media.save()
-                serializer = self.get_serializer(media)
-                return Response(serializer.data)
-            except Exception as e:
-                # Fallback to original file if processing fails
-                pass
-
         # Save original file with secure UUID-based filename
         secure_name = self._build_secure_filename(original_ext)
         media = MediaImage(
@@ -1737,9 +1704,9 @@ class SpecialZoneViewSet(BrowseThrottleMixin, viewsets.ModelViewSet):
         elif self.kwargs.get(self.lookup_field):
             pass
         else:
-            main_store = Store.objects.filter(is_main=True).first()
-            if main_store:
-                qs = qs.filter(store=main_store)
+            main_store_id = get_main_store_id()
+            if main_store_id:
+                qs = qs.filter(store_id=main_store_id)
         qs = _hide_hidden_partner_store_queryset(qs, self.request)
         return self._visible_home_zones(qs)
 
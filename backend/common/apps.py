@@ -12,6 +12,12 @@ class CommonConfig(AppConfig):
     name = "common"
 
     def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import checks  # noqa: F401
+        from .search import repair_sqlite_search_triggers
+
+        post_migrate.connect(repair_sqlite_search_triggers, dispatch_uid='common.repair_sqlite_search_triggers')
+
         if _is_production():
             from django.conf import settings
 
@@ -0,0 +1,38 @@
+"""System checks for settings that only break once several worker processes run."""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.utils.module_loading import import_string
+
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+@register(Tags.caches)
+def check_throttle_store_is_shared(app_configs=None, **kwargs):
+    """
+    Throttle counters kept in a per-process cache are enforced per worker, not per client.
+
+    Runs with every management command (``migrate`` in the deploy command included),
+    so a production deploy with such a store stops before gunicorn starts.
+    """
+    from .apps import _is_production
+    from .throttle_store import CacheThrottleStore
+
+    if not _is_production():
+        return []
+    try:
+        store_class = import_string(settings.THROTTLE_STORE)
+    except ImportError as exc:
+        return [Error(f'THROTTLE_STORE cannot be imported: {exc}', id='common.E001')]
+    if not issubclass(store_class, CacheThrottleStore):
+        return []
+    alias = getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend is None:
+        return [Error(f'THROTTLE_CACHE_ALIAS {alias!r} is not defined in CACHES', id='common.E001')]
+    if backend in LOCAL_CACHE_BACKENDS:
+        return [Error(
+            f'THROTTLE_CACHE_ALIAS {alias!r} uses {backend}, so every worker process keeps its own throttle counters.',
+            hint='Use common.throttle_store.SQLiteThrottleStore, or point THROTTLE_CACHE_ALIAS at a shared cache.',
+            id='common.E001',
+        )]
+    return []
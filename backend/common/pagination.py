@@ -1,7 +1,9 @@
 """
 Custom pagination classes for DRF with enhanced metadata.
 """
-from rest_framework.pagination import PageNumberPagination
+from urllib.parse import parse_qs, urlsplit
+
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
 
@@ -96,3 +98,31 @@ class SmallResultsSetPagination(PageNumberPagination):
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
         })
+
+
+class RankCursorPagination(CursorPagination):
+    """
+    Cursor pagination over precomputed rankings (e.g. the related-products index).
+
+    ``limit`` sets the page size and is capped at ``max_page_size``; follow
+    ``next`` (or pass ``next_cursor`` as ``cursor``) for the next page.
+    """
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 50
+    ordering = 'rank'
+
+    def get_paginated_response(self, data):
+        next_link = self.get_next_link()
+        return Response({
+            'results': data,
+            'has_next': self.has_next,
+            'next_cursor': self._cursor_from_link(next_link),
+            'next': next_link,
+            'previous': self.get_previous_link(),
+        })
+
+    def _cursor_from_link(self, link):
+        if not link:
+            return None
+        return parse_qs(urlsplit(link).query).get(self.cursor_query_param, [None])[0]
@@ -0,0 +1,283 @@
+"""
+Trigram-indexed substring search for admin list filters.
+
+``icontains`` compiles to ``LIKE '%term%'``, which no B-tree index can serve.
+This module indexes the searched columns by trigrams and rewrites the filters
+to use them:
+
+- PostgreSQL: a ``pg_trgm`` GIN index on ``UPPER(column::text)``. Django's
+  ``icontains`` already compiles to ``UPPER(column::text) LIKE UPPER(%s)``, so
+  the planner picks the index up without any change to the query.
+- SQLite: an external-content FTS5 table ``<table>_search`` with the
+  ``trigram`` tokenizer, kept in sync by triggers. Terms of three or more
+  characters are matched through it; shorter terms (which have no trigram)
+  fall back to ``icontains``.
+
+Indexes are declared in app migrations with ``AddSubstringIndex``. Views list
+their searchable parameters in ``substring_search_fields`` and add
+``SubstringSearchFilter`` to ``filter_backends``; ``substring_q`` builds the
+same condition for ad-hoc filters.
+
+Lookups that cross a to-many relation (``items__product__name``) become a
+semi-join subquery (``EXISTS``; ``IN`` on SQLite), so the outer queryset needs
+no ``distinct()``.
+"""
+from django.db import connections, router
+from django.db.migrations.operations.base import Operation
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+MIN_TRIGRAM_LENGTH = 3
+
+_TRIGGER_SUFFIXES = ('ai', 'ad', 'au')
+
+# (database alias, table) -> frozenset of columns covered by the SQLite FTS table
+_fts_columns_cache = {}
+
+
+def fts_table_name(table):
+    return f'{table}_search'
+
+
+def _sqlite_install(cursor, table, columns, create_table=True):
+    fts = fts_table_name(table)
+    cols = ', '.join(f'"{column}"' for column in columns)
+    new_values = ', '.join(f'new."{column}"' for column in columns)
+    old_values = ', '.join(f'old."{column}"' for column in columns)
+    if create_table:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS "{fts}" USING fts5('
+            f"{cols}, content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+    cursor.execute(
+        f'CREATE TRIGGER IF NOT EXISTS "{fts}_ai" AFTER INSERT ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"(rowid, {cols}) VALUES (new.id, {new_values}); END'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER IF NOT EXISTS "{fts}_ad" AFTER DELETE ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, {cols}) VALUES (\'delete\', old.id, {old_values}); END'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER IF NOT EXISTS "{fts}_au" AFTER UPDATE ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, {cols}) VALUES (\'delete\', old.id, {old_values}); '
+        f'INSERT INTO "{fts}"(rowid, {cols}) VALUES (new.id, {new_values}); END'
+    )
+    cursor.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')')
+
+
+def _sqlite_uninstall(cursor, table):
+    fts = fts_table_name(table)
+    for suffix in _TRIGGER_SUFFIXES:
+        cursor.execute(f'DROP TRIGGER IF EXISTS "{fts}_{suffix}"')
+    cursor.execute(f'DROP TABLE IF EXISTS "{fts}"')
+
+
+def _pg_index_name(schema_editor, table, column):
+    return schema_editor._create_index_name(table, [column], suffix='_trgm')
+
+
+class AddSubstringIndex(Operation):
+    """Migration operation: trigram-index ``fields`` of ``model_name`` for substring search."""
+
+    reversible = True
+    reduces_to_sql = False
+
+    def __init__(self, model_name, fields):
+        self.model_name = model_name
+        self.fields = list(fields)
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {'model_name': self.model_name, 'fields': self.fields}
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _columns(self, model):
+        return [model._meta.get_field(name).column for name in self.fields]
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        table = model._meta.db_table
+        columns = self._columns(model)
+        vendor = schema_editor.connection.vendor
+        if vendor == 'postgresql':
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for column in columns:
+                schema_editor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {_pg_index_name(schema_editor, table, column)} '
+                    f'ON "{table}" USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+                )
+        elif vendor == 'sqlite':
+            with schema_editor.connection.cursor() as cursor:
+                _sqlite_uninstall(cursor, table)
+                _sqlite_install(cursor, table, columns)
+        _fts_columns_cache.clear()
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        table = model._meta.db_table
+        vendor = schema_editor.connection.vendor
+        if vendor == 'postgresql':
+            for column in self._columns(model):
+                schema_editor.execute(f'DROP INDEX IF EXISTS {_pg_index_name(schema_editor, table, column)}')
+        elif vendor == 'sqlite':
+            with schema_editor.connection.cursor() as cursor:
+                _sqlite_uninstall(cursor, table)
+        _fts_columns_cache.clear()
+
+    def describe(self):
+        return f"Add substring search index on {self.model_name} ({', '.join(self.fields)})"
+
+    @property
+    def migration_name_fragment(self):
+        return f'{self.model_name.lower()}_substring_index'
+
+
+def repair_sqlite_search_triggers(using='default', **kwargs):
+    """
+    Re-create sync triggers dropped by later migrations.
+
+    SQLite schema changes rebuild the table (create, copy, drop, rename), which
+    drops its triggers; the FTS table itself survives and is rebuilt here.
+    """
+    _fts_columns_cache.clear()
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name LIKE '%\\_search' ESCAPE '\\' AND sql LIKE '%fts5%trigram%'"
+        )
+        fts_tables = [row[0] for row in cursor.fetchall()]
+        for fts in fts_tables:
+            table = fts[:-len('_search')]
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                [f'{fts}_{suffix}' for suffix in _TRIGGER_SUFFIXES],
+            )
+            if cursor.fetchone()[0] == len(_TRIGGER_SUFFIXES):
+                continue
+            cursor.execute(f'PRAGMA table_info("{fts}")')
+            columns = [row[1] for row in cursor.fetchall()]
+            for suffix in _TRIGGER_SUFFIXES:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{fts}_{suffix}"')
+            _sqlite_install(cursor, table, columns, create_table=False)
+
+
+def _fts_columns(connection, table):
+    key = (connection.alias, table)
+    if key not in _fts_columns_cache:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA table_info("{fts_table_name(table)}")')
+            _fts_columns_cache[key] = frozenset(row[1] for row in cursor.fetchall())
+    return _fts_columns_cache[key]
+
+
+def _split_lookup(model, lookup):
+    """
+    Split ``lookup`` into ``(to_many, relation_path, target_model, field)``.
+
+    ``to_many`` is the first path segment when it is a to-many relation ('' otherwise);
+    ``relation_path`` is the remaining path to the model that owns ``field``.
+    """
+    parts = lookup.split('__')
+    to_many, relation = '', []
+    current = model
+    for index, part in enumerate(parts[:-1]):
+        field = current._meta.get_field(part)
+        if index == 0 and (field.one_to_many or field.many_to_many):
+            to_many = part
+        else:
+            relation.append(part)
+        current = field.related_model
+    return to_many, '__'.join(relation), current, current._meta.get_field(parts[-1])
+
+
+def _match_q(model, relation_path, target, fields, term):
+    connection = connections[router.db_for_read(model)]
+    prefix = f'{relation_path}__' if relation_path else ''
+    columns = [field.column for field in fields]
+    if (
+        connection.vendor == 'sqlite'
+        and len(term) >= MIN_TRIGRAM_LENGTH
+        and set(columns) <= _fts_columns(connection, target._meta.db_table)
+    ):
+        fts = fts_table_name(target._meta.db_table)
+        phrase = '"{}"'.format(term.replace('"', '""'))
+        match = '{%s} : %s' % (' '.join(columns), phrase)
+        key = f'{relation_path}__in' if relation_path else 'pk__in'
+        return Q(**{key: RawSQL(f'SELECT rowid FROM "{fts}" WHERE "{fts}" MATCH %s', [match])})
+    q = Q()
+    for field in fields:
+        q |= Q(**{f'{prefix}{field.name}__icontains': term})
+    return q
+
+
+def substring_q(model, lookups, term):
+    """Return a ``Q`` matching rows of ``model`` where any of ``lookups`` contains ``term``."""
+    groups = {}
+    for lookup in lookups:
+        to_many, relation, target, field = _split_lookup(model, lookup)
+        groups.setdefault((to_many, relation, target), []).append(field)
+
+    q = Q()
+    for (to_many, relation, target), fields in groups.items():
+        if not to_many:
+            q |= _match_q(model, relation, target, fields, term)
+            continue
+        # correlate through the to-many relation instead of joining it
+        to_many_field = model._meta.get_field(to_many)
+        related = to_many_field.related_model
+        # reverse relations point back through their field, forward many-to-many through its query name
+        back = to_many_field.field.name if to_many_field.auto_created else to_many_field.related_query_name()
+        matched = related._default_manager.filter(_match_q(related, relation, target, fields, term))
+        if connections[router.db_for_read(model)].vendor == 'sqlite':
+            # SQLite runs a correlated EXISTS once per outer row; an uncorrelated IN
+            # lets it start from the FTS match instead (PostgreSQL plans both as a semi-join)
+            q |= Q(pk__in=matched.values(back))
+        else:
+            q |= Q(Exists(matched.filter(**{back: OuterRef('pk')})))
+    return q
+
+
+class SubstringSearchFilter(BaseFilterBackend):
+    """
+    Filter a list by the view's ``substring_search_fields``.
+
+    ``substring_search_fields`` maps a query parameter (or a tuple of
+    alternative parameter names) to the lookups it searches, e.g.
+    ``{'order_number': ('order_number',), ('search', 'keyword'): ('title', 'user__phone')}``.
+    Several parameters narrow the result together.
+    """
+
+    @staticmethod
+    def _params(view):
+        for params, lookups in getattr(view, 'substring_search_fields', {}).items():
+            yield ((params,) if isinstance(params, str) else tuple(params)), lookups
+
+    def filter_queryset(self, request, queryset, view):
+        for params, lookups in self._params(view):
+            term = next((request.query_params.get(name) for name in params if request.query_params.get(name)), '')
+            term = term.strip()
+            if term:
+                queryset = queryset.filter(substring_q(queryset.model, lookups, term))
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'description': f"Substring match on {', '.join(lookups)}",
+                'schema': {'type': 'string'},
+            }
+            for params, lookups in self._params(view)
+            for name in params
+        ]
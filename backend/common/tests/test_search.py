@@ -0,0 +1,96 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from catalog.models import Brand, Category, Product
+from common.search import fts_table_name, repair_sqlite_search_triggers, substring_q
+from orders.models import Order, OrderItem
+from support.models import FeedbackTicket
+from stores.models import Store
+
+
+class SubstringSearchTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(username='search-admin', password='x')
+        self.buyer = User.objects.create_user(username='zhangsan-buyer', password='x', phone='13812345678')
+        category = Category.objects.create(name='家电', level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(name='搜索品牌')
+        self.fridge = self.make_product('双门冰箱 BCD-500', category, brand)
+        self.washer = self.make_product('滚筒洗衣机 XQG-100', category, brand)
+        self.order = Order.objects.create(user=self.buyer, total_amount=Decimal('20.00'), order_number='ORD20260001')
+        # two matching lines on one order must not duplicate it
+        for _ in range(2):
+            self.add_item(self.order, self.fridge)
+        self.other = Order.objects.create(user=self.admin, total_amount=Decimal('10.00'), order_number='ORD20260002')
+        self.add_item(self.other, self.washer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    @staticmethod
+    def make_product(name, category, brand):
+        return Product.objects.create(name=name, category=category, brand=brand, price=Decimal('10.00'), stock=5)
+
+    @staticmethod
+    def add_item(order, product):
+        OrderItem.objects.create(
+            order=order,
+            product=product,
+            product_name=product.name,
+            unit_price=Decimal('10.00'),
+            actual_amount=Decimal('10.00'),
+        )
+
+    def search_orders(self, **params):
+        response = self.client.get('/api/orders/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['order_number'] for row in response.data['results']]
+
+    def test_order_product_name_search_uses_subquery_without_distinct(self):
+        with CaptureQueriesContext(connection) as queries:
+            numbers = self.search_orders(product_name='bcd-5')
+        self.assertEqual(numbers, ['ORD20260001'])
+        order_sql = next(q['sql'] for q in queries.captured_queries if 'FROM "orders_order"' in q['sql'])
+        self.assertIn('"orders_orderitem"', order_sql.split('WHERE', 1)[1])
+        self.assertNotIn('DISTINCT', order_sql)
+        self.assertIn(fts_table_name('catalog_product'), order_sql)
+
+        # shorter than a trigram: plain icontains fallback
+        self.assertEqual(self.search_orders(product_name='冰'), ['ORD20260001'])
+        self.assertEqual(self.search_orders(order_number='0002', username='admin'), ['ORD20260002'])
+
+    def test_index_follows_updates(self):
+        self.washer.name = '波轮洗衣机'
+        self.washer.save(update_fields=['name'])
+
+        self.assertEqual(self.search_orders(product_name='滚筒洗衣机'), [])
+        self.assertEqual(self.search_orders(product_name='波轮洗衣机'), ['ORD20260002'])
+
+        matches = Product.objects.filter(substring_q(Product, ['name'], 'XQG'))
+        self.assertEqual(list(matches), [])
+
+    def test_triggers_are_repaired_after_table_rebuild(self):
+        fts = fts_table_name('users_user')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER "{fts}_ai"')
+        get_user_model().objects.create_user(username='lisi-dealer', password='x')
+
+        repair_sqlite_search_triggers(using='default')
+
+        response = self.client.get('/api/users/', {'search': 'lisi-de'})
+        self.assertEqual([row['username'] for row in response.data['results']], ['lisi-dealer'])
+
+    def test_feedback_ticket_keyword_searches_ticket_and_user_fields(self):
+        store = Store.objects.get(code=Store.MAIN_STORE_CODE)
+        ticket = FeedbackTicket.objects.create(
+            store=store, user=self.buyer, title='安装问题', content='冰箱门关不上', contact_phone='',
+        )
+        FeedbackTicket.objects.create(store=store, user=self.admin, title='其他', content='无')
+
+        for keyword in ('冰箱门关', '12345678', ticket.ticket_number):
+            response = self.client.get('/api/support/feedback-tickets/', {'keyword': keyword})
+            self.assertEqual([row['id'] for row in response.data['results']], [ticket.id], keyword)
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from common.checks import check_throttle_store_is_shared
+from common.throttle_store import CacheThrottleStore, SQLiteThrottleStore, get_throttle_store, reset_throttle_store
+from common.throttles import AnonLoginRateThrottle
+
+
+class SlidingWindowThrottleTests(SimpleTestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "throttle.sqlite3")
+        settings_override = override_settings(
+            THROTTLE_STORE="common.throttle_store.SQLiteThrottleStore", THROTTLE_SQLITE_PATH=self.path
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_throttle_store()
+        self.addCleanup(reset_throttle_store)
+        self.factory = APIRequestFactory()
+        self.now = 1_000_000 * 60.0
+
+    def _allow(self, ip="10.0.0.1"):
+        throttle = AnonLoginRateThrottle()
+        request = self.factory.post("/api/login/", REMOTE_ADDR=ip)
+        request.user = AnonymousUser()
+        with patch.object(throttle, "timer", return_value=self.now):
+            return throttle.allow_request(request, None), throttle
+
+    def test_limit_within_window(self):
+        for _ in range(5):
+            self.assertTrue(self._allow()[0])
+        allowed, throttle = self._allow()
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(throttle.wait(), 60.0)
+        # other clients keep their own counters
+        self.assertTrue(self._allow(ip="10.0.0.2")[0])
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        for _ in range(5):
+            self._allow()
+        # 45s into the next window a quarter of the previous hits still count (1.25)
+        self.now += 105
+        for _ in range(4):
+            self.assertTrue(self._allow()[0])
+        allowed, throttle = self._allow()
+        self.assertFalse(allowed)
+        # 5 * (15 - t) / 60 + 4 < 5 once t > 3s
+        self.assertAlmostEqual(throttle.wait(), 3.0)
+        self.now += 2
+        self.assertFalse(self._allow()[0])
+        self.now += 1.5
+        self.assertTrue(self._allow()[0])
+
+    def test_counters_are_shared_between_store_instances(self):
+        for _ in range(5):
+            self._allow()
+        # a second process opens the same file
+        other_worker = SQLiteThrottleStore(self.path)
+        throttle = AnonLoginRateThrottle()
+        key = throttle.cache_format % {"scope": "login", "ident": "10.0.0.1"}
+        window = int(self.now // 60)
+        self.assertEqual(other_worker.counts(key, window), (0, 5))
+        other_worker.incr(key, window + 1, 120)
+        self.now += 60
+        self.assertEqual(self._allow()[1].current, 1)
+
+    def test_store_errors_allow_the_request(self):
+        with patch.object(SQLiteThrottleStore, "counts", side_effect=sqlite3.OperationalError("database is locked")):
+            self.assertTrue(self._allow()[0])
+        with patch.object(SQLiteThrottleStore, "incr", side_effect=sqlite3.OperationalError("database is locked")):
+            self.assertTrue(self._allow()[0])
+        self.assertEqual(self._allow()[1].current, 0)
+
+
+class CacheThrottleStoreTests(SimpleTestCase):
+    def test_development_store_uses_the_cache(self):
+        reset_throttle_store()
+        self.addCleanup(reset_throttle_store)
+        self.assertIsInstance(get_throttle_store(), CacheThrottleStore)
+
+    @override_settings(
+        THROTTLE_STORE="common.throttle_store.CacheThrottleStore",
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    def test_production_rejects_a_per_process_cache(self):
+        with patch("common.apps._is_production", return_value=True):
+            errors = check_throttle_store_is_shared()
+            self.assertEqual([error.id for error in errors], ["common.E001"])
+            with override_settings(THROTTLE_STORE="common.throttle_store.SQLiteThrottleStore"):
+                self.assertEqual(check_throttle_store_is_shared(), [])
+        self.assertEqual(check_throttle_store_is_shared(), [])
+
+    def test_counts_and_incr(self):
+        store = CacheThrottleStore()
+        store.clear()
+        self.addCleanup(store.clear)
+        store.incr("k", 10, 60)
+        store.incr("k", 11, 60)
+        store.incr("k", 11, 60)
+        self.assertEqual(store.counts("k", 11), (1, 2))
+        self.assertEqual(store.counts("k", 13), (0, 0))
@@ -0,0 +1,128 @@
+"""
+Counter stores for the sliding-window throttles in ``common.throttles``.
+
+A throttle keeps two fixed-window counters per key (the current window and the
+previous one), so every check is one read of two counters plus one increment,
+whatever the configured rate.
+
+Stores:
+- ``SQLiteThrottleStore``: counters in a SQLite file (``THROTTLE_SQLITE_PATH``)
+  shared by every worker process that mounts it (production default).
+- ``CacheThrottleStore``: counters in a Django cache alias (``THROTTLE_CACHE_ALIAS``,
+  development default). The alias must be a shared backend (Redis / Memcached /
+  DatabaseCache) wherever more than one process serves requests; the
+  ``common.E001`` check rejects a local-memory alias in production.
+
+Select the store with ``THROTTLE_STORE`` (dotted path). Store errors never fail
+a request: the throttles let it through (see ``common.throttles``).
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class SQLiteThrottleStore:
+    """Counters stored in a local SQLite file (WAL mode, one connection per thread)."""
+
+    # roughly one increment in CLEANUP_EVERY purges expired windows
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.THROTTLE_SQLITE_PATH)
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS throttle_window ('
+                ' key TEXT NOT NULL,'
+                ' bucket INTEGER NOT NULL,'
+                ' hits INTEGER NOT NULL,'
+                ' expires_at REAL NOT NULL,'
+                ' PRIMARY KEY (key, bucket)'
+                ') WITHOUT ROWID'
+            )
+            self._local.conn = conn
+        return conn
+
+    def counts(self, key, window):
+        rows = self._connection().execute(
+            'SELECT bucket, hits FROM throttle_window WHERE key = ? AND bucket IN (?, ?)',
+            (key, window - 1, window),
+        ).fetchall()
+        found = dict(rows)
+        return found.get(window - 1, 0), found.get(window, 0)
+
+    def incr(self, key, window, ttl):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            'INSERT INTO throttle_window (key, bucket, hits, expires_at) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT (key, bucket) DO UPDATE SET hits = hits + 1',
+            (key, window, now + ttl),
+        )
+        if random.randrange(self.CLEANUP_EVERY) == 0:
+            conn.execute('DELETE FROM throttle_window WHERE expires_at < ?', (now,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM throttle_window')
+
+
+class CacheThrottleStore:
+    """Counters stored in a Django cache alias (``THROTTLE_CACHE_ALIAS``)."""
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+    @staticmethod
+    def _key(key, window):
+        return f'{key}:{window}'
+
+    def counts(self, key, window):
+        previous, current = self._key(key, window - 1), self._key(key, window)
+        found = self.cache.get_many([previous, current])
+        return found.get(previous, 0), found.get(current, 0)
+
+    def incr(self, key, window, ttl):
+        cache_key = self._key(key, window)
+        if self.cache.add(cache_key, 1, ttl):
+            return
+        try:
+            self.cache.incr(cache_key)
+        except ValueError:
+            # the key expired between add() and incr()
+            self.cache.add(cache_key, 1, ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_throttle_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                path = getattr(settings, 'THROTTLE_STORE', 'common.throttle_store.SQLiteThrottleStore')
+                _store = import_string(path)()
+    return _store
+
+
+def reset_throttle_store():
+    global _store
+    with _store_lock:
+        _store = None
@@ -5,7 +5,80 @@ This module provides specialized throttle classes for sensitive operations
 like login and payment, with stricter rate limits than general API endpoints.
 """
 
-from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
+import logging
+import math
+
+from rest_framework import throttling
+
+from .throttle_store import get_throttle_store
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowThrottleMixin:
+    """
+    Sliding-window rate limiting on two fixed-window counters.
+
+    The request rate is estimated as the current window's count plus the previous
+    window's count weighted by how much of it still overlaps the sliding window:
+
+        estimate = previous * (1 - elapsed / duration) + current
+
+    Counters live in the shared throttle store (``common.throttle_store``), so the
+    limit holds across all worker processes and each check is O(1) regardless of
+    the configured rate. If the store is unavailable (locked SQLite file, cache
+    outage) the request is allowed rather than failed.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        self.window = int(self.now // self.duration)
+        self.elapsed = self.now - self.window * self.duration
+        try:
+            self.previous, self.current = get_throttle_store().counts(self.key, self.window)
+        except Exception:
+            logger.warning('throttle store unavailable, allowing request', exc_info=True)
+            return True
+        if self.estimate() >= self.num_requests:
+            return self.throttle_failure()
+        return self.throttle_success()
+
+    def estimate(self):
+        return self.previous * (1 - self.elapsed / self.duration) + self.current
+
+    def throttle_success(self):
+        try:
+            get_throttle_store().incr(self.key, self.window, self.duration * 2)
+        except Exception:
+            logger.warning('throttle store unavailable, hit not counted', exc_info=True)
+        return True
+
+    def wait(self):
+        """Seconds until the estimate drops below the limit."""
+        remaining = self.duration - self.elapsed
+        if self.current >= self.num_requests:
+            # only the next window frees capacity; by then this window is "previous"
+            return remaining + self.duration * (1 - self.num_requests / self.current)
+        if not self.previous:
+            return remaining
+        # previous * (1 - (elapsed + t) / duration) + current < num_requests
+        needed = self.duration * (1 - (self.num_requests - self.current) / self.previous) - self.elapsed
+        return max(0.0, min(math.ceil(needed * 1000) / 1000, remaining))
+
+
+class UserRateThrottle(SlidingWindowThrottleMixin, throttling.UserRateThrottle):
+    """Per-user (or per-IP for anonymous requests) sliding-window throttle."""
+
+
+class AnonRateThrottle(SlidingWindowThrottleMixin, throttling.AnonRateThrottle):
+    """Per-IP sliding-window throttle for anonymous requests."""
 
 
 class LoginRateThrottle(UserRateThrottle):
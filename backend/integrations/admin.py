@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import HaierConfig, HaierSyncLog
+from .callback_inbox import process_entry
+from .models import CallbackInbox, HaierConfig, HaierSyncLog
 
 
 @admin.register(HaierConfig)
@@ -23,3 +24,24 @@ class HaierSyncLogAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         """禁止手动添加日志"""
         return False
+
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    """回调收件箱管理"""
+    list_display = ['id', 'provider', 'event_type', 'dedup_key', 'status', 'attempts', 'receive_count', 'received_at', 'processed_at', 'next_attempt_at']
+    list_filter = ['provider', 'status', 'received_at']
+    search_fields = ['dedup_key', 'last_error']
+    readonly_fields = ['provider', 'event_type', 'dedup_key', 'payload', 'status', 'attempts', 'receive_count',
+                      'result', 'last_error', 'received_at', 'processed_at', 'next_attempt_at', 'updated_at']
+    actions = ['replay']
+
+    def has_add_permission(self, request):
+        """回调只能由服务商推送"""
+        return False
+
+    @admin.action(description='重新处理所选回调')
+    def replay(self, request, queryset):
+        results = [process_entry(entry_id, reclaim_failed=True) for entry_id in queryset.values_list('id', flat=True)]
+        succeeded = results.count(CallbackInbox.STATUS_SUCCEEDED)
+        self.message_user(request, f'已处理 {len([r for r in results if r])} 条，成功 {succeeded} 条')
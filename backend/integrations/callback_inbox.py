@@ -0,0 +1,218 @@
+"""
+Inbox for provider callbacks (WeChat Pay notifications, YLH order callbacks).
+
+Endpoints verify the signature, store the callback under a per-provider dedup
+key and acknowledge straight away. The business side effects run afterwards in
+a worker, at most one claim per entry at a time, so provider retries of a slow
+callback no longer pile up on the same locked order and payment rows. Redelivered
+callbacks only bump ``receive_count``.
+
+Handlers are looked up per provider in ``CALLBACK_HANDLERS``. A handler takes the
+stored payload, returns a short result string and raises when the callback could
+not be applied; the entry is then marked failed and retried automatically by
+``manage.py process_callback_inbox`` with exponential backoff, up to
+``CALLBACK_INBOX_MAX_ATTEMPTS`` attempts. After that it is only replayed on request
+(``--failed``, ``--id`` or the admin action).
+
+Payment sweeps must not expire a payment whose SUCCESS notification is still
+waiting in the inbox; see ``unsettled_payment_references``.
+
+Settings:
+- CALLBACK_INBOX_MODE: ``thread`` (in-process worker after commit), ``inline``
+  (process in the on_commit callback) or ``command`` (leave entries pending for
+  ``manage.py process_callback_inbox``)
+- CALLBACK_INBOX_MAX_ATTEMPTS: attempts before a failing entry stops being retried
+- CALLBACK_INBOX_RETRY_SECONDS: delay before the first retry, doubled per attempt
+"""
+import logging
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CallbackInbox
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_HANDLERS = {
+    CallbackInbox.PROVIDER_WECHAT_PAY: 'orders.payment_service.process_wechat_payment_callback',
+    CallbackInbox.PROVIDER_YLH: 'integrations.ylhapi.process_ylh_callback',
+}
+# an entry left in "processing" this long is assumed to belong to a dead worker
+STALE_PROCESSING_MINUTES = 10
+MAX_RETRY_DELAY = timedelta(hours=6)
+UNSETTLED_STATUSES = (CallbackInbox.STATUS_PENDING, CallbackInbox.STATUS_PROCESSING, CallbackInbox.STATUS_FAILED)
+
+
+def receive(provider, dedup_key, payload, event_type=''):
+    """
+    Store a verified callback; return ``(entry, created)``.
+
+    A redelivery of an existing key only increments ``receive_count`` and is not
+    scheduled again.
+    """
+    entry, created = CallbackInbox.objects.get_or_create(
+        provider=provider,
+        dedup_key=dedup_key[:128],
+        defaults={'payload': payload, 'event_type': (event_type or '')[:64]},
+    )
+    if created:
+        schedule_callback_processing(entry.pk)
+    else:
+        CallbackInbox.objects.filter(pk=entry.pk).update(receive_count=F('receive_count') + 1)
+    return entry, created
+
+
+def _claimable(reclaim_failed=False, now=None):
+    """Pending entries, failed ones due for a retry (or all failed ones) and stale claims."""
+    now = now or timezone.now()
+    if reclaim_failed:
+        failed = Q(status=CallbackInbox.STATUS_FAILED)
+    else:
+        failed = Q(status=CallbackInbox.STATUS_FAILED, next_attempt_at__lte=now)
+    stale_before = now - timedelta(minutes=STALE_PROCESSING_MINUTES)
+    return (
+        Q(status=CallbackInbox.STATUS_PENDING)
+        | failed
+        | Q(status=CallbackInbox.STATUS_PROCESSING, updated_at__lt=stale_before)
+    )
+
+
+def retry_delay(attempts):
+    """Backoff before the next automatic attempt, or ``None`` once the attempts are used up."""
+    if attempts >= getattr(settings, 'CALLBACK_INBOX_MAX_ATTEMPTS', 8):
+        return None
+    base = getattr(settings, 'CALLBACK_INBOX_RETRY_SECONDS', 60)
+    return min(timedelta(seconds=base * 2 ** max(attempts - 1, 0)), MAX_RETRY_DELAY)
+
+
+def _claim(entry_id, reclaim_failed=False):
+    return CallbackInbox.objects.filter(_claimable(reclaim_failed), pk=entry_id).update(
+        status=CallbackInbox.STATUS_PROCESSING,
+        attempts=F('attempts') + 1,
+        updated_at=timezone.now(),
+    ) == 1
+
+
+def process_entry(entry_id, reclaim_failed=False):
+    """
+    Run the provider handler for one entry if no other worker has claimed it.
+
+    Returns the resulting status, or ``None`` when the entry was not claimable
+    (already processed, or being processed elsewhere).
+    """
+    if not _claim(entry_id, reclaim_failed=reclaim_failed):
+        return None
+    entry = CallbackInbox.objects.filter(pk=entry_id).first()
+    if entry is None:
+        return None
+    fields = {'next_attempt_at': None}
+    now = timezone.now()
+    try:
+        handler = import_string(CALLBACK_HANDLERS[entry.provider])
+        fields['result'] = str(handler(entry.payload) or '')[:255]
+        fields['status'] = CallbackInbox.STATUS_SUCCEEDED
+        fields['last_error'] = ''
+    except Exception as exc:
+        fields['status'] = CallbackInbox.STATUS_FAILED
+        fields['last_error'] = str(exc)[:2000]
+        delay = retry_delay(entry.attempts)
+        if delay is None:
+            logger.error(
+                'Callback inbox entry %s (%s %s) failed %s times, giving up: %s',
+                entry_id, entry.provider, entry.dedup_key, entry.attempts, exc,
+            )
+        else:
+            fields['next_attempt_at'] = now + delay
+            logger.warning(
+                'Callback inbox entry %s (%s %s) failed, retrying in %ss: %s',
+                entry_id, entry.provider, entry.dedup_key, int(delay.total_seconds()), exc,
+            )
+    fields['processed_at'] = now
+    fields['updated_at'] = now
+    CallbackInbox.objects.filter(pk=entry_id).update(**fields)
+    return fields['status']
+
+
+def iter_pending_entry_ids(chunk_size=100, reclaim_failed=False, provider=None):
+    """Yield ids of entries still to be processed (including failed ones due for a retry), oldest first."""
+    qs = CallbackInbox.objects.filter(_claimable(reclaim_failed))
+    if provider:
+        qs = qs.filter(provider=provider)
+    last_id = 0
+    while True:
+        ids = list(qs.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def unsettled_payment_references(out_trade_nos):
+    """
+    Return the ``out_trade_no`` values that have a WeChat Pay SUCCESS notification
+    which has not been applied yet (pending, processing or failed).
+
+    The order behind such a reference has been paid even if its payment still looks
+    open, so expiry and unpaid-order sweeps have to leave it alone.
+    """
+    out_trade_nos = {value for value in out_trade_nos if value}
+    if not out_trade_nos:
+        return set()
+    # unsettled entries are few, so match in Python rather than with a JSON ``__in``
+    # lookup; SQLite hands numeric-looking order numbers back as integers
+    unsettled = CallbackInbox.objects.filter(
+        provider=CallbackInbox.PROVIDER_WECHAT_PAY,
+        event_type='SUCCESS',
+        status__in=UNSETTLED_STATUSES,
+    ).values_list('payload__transaction__out_trade_no', flat=True)
+    return out_trade_nos.intersection(str(value) for value in unsettled if value is not None)
+
+
+class _InboxWorker:
+    """Single daemon thread that drains a queue of CallbackInbox ids in arrival order."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, entry_id):
+        self._queue.put(entry_id)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='callback-inbox', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            entry_id = self._queue.get()
+            try:
+                process_entry(entry_id)
+            except Exception as exc:
+                logger.error('Callback inbox worker error for entry %s: %s', entry_id, exc)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+_worker = _InboxWorker()
+
+
+def schedule_callback_processing(entry_id):
+    """Queue ``entry_id`` for processing once the current transaction commits."""
+    mode = getattr(settings, 'CALLBACK_INBOX_MODE', 'thread')
+    if mode == 'command':
+        return
+    if mode == 'inline':
+        transaction.on_commit(lambda: process_entry(entry_id), robust=True)
+    else:
+        transaction.on_commit(lambda: _worker.submit(entry_id), robust=True)
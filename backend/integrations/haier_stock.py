@@ -0,0 +1,129 @@
+"""海尔库存查询服务
+
+- 短时缓存：按 (product_code, county_code) 缓存库存接口返回，默认 30 秒；
+- 请求合并：同一进程内对同一键的并发查询只发起一次上游请求，其余线程等待同一结果；
+- 批量预取：下单前并发查询结算单内全部海尔商品，数据库事务内只读取缓存结果，
+  不在持有行锁时等待第三方接口。
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .haierapi import HaierAPI
+
+logger = logging.getLogger(__name__)
+
+HAIER_STOCK_CACHE_PREFIX = 'haier_stock'
+# 等待其他线程的上游请求时最多等待的秒数，与 HaierAPI.check_stock 的请求超时一致
+HAIER_STOCK_WAIT_SECONDS = 30
+
+_client: Optional[HaierAPI] = None
+_client_lock = threading.Lock()
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _cache_key(product_code: str, county_code: str) -> str:
+    return f'{HAIER_STOCK_CACHE_PREFIX}:{product_code}:{county_code}'
+
+
+def get_haier_client() -> HaierAPI:
+    """进程内共享的海尔客户端，复用访问令牌，避免每次查询都重新认证。"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HaierAPI.from_settings()
+        return _client
+
+
+def reset_haier_client() -> None:
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def fetch_haier_stock(product_code: str, county_code: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+    """查询海尔库存接口原始返回，失败时返回 None（失败结果不缓存）。
+
+    Args:
+        product_code: 海尔商品编码
+        county_code: 区县编码
+        use_cache: 为 False 时跳过缓存读取（后台同步需要最新数据），结果仍会写回缓存
+    """
+    key = _cache_key(product_code, county_code)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        try:
+            return future.result(timeout=HAIER_STOCK_WAIT_SECONDS)
+        except FutureTimeoutError:
+            # 上游迟迟未返回时按查询失败处理，不再叠加一次同样可能超时的请求
+            logger.warning(f'等待海尔库存查询超时: product_code={product_code}, county_code={county_code}')
+            return None
+
+    try:
+        stock_info = get_haier_client().check_stock(product_code, county_code)
+        if stock_info:
+            cache.set(key, stock_info, getattr(settings, 'HAIER_STOCK_CACHE_SECONDS', 30))
+        future.set_result(stock_info)
+        return stock_info
+    except Exception as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def prefetch_haier_stock(
+    keys: Iterable[Tuple[str, str]],
+    use_cache: bool = True,
+) -> Dict[Tuple[str, str], Optional[Dict[str, Any]]]:
+    """并发查询多个 (product_code, county_code)，返回 {键: 原始返回或 None}。"""
+    unique_keys = [key for key in dict.fromkeys(keys) if key[0]]
+    if not unique_keys:
+        return {}
+    if len(unique_keys) == 1:
+        product_code, county_code = unique_keys[0]
+        return {unique_keys[0]: _safe_fetch(product_code, county_code, use_cache)}
+
+    workers = min(len(unique_keys), max(1, getattr(settings, 'HAIER_STOCK_PREFETCH_WORKERS', 4)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda key: _safe_fetch(key[0], key[1], use_cache), unique_keys)
+        return dict(zip(unique_keys, results))
+
+
+def _safe_fetch(product_code: str, county_code: str, use_cache: bool) -> Optional[Dict[str, Any]]:
+    try:
+        return fetch_haier_stock(product_code, county_code, use_cache=use_cache)
+    except Exception as exc:
+        logger.error(f'海尔库存查询异常: product_code={product_code}, county_code={county_code}, error={exc}')
+        return None
+
+
+def summarize_haier_stock(stock_info: Dict[str, Any]) -> Dict[str, Any]:
+    """汇总各仓库库存，并选出库存最多的仓库。"""
+    warehouses = stock_info.get('data') or []
+    best_warehouse = max(warehouses, key=lambda wh: int(wh.get('stock', 0))) if warehouses else {}
+    return {
+        'stock': sum(int(wh.get('stock', 0)) for wh in warehouses),
+        'warehouse_code': best_warehouse.get('secCode', ''),
+        'warehouse_grade': best_warehouse.get('warehouseGrade', ''),
+        'timeliness_data': best_warehouse.get('timelinessData', {}),
+    }
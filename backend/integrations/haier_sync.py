@@ -0,0 +1,311 @@
+"""海尔商品批量同步
+
+按海尔接口单次上限（20 个编码）分批拉取商品和价格，库存用有界线程池并发查询，
+与数据库现有数据比对后只写入有变化的字段（bulk_create / bulk_update）。每批处理完
+把进度、速率和失败明细写入 HaierSyncLog.checkpoint，中断后可从断点续跑。
+"""
+
+import logging
+import time
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from catalog.models import Brand, Category, Product
+from stores.content_cache import bump_content_version
+from stores.models import get_main_store_pk
+
+from .haier_stock import prefetch_haier_stock, summarize_haier_stock
+from .models import HaierSyncLog
+
+logger = logging.getLogger(__name__)
+
+# 海尔商品、价格接口单次最多接受 20 个产品编码
+HAIER_SYNC_BATCH_SIZE = 20
+# 断点中保留的失败明细条数上限
+HAIER_SYNC_MAX_FAILURES = 200
+
+RESUMABLE_STATUSES = ('processing', 'failed', 'partial')
+
+
+class HaierCatalogSync:
+    """海尔商品同步管道
+
+    Args:
+        api: HaierAPI 实例（已配置）
+        category / brand: 新建商品使用的分类和品牌，未指定时使用第一个分类/品牌
+        sync_prices: 是否同步价格
+        sync_stock: 是否同步库存
+        county_code: 库存查询使用的区域编码
+        batch_size: 每批编码数，不超过海尔接口上限
+        progress: 每批完成后的回调 progress(log)
+    """
+
+    def __init__(
+        self,
+        api,
+        category=None,
+        brand=None,
+        sync_prices=False,
+        sync_stock=False,
+        county_code='110101',
+        batch_size=HAIER_SYNC_BATCH_SIZE,
+        progress=None,
+    ):
+        self.api = api
+        self.category = category
+        self.brand = brand
+        self.sync_prices = sync_prices
+        self.sync_stock = sync_stock
+        self.county_code = county_code
+        self.batch_size = max(1, min(batch_size, HAIER_SYNC_BATCH_SIZE))
+        self.progress = progress
+        self._listing = {}
+        self._brands = {}
+        self._defaults = {}
+
+    # ------------------------------------------------------------------
+    # 入口
+    # ------------------------------------------------------------------
+
+    def start(self, product_codes=None, stale_since=None) -> HaierSyncLog:
+        """新建同步任务并执行。
+
+        Args:
+            product_codes: 指定产品编码；为空时同步海尔可采全量商品
+            stale_since: 跳过在该时间之后已同步过的商品，只处理更早同步或从未同步的商品
+        """
+        codes = list(dict.fromkeys(product_codes or []))
+        if not codes:
+            listing = self.api.get_products() or []
+            self._listing = {row['productCode']: row for row in listing if row.get('productCode')}
+            codes = list(self._listing)
+        if stale_since:
+            fresh = set(
+                Product.objects.filter(product_code__in=codes, last_sync_at__gte=stale_since)
+                .values_list('product_code', flat=True)
+            )
+            codes = [code for code in codes if code not in fresh]
+
+        log = HaierSyncLog.objects.create(
+            sync_type='products',
+            status='processing',
+            total_count=len(codes),
+            checkpoint={
+                'product_codes': codes,
+                'offset': 0,
+                'failures': [],
+                'options': {
+                    'sync_prices': self.sync_prices,
+                    'sync_stock': self.sync_stock,
+                    'county_code': self.county_code,
+                    'stale_since': stale_since.isoformat() if stale_since else None,
+                },
+            },
+        )
+        return self.run(log)
+
+    @classmethod
+    def resume(cls, api, log=None, **kwargs) -> HaierSyncLog:
+        """从最近一次未完成的商品同步断点继续。"""
+        log = log or latest_resumable_log()
+        if log is None:
+            return None
+        options = log.checkpoint.get('options') or {}
+        kwargs.setdefault('sync_prices', options.get('sync_prices', False))
+        kwargs.setdefault('sync_stock', options.get('sync_stock', False))
+        kwargs.setdefault('county_code', options.get('county_code', '110101'))
+        return cls(api, **kwargs).run(log)
+
+    def run(self, log: HaierSyncLog) -> HaierSyncLog:
+        checkpoint = log.checkpoint
+        codes = checkpoint.get('product_codes') or []
+        offset = checkpoint.get('offset', 0)
+        started = time.monotonic()
+        processed = 0
+
+        if log.status != 'processing':
+            HaierSyncLog.objects.filter(pk=log.pk).update(status='processing', completed_at=None)
+            log.status = 'processing'
+
+        while offset < len(codes):
+            chunk = codes[offset:offset + self.batch_size]
+            try:
+                synced, failures = self.sync_chunk(chunk)
+            except Exception as exc:
+                logger.exception(f'海尔商品批量同步失败: offset={offset}')
+                synced, failures = 0, [{'code': code, 'error': str(exc)} for code in chunk]
+
+            offset += len(chunk)
+            processed += len(chunk)
+            log.success_count += synced
+            log.failed_count += len(failures)
+            checkpoint['offset'] = offset
+            checkpoint['failures'] = (checkpoint.get('failures', []) + failures)[-HAIER_SYNC_MAX_FAILURES:]
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed else 0
+            log.message = f'进度 {offset}/{len(codes)}，速率 {rate:.1f} 条/秒，失败 {log.failed_count} 条'
+            log.checkpoint = checkpoint
+            log.save(update_fields=['success_count', 'failed_count', 'checkpoint', 'message'])
+            if self.progress:
+                self.progress(log)
+
+        if not log.failed_count:
+            log.status = 'success'
+        elif log.success_count:
+            log.status = 'partial'
+        else:
+            log.status = 'failed'
+        log.completed_at = timezone.now()
+        log.save(update_fields=['status', 'completed_at'])
+        return log
+
+    # ------------------------------------------------------------------
+    # 单批处理
+    # ------------------------------------------------------------------
+
+    def fetch_chunk(self, codes):
+        """拉取一批编码的商品、价格和库存数据，返回 ({编码: 商品数据}, 失败列表)。"""
+        rows = {code: self._listing[code] for code in codes if code in self._listing}
+        missing = [code for code in codes if code not in rows]
+        if missing:
+            for row in self.api.get_products(product_codes=missing) or []:
+                if row.get('productCode'):
+                    rows[row['productCode']] = row
+
+        if self.sync_prices and rows:
+            for price in self.api.get_product_prices(list(rows)) or []:
+                code = price.get('productCode')
+                if code in rows:
+                    rows[code] = {**rows[code], **price}
+
+        failures = [{'code': code, 'error': '海尔未返回商品数据'} for code in codes if code not in rows]
+
+        if self.sync_stock and rows:
+            stock = prefetch_haier_stock(((code, self.county_code) for code in rows), use_cache=False)
+            for code in rows:
+                stock_data = stock.get((code, self.county_code))
+                if stock_data is None:
+                    failures.append({'code': code, 'error': '库存查询失败'})
+                    continue
+                rows[code] = {**rows[code], '_stock': stock_data}
+        return rows, failures
+
+    def sync_chunk(self, codes):
+        """同步一批编码，返回 (成功数, 失败列表)。"""
+        rows, failures = self.fetch_chunk(codes)
+        failed_codes = {failure['code'] for failure in failures}
+        rows = {code: row for code, row in rows.items() if code not in failed_codes}
+        if rows:
+            self.apply(rows)
+        return len(rows), failures
+
+    @transaction.atomic
+    def apply(self, rows):
+        """与现有商品比对，只写入有变化的字段。"""
+        now = timezone.now()
+        existing = Product.objects.in_bulk(list(rows), field_name='product_code')
+        to_create = []
+        to_update = []
+        update_fields = set()
+        touched_stores = set()
+
+        for code, row in rows.items():
+            product = existing.get(code)
+            if product is None:
+                product = Product(
+                    product_code=code,
+                    name=row.get('productModel', code),
+                    store_id=self._main_store_pk(),
+                    category=self.category or self._default('category', Category),
+                    brand=self.brand or self._resolve_brand(row) or self._default('brand', Brand),
+                    price=0,
+                    source=Product.SOURCE_HAIER,
+                    last_sync_at=now,
+                )
+                self._assign(product, row)
+                to_create.append(product)
+                continue
+
+            changed = self._assign(product, row)
+            if product.source != Product.SOURCE_HAIER:
+                product.source = Product.SOURCE_HAIER
+                changed.add('source')
+            if changed:
+                product.updated_at = now
+                to_update.append(product)
+                update_fields |= changed | {'updated_at'}
+                touched_stores.add(product.store_id)
+
+        if to_create:
+            Product.objects.bulk_create(to_create)
+            touched_stores |= {product.store_id for product in to_create}
+        if to_update:
+            Product.objects.bulk_update(to_update, sorted(update_fields))
+        if existing:
+            Product.objects.filter(pk__in=[product.pk for product in existing.values()]).update(last_sync_at=now)
+        for store_id in touched_stores:
+            bump_content_version(store_id)
+
+    def _assign(self, product, row):
+        """把海尔数据写到商品对象上，返回发生变化的字段名集合。"""
+        values = Product.haier_field_values(row)
+        brand = None if self.brand else self._resolve_brand(row)
+        if brand is not None:
+            values['brand'] = brand
+        stock_data = row.get('_stock')
+        if stock_data is not None:
+            summary = summarize_haier_stock(stock_data)
+            values['stock'] = summary['stock']
+            values['warehouse_code'] = summary['warehouse_code']
+            values['warehouse_grade'] = summary['warehouse_grade']
+
+        changed = set()
+        for name, value in values.items():
+            field = Product._meta.get_field(name)
+            if name == 'brand':
+                if product.brand_id != value.pk:
+                    product.brand = value
+                    changed.add(name)
+                continue
+            value = field.to_python(value)
+            if isinstance(value, Decimal):
+                value = value.quantize(Decimal(10) ** -field.decimal_places)
+            if getattr(product, name) != value:
+                setattr(product, name, value)
+                changed.add(name)
+
+        price = product.price
+        product.apply_haier_sale_price()
+        if product.price != price:
+            product.price = Product._meta.get_field('price').to_python(product.price)
+            changed.add('price')
+        return changed
+
+    def _default(self, name, model):
+        if name not in self._defaults:
+            self._defaults[name] = model.objects.first()
+        return self._defaults[name]
+
+    def _main_store_pk(self):
+        if 'store' not in self._defaults:
+            self._defaults['store'] = get_main_store_pk()
+        return self._defaults['store']
+
+    def _resolve_brand(self, row):
+        name = row.get('productBrandName')
+        if not name:
+            return None
+        if name not in self._brands:
+            self._brands[name], _ = Brand.objects.get_or_create(store_id=self._main_store_pk(), name=name)
+        return self._brands[name]
+
+
+def latest_resumable_log():
+    """最近一次未跑完的商品同步任务。"""
+    for log in HaierSyncLog.objects.filter(sync_type='products', status__in=RESUMABLE_STATUSES)[:5]:
+        checkpoint = log.checkpoint or {}
+        if checkpoint.get('offset', 0) < len(checkpoint.get('product_codes') or []):
+            return log
+    return None
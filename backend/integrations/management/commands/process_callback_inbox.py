@@ -0,0 +1,56 @@
+"""
+Process queued provider callbacks, or replay the ones that failed.
+
+Failed entries whose retry is due (exponential backoff, see
+``integrations.callback_inbox``) and entries stuck in "processing" longer than
+the stale window (dead worker) are picked up again as well.
+
+Usage:
+    python manage.py process_callback_inbox
+    python manage.py process_callback_inbox --failed                # replay all failed entries now
+    python manage.py process_callback_inbox --failed --provider ylh
+    python manage.py process_callback_inbox --id 42 --id 43         # replay specific entries
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from integrations.callback_inbox import iter_pending_entry_ids, process_entry
+from integrations.models import CallbackInbox
+
+
+class Command(BaseCommand):
+    help = 'Process pending provider callbacks and failed ones due for a retry; optionally replay all failed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help='Replay all failed entries, including ones not yet due or out of attempts')
+        parser.add_argument('--id', type=int, action='append', dest='ids', default=[], help='Replay only this entry (repeatable)')
+        parser.add_argument(
+            '--provider', choices=[value for value, _ in CallbackInbox.PROVIDER_CHOICES],
+            help='Only process callbacks from this provider',
+        )
+        parser.add_argument('--chunk-size', type=int, default=100, help='Entries loaded per query')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many entries (0 = no limit)')
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        stats = {'processed': 0, 'succeeded': 0, 'failed': 0, 'busy': 0}
+        if options['ids']:
+            chunks = [sorted(options['ids'])]
+            reclaim_failed = True
+        else:
+            reclaim_failed = options['failed']
+            chunks = iter_pending_entry_ids(options['chunk_size'], reclaim_failed=reclaim_failed, provider=options['provider'])
+        for ids in chunks:
+            for entry_id in ids:
+                if limit and stats['processed'] >= limit:
+                    break
+                result = process_entry(entry_id, reclaim_failed=reclaim_failed)
+                stats['processed'] += 1
+                stats[result or 'busy'] += 1
+            close_old_connections()
+            if limit and stats['processed'] >= limit:
+                break
+        self.stdout.write(self.style.SUCCESS(
+            'Callback inbox: processed={processed} succeeded={succeeded} failed={failed} busy={busy}'.format(**stats)
+        ))
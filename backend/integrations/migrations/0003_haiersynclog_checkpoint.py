@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0002_haierconfig_haiersynclog_delete_supplierconfig_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='haiersynclog',
+            name='checkpoint',
+            field=models.JSONField(blank=True, default=dict, help_text='批量同步的待处理编码、已处理位置和失败明细，用于中断后续跑', verbose_name='断点信息'),
+        ),
+    ]
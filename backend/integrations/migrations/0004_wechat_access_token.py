@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0003_haiersynclog_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeChatAccessToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('appid', models.CharField(max_length=64, unique=True, verbose_name='小程序AppID')),
+                ('access_token', models.CharField(blank=True, default='', max_length=512, verbose_name='接口调用凭证')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='过期时间')),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True, verbose_name='刷新时间')),
+                ('refresh_count', models.PositiveIntegerField(default=0, verbose_name='刷新次数')),
+            ],
+            options={
+                'verbose_name': '微信接口凭证',
+                'verbose_name_plural': '微信接口凭证',
+            },
+        ),
+    ]
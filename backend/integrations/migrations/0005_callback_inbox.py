@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0004_wechat_access_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('wechat_pay', '微信支付'), ('ylh', '易理货')], max_length=20, verbose_name='回调来源')),
+                ('event_type', models.CharField(blank=True, default='', help_text='微信支付为 trade_state，易理货为回调 Method', max_length=64, verbose_name='事件类型')),
+                ('dedup_key', models.CharField(help_text='同一来源下唯一，如 交易号:交易状态', max_length=128, verbose_name='去重键')),
+                ('payload', models.JSONField(default=dict, help_text='验签后的原始回调数据', verbose_name='回调内容')),
+                ('status', models.CharField(choices=[('pending', '待处理'), ('processing', '处理中'), ('succeeded', '已处理'), ('failed', '处理失败')], default='pending', max_length=20, verbose_name='处理状态')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='处理次数')),
+                ('receive_count', models.PositiveIntegerField(default=1, help_text='服务商重复送达时累加', verbose_name='接收次数')),
+                ('result', models.CharField(blank=True, default='', max_length=255, verbose_name='处理结果')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='最近错误')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='接收时间')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='处理完成时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '回调收件箱',
+                'verbose_name_plural': '回调收件箱',
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(fields=['status', 'id'], name='integration_status_8d1fc4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('provider', 'dedup_key'), name='uniq_callback_inbox_dedup')],
+            },
+        ),
+    ]
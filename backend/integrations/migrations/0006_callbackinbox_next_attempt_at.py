@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0005_callback_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='callbackinbox',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='处理失败后自动重试的时间，为空表示不再自动重试', null=True, verbose_name='下次重试时间'),
+        ),
+    ]
@@ -111,6 +111,13 @@ class HaierSyncLog(models.Model):
         help_text='失败的记录数'
     )
     
+    checkpoint = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='断点信息',
+        help_text='批量同步的待处理编码、已处理位置和失败明细，用于中断后续跑'
+    )
+    
     # 时间戳
     started_at = models.DateTimeField(
         auto_now_add=True,
@@ -147,3 +154,180 @@ class HaierSyncLog(models.Model):
         if self.completed_at:
             return (self.completed_at - self.started_at).total_seconds()
         return None
+    
+    @property
+    def throughput(self):
+        """获取同步速率（条/秒）"""
+        duration = self.duration
+        if not duration:
+            return None
+        return round((self.success_count + self.failed_count) / duration, 2)
+
+
+class WeChatAccessToken(models.Model):
+    """
+    微信接口调用凭证
+
+    同一小程序的 access_token 在所有进程间共用一行记录，刷新时锁定该行，
+    避免多个 worker 各自刷新导致彼此的凭证失效。
+    """
+
+    appid = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='小程序AppID'
+    )
+
+    access_token = models.CharField(
+        max_length=512,
+        blank=True,
+        default='',
+        verbose_name='接口调用凭证'
+    )
+
+    expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='过期时间'
+    )
+
+    refreshed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='刷新时间'
+    )
+
+    refresh_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='刷新次数'
+    )
+
+    class Meta:
+        verbose_name = '微信接口凭证'
+        verbose_name_plural = '微信接口凭证'
+
+    def __str__(self):
+        return f"{self.appid} (过期: {self.expires_at})"
+
+
+class CallbackInbox(models.Model):
+    """
+    第三方回调收件箱
+
+    支付、易理货回调先按去重键落库并立即应答，再由后台 worker 逐条处理。
+    服务商重试送达的同一回调只累加 receive_count，不会重复执行业务逻辑；
+    处理失败的记录按 next_attempt_at 指数退避自动重试，超过次数上限后
+    可用 process_callback_inbox --failed 重放。
+    """
+
+    PROVIDER_WECHAT_PAY = 'wechat_pay'
+    PROVIDER_YLH = 'ylh'
+    PROVIDER_CHOICES = [
+        (PROVIDER_WECHAT_PAY, '微信支付'),
+        (PROVIDER_YLH, '易理货'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '待处理'),
+        (STATUS_PROCESSING, '处理中'),
+        (STATUS_SUCCEEDED, '已处理'),
+        (STATUS_FAILED, '处理失败'),
+    ]
+
+    provider = models.CharField(
+        max_length=20,
+        choices=PROVIDER_CHOICES,
+        verbose_name='回调来源'
+    )
+
+    event_type = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='事件类型',
+        help_text='微信支付为 trade_state，易理货为回调 Method'
+    )
+
+    dedup_key = models.CharField(
+        max_length=128,
+        verbose_name='去重键',
+        help_text='同一来源下唯一，如 交易号:交易状态'
+    )
+
+    payload = models.JSONField(
+        default=dict,
+        verbose_name='回调内容',
+        help_text='验签后的原始回调数据'
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        verbose_name='处理状态'
+    )
+
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='处理次数'
+    )
+
+    receive_count = models.PositiveIntegerField(
+        default=1,
+        verbose_name='接收次数',
+        help_text='服务商重复送达时累加'
+    )
+
+    result = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        verbose_name='处理结果'
+    )
+
+    last_error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='最近错误'
+    )
+
+    received_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='接收时间'
+    )
+
+    processed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='处理完成时间'
+    )
+
+    next_attempt_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='下次重试时间',
+        help_text='处理失败后自动重试的时间，为空表示不再自动重试'
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='更新时间'
+    )
+
+    class Meta:
+        verbose_name = '回调收件箱'
+        verbose_name_plural = '回调收件箱'
+        ordering = ['-received_at']
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'dedup_key'], name='uniq_callback_inbox_dedup'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_provider_display()} {self.dedup_key} ({self.get_status_display()})"
@@ -53,6 +53,7 @@ class HaierSyncLogSerializer(serializers.ModelSerializer):
             'completed_at',
             'created_at',
             'duration',
+            'throughput',
         ]
         read_only_fields = [
             'id',
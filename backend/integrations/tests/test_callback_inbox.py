@@ -0,0 +1,247 @@
+import base64
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from catalog.models import Brand, Category, Product
+from integrations.models import CallbackInbox
+from integrations.ylhapi import YLHCallbackHandler
+from orders.models import Order, OrderItem, Payment
+
+API_V3_KEY = 'k' * 32
+
+
+class FakeWeChatPay:
+    """Local stand-in for WeChat Pay: signs and encrypts transaction notifications like the v3 API."""
+
+    def __init__(self):
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = self.private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        handle, self.public_key_path = tempfile.mkstemp(suffix='.pem')
+        with os.fdopen(handle, 'wb') as fh:
+            fh.write(pem)
+
+    def close(self):
+        os.unlink(self.public_key_path)
+
+    def notify(self, client, payment, trade_state, transaction_id='4200000001', event_id=None):
+        transaction = {
+            'mchid': '', 'appid': '',
+            'out_trade_no': payment.order.order_number,
+            'attach': str(payment.id),
+            'transaction_id': transaction_id if trade_state == 'SUCCESS' else '',
+            'trade_state': trade_state,
+            'amount': {'total': int(payment.amount * 100)},
+        }
+        nonce = uuid.uuid4().hex[:12]
+        ciphertext = AESGCM(API_V3_KEY.encode()).encrypt(nonce.encode(), json.dumps(transaction).encode(), b'transaction')
+        body = json.dumps({
+            'id': event_id or str(uuid.uuid4()),
+            'event_type': f'TRANSACTION.{trade_state}',
+            'resource': {
+                'algorithm': 'AEAD_AES_256_GCM',
+                'ciphertext': base64.b64encode(ciphertext).decode(),
+                'nonce': nonce,
+                'associated_data': 'transaction',
+            },
+        })
+        timestamp, sign_nonce = str(int(time.time())), uuid.uuid4().hex
+        signature = self.private_key.sign(f'{timestamp}\n{sign_nonce}\n{body}\n'.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return client.generic(
+            'POST', '/api/payments/callback/wechat/', body, content_type='application/json',
+            HTTP_WECHATPAY_SIGNATURE=base64.b64encode(signature).decode(),
+            HTTP_WECHATPAY_TIMESTAMP=timestamp,
+            HTTP_WECHATPAY_NONCE=sign_nonce,
+            HTTP_WECHATPAY_SERIAL='FAKE',
+        )
+
+
+class FakeYLH:
+    """Local stand-in for the YLH platform: posts signed form callbacks; every retry gets a fresh timestamp."""
+
+    def __init__(self):
+        self.handler = YLHCallbackHandler('ylh-app', 'ylh-secret')
+
+    def notify(self, client, method, data):
+        form = {
+            'AppKey': 'ylh-app',
+            'TimeStamp': str(time.time_ns()),
+            'Method': method,
+            'Data': json.dumps(data, ensure_ascii=False),
+        }
+        form['Sign'] = self.handler.generate_sign(form)
+        return client.post('/api/haier/ylh/callback/', form)
+
+
+@override_settings(
+    CALLBACK_INBOX_MODE='inline',
+    WECHAT_PAY_API_V3_KEY=API_V3_KEY,
+    WECHAT_PAY_PUBLIC_KEY_ID='',
+    WECHAT_PAY_MCHID='',
+    WECHAT_APPID='',
+    YLH_CALLBACK_APP_KEY='ylh-app',
+    YLH_CALLBACK_SECRET='ylh-secret',
+)
+class CallbackInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.wechat = FakeWeChatPay()
+        self.addCleanup(self.wechat.close)
+        override = override_settings(WECHAT_PAY_PUBLIC_KEY_PATH=self.wechat.public_key_path)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.ylh = FakeYLH()
+
+        self.user = get_user_model().objects.create_user(username='inbox-user', password='x')
+        category = Category.objects.create(name='回调', level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(name='回调品牌')
+        self.product = Product.objects.create(
+            name='回调商品', category=category, brand=brand, price=Decimal('99.00'), stock=10, product_code='P-100',
+        )
+        self.order = self.make_order()
+
+    def make_order(self, order_number=None):
+        order = Order.objects.create(
+            user=self.user, product=self.product, quantity=1,
+            total_amount=Decimal('99.00'), actual_amount=Decimal('99.00'), status='pending',
+            snapshot_contact_name='张三', snapshot_phone='13800000000', snapshot_address='地址',
+            **({'order_number': order_number} if order_number else {}),
+        )
+        OrderItem.objects.create(
+            order=order, product=self.product, product_name=self.product.name, quantity=2,
+            unit_price=Decimal('49.50'), actual_amount=Decimal('99.00'),
+        )
+        return order
+
+    def post(self, send, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = send(self.client, *args, **kwargs)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_payment_duplicates_and_late_notpay_are_applied_once(self):
+        payment = Payment.create_for_order(self.order, method='wechat', ttl_minutes=10)
+        event_id = str(uuid.uuid4())
+
+        # an early NOTPAY, then SUCCESS delivered three times, then a stale NOTPAY redelivery
+        self.post(self.wechat.notify, payment, 'NOTPAY')
+        for _ in range(3):
+            response = self.post(self.wechat.notify, payment, 'SUCCESS', event_id=event_id)
+            self.assertEqual(response.data['code'], 'SUCCESS')
+        self.post(self.wechat.notify, payment, 'NOTPAY')
+
+        payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(payment.status, 'succeeded')
+        self.assertEqual(self.order.status, 'paid')
+        entries = {entry.event_type: entry for entry in CallbackInbox.objects.filter(provider='wechat_pay')}
+        self.assertEqual(len(entries), 2)
+        self.assertEqual((entries['SUCCESS'].receive_count, entries['SUCCESS'].attempts), (3, 1))
+        self.assertEqual(entries['SUCCESS'].status, CallbackInbox.STATUS_SUCCEEDED)
+        self.assertEqual(entries['NOTPAY'].receive_count, 2)
+        self.assertEqual(entries['NOTPAY'].result, 'processing')
+
+        forged = self.client.generic(
+            'POST', '/api/payments/callback/wechat/', json.dumps({'resource': {}}),
+            content_type='application/json',
+        )
+        self.assertEqual(forged.status_code, 400)
+        self.assertEqual(CallbackInbox.objects.count(), 2)
+
+    def test_ylh_duplicate_cancel_counted_once_and_late_confirm_ignored(self):
+        cancel = {
+            'ExtOrderNo': 'HR-1', 'PlatformOrderNo': self.order.order_number, 'State': 2,
+            'itemList': [{'productCode': 'P-100', 'returnQty': 1}],
+        }
+        self.post(self.ylh.notify, 'hmm.scm_heorder.cancel', cancel)
+        self.post(self.ylh.notify, 'hmm.scm_heorder.cancel', cancel)
+        response = self.post(
+            self.ylh.notify, 'hmm.scm_heorder.confirm',
+            {'ExtOrderNo': 'HR-1', 'PlatformOrderNo': self.order.order_number, 'State': 1},
+        )
+        self.assertTrue(response.json()['success'])
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.haier_status, 'partially_cancelled')
+        self.assertEqual(self.order.items.get().return_qty, 1)
+        cancel_entry = CallbackInbox.objects.get(provider='ylh', event_type='hmm.scm_heorder.cancel')
+        self.assertEqual((cancel_entry.receive_count, cancel_entry.attempts), (2, 1))
+
+        bad_sign = self.client.post('/api/haier/ylh/callback/', {
+            'AppKey': 'ylh-app', 'Method': 'hmm.scm_heorder.confirm', 'Data': '{}', 'Sign': 'X',
+        })
+        self.assertFalse(bad_sign.json()['success'])
+        self.assertEqual(CallbackInbox.objects.filter(provider='ylh').count(), 2)
+
+    def test_failed_entry_is_replayed_by_command(self):
+        # the confirm reaches us before the order it refers to exists
+        self.post(
+            self.ylh.notify, 'hmm.scm_heorder.confirm',
+            {'ExtOrderNo': 'HR-9', 'PlatformOrderNo': 'LATE-ORDER', 'State': 1},
+        )
+        entry = CallbackInbox.objects.get(provider='ylh')
+        self.assertEqual(entry.status, CallbackInbox.STATUS_FAILED)
+        self.assertIn('order_not_found', entry.last_error)
+
+        order = self.make_order(order_number='LATE-ORDER')
+        out = StringIO()
+        call_command('process_callback_inbox', stdout=out)
+        self.assertIn('processed=0', out.getvalue())
+
+        call_command('process_callback_inbox', '--failed', '--provider', 'ylh', stdout=out)
+        entry.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts, entry.next_attempt_at), (CallbackInbox.STATUS_SUCCEEDED, 2, None))
+        self.assertEqual((order.haier_status, order.haier_order_no), ('confirmed', 'HR-9'))
+
+    @override_settings(CALLBACK_INBOX_RETRY_SECONDS=60, CALLBACK_INBOX_MAX_ATTEMPTS=3)
+    def test_failed_entry_is_retried_with_backoff_until_attempts_run_out(self):
+        confirm = {'ExtOrderNo': 'HR-7', 'PlatformOrderNo': 'MISSING-ORDER', 'State': 1}
+        before = timezone.now()
+        self.post(self.ylh.notify, 'hmm.scm_heorder.confirm', confirm)
+        entry = CallbackInbox.objects.get(provider='ylh')
+        self.assertEqual(entry.status, CallbackInbox.STATUS_FAILED)
+        self.assertGreaterEqual(entry.next_attempt_at, before + timedelta(seconds=60))
+
+        def run_when_due():
+            CallbackInbox.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+            out = StringIO()
+            call_command('process_callback_inbox', stdout=out)
+            entry.refresh_from_db()
+            return out.getvalue()
+
+        self.assertIn('processed=1 succeeded=0 failed=1', run_when_due())
+        # the delay doubles with every attempt
+        self.assertGreaterEqual(entry.next_attempt_at, timezone.now() + timedelta(seconds=110))
+        self.assertIn('failed=1', run_when_due())
+        self.assertEqual((entry.attempts, entry.next_attempt_at), (3, None))
+
+        # out of attempts: only an explicit replay picks it up again
+        out = StringIO()
+        call_command('process_callback_inbox', stdout=out)
+        self.assertIn('processed=0', out.getvalue())
+        order = self.make_order(order_number='MISSING-ORDER')
+        call_command('process_callback_inbox', '--id', str(entry.pk), stdout=out)
+        entry.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (CallbackInbox.STATUS_SUCCEEDED, 4))
+        self.assertEqual(order.haier_order_no, 'HR-7')
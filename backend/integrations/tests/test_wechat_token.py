@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from integrations.models import WeChatAccessToken
+from integrations.wechat import WeChatMiniProgramClient
+from integrations.wechat_token import (
+    WeChatAccessTokenBroker,
+    get_access_token_broker,
+    reset_access_token_brokers,
+)
+
+
+class FakeTokenServer:
+    """Local stand-in for https://api.weixin.qq.com/cgi-bin/token."""
+
+    def __init__(self, delay=0.0, expires_in=7200):
+        self.delay = delay
+        self.expires_in = expires_in
+        self.hits = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.hits += 1
+                    token = f"token-{server.hits}"
+                time.sleep(server.delay)
+                body = json.dumps({"access_token": token, "expires_in": server.expires_in}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/cgi-bin/token"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.content = json.dumps(payload).encode()
+
+    def json(self):
+        return self.payload
+
+
+class WeChatAccessTokenBrokerTests(TestCase):
+    def setUp(self):
+        self.server = FakeTokenServer()
+        self.addCleanup(self.server.close)
+        reset_access_token_brokers()
+        self.addCleanup(reset_access_token_brokers)
+
+    def _broker(self):
+        return WeChatAccessTokenBroker("appid", "secret", token_url=self.server.url, refresh_margin=300)
+
+    def test_token_is_shared_between_workers_and_refreshed_before_expiry(self):
+        worker_a = self._broker()
+        worker_b = self._broker()
+
+        self.assertEqual(worker_a.get_token(), "token-1")
+        self.assertEqual(worker_b.get_token(), "token-1")
+        self.assertEqual(self.server.hits, 1)
+
+        WeChatAccessToken.objects.filter(appid="appid").update(expires_at=timezone.now() + timedelta(seconds=100))
+        fresh = self._broker()
+        self.assertEqual(fresh.get_token(), "token-2")
+        self.assertEqual(self.server.hits, 2)
+        self.assertEqual(WeChatAccessToken.objects.get(appid="appid").refresh_count, 2)
+
+    def test_rejected_token_is_refreshed_once(self):
+        broker = self._broker()
+        seen = []
+
+        def api_call(token):
+            seen.append(token)
+            return FakeResponse({"errcode": 40001 if token == "token-1" else 0})
+
+        response = broker.call(api_call)
+
+        self.assertEqual(response.json(), {"errcode": 0})
+        self.assertEqual(seen, ["token-1", "token-2"])
+        # a late caller reporting the same stale token reuses the refreshed one
+        self.assertEqual(broker.force_refresh("token-1"), "token-2")
+        self.assertEqual(self.server.hits, 2)
+
+    def test_client_retries_shipping_upload_after_expired_token(self):
+        with override_settings(WECHAT_TOKEN_URL=self.server.url):
+            client = WeChatMiniProgramClient(appid="appid", secret="secret")
+            with patch("integrations.wechat.requests.post") as post:
+                post.side_effect = [
+                    FakeResponse({"errcode": 42001, "errmsg": "access_token expired"}),
+                    FakeResponse({"errcode": 0, "errmsg": "ok"}),
+                ]
+                ok, data, error = client.upload_shipping_info({"order_key": {}})
+
+        self.assertTrue(ok, error)
+        self.assertIn("access_token=token-1", post.call_args_list[0].args[0])
+        self.assertIn("access_token=token-2", post.call_args_list[1].args[0])
+        self.assertIs(client.token_broker, get_access_token_broker("appid", "secret"))
+
+
+class WeChatAccessTokenConcurrencyTests(TransactionTestCase):
+    def test_concurrent_callers_trigger_a_single_refresh(self):
+        server = FakeTokenServer(delay=0.2)
+        self.addCleanup(server.close)
+        broker = WeChatAccessTokenBroker("appid", "secret", token_url=server.url)
+        results = []
+
+        def worker():
+            results.append(broker.get_token())
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["token-1"] * 8)
+        self.assertEqual(server.hits, 1)
@@ -17,7 +17,7 @@ import json
 from common.permissions import IsAdmin
 from .haierapi import HaierAPI
 from .ylhapi import YLHSystemAPI
-from .models import HaierConfig, HaierSyncLog
+from .models import CallbackInbox, HaierConfig, HaierSyncLog
 from .wechat import WeChatMiniProgramClient
 from common.serializers import EmptySerializer
 from drf_spectacular.types import OpenApiTypes as OT
@@ -25,42 +25,6 @@ from drf_spectacular.utils import extend_schema
 
 logger = logging.getLogger(__name__)
 
-def _truncate_text(value: str, max_len: int = 2000) -> str:
-    if value is None:
-        return ""
-    if len(value) <= max_len:
-        return value
-    return value[:max_len] + f"...(truncated,{len(value)} chars)"
-
-
-def _mask_sensitive_value(key: str, value):
-    key_lower = (key or "").lower()
-    if value is None:
-        return None
-    if any(token in key_lower for token in ["password", "secret", "token", "authorization"]):
-        return "***"
-    if "sign" in key_lower:
-        return "***"
-    if any(token in key_lower for token in ["mobile", "phone"]):
-        s = str(value)
-        if len(s) <= 4:
-            return "***"
-        return s[:3] + "****" + s[-4:]
-    if "address" in key_lower:
-        return "***"
-    return value
-
-
-def _sanitize_payload(obj):
-    if isinstance(obj, dict):
-        return {k: _sanitize_payload(_mask_sensitive_value(k, v)) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_sanitize_payload(v) for v in obj]
-    if isinstance(obj, str):
-        return _truncate_text(obj)
-    return obj
-
-
 def _get_client_ip(request) -> str:
     xff = request.META.get("HTTP_X_FORWARDED_FOR")
     if xff:
@@ -433,8 +397,9 @@ def ylh_callback_view(request):
     - Method: 回调方法
     - Data: 业务数据(JSON字符串)
     """
+    from .callback_inbox import receive
     from .ylhapi import YLHCallbackHandler
-    
+
     try:
         form_data = {}
         content_type = (request.content_type or "").lower()
@@ -444,68 +409,35 @@ def ylh_callback_view(request):
             form_data = json.loads((request.body or b"{}").decode('utf-8'))
         else:
             form_data = request.POST.dict()
-        
-        data_value = form_data.get("Data")
-        parsed_data = None
-        if isinstance(data_value, str) and data_value.strip():
-            try:
-                parsed_data = json.loads(data_value)
-            except Exception:
-                parsed_data = None
-        elif isinstance(data_value, (dict, list)):
-            parsed_data = data_value
 
-        data_summary = {}
-        if isinstance(parsed_data, dict):
-            for k in ["ExtOrderNo", "PlatformOrderNo", "State", "FailMsg"]:
-                if k in parsed_data:
-                    data_summary[k] = parsed_data.get(k)
-
-        headers = {
-            "Content-Type": request.META.get("CONTENT_TYPE"),
-            "User-Agent": request.META.get("HTTP_USER_AGENT"),
-            "Host": request.META.get("HTTP_HOST"),
-            "X-Forwarded-For": request.META.get("HTTP_X_FORWARDED_FOR"),
-            "X-Real-IP": request.META.get("HTTP_X_REAL_IP"),
-        }
-
-        received_log = {
-            "event": "ylh_callback_received",
-            "path": request.path,
-            "method": request.method,
-            "client_ip": _get_client_ip(request),
-            "content_type": request.content_type,
-            "app_key": form_data.get("AppKey"),
-            "timestamp": form_data.get("TimeStamp"),
-            "callback_method": form_data.get("Method"),
-            "headers": _sanitize_payload(headers),
-            "form": _sanitize_payload({k: v for k, v in form_data.items() if k != "Data"}),
-            "data_summary": _sanitize_payload(data_summary),
-            "data": _sanitize_payload(parsed_data if parsed_data is not None else data_value),
-        }
-
-        logger.info("YLH Callback received: %s", json.dumps(received_log, ensure_ascii=False, default=str))
-        
-        # 创建回调处理器
+        # 验签后写入回调收件箱并立即应答，订单处理由收件箱 worker 完成
         handler = YLHCallbackHandler.from_settings()
-        
-        # 路由并处理回调
-        response_data = handler.route_callback(form_data)
-        
-        # 记录响应
-        response_log = {
-            "event": "ylh_callback_response",
-            "callback_method": form_data.get("Method"),
-            "app_key": form_data.get("AppKey"),
-            "timestamp": form_data.get("TimeStamp"),
-            "success": response_data.get("success") if isinstance(response_data, dict) else None,
-            "code": response_data.get("code") if isinstance(response_data, dict) else None,
-            "description": response_data.get("description") if isinstance(response_data, dict) else None,
-        }
-        logger.info("YLH Callback response: %s", json.dumps(_sanitize_payload(response_log), ensure_ascii=False, default=str))
-        
-        return JsonResponse(response_data)
-        
+        parsed = handler.parse_callback_data(form_data)
+        if not parsed:
+            return JsonResponse(handler._error_response("签名验证失败"))
+        method = parsed.get('Method') or ''
+        if method not in YLHCallbackHandler.CALLBACK_METHODS:
+            logger.error(f"Unknown callback method: {method}")
+            return JsonResponse(handler._error_response(f"未知的回调方法: {method}"))
+
+        data = parsed.get('Data') if isinstance(parsed.get('Data'), dict) else {}
+        entry, created = receive(
+            CallbackInbox.PROVIDER_YLH,
+            YLHCallbackHandler.dedup_key(form_data),
+            {'form': form_data},
+            event_type=method,
+        )
+        logger.info(
+            "YLH callback queued: method=%s platform=%s ext=%s state=%s inbox_id=%s duplicate=%s client_ip=%s",
+            method, data.get("PlatformOrderNo"), data.get("ExtOrderNo"), data.get("State"),
+            entry.id, not created, _get_client_ip(request),
+        )
+        return JsonResponse(handler._success_response({
+            "statusCode": "200",
+            "message": "成功",
+            "platformOrderNo": data.get("PlatformOrderNo"),
+        }))
+
     except Exception as e:
         logger.error(f"YLH Callback error: {str(e)}", exc_info=True)
         return JsonResponse({
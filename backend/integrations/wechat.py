@@ -7,7 +7,8 @@ from typing import Tuple
 
 import requests
 from django.conf import settings
-from django.core.cache import cache
+
+from .wechat_token import WeChatAccessTokenError, get_access_token_broker
 
 logger = logging.getLogger(__name__)
 
@@ -40,37 +41,29 @@ class WeChatMiniProgramClient:
         self.appid = appid or getattr(settings, 'WECHAT_APPID', '')
         self.secret = secret or getattr(settings, 'WECHAT_SECRET', '')
 
-    def _cache_key(self) -> str:
-        return f'wechat_access_token:{self.appid}'
+    @property
+    def token_broker(self):
+        return get_access_token_broker(self.appid, self.secret)
 
     def get_access_token(self) -> str | None:
         if not self.appid or not self.secret:
             return None
+        try:
+            return self.token_broker.get_token()
+        except WeChatAccessTokenError as exc:
+            logger.warning('Failed to fetch WeChat access token: %s %s', exc.message, exc.data)
+            return None
 
-        cached = cache.get(self._cache_key())
-        if cached:
-            return cached
-
+    def _call_with_token(self, func):
+        """Run func(token); a rejected token is refreshed once and the call retried."""
+        token = self.get_access_token()
+        if not token:
+            return None
         try:
-            resp = requests.get(
-                'https://api.weixin.qq.com/cgi-bin/token',
-                params={
-                    'grant_type': 'client_credential',
-                    'appid': self.appid,
-                    'secret': self.secret,
-                },
-                timeout=5,
-            )
-            data = resp.json() if resp.content else {}
-            token = data.get('access_token')
-            expires_in = int(data.get('expires_in', 0) or 0)
-            if token:
-                cache.set(self._cache_key(), token, max(expires_in - 120, 300))
-                return token
-            logger.warning('Failed to fetch WeChat access token: %s', data)
-        except Exception as exc:
-            logger.error('WeChat access token request failed: %s', exc)
-        return None
+            return self.token_broker.call(func)
+        except WeChatAccessTokenError as exc:
+            logger.warning('Failed to refresh WeChat access token: %s %s', exc.message, exc.data)
+            return None
 
     def send_subscribe_message(
         self,
@@ -81,10 +74,6 @@ class WeChatMiniProgramClient:
         lang: str = 'zh_CN',
     ) -> Tuple[bool, str]:
         """Send a subscription message; returns (success, error message)."""
-        token = self.get_access_token()
-        if not token:
-            return False, 'missing_access_token'
-
         payload = {
             'touser': touser,
             'template_id': template_id,
@@ -96,11 +85,13 @@ class WeChatMiniProgramClient:
             payload['page'] = page
 
         try:
-            resp = requests.post(
+            resp = self._call_with_token(lambda token: requests.post(
                 f'https://api.weixin.qq.com/cgi-bin/message/subscribe/send?access_token={token}',
                 json=payload,
                 timeout=5,
-            )
+            ))
+            if resp is None:
+                return False, 'missing_access_token'
             resp_data = resp.json() if resp.content else {}
             if resp.status_code == 200 and resp_data.get('errcode') == 0:
                 return True, ''
@@ -111,18 +102,16 @@ class WeChatMiniProgramClient:
 
     def upload_shipping_info(self, payload: dict) -> Tuple[bool, dict, str]:
         """Upload shipping info to WeChat order management."""
-        token = self.get_access_token()
-        if not token:
-            return False, {}, 'missing_access_token'
-
         try:
             body = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
-            resp = requests.post(
+            resp = self._call_with_token(lambda token: requests.post(
                 f'https://api.weixin.qq.com/wxa/sec/order/upload_shipping_info?access_token={token}',
                 data=body,
                 headers={'Content-Type': 'application/json; charset=utf-8'},
                 timeout=8,
-            )
+            ))
+            if resp is None:
+                return False, {}, 'missing_access_token'
             return _wechat_result(resp)
         except Exception as exc:
             logger.error('WeChat upload shipping info failed: %s', exc)
@@ -130,16 +119,14 @@ class WeChatMiniProgramClient:
 
     def get_delivery_company_list(self) -> Tuple[bool, dict, str]:
         """Fetch delivery list (运力 id 列表) for order shipping."""
-        token = self.get_access_token()
-        if not token:
-            return False, {}, 'missing_access_token'
-
         try:
-            resp = requests.post(
+            resp = self._call_with_token(lambda token: requests.post(
                 f'https://api.weixin.qq.com/cgi-bin/express/delivery/open_msg/get_delivery_list?access_token={token}',
                 json={},
                 timeout=8,
-            )
+            ))
+            if resp is None:
+                return False, {}, 'missing_access_token'
             resp.encoding = 'utf-8'
             return _wechat_result(resp)
         except Exception as exc:
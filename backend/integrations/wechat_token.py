@@ -0,0 +1,184 @@
+"""
+WeChat access token broker shared by login, subscribe messages and shipping upload.
+
+The token lives in one WeChatAccessToken row per appid so every worker uses the same
+token. Refreshes are single-flight: threads in a process serialize on a lock, and
+processes serialize on a row lock (select_for_update) and re-check the row before
+calling WeChat. Tokens are refreshed WECHAT_ACCESS_TOKEN_REFRESH_MARGIN seconds before
+they expire, and a rejected token (40001/40014/42001) triggers a forced refresh
+that only one caller performs.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import WeChatAccessToken
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_URL = 'https://api.weixin.qq.com/cgi-bin/token'
+# 40001 invalid credential / 40014 invalid access_token / 42001 access_token expired
+TOKEN_INVALID_ERRCODES = {40001, 40014, 42001}
+
+
+class WeChatAccessTokenError(Exception):
+    def __init__(self, message, data=None):
+        self.message = message
+        self.data = data or {}
+        super().__init__(message)
+
+
+def response_errcode(resp):
+    try:
+        data = resp.json()
+    except Exception:
+        return None
+    if not isinstance(data, dict):
+        return None
+    try:
+        return int(data.get('errcode') or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class WeChatAccessTokenBroker:
+    LOCAL_RECHECK_SECONDS = 60
+
+    def __init__(self, appid: str, secret: str, token_url: str | None = None, refresh_margin: int | None = None):
+        self.appid = appid
+        self.secret = secret
+        self.token_url = token_url or getattr(settings, 'WECHAT_TOKEN_URL', DEFAULT_TOKEN_URL)
+        if refresh_margin is None:
+            refresh_margin = getattr(settings, 'WECHAT_ACCESS_TOKEN_REFRESH_MARGIN', 300)
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._lock = threading.Lock()
+        self._token = ''
+        self._expires_at = None
+        self._checked_at = 0.0
+
+    def _fresh(self, token, expires_at) -> bool:
+        return bool(token and expires_at and expires_at - self.refresh_margin > timezone.now())
+
+    def _fresh_local(self) -> bool:
+        # re-read the shared row periodically so tokens refreshed by other workers are picked up
+        return (
+            self._fresh(self._token, self._expires_at)
+            and time.monotonic() - self._checked_at < self.LOCAL_RECHECK_SECONDS
+        )
+
+    def _remember(self, token, expires_at):
+        self._token, self._expires_at = token, expires_at
+        self._checked_at = time.monotonic()
+
+    def get_token(self) -> str:
+        """Return a valid token, refreshing it first if it is close to expiry."""
+        if self._fresh_local():
+            return self._token
+        with self._lock:
+            if self._fresh_local():
+                return self._token
+            row = WeChatAccessToken.objects.filter(appid=self.appid).only('access_token', 'expires_at').first()
+            if row is not None and self._fresh(row.access_token, row.expires_at):
+                self._remember(row.access_token, row.expires_at)
+                return row.access_token
+            return self._load_or_refresh()
+
+    def force_refresh(self, rejected_token: str | None = None) -> str:
+        """Refresh after WeChat rejected ``rejected_token``.
+
+        If another caller already replaced that token, the newer token is returned
+        without another refresh.
+        """
+        with self._lock:
+            if rejected_token and self._token != rejected_token and self._fresh(self._token, self._expires_at):
+                return self._token
+            return self._load_or_refresh(rejected_token or self._token)
+
+    def call(self, func):
+        """Run ``func(token)`` and retry once with a new token if it was rejected."""
+        token = self.get_token()
+        resp = func(token)
+        if response_errcode(resp) in TOKEN_INVALID_ERRCODES:
+            logger.warning('WeChat rejected access token for %s, refreshing', self.appid)
+            resp = func(self.force_refresh(token))
+        return resp
+
+    def _load_or_refresh(self, rejected_token: str | None = None) -> str:
+        with transaction.atomic():
+            row = self._lock_row()
+            if row.access_token != rejected_token and self._fresh(row.access_token, row.expires_at):
+                token, expires_at = row.access_token, row.expires_at
+            else:
+                token, expires_in = self._fetch()
+                now = timezone.now()
+                expires_at = now + timedelta(seconds=expires_in)
+                row.access_token = token
+                row.expires_at = expires_at
+                row.refreshed_at = now
+                row.refresh_count += 1
+                row.save(update_fields=['access_token', 'expires_at', 'refreshed_at', 'refresh_count'])
+        self._remember(token, expires_at)
+        return token
+
+    def _lock_row(self) -> WeChatAccessToken:
+        rows = WeChatAccessToken.objects.select_for_update()
+        row = rows.filter(appid=self.appid).first()
+        if row is not None:
+            return row
+        try:
+            with transaction.atomic():
+                WeChatAccessToken.objects.create(appid=self.appid)
+        except IntegrityError:
+            pass
+        return rows.get(appid=self.appid)
+
+    def _fetch(self):
+        if not self.appid or not self.secret:
+            raise WeChatAccessTokenError('WeChat credentials are not configured')
+        try:
+            resp = requests.get(
+                self.token_url,
+                params={
+                    'grant_type': 'client_credential',
+                    'appid': self.appid,
+                    'secret': self.secret,
+                },
+                timeout=5,
+            )
+            data = resp.json()
+        except Exception as exc:
+            logger.error('WeChat access token request failed: %s', exc)
+            raise WeChatAccessTokenError(f'WeChat access token request failed: {exc}') from exc
+        token = data.get('access_token') if isinstance(data, dict) else None
+        if not token:
+            logger.warning('Failed to fetch WeChat access token: %s', data)
+            raise WeChatAccessTokenError('Invalid WeChat access token response', data if isinstance(data, dict) else {})
+        return token, int(data.get('expires_in') or 7200)
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_access_token_broker(appid: str | None = None, secret: str | None = None) -> WeChatAccessTokenBroker:
+    appid = appid or getattr(settings, 'WECHAT_APPID', '')
+    secret = secret or getattr(settings, 'WECHAT_SECRET', '')
+    key = (appid, secret)
+    broker = _brokers.get(key)
+    if broker is None:
+        with _brokers_lock:
+            broker = _brokers.get(key)
+            if broker is None:
+                broker = _brokers[key] = WeChatAccessTokenBroker(appid, secret)
+    return broker
+
+
+def reset_access_token_brokers():
+    with _brokers_lock:
+        _brokers.clear()
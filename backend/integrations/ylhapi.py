@@ -467,6 +467,14 @@ class YLHCallbackHandler:
     
     用于处理海尔平台的回调通知（确认订单、取消订单、订单缺货）
     """
+
+    CALLBACK_METHODS = (
+        'hmm.scm_heorder.confirm',
+        'hmm.scm_heorder.cancel',
+        'hmm.scm_heorder.oostock',
+    )
+    # 已取消/缺货的订单不再被迟到的确认回调改回 confirmed
+    CONFIRM_SUPERSEDED_STATUSES = ('cancelled', 'partially_cancelled', 'out_of_stock')
     
     def __init__(self, app_key: str, secret: str):
         """
@@ -515,6 +523,23 @@ class YLHCallbackHandler:
         secret = getattr(settings, 'YLH_CALLBACK_SECRET', '')
         return cls(app_key, secret)
     
+    @staticmethod
+    def dedup_key(form_data: Dict[str, Any]) -> str:
+        """
+        回调收件箱去重键：Method + 业务数据的摘要
+
+        平台重试时 TimeStamp、Sign 会变化，只按 Method 和 Data 判断是否为同一回调。
+        """
+        data = form_data.get('Data', '')
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except Exception:
+                pass
+        canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+        digest = hashlib.sha256(f"{form_data.get('Method', '')}|{canonical}".encode('utf-8')).hexdigest()
+        return f"{form_data.get('Method', '')}:{digest}"
+
     def generate_sign(self, params: Dict[str, Any]) -> str:
         """
         生成签名
@@ -658,6 +683,14 @@ class YLHCallbackHandler:
                 logger.error(f"Order not found for confirm callback: platform={platform_order_no}")
                 return self._error_response("订单不存在", code="order_not_found")
 
+            if data.get('State') == 1 and order.haier_status in self.CONFIRM_SUPERSEDED_STATUSES:
+                # 乱序到达：取消/缺货回调已先处理，忽略迟到的确认
+                logger.warning(f"Stale confirm callback ignored: platform={platform_order_no}, haier_status={order.haier_status}")
+                return self._success_response({
+                    "statusCode": "200",
+                    "message": "成功",
+                    "platformOrderNo": platform_order_no
+                })
             order.update_from_haier_callback(data)
             self._debug_log("confirm_updated", {"order_id": order.id, "haier_order_no": order.haier_order_no, "haier_status": order.haier_status})
         except Exception as e:
@@ -964,6 +997,15 @@ class YLHCallbackHandler:
         }
 
 
+
+def process_ylh_callback(payload):
+    """回调收件箱的易理货处理入口，处理失败时抛出异常以便重放"""
+    form_data = payload.get('form') or {}
+    response = YLHCallbackHandler.from_settings().route_callback(form_data)
+    if not response.get('success'):
+        raise ValueError(f"{response.get('code')}: {response.get('description')}")
+    return form_data.get('Method', '')
+
 if __name__ == "__main__":
     # 测试代码
     config = {
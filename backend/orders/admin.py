@@ -12,6 +12,7 @@ from .models import (
     Invoice,
     ReturnRequest,
     Payment,
+    PaymentEvent,
     Refund,
     OrderShippingAction,
     StoreProfitSharingEntry,
@@ -106,12 +107,21 @@ class InvoiceAdmin(admin.ModelAdmin):
     search_fields = ("order__order_number", "user__username", "invoice_number", "title")
 
 
+class PaymentEventInline(admin.TabularInline):
+    model = PaymentEvent
+    extra = 0
+    can_delete = False
+    fields = ("created_at", "event", "payload")
+    readonly_fields = fields
+
+
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ("id", "order", "amount", "method", "status", "profit_sharing_required", "profit_sharing_status", "created_at", "expires_at")
     list_filter = ("status", "method", "profit_sharing_required", "profit_sharing_status", "created_at")
     search_fields = ("id", "order__order_number", "order__user__username")
     list_select_related = ("order", "order__user")
+    inlines = [PaymentEventInline]
 
 
 @admin.register(StoreProfitSharingEntry)
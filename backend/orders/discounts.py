@@ -0,0 +1,333 @@
+"""折扣定向引擎
+
+- 明细目标（DiscountTarget）按批 bulk_create 写入，重复的 (折扣, 用户, 商品) 由唯一约束忽略；
+  重设范围时只删除不再适用的行、只补写缺少的行；
+- 定向规则（DiscountScope）按 用户维度 × 商品维度 表达，计价时实时匹配，不展开成明细行；
+- "某用户在一组商品上的最优折扣" 一次查询明细目标、一次匹配规则，结果按
+  ``discount_rule:`` 前缀缓存；
+- 缓存失效按用户定向：明细目标变化只让相关用户的缓存版本失效，定向规则变化才整体失效。
+"""
+
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from catalog.category_tree import get_category_tree
+
+from .models import Discount, DiscountScope, DiscountTarget
+
+DISCOUNT_RULE_CACHE_PREFIX = 'discount_rule'
+DISCOUNT_RULE_CACHE_TIMEOUT = 60
+DISCOUNT_TARGET_BATCH_SIZE = 2000
+
+_GENERATION_KEY = f'{DISCOUNT_RULE_CACHE_PREFIX}:gen'
+
+
+def _user_version_key(user_id) -> str:
+    return f'{DISCOUNT_RULE_CACHE_PREFIX}:ver:{user_id}'
+
+
+def _rule_key(user_id, product_id, generation, version) -> str:
+    return f'{DISCOUNT_RULE_CACHE_PREFIX}:{user_id}:{product_id}:{generation}:{version}'
+
+
+def _scopes_key(generation) -> str:
+    return f'{DISCOUNT_RULE_CACHE_PREFIX}:scopes:{generation}'
+
+
+# ----------------------------------------------------------------------
+# 缓存失效
+# ----------------------------------------------------------------------
+
+def invalidate_discount_rules(user_ids=None) -> None:
+    """事务提交后让折扣缓存失效；user_ids 为 None 时全部失效。"""
+    user_ids = None if user_ids is None else set(user_ids)
+
+    def _invalidate():
+        token = time.time_ns()
+        if user_ids is None:
+            cache.set(_GENERATION_KEY, token, None)
+        elif user_ids:
+            cache.set_many({_user_version_key(user_id): token for user_id in user_ids}, None)
+
+    transaction.on_commit(_invalidate, robust=True)
+
+
+def invalidate_discount(discount) -> None:
+    """折扣本身（金额、时间窗、优先级）变化：带定向规则时全部失效，否则只失效其明细用户。"""
+    if discount.scopes.exists():
+        invalidate_discount_rules()
+        return
+    invalidate_discount_rules(
+        DiscountTarget.objects.filter(discount=discount).values_list('user_id', flat=True).distinct()
+    )
+
+
+# ----------------------------------------------------------------------
+# 明细目标批量写入
+# ----------------------------------------------------------------------
+
+def _bulk_insert_pairs(discount, pairs, batch_size) -> int:
+    batch = []
+    total = 0
+    for user_id, product_id in pairs:
+        batch.append(DiscountTarget(discount=discount, user_id=user_id, product_id=product_id))
+        if len(batch) >= batch_size:
+            DiscountTarget.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+            batch = []
+    if batch:
+        DiscountTarget.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+    return total
+
+
+@transaction.atomic
+def upsert_discount_targets(discount, user_ids, product_ids, batch_size=DISCOUNT_TARGET_BATCH_SIZE) -> int:
+    """为 用户 × 商品 写入明细目标，已存在的组合忽略，返回提交写入的组合数。
+
+    目标表只有 (折扣, 用户, 商品) 三列且有唯一约束，ignore_conflicts 即可完成 upsert。
+    """
+    user_ids = sorted(set(user_ids or []))
+    product_ids = sorted(set(product_ids or []))
+    if not user_ids or not product_ids:
+        return 0
+    pairs = ((user_id, product_id) for user_id in user_ids for product_id in product_ids)
+    written = _bulk_insert_pairs(discount, pairs, batch_size)
+    invalidate_discount_rules(user_ids)
+    return written
+
+
+@transaction.atomic
+def replace_discount_targets(discount, user_ids, product_ids, batch_size=DISCOUNT_TARGET_BATCH_SIZE) -> int:
+    """把折扣的明细目标重设为 用户 × 商品：只删除多余的行、只补写缺少的行。"""
+    user_ids = set(user_ids or [])
+    product_ids = set(product_ids or [])
+    targets = DiscountTarget.objects.filter(discount=discount)
+
+    stale = targets.exclude(user_id__in=user_ids, product_id__in=product_ids)
+    affected_users = set(stale.values_list('user_id', flat=True).distinct())
+    stale.delete()
+
+    if not user_ids or not product_ids:
+        invalidate_discount_rules(affected_users)
+        return 0
+
+    kept_users = set(targets.values_list('user_id', flat=True).distinct())
+    kept_products = set(targets.values_list('product_id', flat=True).distinct())
+    # 现存目标若正好是 kept_users × kept_products，这部分组合不必再写
+    if targets.count() == len(kept_users) * len(kept_products):
+        pairs = (
+            (user_id, product_id)
+            for user_id in sorted(user_ids)
+            for product_id in sorted(product_ids)
+            if user_id not in kept_users or product_id not in kept_products
+        )
+    else:
+        pairs = ((user_id, product_id) for user_id in sorted(user_ids) for product_id in sorted(product_ids))
+    written = _bulk_insert_pairs(discount, pairs, batch_size)
+    invalidate_discount_rules(affected_users | user_ids)
+    return written
+
+
+@transaction.atomic
+def replace_discount_scopes(discount, scopes) -> None:
+    """重设折扣的定向规则，scopes 为字段字典列表。"""
+    DiscountScope.objects.filter(discount=discount).delete()
+    DiscountScope.objects.bulk_create([DiscountScope(discount=discount, **scope) for scope in scopes])
+    invalidate_discount_rules()
+
+
+# ----------------------------------------------------------------------
+# 计价时查询
+# ----------------------------------------------------------------------
+
+def _rule(discount_id, discount_type, amount, priority, updated_at):
+    return {
+        'type': discount_type,
+        'value': str(amount),
+        'discount_id': discount_id,
+        'priority': priority,
+        'updated_at': updated_at.timestamp() if updated_at else 0,
+    }
+
+
+def _active_scopes(generation, now):
+    """未过期的定向规则，按规则版本缓存；生效时间在匹配时再判断。"""
+    key = _scopes_key(generation)
+    scopes = cache.get(key)
+    if scopes is None:
+        scopes = [
+            {
+                'user_role': row['user_role'],
+                'customer_group_id': row['customer_group_id'],
+                'store_id': row['store_id'],
+                'category_id': row['category_id'],
+                'brand_id': row['brand_id'],
+                'effective_time': row['discount__effective_time'],
+                'expiration_time': row['discount__expiration_time'],
+                'rule': _rule(
+                    row['discount_id'],
+                    row['discount__discount_type'],
+                    row['discount__amount'],
+                    row['discount__priority'],
+                    row['discount__updated_at'],
+                ),
+            }
+            for row in DiscountScope.objects.filter(discount__expiration_time__gt=now).values(
+                'discount_id',
+                'user_role',
+                'customer_group_id',
+                'store_id',
+                'category_id',
+                'brand_id',
+                'discount__discount_type',
+                'discount__amount',
+                'discount__priority',
+                'discount__updated_at',
+                'discount__effective_time',
+                'discount__expiration_time',
+            )
+        ]
+        cache.set(key, scopes, DISCOUNT_RULE_CACHE_TIMEOUT)
+    return [scope for scope in scopes if scope['effective_time'] <= now < scope['expiration_time']]
+
+
+def _user_group_ids(user):
+    from stores.models import StoreCustomerGroupMember
+
+    return set(
+        StoreCustomerGroupMember.objects.filter(
+            user=user,
+            status=StoreCustomerGroupMember.STATUS_ACTIVE,
+            group__status='active',
+        ).values_list('group_id', flat=True)
+    )
+
+
+def _category_lineage(category_ids):
+    """{类别ID: 自身及全部上级类别ID集合}"""
+    tree = get_category_tree()
+    return {category_id: tree.ancestor_ids(category_id) for category_id in category_ids}
+
+
+def _match_scopes(user, products, scopes):
+    user_scopes = []
+    group_ids = None
+    for scope in scopes:
+        if scope['user_role'] and scope['user_role'] != getattr(user, 'role', ''):
+            continue
+        if scope['customer_group_id']:
+            if group_ids is None:
+                group_ids = _user_group_ids(user)
+            if scope['customer_group_id'] not in group_ids:
+                continue
+        user_scopes.append(scope)
+    if not user_scopes:
+        return {}
+
+    lineage = {}
+    if any(scope['category_id'] for scope in user_scopes):
+        lineage = _category_lineage({product.category_id for product in products if product.category_id})
+
+    matches = {}
+    for product in products:
+        for scope in user_scopes:
+            if scope['store_id'] and scope['store_id'] != product.store_id:
+                continue
+            if scope['brand_id'] and scope['brand_id'] != product.brand_id:
+                continue
+            if scope['category_id'] and scope['category_id'] not in lineage.get(product.category_id, ()):
+                continue
+            matches.setdefault(product.id, []).append(scope['rule'])
+    return matches
+
+
+def _best(rules):
+    if not rules:
+        return None
+    return max(rules, key=lambda rule: (rule['priority'], rule['updated_at']))
+
+
+def get_best_discount_rules(user, products) -> dict:
+    """返回 {商品ID: 最优折扣规则或 None}。
+
+    规则格式: {'type', 'value', 'discount_id', 'priority', 'updated_at'}；
+    同时命中多个折扣时取优先级最高、更新时间最新的一个。
+    """
+    products = list(products)
+    if not user or not getattr(user, 'is_authenticated', False):
+        return {product.id: None for product in products}
+
+    versions = cache.get_many([_GENERATION_KEY, _user_version_key(user.id)])
+    generation = versions.get(_GENERATION_KEY, 0)
+    version = versions.get(_user_version_key(user.id), 0)
+    keys = {product.id: _rule_key(user.id, product.id, generation, version) for product in products}
+    cached = cache.get_many(list(keys.values()))
+
+    result = {}
+    misses = []
+    for product in products:
+        value = cached.get(keys[product.id])
+        if value is None:
+            misses.append(product)
+        else:
+            result[product.id] = value or None
+    if not misses:
+        return result
+
+    now = timezone.now()
+    candidates = {}
+    rows = DiscountTarget.objects.filter(
+        user=user,
+        product_id__in=[product.id for product in misses],
+        discount__effective_time__lte=now,
+        discount__expiration_time__gt=now,
+    ).values_list(
+        'product_id',
+        'discount_id',
+        'discount__discount_type',
+        'discount__amount',
+        'discount__priority',
+        'discount__updated_at',
+    )
+    for product_id, *discount in rows:
+        candidates.setdefault(product_id, []).append(_rule(*discount))
+
+    scopes = _active_scopes(generation, now)
+    if scopes:
+        for product_id, rules in _match_scopes(user, misses, scopes).items():
+            candidates.setdefault(product_id, []).extend(rules)
+
+    fresh = {}
+    for product in misses:
+        rule = _best(candidates.get(product.id))
+        result[product.id] = rule
+        fresh[keys[product.id]] = rule or False
+    cache.set_many(fresh, DISCOUNT_RULE_CACHE_TIMEOUT)
+    return result
+
+
+def resolve_rule_amount(rule, base_price) -> Decimal:
+    """按折扣规则计算单件优惠金额。"""
+    if not rule:
+        return Decimal('0')
+    base = Decimal(base_price or 0)
+    if rule['type'] == Discount.TYPE_PERCENT:
+        rate = Decimal(rule['value'])
+        if rate < 0:
+            rate = Decimal('0')
+        if rate > 10:
+            rate = Decimal('10')
+        discounted_price = (base * rate) / Decimal('10')
+        amount = base - discounted_price
+    else:
+        amount = Decimal(rule['value'])
+    if amount < 0:
+        amount = Decimal('0')
+    if amount > base:
+        amount = base
+    return amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
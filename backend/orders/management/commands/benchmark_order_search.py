@@ -0,0 +1,119 @@
+"""
+Benchmark admin order substring search: legacy join + DISTINCT icontains vs. the
+trigram-indexed semi-join filter from common.search.
+
+Synthetic orders are inserted inside a transaction that is rolled back at the
+end (unless --keep), so the command can run against a staging copy of the
+production database.
+
+Usage:
+    python manage.py benchmark_order_search
+    python manage.py benchmark_order_search --orders 1000000 --term BCD-0001
+    python manage.py benchmark_order_search --orders 0 --term 冰箱   # existing data only
+"""
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from catalog.models import Brand, Category, Product
+from common.search import substring_q
+from orders.models import Order, OrderItem
+from users.models import User
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare order product-name search plans and timings on synthetic data (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1_000_000, help='Synthetic orders to insert')
+        parser.add_argument('--products', type=int, default=2000, help='Synthetic products to spread items over')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Rows per bulk insert')
+        parser.add_argument('--term', default='BCD-0001', help='Search term')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query (best time is reported)')
+        parser.add_argument('--keep', action='store_true', help='Commit the synthetic data instead of rolling back')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['orders']:
+                    self._seed(options)
+                self._compare(options)
+                if not options['keep']:
+                    raise _Rollback
+        except _Rollback:
+            self.stdout.write('Synthetic data rolled back')
+
+    def _seed(self, options):
+        started = time.monotonic()
+        user = User.objects.create_user(username='benchmark-order-search', password=None)
+        category = Category.objects.create(name='benchmark', level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(name='benchmark-order-search')
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'{"双门冰箱" if i % 2 else "滚筒洗衣机"} BCD-{i:05d}',
+                category=category,
+                brand=brand,
+                price=Decimal('100.00'),
+            )
+            for i in range(options['products'])
+        ])
+        batch_size = options['batch_size']
+        total = options['orders']
+        for offset in range(0, total, batch_size):
+            count = min(batch_size, total - offset)
+            orders = Order.objects.bulk_create([
+                Order(
+                    user=user,
+                    order_number=f'BENCH{offset + i:012d}',
+                    total_amount=Decimal('100.00'),
+                    actual_amount=Decimal('100.00'),
+                )
+                for i in range(count)
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=products[(offset + i) % len(products)],
+                    product_name=products[(offset + i) % len(products)].name,
+                    unit_price=Decimal('100.00'),
+                    actual_amount=Decimal('100.00'),
+                )
+                for i, order in enumerate(orders)
+            ])
+            self.stdout.write(f'  seeded {offset + count}/{total} orders')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'Seeded {total} orders in {time.monotonic() - started:.1f}s')
+
+    def _compare(self, options):
+        term = options['term']
+        legacy = (
+            Order.objects
+            .filter(Q(product__name__icontains=term) | Q(items__product__name__icontains=term))
+            .distinct()
+            .order_by('-created_at')
+        )
+        indexed = (
+            Order.objects
+            .filter(substring_q(Order, ('product__name', 'items__product__name'), term))
+            .order_by('-created_at')
+        )
+        for label, qs in (('legacy join + DISTINCT', legacy), ('trigram semi-join', indexed)):
+            page = qs.values_list('pk', flat=True)[:20]
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.monotonic()
+                rows = list(page)
+                count = qs.count()
+                timings.append(time.monotonic() - started)
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: count={count} first_page={len(rows)} best={min(timings) * 1000:.1f}ms'
+            ))
+            self.stdout.write(qs.explain())
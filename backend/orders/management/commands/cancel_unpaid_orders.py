@@ -2,25 +2,25 @@
 Management command to automatically cancel unpaid orders that have exceeded the payment timeout.
 
 This command:
-1. Finds all pending orders that have exceeded the payment timeout
-2. Cancels them using the OrderStateMachine
-3. Releases the locked inventory
-4. Logs the operation
+1. Walks pending orders created before the timeout in primary-key chunks
+2. Claims each chunk with SKIP LOCKED (orders held by a live checkout or payment
+   callback are left for the next run), so several runners can work at once
+3. Cancels them using the OrderStateMachine, which releases the locked inventory
+4. Reports throughput for the run
 
 Usage:
     python manage.py cancel_unpaid_orders
     python manage.py cancel_unpaid_orders --timeout-minutes 30
+    python manage.py cancel_unpaid_orders --chunk-size 500 --limit 10000
 """
 
-from django.core.management.base import BaseCommand, CommandError
-from django.utils import timezone
 from datetime import timedelta
-from django.db import transaction
 
 from django.conf import settings
-from orders.models import Order, Payment
-from orders.state_machine import OrderStateMachine
-from orders.services import InventoryService
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.sweeps import DEFAULT_CHUNK_SIZE, cancel_unpaid_orders, format_stats, iter_chunks, unpaid_orders
 
 
 class Command(BaseCommand):
@@ -38,10 +38,13 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be cancelled without actually cancelling',
         )
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Orders claimed per transaction')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after scanning this many orders (0 = no limit)')
 
     def handle(self, *args, **options):
         timeout_minutes = options['timeout_minutes']
         dry_run = options['dry_run']
+        chunk_size = max(1, options['chunk_size'])
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -49,69 +52,30 @@ class Command(BaseCommand):
             )
         )
 
-        # Calculate the cutoff time
+        # Orders created before the cutoff have not been paid within the timeout period
         cutoff_time = timezone.now() - timedelta(minutes=timeout_minutes)
 
-        # Find all pending orders created before the cutoff time
-        # These orders have not been paid within the timeout period
-        unpaid_orders = Order.objects.filter(
-            status='pending',
-            created_at__lt=cutoff_time
-        ).select_related('user', 'product')
-
-        cancelled_count = 0
-        error_count = 0
-
-        for order in unpaid_orders:
-            try:
-                if dry_run:
+        if dry_run:
+            total = 0
+            queryset = unpaid_orders(cutoff_time).select_related('user')
+            for orders in iter_chunks(queryset, chunk_size, options['limit']):
+                for order in orders:
                     self.stdout.write(
                         f'[DRY RUN] Would cancel order #{order.order_number} '
                         f'(created: {order.created_at}, user: {order.user.username})'
                     )
-                else:
-                    self._cancel_order(order)
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'✓ Cancelled order #{order.order_number} '
-                            f'(created: {order.created_at}, user: {order.user.username})'
-                        )
-                    )
-                cancelled_count += 1
-
-            except Exception as e:
-                error_count += 1
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'✗ Failed to cancel order #{order.order_number}: {str(e)}'
-                    )
-                )
+                total += len(orders)
+            self.stdout.write(self.style.SUCCESS(f'\n=== Summary ===\nTotal orders processed: {total}'))
+            return
 
-        # Summary
+        stats = cancel_unpaid_orders(cutoff_time, chunk_size=chunk_size, limit=options['limit'])
         self.stdout.write(
             self.style.SUCCESS(
                 f'\n=== Summary ===\n'
-                f'Total orders processed: {unpaid_orders.count()}\n'
-                f'Successfully cancelled: {cancelled_count}\n'
-                f'Errors: {error_count}'
+                f"Total orders processed: {stats['claimed']}\n"
+                f"Successfully cancelled: {stats['cancelled']}\n"
+                f"Skipped (locked elsewhere): {stats['skipped']}\n"
+                f"Errors: {stats['errors']}\n"
+                f'Metrics: {format_stats(stats)}'
             )
         )
-
-    @transaction.atomic
-    def _cancel_order(self, order):
-        """Cancel a single order and release its inventory
-        
-        Args:
-            order: Order object to cancel
-            
-        Raises:
-            ValueError: If order cannot be cancelled
-        """
-        # Use the state machine to transition the order to cancelled status
-        # This will automatically trigger inventory release via the post-transition handler
-        OrderStateMachine.transition(
-            order=order,
-            new_status='cancelled',
-            operator=None,
-            note='Automatically cancelled due to payment timeout'
-        )
@@ -11,11 +11,8 @@ Usage:
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.db import transaction
 
-from orders.models import Payment
-from orders.payment_service import PaymentService
-from orders.state_machine import OrderStateMachine
+from orders.sweeps import DEFAULT_CHUNK_SIZE, expire_overdue_payments, format_stats, iter_chunks, overdue_payments
 
 
 class Command(BaseCommand):
@@ -27,34 +24,24 @@ class Command(BaseCommand):
             action='store_true',
             help='Show actions without applying changes',
         )
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Payments claimed per transaction')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after scanning this many payments (0 = no limit)')
 
     def handle(self, *args, **options):
-        dry_run = options['dry_run']
         now = timezone.now()
-        qs = Payment.objects.filter(status__in=['init', 'processing']).select_related('order')
-        total = qs.count()
-        succeeded = 0
-        expired = 0
-        self.stdout.write(self.style.SUCCESS(f'Found {total} payments to reconcile'))
-
-        for pay in qs:
-            # Expire overdue payments
-            if pay.expires_at and pay.expires_at < now:
-                if dry_run:
+        chunk_size = max(1, options['chunk_size'])
+        if options['dry_run']:
+            for payments in iter_chunks(overdue_payments(now), chunk_size, options['limit']):
+                for pay in payments:
                     self.stdout.write(f'[DRY RUN] Would expire payment #{pay.id}')
-                else:
-                    with transaction.atomic():
-                        pay.status = 'expired'
-                        pay.logs.append({'t': now.isoformat(), 'event': 'expired_by_reconcile'})
-                        pay.save(update_fields=['status', 'logs', 'updated_at'])
-                        try:
-                            if pay.order.status == 'pending':
-                                OrderStateMachine.transition(pay.order, 'cancelled', operator=None, note='Reconcile expired')
-                        except Exception:
-                            pass
-                    expired += 1
-                continue
-
-            # Placeholder for real provider query; no simulated success
-
-        self.stdout.write(self.style.SUCCESS(f'Succeeded: {succeeded}, Expired: {expired}'))
+            return
+
+        # Expire overdue payments; placeholder for real provider query, no simulated success
+        stats = expire_overdue_payments(
+            now=now,
+            chunk_size=chunk_size,
+            limit=options['limit'],
+            event='expired_by_reconcile',
+            note='Reconcile expired',
+        )
+        self.stdout.write(self.style.SUCCESS(f"Succeeded: 0, Expired: {stats['expired']} ({format_stats(stats)})"))
@@ -0,0 +1,39 @@
+"""
+Management command to handle expired stock reservations and refresh bucketed stock.
+
+Usage:
+    python manage.py release_expired_reservations
+    python manage.py release_expired_reservations --limit 500
+    python manage.py release_expired_reservations --refresh-buckets
+"""
+
+from django.core.management.base import BaseCommand
+
+from orders.reservations import expire_reservations, refresh_bucketed_stock
+
+
+class Command(BaseCommand):
+    help = 'Cancel orders whose stock reservations expired and release the reserved stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=200,
+            help='Maximum number of orders to process in one run',
+        )
+        parser.add_argument(
+            '--refresh-buckets',
+            action='store_true',
+            help='Write bucketed stock totals back to product/SKU stock for display',
+        )
+
+    def handle(self, *args, **options):
+        stats = expire_reservations(limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            'Expired reservations: orders={orders} cancelled={cancelled} consumed={consumed} '
+            'released={released} errors={errors}'.format(**stats)
+        ))
+        if options['refresh_buckets']:
+            updated = refresh_bucketed_stock()
+            self.stdout.write(self.style.SUCCESS(f'Refreshed {updated} bucketed stock rows'))
@@ -1,11 +1,40 @@
 from django.core.management.base import BaseCommand
 
 from orders.profit_sharing import ProfitSharingService
+from orders.profit_sharing_settlement import get_profit_sharing_client, settle_profit_sharing
 
 
 class Command(BaseCommand):
-    help = "Sync local profit sharing state and mark due frozen entries available."
+    help = (
+        "Mark due frozen profit sharing entries available, then settle them in batches through the "
+        "configured provider client (PROFIT_SHARING_CLIENT). Interrupted runs resume by out_order_no; "
+        "safe to run in several processes at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=0, help="Stop after claiming this many entries (0 = drain)")
+        parser.add_argument("--chunk-size", type=int, default=100, help="Entries claimed per transaction")
+        parser.add_argument("--workers", type=int, default=None, help="Concurrent provider requests (default: PROFIT_SHARING_WORKERS)")
+        parser.add_argument("--store", type=int, default=None, help="Only settle entries of this store id")
+        parser.add_argument("--retry-failed", action="store_true", help="Resubmit failed entries under a new out_order_no")
 
     def handle(self, *args, **options):
         available_count = ProfitSharingService.mark_available()
         self.stdout.write(self.style.SUCCESS(f"marked available: {available_count}"))
+
+        client = get_profit_sharing_client()
+        if client is None:
+            self.stdout.write("PROFIT_SHARING_CLIENT not configured; settlement skipped (manual settlement only).")
+            return
+        stats = settle_profit_sharing(
+            chunk_size=max(1, options["chunk_size"]),
+            limit=max(0, options["limit"] or 0),
+            workers=options["workers"],
+            client=client,
+            store_id=options["store"],
+            retry_failed=options["retry_failed"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "settled: claimed={claimed} orders={orders} shared={shared} failed={failed} "
+            "processing={processing} resumed={resumed} manual={manual}".format(**stats)
+        ))
@@ -0,0 +1,61 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0043_stock_buckets'),
+        ('orders', '0031_merge_shipping_action_profit_sharing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('bucket', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='库存分桶')),
+                ('quantity', models.PositiveIntegerField(verbose_name='数量')),
+                ('status', models.CharField(choices=[('held', '预占中'), ('consumed', '已消耗'), ('released', '已释放')], default='held', max_length=20, verbose_name='状态')),
+                ('expires_at', models.DateTimeField(verbose_name='过期时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '库存预占',
+                'verbose_name_plural': '库存预占',
+            },
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='checkout_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='orders.checkoutorder', verbose_name='结算单'),
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='orders.order', verbose_name='订单'),
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stock_reservations', to='catalog.product', verbose_name='商品'),
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='sku',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stock_reservations', to='catalog.productsku', verbose_name='SKU'),
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['status', 'expires_at'], name='orders_stoc_status_e8aa04_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['order', 'status'], name='orders_stoc_order_i_a4ab61_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['checkout_order', 'status'], name='orders_stoc_checkou_d2ceb4_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0043_stock_buckets'),
+        ('orders', '0032_stock_reservation'),
+        ('stores', '0011_store_content_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscountScope',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user_role', models.CharField(blank=True, default='', max_length=20, verbose_name='用户角色')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '折扣定向规则',
+                'verbose_name_plural': '折扣定向规则',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='discounttarget',
+            name='orders_disc_user_id_3d6d19_idx',
+        ),
+        migrations.AddIndex(
+            model_name='discounttarget',
+            index=models.Index(fields=['user', 'product', 'discount'], name='orders_disc_user_prod_disc_idx'),
+        ),
+        migrations.AddField(
+            model_name='discountscope',
+            name='brand',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='discount_scopes', to='catalog.brand', verbose_name='品牌'),
+        ),
+        migrations.AddField(
+            model_name='discountscope',
+            name='category',
+            field=models.ForeignKey(blank=True, help_text='包含下级类别', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='discount_scopes', to='catalog.category', verbose_name='类别'),
+        ),
+        migrations.AddField(
+            model_name='discountscope',
+            name='customer_group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='discount_scopes', to='stores.storecustomergroup', verbose_name='客户分组'),
+        ),
+        migrations.AddField(
+            model_name='discountscope',
+            name='discount',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scopes', to='orders.discount', verbose_name='折扣'),
+        ),
+        migrations.AddField(
+            model_name='discountscope',
+            name='store',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='discount_scopes', to='stores.store', verbose_name='店铺'),
+        ),
+        migrations.AddIndex(
+            model_name='discountscope',
+            index=models.Index(fields=['discount'], name='orders_disc_discoun_d58d65_idx'),
+        ),
+    ]
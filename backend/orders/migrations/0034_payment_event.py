@@ -0,0 +1,86 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils.dateparse import parse_datetime
+
+LOG_SUMMARY_SIZE = 10
+BATCH_SIZE = 500
+
+
+def _event_time(entry, fallback):
+    value = parse_datetime(str(entry.get('t') or '')) if isinstance(entry, dict) else None
+    if value is None:
+        return fallback
+    if django.utils.timezone.is_naive(value):
+        value = django.utils.timezone.make_aware(value)
+    return value
+
+
+def move_payment_logs(apps, schema_editor):
+    Payment = apps.get_model('orders', 'Payment')
+    PaymentEvent = apps.get_model('orders', 'PaymentEvent')
+    events = []
+    payments = Payment.objects.exclude(logs=[]).only('id', 'logs', 'created_at').order_by('id')
+    for payment in payments.iterator(chunk_size=BATCH_SIZE):
+        logs = payment.logs if isinstance(payment.logs, list) else []
+        for entry in logs:
+            entry = entry if isinstance(entry, dict) else {'detail': entry}
+            payload = {key: value for key, value in entry.items() if key not in ('t', 'event')}
+            events.append(PaymentEvent(
+                payment_id=payment.id,
+                event=str(entry.get('event') or 'legacy')[:64],
+                payload=payload,
+                created_at=_event_time(entry, payment.created_at),
+            ))
+        if len(logs) > LOG_SUMMARY_SIZE:
+            Payment.objects.filter(pk=payment.pk).update(logs=logs[-LOG_SUMMARY_SIZE:])
+        if len(events) >= BATCH_SIZE:
+            PaymentEvent.objects.bulk_create(events, batch_size=BATCH_SIZE)
+            events = []
+    if events:
+        PaymentEvent.objects.bulk_create(events, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0033_discount_scope'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event', models.CharField(max_length=64, verbose_name='事件类型')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='事件内容')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='发生时间')),
+            ],
+            options={
+                'verbose_name': '支付事件',
+                'verbose_name_plural': '支付事件',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='logs',
+            field=models.JSONField(blank=True, default=list, verbose_name='支付日志摘要'),
+        ),
+        migrations.AddField(
+            model_name='paymentevent',
+            name='payment',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='orders.payment', verbose_name='支付记录'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(fields=['payment', 'id'], name='orders_paym_payment_ac0871_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(fields=['event', 'created_at'], name='orders_paym_event_337966_idx'),
+        ),
+        migrations.RunPython(move_payment_logs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from common.search import AddSubstringIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0034_payment_event'),
+    ]
+
+    operations = [
+        AddSubstringIndex(model_name='order', fields=['order_number']),
+    ]
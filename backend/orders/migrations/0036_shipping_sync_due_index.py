@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0035_order_substring_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ordershippingsync',
+            index=models.Index(fields=['status', 'next_retry_at'], name='orders_ship_sync_due_idx'),
+        ),
+    ]
@@ -394,6 +394,53 @@ class SubOrderItem(models.Model):
         return f'子单{self.suborder_id} - {self.product_name} x{self.quantity}'
 
 
+class StockReservation(models.Model):
+    """库存预占记录
+
+    下单扣减库存时按订单行写入，带过期时间。取消/退款时按记录回补，记录状态保证只回补一次；
+    支付成功后标记为已消耗，过期未支付的由 release_expired_reservations 命令统一释放。
+    """
+    STATUS_HELD = 'held'
+    STATUS_CONSUMED = 'consumed'
+    STATUS_RELEASED = 'released'
+    STATUS_CHOICES = [
+        (STATUS_HELD, '预占中'),
+        (STATUS_CONSUMED, '已消耗'),
+        (STATUS_RELEASED, '已释放'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations', verbose_name='订单')
+    checkout_order = models.ForeignKey(
+        CheckoutOrder,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='stock_reservations',
+        verbose_name='结算单'
+    )
+    product = models.ForeignKey('catalog.Product', on_delete=models.PROTECT, related_name='stock_reservations', verbose_name='商品')
+    sku = models.ForeignKey('catalog.ProductSKU', on_delete=models.PROTECT, null=True, blank=True, related_name='stock_reservations', verbose_name='SKU')
+    bucket = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='库存分桶')
+    quantity = models.PositiveIntegerField(verbose_name='数量')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_HELD, verbose_name='状态')
+    expires_at = models.DateTimeField(verbose_name='过期时间')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '库存预占'
+        verbose_name_plural = '库存预占'
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['order', 'status']),
+            models.Index(fields=['checkout_order', 'status']),
+        ]
+
+    def __str__(self):
+        return f'预占#{self.id} 订单{self.order_id} 商品{self.product_id} x{self.quantity} ({self.status})'
+
+
 class Cart(models.Model):
     user = models.ForeignKey('users.User', on_delete=models.PROTECT, related_name='cart', verbose_name='用户')
 
@@ -459,7 +506,8 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     expires_at = models.DateTimeField(verbose_name='过期时间')
-    logs = models.JSONField(default=list, blank=True, verbose_name='支付日志')
+    # 仅保留最近若干条事件摘要，完整事件流水见 PaymentEvent（orders.payment_events）
+    logs = models.JSONField(default=list, blank=True, verbose_name='支付日志摘要')
 
     class Meta:
         verbose_name = '支付记录'
@@ -491,8 +539,10 @@ class Payment(models.Model):
             profit_sharing_required=requires_profit_sharing,
             profit_sharing_status='pending' if requires_profit_sharing else 'not_required',
             expires_at=now + timedelta(minutes=ttl),
-            logs=[{'t': now.isoformat(), 'event': 'start', 'detail': f'start payment {method}'}]
         )
+        from .payment_events import record_payment_event
+        record_payment_event(payment, 'start', at=now, detail=f'start payment {method}')
+        payment.save(update_fields=['logs'])
         if payment.checkout_order_id:
             payment.checkout_order.payment_status = 'init'
             payment.checkout_order.payment_number = str(payment.id)
@@ -504,6 +554,27 @@ class Payment(models.Model):
         return False
 
 
+class PaymentEvent(models.Model):
+    """支付事件流水（只追加），替代不断增长的 Payment.logs"""
+    id = models.BigAutoField(primary_key=True)
+    payment = models.ForeignKey('orders.Payment', on_delete=models.CASCADE, related_name='events', verbose_name='支付记录')
+    event = models.CharField(max_length=64, verbose_name='事件类型')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='事件内容')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='发生时间')
+
+    class Meta:
+        verbose_name = '支付事件'
+        verbose_name_plural = '支付事件'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['payment', 'id']),
+            models.Index(fields=['event', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f'支付#{self.payment_id} {self.event}'
+
+
 class StoreProfitSharingEntry(models.Model):
     STATUS_CHOICES = [
         ('platform_retained', '平台留存'),
@@ -712,7 +783,8 @@ class DiscountTarget(models.Model):
         verbose_name_plural = '折扣适用范围'
         unique_together = ('discount', 'user', 'product')
         indexes = [
-            models.Index(fields=['user', 'product']),
+            # 覆盖 "某用户在一组商品上的折扣" 查询，无需回表即可拿到 discount_id
+            models.Index(fields=['user', 'product', 'discount'], name='orders_disc_user_prod_disc_idx'),
             models.Index(fields=['discount']),
         ]
 
@@ -720,6 +792,61 @@ class DiscountTarget(models.Model):
         return f"Target d={self.discount_id} u={self.user_id} p={self.product_id}"
 
 
+class DiscountScope(models.Model):
+    """折扣定向规则：用户维度 × 商品维度。
+
+    与 DiscountTarget 逐条列出 (用户, 商品) 不同，规则在计价时实时匹配，不展开成明细行。
+    各维度留空表示不限。
+    """
+    id = models.BigAutoField(primary_key=True)
+    discount = models.ForeignKey(Discount, on_delete=models.CASCADE, related_name='scopes', verbose_name='折扣')
+    user_role = models.CharField(max_length=20, blank=True, default='', verbose_name='用户角色')
+    customer_group = models.ForeignKey(
+        'stores.StoreCustomerGroup',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='discount_scopes',
+        verbose_name='客户分组',
+    )
+    store = models.ForeignKey(
+        'stores.Store',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='discount_scopes',
+        verbose_name='店铺',
+    )
+    category = models.ForeignKey(
+        'catalog.Category',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='discount_scopes',
+        verbose_name='类别',
+        help_text='包含下级类别',
+    )
+    brand = models.ForeignKey(
+        'catalog.Brand',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='discount_scopes',
+        verbose_name='品牌',
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '折扣定向规则'
+        verbose_name_plural = '折扣定向规则'
+        indexes = [
+            models.Index(fields=['discount']),
+        ]
+
+    def __str__(self):
+        return f"Scope d={self.discount_id} role={self.user_role or '*'} group={self.customer_group_id or '*'}"
+
+
 class OrderStatusHistory(models.Model):
     """订单状态变更历史"""
     id = models.BigAutoField(primary_key=True)
@@ -841,6 +968,7 @@ class OrderShippingSync(models.Model):
             models.Index(fields=['order'], name='orders_ship_sync_order_idx'),
             models.Index(fields=['status'], name='orders_ship_sync_status_idx'),
             models.Index(fields=['next_retry_at'], name='orders_ship_sync_retry_idx'),
+            models.Index(fields=['status', 'next_retry_at'], name='orders_ship_sync_due_idx'),
         ]
 
     def __str__(self):
@@ -0,0 +1,64 @@
+"""支付事件流水
+
+所有支付事件只追加写入 PaymentEvent；Payment.logs 仅保留最近 PAYMENT_LOG_SUMMARY_SIZE
+条摘要，保存支付记录时写入的数据量不再随回调/重试次数增长。
+"""
+from django.utils import timezone
+
+from .models import PaymentEvent
+
+PAYMENT_LOG_SUMMARY_SIZE = 10
+
+
+def summarize_logs(entries):
+    return list(entries or [])[-PAYMENT_LOG_SUMMARY_SIZE:]
+
+
+def record_payment_event(payment, event, at=None, **payload):
+    """写入一条支付事件，并刷新内存中的 payment.logs 摘要。
+
+    调用方按原有方式保存 payment（update_fields 包含 logs）即可。
+    """
+    at = at or timezone.now()
+    PaymentEvent.objects.create(payment=payment, event=event, payload=payload, created_at=at)
+    entry = {'t': at.isoformat(), 'event': event, **payload}
+    payment.logs = summarize_logs([*(payment.logs or []), entry])
+    return entry
+
+
+def record_payment_events(payments, event, at=None, **payload):
+    """为一批支付各写入一条相同事件（一次 bulk_create），并刷新各自的 logs 摘要。
+
+    调用方负责批量保存这些 payment（如 bulk_update 包含 logs）。
+    """
+    at = at or timezone.now()
+    PaymentEvent.objects.bulk_create([
+        PaymentEvent(payment=payment, event=event, payload=payload, created_at=at)
+        for payment in payments
+    ])
+    entry = {'t': at.isoformat(), 'event': event, **payload}
+    for payment in payments:
+        payment.logs = summarize_logs([*(payment.logs or []), entry])
+    return entry
+
+
+def append_payment_event(payment_id, event, **payload):
+    """只追加事件流水，不改动支付记录本身（回调审计日志等高频事件使用）"""
+    return PaymentEvent.objects.create(payment_id=payment_id, event=event, payload=payload)
+
+
+def resolve_transaction_id(payment) -> str:
+    """最近一次记录的微信交易号：先查摘要，再查事件流水"""
+    for entry in reversed(payment.logs or []):
+        if isinstance(entry, dict) and entry.get('transaction_id'):
+            return entry['transaction_id']
+    if not payment.pk:
+        return ''
+    payload = (
+        PaymentEvent.objects
+        .filter(payment_id=payment.pk, payload__has_key='transaction_id')
+        .order_by('-id')
+        .values_list('payload', flat=True)
+        .first()
+    )
+    return (payload or {}).get('transaction_id') or ''
@@ -26,6 +26,8 @@ from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+from common.logging import log_security
+
 logger = logging.getLogger(__name__)
 
 class PaymentService:
@@ -420,17 +422,15 @@ class PaymentService:
         return None
 
     @staticmethod
-    def parse_wechat_callback(request) -> tuple[Optional[Dict], Optional[str]]:
+    def verify_wechat_callback(request) -> tuple[Optional[Dict], Optional[str]]:
         """
-        解析并验证微信支付回调，返回包含交易数据的字典。
+        验签并解密微信支付回调，不访问数据库。
 
-        返回 (result, error)，其中 result 包含:
+        返回 (event, error)，其中 event 包含:
         {
-            'payment': Payment,
-            'transaction': dict,
-            'trade_state': str,
-            'transaction_id': str,
-            'amount_decimal': Decimal,
+            'id': str,            # 微信通知ID
+            'event_type': str,
+            'transaction': dict,  # 解密后的交易数据
         }
         """
         raw_body = request.body.decode('utf-8') if getattr(request, 'body', None) else ''
@@ -457,7 +457,6 @@ class PaymentService:
             return None, f'回调资源解密失败: {exc}'
         PaymentService._log_debug('wechat callback parsed', {'transaction': transaction})
 
-        from .models import Payment, Order
         mchid = getattr(settings, 'WECHAT_PAY_MCHID', '')
         appid = getattr(settings, 'WECHAT_APPID', '')
         if mchid and transaction.get('mchid') and transaction['mchid'] != mchid:
@@ -465,6 +464,28 @@ class PaymentService:
         if appid and transaction.get('appid') and transaction['appid'] != appid:
             return None, 'appid 不匹配'
 
+        return {
+            'id': payload.get('id') or '',
+            'event_type': payload.get('event_type') or '',
+            'transaction': transaction,
+        }, None
+
+    @staticmethod
+    def resolve_wechat_callback(transaction: Dict) -> tuple[Optional[Dict], Optional[str]]:
+        """
+        按已解密的交易数据找到支付记录，并校验金额与订单号。
+
+        返回 (result, error)，其中 result 包含:
+        {
+            'payment': Payment,
+            'transaction': dict,
+            'trade_state': str,
+            'transaction_id': str,
+            'amount_decimal': Decimal,
+        }
+        """
+        from .models import Payment, Order
+
         out_trade_no = transaction.get('out_trade_no')
         attach = transaction.get('attach')
         payment = None
@@ -502,6 +523,216 @@ class PaymentService:
             'out_trade_no': out_trade_no,
         }, None
 
+    @staticmethod
+    def parse_wechat_callback(request) -> tuple[Optional[Dict], Optional[str]]:
+        """
+        解析并验证微信支付回调，返回包含交易数据的字典。
+
+        等价于 verify_wechat_callback + resolve_wechat_callback，返回值同后者。
+        """
+        event, err = PaymentService.verify_wechat_callback(request)
+        if err:
+            return None, err
+        return PaymentService.resolve_wechat_callback(event['transaction'])
+
+    @staticmethod
+    def wechat_callback_dedup_key(event: Dict) -> str:
+        """回调收件箱去重键：同一交易的同一交易状态只处理一次"""
+        transaction = event.get('transaction') or {}
+        reference = transaction.get('transaction_id') or transaction.get('out_trade_no') or event.get('id') or ''
+        return f"{reference}:{transaction.get('trade_state') or ''}"
+
+    @staticmethod
+    def map_payment_status(provider: str, status_param: str) -> str:
+        """映射支付状态"""
+        if provider == 'wechat':
+            val = str(status_param).upper() if status_param else ''
+            if val == 'SUCCESS':
+                return 'succeeded'
+            if val in {'CLOSED', 'REVOKED'}:
+                return 'cancelled'
+            if val in {'USERPAYING', 'NOTPAY', 'ACCEPT'}:
+                return 'processing'
+            return 'failed'
+        if provider == 'alipay':
+            val = str(status_param).lower() if status_param else ''
+            if val == 'trade_success':
+                return 'succeeded'
+            if val == 'trade_closed':
+                return 'cancelled'
+            return 'failed'
+        return 'processing'
+
+    @staticmethod
+    def handle_wechat_callback(event: Dict) -> str:
+        """
+        处理一条已验签的微信支付回调（由回调收件箱 worker 调用）。
+
+        回调可能重复或乱序到达：锁定支付记录后再判断状态，已成功、已取消、已过期、
+        已失败的支付不会被后到的回调改写。返回处理结果；无法处理时抛出异常，
+        收件箱记为失败，可重放。
+        """
+        from .models import Payment
+
+        provider = 'wechat'
+        parsed, err = PaymentService.resolve_wechat_callback(event.get('transaction') or {})
+        if err:
+            raise ValueError(err)
+        payment = parsed['payment']
+        status_param = parsed.get('trade_state')
+        transaction_id = parsed.get('transaction_id')
+        callback_amount = parsed.get('amount_decimal')
+        PaymentService.log_payment_event(
+            payment.id,
+            'signature_verified',
+            details={'provider': provider, 'channel': 'wechat_v3'}
+        )
+
+        # 验证回调金额与支付单一致
+        ok_amount, reason_amount = PaymentService.validate_callback_amount(payment, {'amount': callback_amount})
+        if not ok_amount:
+            logger.error(f'回调金额校验失败: payment_id={payment.id}, reason={reason_amount}')
+            PaymentService.log_payment_event(
+                payment.id,
+                'callback_amount_mismatch',
+                details={'provider': provider},
+                error=reason_amount
+            )
+            raise ValueError(reason_amount)
+
+        new_status = PaymentService.map_payment_status(provider, status_param)
+
+        try:
+            with transaction.atomic():
+                # 锁定支付记录，在锁内判断状态，避免并发或乱序回调覆盖终态
+                payment = Payment.objects.select_for_update().select_related('order').get(id=payment.id)
+
+                # 防止重复处理已成功的支付
+                if payment.status == 'succeeded':
+                    logger.warning(f'支付记录已处理过: payment_id={payment.id}')
+                    PaymentService.log_payment_event(
+                        payment.id,
+                        'duplicate_callback_ignored',
+                        details={'provider': provider, 'trade_state': status_param}
+                    )
+                    return 'duplicate'
+                if payment.status in ['cancelled', 'expired', 'failed']:
+                    logger.warning(f'回调被拒绝，支付状态不允许更新: payment_id={payment.id}, status={payment.status}')
+                    PaymentService.log_payment_event(
+                        payment.id,
+                        'callback_rejected_by_status',
+                        details={'provider': provider, 'status': payment.status, 'trade_state': status_param}
+                    )
+                    return f'ignored:{payment.status}'
+
+                # 处理支付成功
+                if new_status == 'succeeded':
+                    # 再次金额阈值/一致性校验
+                    ok_amount, reason_amt = PaymentService.check_amount_threshold(payment.order)
+                    if not ok_amount:
+                        raise ValueError(reason_amt)
+                    if callback_amount is not None and callback_amount != payment.amount:
+                        log_security('callback_amount_mismatch', '回调金额不一致', {'payment_id': payment.id, 'order_id': payment.order_id})
+                        raise ValueError('回调金额与支付单不一致')
+
+                    PaymentService.process_payment_success(
+                        payment.id,
+                        transaction_id=transaction_id,
+                        operator=None
+                    )
+                    logger.info(f'支付成功处理: payment_id={payment.id}, transaction_id={transaction_id}')
+
+                # 处理支付失败
+                elif new_status == 'failed':
+                    payment.status = 'failed'
+                    PaymentService.log_payment_event(
+                        payment.id,
+                        'payment_failed',
+                        details={'provider': provider, 'reason': status_param}
+                    )
+                    payment.save()
+                    logger.warning(f'支付失败: payment_id={payment.id}')
+
+                # 处理支付取消
+                elif new_status == 'cancelled':
+                    payment.status = 'cancelled'
+                    PaymentService.log_payment_event(
+                        payment.id,
+                        'payment_cancelled',
+                        details={'provider': provider}
+                    )
+                    payment.save()
+                    logger.info(f'支付已取消: payment_id={payment.id}')
+
+                # 处理支付过期
+                elif new_status == 'expired':
+                    payment.status = 'expired'
+                    # 使用状态机更新订单状态
+                    try:
+                        from .state_machine import OrderStateMachine
+                        OrderStateMachine.transition(
+                            payment.order,
+                            'cancelled',
+                            operator=None,
+                            note='Payment expired'
+                        )
+                    except ValueError as e:
+                        logger.error(f'订单状态转换失败: {str(e)}')
+                        payment.order.status = 'cancelled'
+                        payment.order.save()
+
+                    try:
+                        from users.services import create_notification
+                        create_notification(
+                            payment.order.user,
+                            title='支付已过期',
+                            content=f'订单 {payment.order.order_number} 支付已过期，请重新下单或再次支付',
+                            ntype='payment',
+                            metadata={
+                                'order_id': payment.order_id,
+                                'payment_id': payment.id,
+                                'order_number': payment.order.order_number,
+                                'page': f'pages/order-detail/index?id={payment.order_id}',
+                                'subscription_data': {
+                                    'thing1': {'value': f'订单 {payment.order.order_number}'[:20]},
+                                    'time2': {'value': timezone.localtime(payment.expires_at).strftime('%Y-%m-%d %H:%M') if payment.expires_at else ''},
+                                    'thing3': {'value': '支付已过期'},
+                                },
+                            }
+                        )
+                    except Exception:
+                        pass
+
+                    PaymentService.log_payment_event(
+                        payment.id,
+                        'payment_expired',
+                        details={'provider': provider}
+                    )
+                    payment.save()
+                    logger.info(f'支付已过期: payment_id={payment.id}')
+
+                # 处理支付处理中
+                else:
+                    payment.status = 'processing'
+                    PaymentService.log_payment_event(
+                        payment.id,
+                        'payment_processing',
+                        details={'provider': provider}
+                    )
+                    payment.save()
+                    logger.info(f'支付处理中: payment_id={payment.id}')
+        except Exception as e:
+            logger.error(f'处理支付回调异常: {str(e)}')
+            PaymentService.log_payment_event(
+                payment.id,
+                'callback_processing_error',
+                details={'provider': provider},
+                error=str(e)
+            )
+            raise
+
+        return new_status
+
     @staticmethod
     def parse_wechat_refund_callback(request) -> tuple[Optional[Dict], Optional[str]]:
         """
@@ -683,16 +914,11 @@ class PaymentService:
 
     @staticmethod
     def _resolve_wechat_transaction_id(payment) -> str | None:
-        """尝试从支付日志解析微信交易ID。"""
-        if not payment or not payment.logs:
-            return None
-        try:
-            for entry in payment.logs:
-                if isinstance(entry, dict) and entry.get('transaction_id'):
-                    return entry.get('transaction_id')
-        except Exception:
+        """尝试从支付事件解析微信交易ID。"""
+        if not payment:
             return None
-        return None
+        from .payment_events import resolve_transaction_id
+        return resolve_transaction_id(payment) or None
 
     @staticmethod
     def create_wechat_refund(refund, operator=None) -> Dict:
@@ -953,6 +1179,7 @@ class PaymentService:
             ... )
         """
         from .models import Payment
+        from .payment_events import record_payment_event
         from .state_machine import OrderStateMachine
         from users.services import create_notification
         
@@ -968,11 +1195,7 @@ class PaymentService:
         if timezone.now() > payment.expires_at:
             logger.warning(f'支付记录#{payment_id}已过期')
             payment.status = 'expired'
-            payment.logs.append({
-                't': timezone.now().isoformat(),
-                'event': 'expired',
-                'detail': 'Payment expired before processing'
-            })
+            record_payment_event(payment, 'expired', detail='Payment expired before processing')
             payment.save()
             return payment
         
@@ -981,19 +1204,15 @@ class PaymentService:
         
         # 记录交易ID
         if transaction_id:
-            payment.logs.append({
-                't': timezone.now().isoformat(),
-                'event': 'transaction_id_recorded',
-                'transaction_id': transaction_id
-            })
+            record_payment_event(payment, 'transaction_id_recorded', transaction_id=transaction_id)
         
         # 记录支付成功事件
-        payment.logs.append({
-            't': timezone.now().isoformat(),
-            'event': 'payment_succeeded',
-            'operator': operator.username if operator else 'system',
-            'detail': 'Payment processed successfully'
-        })
+        record_payment_event(
+            payment,
+            'payment_succeeded',
+            operator=operator.username if operator else 'system',
+            detail='Payment processed successfully',
+        )
         
         payment.save()
         
@@ -1015,11 +1234,7 @@ class PaymentService:
         except ValueError as e:
             logger.error(f'订单状态转换失败: {str(e)}')
             # 记录状态转换失败的日志，但不中断支付处理
-            payment.logs.append({
-                't': timezone.now().isoformat(),
-                'event': 'order_transition_failed',
-                'error': str(e)
-            })
+            record_payment_event(payment, 'order_transition_failed', error=str(e))
             payment.save()
             raise
 
@@ -1047,11 +1262,7 @@ class PaymentService:
                 ProfitSharingService.create_entries_for_payment(payment)
             except Exception as exc:
                 logger.exception('创建分账流水失败', extra={'payment_id': payment.id, 'checkout_order_id': checkout.id})
-                payment.logs.append({
-                    't': timezone.now().isoformat(),
-                    'event': 'profit_sharing_entry_error',
-                    'error': str(exc)
-                })
+                record_payment_event(payment, 'profit_sharing_entry_error', error=str(exc))
                 payment.save(update_fields=['logs', 'updated_at'])
 
         # 创建通知（订阅消息/站内）
@@ -1191,7 +1402,7 @@ class PaymentService:
     ):
         """记录支付事件
         
-        为支付记录添加事件日志，用于审计和调试。
+        追加一条支付事件流水（PaymentEvent），用于审计和调试；不改写支付记录本身。
         
         Args:
             payment_id: 支付记录ID
@@ -1207,26 +1418,27 @@ class PaymentService:
             ... )
         """
         from .models import Payment
+        from .payment_events import append_payment_event
         
         try:
-            payment = Payment.objects.get(id=payment_id)
-            
-            log_entry = {
-                't': timezone.now().isoformat(),
-                'event': event,
-            }
+            if not Payment.objects.filter(id=payment_id).exists():
+                raise Payment.DoesNotExist
             
+            payload = {}
             if details:
-                log_entry['details'] = details
-            
+                payload['details'] = details
             if error:
-                log_entry['error'] = error
+                payload['error'] = error
             
-            payment.logs.append(log_entry)
-            payment.save(update_fields=['logs'])
+            append_payment_event(payment_id, event, **payload)
             
             logger.info(f'支付事件已记录: payment_id={payment_id}, event={event}')
         except Payment.DoesNotExist:
             logger.error(f'支付记录不存在: payment_id={payment_id}')
         except Exception as e:
             logger.error(f'记录支付事件失败: {str(e)}')
+
+
+def process_wechat_payment_callback(payload):
+    """回调收件箱的微信支付处理入口"""
+    return PaymentService.handle_wechat_callback(payload)
@@ -9,6 +9,7 @@ from django.utils import timezone
 from stores.models import Store, StorePaymentConfig
 
 from .models import Payment, StoreProfitSharingEntry, SubOrder
+from .payment_events import resolve_transaction_id
 
 
 class ProfitSharingService:
@@ -127,10 +128,17 @@ class ProfitSharingService:
     @staticmethod
     def mark_available(now=None) -> int:
         now = now or timezone.now()
-        return StoreProfitSharingEntry.objects.filter(
-            status="frozen",
-            available_at__lte=now,
-        ).update(status="available", updated_at=now)
+        due = StoreProfitSharingEntry.objects.filter(status="frozen", available_at__lte=now)
+        payment_ids = list(due.values_list("payment_id", flat=True).distinct())
+        updated = due.update(status="available", updated_at=now)
+        if updated:
+            # 冻结中的支付只要有流水到期即变为可分账，与 update_payment_status 的判定一致
+            Payment.objects.filter(
+                id__in=payment_ids,
+                profit_sharing_required=True,
+                profit_sharing_status="frozen",
+            ).update(profit_sharing_status="available", updated_at=now)
+        return updated
 
     @staticmethod
     def update_payment_status(payment: Payment):
@@ -157,7 +165,4 @@ class ProfitSharingService:
 
     @staticmethod
     def resolve_transaction_id(payment: Payment) -> str:
-        for entry in reversed(payment.logs or []):
-            if isinstance(entry, dict) and entry.get("transaction_id"):
-                return entry["transaction_id"]
-        return ""
+        return resolve_transaction_id(payment)
@@ -0,0 +1,368 @@
+"""店铺分账批量结算
+
+原有流程逐笔支付、逐个接收方处理分账流水，每次都单独请求支付渠道。这里改为：
+
+- 按主键分批认领可分账流水（SELECT ... FOR UPDATE SKIP LOCKED），同一支付下同一接收方的
+  流水合并为一笔分账单（WechatProfitSharingOrder），分账单与流水状态在同一事务内批量写入；
+- 分账单号 out_order_no 在请求渠道前落库，作为幂等键：进程中途崩溃后，下次运行先按单号
+  查询渠道结果（查不到才重新提交），不会重复分账；
+- 请求通过可替换的渠道客户端（PROFIT_SHARING_CLIENT）发出，线程池限制并发数，工作线程
+  只访问渠道，所有数据库写入留在主线程并批量执行。
+
+未配置渠道客户端时分账结算保持停用，只能人工结算。
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import StoreProfitSharingEntry, WechatProfitSharingOrder
+from .payment_events import resolve_transaction_id
+from .profit_sharing import ProfitSharingService
+
+logger = logging.getLogger(__name__)
+
+# 分账单提交后在该时长内视为仍由本次运行处理；超时仍为处理中的分账单由后续运行查询续办
+SETTLEMENT_LEASE_MINUTES = 5
+DEFAULT_CHUNK_SIZE = 100
+
+
+class ProfitSharingRejected(Exception):
+    """渠道明确拒绝分账请求（参数错误、余额不足等），重试同一单号不会成功"""
+
+
+def get_profit_sharing_client():
+    """按 PROFIT_SHARING_CLIENT 实例化渠道客户端；未配置时返回 None（分账结算停用）"""
+    path = getattr(settings, 'PROFIT_SHARING_CLIENT', '')
+    return import_string(path)() if path else None
+
+
+class WechatProfitSharingClient:
+    """微信支付 v3 分账接口：请求分账与查询分账结果"""
+
+    BASE_URL = 'https://api.mch.weixin.qq.com'
+
+    def __init__(self):
+        from .payment_service import PaymentService
+
+        self.appid = getattr(settings, 'WECHAT_APPID', '')
+        self.mchid = getattr(settings, 'WECHAT_PAY_MCHID', '')
+        self.serial_no = getattr(settings, 'WECHAT_PAY_SERIAL_NO', '')
+        self._sign = PaymentService._sign_rsa
+        self._load_public_key = PaymentService._load_wechat_public_key
+        if not (self.appid and self.mchid and self.serial_no):
+            raise RuntimeError('微信分账配置不完整')
+
+    def _headers(self, method: str, path: str, body: str = '') -> dict:
+        nonce_str = uuid.uuid4().hex
+        timestamp = str(int(time.time()))
+        signature = self._sign(f'{method}\n{path}\n{timestamp}\n{nonce_str}\n{body}\n')
+        return {
+            'Authorization': (
+                'WECHATPAY2-SHA256-RSA2048 '
+                f'mchid="{self.mchid}",'
+                f'nonce_str="{nonce_str}",'
+                f'signature="{signature}",'
+                f'timestamp="{timestamp}",'
+                f'serial_no="{self.serial_no}"'
+            ),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json; charset=UTF-8',
+        }
+
+    def submit(self, order: dict) -> dict:
+        receivers = []
+        headers_extra = {}
+        for receiver in order['receivers']:
+            item = {
+                'type': receiver['type'],
+                'account': receiver['account'],
+                'amount': receiver['amount'],
+                'description': receiver['description'],
+            }
+            if receiver.get('name'):
+                # 接收方名称需用微信支付公钥加密，并通过 Wechatpay-Serial 声明所用公钥
+                public_key, serial = self._load_public_key()
+                item['name'] = base64.b64encode(public_key.encrypt(
+                    receiver['name'].encode('utf-8'),
+                    padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA1()), algorithm=hashes.SHA1(), label=None),
+                )).decode('utf-8')
+                headers_extra['Wechatpay-Serial'] = getattr(settings, 'WECHAT_PAY_PUBLIC_KEY_ID', '') or serial or ''
+            receivers.append(item)
+        body = json.dumps({
+            'appid': self.appid,
+            'transaction_id': order['transaction_id'],
+            'out_order_no': order['out_order_no'],
+            'receivers': receivers,
+            'unfreeze_unsplit': order['unfreeze_unsplit'],
+        }, separators=(',', ':'), ensure_ascii=False)
+        path = '/v3/profitsharing/orders'
+        headers = {**self._headers('POST', path, body), **headers_extra}
+        resp = requests.post(f'{self.BASE_URL}{path}', data=body.encode('utf-8'), headers=headers, timeout=10)
+        if 400 <= resp.status_code < 500 and resp.status_code != 429:
+            raise ProfitSharingRejected(f'{resp.status_code} {resp.text}')
+        if resp.status_code >= 300:
+            raise RuntimeError(f'分账请求失败: {resp.status_code} {resp.text}')
+        return resp.json()
+
+    def query(self, order: dict) -> dict | None:
+        path = f"/v3/profitsharing/orders/{order['out_order_no']}?transaction_id={order['transaction_id']}"
+        resp = requests.get(f'{self.BASE_URL}{path}', headers=self._headers('GET', path), timeout=10)
+        if resp.status_code == 404:
+            return None
+        if resp.status_code >= 300:
+            raise RuntimeError(f'分账查询失败: {resp.status_code} {resp.text}')
+        return resp.json()
+
+
+def eligible_entries(store_id=None, retry_failed=False):
+    """可提交分账的流水：已到可分账时间、店铺分账配置就绪、支付成功"""
+    statuses = ['available', 'failed'] if retry_failed else ['available']
+    qs = StoreProfitSharingEntry.objects.filter(
+        status__in=statuses,
+        sharing_amount__gt=0,
+        payment__status='succeeded',
+        store__payment_config__is_active=True,
+        store__payment_config__profit_sharing_enabled=True,
+        store__payment_config__profit_sharing_receiver_added=True,
+        store__payment_config__profit_sharing_receiver_verified=True,
+    ).exclude(receiver_account='')
+    if store_id is not None:
+        qs = qs.filter(store_id=store_id)
+    return qs
+
+
+def _log(entry, now, event, **extra):
+    entry.logs = [*(entry.logs or []), {'t': now.isoformat(), 'event': event, **extra}]
+    entry.updated_at = now
+
+
+def _claim_entries(queryset, last_id, size, operator, stats):
+    """认领一批流水并生成分账单；返回 (本批最大主键, 新建分账单主键列表)"""
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            queryset.filter(pk__gt=last_id)
+            .select_related('payment', 'store')
+            .order_by('pk')
+            .select_for_update(skip_locked=True, of=('self',))[:size]
+        )
+        if not entries:
+            return None, []
+        stats['claimed'] += len(entries)
+
+        groups: dict[tuple, list[StoreProfitSharingEntry]] = {}
+        transaction_ids: dict[int, str] = {}
+        manual = []
+        for entry in entries:
+            if entry.payment_id not in transaction_ids:
+                transaction_ids[entry.payment_id] = resolve_transaction_id(entry.payment)
+            if not transaction_ids[entry.payment_id]:
+                entry.status = 'manual_settlement_required'
+                entry.failure_reason = '缺少微信支付交易号'
+                _log(entry, now, 'profit_sharing_manual_required', reason=entry.failure_reason)
+                manual.append(entry)
+                continue
+            key = (entry.payment_id, entry.receiver_type, entry.receiver_account)
+            groups.setdefault(key, []).append(entry)
+        stats['manual'] += len(manual)
+
+        orders = []
+        for (payment_id, receiver_type, receiver_account), group in groups.items():
+            amount = sum((entry.sharing_amount for entry in group), Decimal('0.00'))
+            orders.append(WechatProfitSharingOrder(
+                # 模型默认单号为秒级时间戳加随机数，整批写入或多进程同秒建单时可能撞号
+                out_order_no=f'PS{uuid.uuid4().hex}',
+                payment_id=payment_id,
+                checkout_order_id=group[0].checkout_order_id,
+                transaction_id=transaction_ids[payment_id],
+                receivers=[{
+                    'type': receiver_type,
+                    'account': receiver_account,
+                    'name': group[0].receiver_name_snapshot,
+                    'amount': str(amount),
+                    'description': f'{group[0].store.name}订单分账',
+                }],
+                amount=amount,
+                operator=operator,
+            ))
+        WechatProfitSharingOrder.objects.bulk_create(orders)
+
+        links = []
+        for order, group in zip(orders, groups.values()):
+            for entry in group:
+                entry.status = 'processing'
+                entry.failure_reason = ''
+                _log(entry, now, 'profit_sharing_submitted', out_order_no=order.out_order_no)
+                links.append(WechatProfitSharingOrder.entries.through(
+                    wechatprofitsharingorder_id=order.id, storeprofitsharingentry_id=entry.id,
+                ))
+        WechatProfitSharingOrder.entries.through.objects.bulk_create(links)
+        StoreProfitSharingEntry.objects.bulk_update(entries, ['status', 'failure_reason', 'logs', 'updated_at'])
+        stats['orders'] += len(orders)
+    return entries[-1].pk, [order.id for order in orders]
+
+
+def claim_stale_orders(chunk_size=DEFAULT_CHUNK_SIZE, exclude_ids=()):
+    """认领租约已过期、仍为处理中的分账单（上次运行中断或渠道仍在处理），并续租"""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            WechatProfitSharingOrder.objects
+            .filter(status='processing', updated_at__lt=now - timedelta(minutes=SETTLEMENT_LEASE_MINUTES))
+            .exclude(id__in=exclude_ids)
+            .order_by('id')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if ids:
+            WechatProfitSharingOrder.objects.filter(id__in=ids).update(updated_at=now)
+    return ids
+
+
+def _request_payload(order: WechatProfitSharingOrder) -> dict:
+    return {
+        'out_order_no': order.out_order_no,
+        'transaction_id': order.transaction_id,
+        'unfreeze_unsplit': order.unfreeze_unsplit,
+        'receivers': [
+            {**receiver, 'amount': int((Decimal(receiver['amount']) * 100).quantize(Decimal('1')))}
+            for receiver in order.receivers
+        ],
+    }
+
+
+def _call_provider(client, payload, resume):
+    """在工作线程中执行：续办时先查询，查不到再提交；返回 (响应, 错误信息, 是否被拒绝)"""
+    try:
+        response = client.query(payload) if resume else None
+        if response is None:
+            response = client.submit(payload)
+        return response or {}, '', False
+    except ProfitSharingRejected as exc:
+        return {}, str(exc), True
+    except Exception as exc:
+        return {}, str(exc), False
+
+
+def _result_status(response: dict) -> tuple[str, str]:
+    """将渠道响应映射为分账单状态：shared / failed / processing"""
+    receivers = response.get('receivers') or []
+    if any(item.get('result') == 'CLOSED' for item in receivers):
+        reasons = [item.get('fail_reason') or 'CLOSED' for item in receivers if item.get('result') == 'CLOSED']
+        return 'failed', ','.join(reasons)
+    if receivers and all(item.get('result') == 'SUCCESS' for item in receivers):
+        return 'shared', ''
+    if not receivers and response.get('state') == 'FINISHED':
+        return 'shared', ''
+    return 'processing', ''
+
+
+def _apply_results(orders, outcomes, stats):
+    now = timezone.now()
+    entries = []
+    payments = {}
+    for order, (response, error, rejected) in zip(orders, outcomes):
+        if rejected:
+            status, reason = 'failed', error
+        elif error:
+            # 网络或渠道临时错误：保持处理中，租约到期后由后续运行按单号查询续办
+            status, reason = 'processing', error
+        else:
+            status, reason = _result_status(response)
+        order.status = status
+        order.wechat_response = response or order.wechat_response
+        order.error_message = reason
+        order.updated_at = now
+        stats[status] += 1
+        payments[order.payment_id] = order.payment
+        if status == 'processing':
+            continue
+        for entry in order.entries.all():
+            entry.status = status
+            entry.failure_reason = reason
+            if status == 'shared':
+                entry.shared_at = now
+            _log(entry, now, f'profit_sharing_{status}', out_order_no=order.out_order_no)
+            entries.append(entry)
+    with transaction.atomic():
+        WechatProfitSharingOrder.objects.bulk_update(orders, ['status', 'wechat_response', 'error_message', 'updated_at'])
+        StoreProfitSharingEntry.objects.bulk_update(entries, ['status', 'failure_reason', 'shared_at', 'logs', 'updated_at'])
+    for payment in payments.values():
+        ProfitSharingService.update_payment_status(payment)
+
+
+def _dispatch(pool, client, order_ids, resume, stats):
+    orders = list(
+        WechatProfitSharingOrder.objects
+        .filter(id__in=order_ids)
+        .select_related('payment')
+        .prefetch_related('entries')
+        .order_by('id')
+    )
+    if not orders:
+        return
+    payloads = [_request_payload(order) for order in orders]
+    outcomes = list(pool.map(lambda payload: _call_provider(client, payload, resume), payloads))
+    _apply_results(orders, outcomes, stats)
+
+
+def settle_profit_sharing(
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    limit: int = 0,
+    workers: int | None = None,
+    client=None,
+    operator=None,
+    store_id: int | None = None,
+    retry_failed: bool = False,
+) -> dict:
+    """
+    先续办中断或仍在处理中的分账单，再分批认领可分账流水、合并为分账单并并发提交。
+
+    limit 同时限制续办的分账单数与认领的流水数（各自计数，0 表示不限）；retry_failed 为 True 时失败流水会以新单号重新提交。
+    返回统计：claimed/orders/manual 为本次认领与建单数，shared/failed/processing 为提交结果，
+    resumed 为续办的分账单数。
+    """
+    client = client or get_profit_sharing_client()
+    if client is None:
+        raise RuntimeError('未配置分账渠道客户端（PROFIT_SHARING_CLIENT）')
+    workers = max(1, int(workers or getattr(settings, 'PROFIT_SHARING_WORKERS', 4) or 1))
+    stats = {'claimed': 0, 'orders': 0, 'manual': 0, 'resumed': 0, 'shared': 0, 'failed': 0, 'processing': 0}
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='profit-sharing') as pool:
+        resumed_ids: list[int] = []
+        while not limit or stats['resumed'] < limit:
+            size = min(chunk_size, limit - stats['resumed']) if limit else chunk_size
+            ids = claim_stale_orders(size, exclude_ids=resumed_ids)
+            if not ids:
+                break
+            resumed_ids.extend(ids)
+            stats['resumed'] += len(ids)
+            _dispatch(pool, client, ids, True, stats)
+
+        queryset = eligible_entries(store_id=store_id, retry_failed=retry_failed)
+        last_id = 0
+        while not limit or stats['claimed'] < limit:
+            size = min(chunk_size, limit - stats['claimed']) if limit else chunk_size
+            last_id, order_ids = _claim_entries(queryset, last_id, size, operator, stats)
+            if last_id is None:
+                break
+            _dispatch(pool, client, order_ids, False, stats)
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    logger.info('分账结算完成: %s', ' '.join(f'{key}={value}' for key, value in stats.items()))
+    return stats
@@ -0,0 +1,304 @@
+"""库存预占引擎
+
+- 条件扣减：``UPDATE ... SET stock = stock - n WHERE stock >= n``，不加读锁、不回读，
+  行锁只在这一条语句上产生；
+- 预占记录：扣减结果按订单写入 StockReservation，带过期时间。取消、退款或过期时按记录回补，
+  记录状态的条件更新保证同一笔预占只回补一次；
+- 分桶库存：秒杀热点商品/SKU 可以把库存拆到 StockBucket 多行，扣减时随机选桶，
+  把同一行上的排队分散到 N 行；
+- 店铺内容版本只在库存跨过零（售罄或恢复有货）时递增，普通预占与回补不写店铺行。
+"""
+
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from catalog.models import InventoryLog, Product, ProductSKU, StockBucket
+from stores.content_cache import bump_content_version, bump_product_content_version
+
+from .models import Order, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+def _stock_target(product_id, sku_id=None):
+    if sku_id:
+        return ProductSKU.objects.filter(pk=sku_id, product_id=product_id)
+    return Product.objects.filter(pk=product_id)
+
+
+def _missing_target(sku_id=None):
+    if sku_id:
+        return ProductSKU.DoesNotExist('ProductSKU matching query does not exist.')
+    return Product.DoesNotExist('Product matching query does not exist.')
+
+
+def _bucket_rows(product_id, sku_id=None):
+    if sku_id:
+        return StockBucket.objects.filter(sku_id=sku_id)
+    return StockBucket.objects.filter(product_id=product_id, sku__isnull=True)
+
+
+def _decrement_buckets(product_id, sku_id, quantity, bucket_count):
+    rows = _bucket_rows(product_id, sku_id)
+    start = random.randrange(bucket_count)
+    for offset in range(bucket_count):
+        bucket = (start + offset) % bucket_count
+        if rows.filter(bucket=bucket, stock__gte=quantity).update(stock=F('stock') - quantity):
+            return [(bucket, quantity)]
+
+    # 没有单个分桶够扣：锁住全部分桶后跨桶扣减（只在库存见底时出现）
+    locked = list(rows.select_for_update().order_by('bucket'))
+    available = sum(row.stock for row in locked)
+    if available < quantity:
+        raise ValueError(f'库存不足，当前库存: {available}，需要: {quantity}')
+    allocations = []
+    remaining = quantity
+    for row in locked:
+        take = min(row.stock, remaining)
+        if take:
+            StockBucket.objects.filter(pk=row.pk).update(stock=F('stock') - take)
+            allocations.append((row.bucket, take))
+            remaining -= take
+        if not remaining:
+            break
+    return allocations
+
+
+def stock_on_hand(product_id: int, sku_id: int = None) -> int:
+    """当前可售库存：已分桶时为分桶合计，否则为主表库存。"""
+    row = _stock_target(product_id, sku_id).values('stock', 'stock_buckets').first()
+    if row is None:
+        raise _missing_target(sku_id)
+    if not row['stock_buckets']:
+        return row['stock']
+    return _bucket_rows(product_id, sku_id).aggregate(total=Coalesce(Sum('stock'), 0))['total']
+
+
+@transaction.atomic
+def decrement_stock(product_id: int, quantity: int, sku_id: int = None):
+    """条件扣减库存，返回 [(分桶序号或 None, 数量), ...]。
+
+    Raises:
+        ValueError: 库存不足
+        Product.DoesNotExist / ProductSKU.DoesNotExist: 商品或 SKU 不存在
+    """
+    target = _stock_target(product_id, sku_id)
+    if target.filter(stock_buckets=0, stock__gte=quantity).update(stock=F('stock') - quantity):
+        # 店铺页缓存展示具体库存数，主表库存每次变化都递增店铺内容版本
+        bump_product_content_version(product_id)
+        return [(None, quantity)]
+    row = target.values('stock', 'stock_buckets').first()
+    if row is None:
+        raise _missing_target(sku_id)
+    if not row['stock_buckets']:
+        raise ValueError(f'库存不足，当前库存: {row["stock"]}，需要: {quantity}')
+    # 分桶商品的展示库存由 refresh_bucketed_stock 回写主表并递增版本
+    return _decrement_buckets(product_id, sku_id, quantity, row['stock_buckets'])
+
+
+@transaction.atomic
+def increment_stock(product_id: int, quantity: int, sku_id: int = None, bucket: int = None):
+    """回补库存；分桶已合并或目标未分桶时回补到主表，已分桶时回补到分桶。"""
+    if bucket is not None and _bucket_rows(product_id, sku_id).filter(bucket=bucket).update(stock=F('stock') + quantity):
+        return
+    target = _stock_target(product_id, sku_id)
+    if target.filter(stock_buckets=0).update(stock=F('stock') + quantity):
+        bump_product_content_version(product_id)
+        return
+    row = target.values('stock_buckets').first()
+    if row is None:
+        raise _missing_target(sku_id)
+    bucket = random.randrange(row['stock_buckets'])
+    _bucket_rows(product_id, sku_id).filter(bucket=bucket).update(stock=F('stock') + quantity)
+
+
+def reserve_stock(product_id: int, quantity: int, sku_id: int = None, reason: str = 'order_created', operator=None):
+    """扣减库存并写库存日志，返回分桶分配结果，用于随后生成预占记录。"""
+    allocations = decrement_stock(product_id, quantity, sku_id=sku_id)
+    InventoryLog.objects.create(
+        product_id=product_id,
+        sku_id=sku_id,
+        change_type='lock',
+        quantity=-quantity,
+        reason=reason,
+        created_by=operator,
+    )
+    return allocations
+
+
+def reservation_expires_at(now=None):
+    now = now or timezone.now()
+    return now + timedelta(minutes=getattr(settings, 'ORDER_PAYMENT_TIMEOUT_MINUTES', 1440))
+
+
+def build_reservations(order, product_id, allocations, sku_id=None, checkout_order=None, status=None, expires_at=None):
+    """按分桶分配结果生成（未保存的）预占记录。"""
+    expires_at = expires_at or reservation_expires_at()
+    return [
+        StockReservation(
+            order=order,
+            checkout_order=checkout_order,
+            product_id=product_id,
+            sku_id=sku_id,
+            bucket=bucket,
+            quantity=quantity,
+            status=status or StockReservation.STATUS_HELD,
+            expires_at=expires_at,
+        )
+        for bucket, quantity in allocations
+    ]
+
+
+def reservations_for_order(order):
+    """主订单覆盖整个结算单的预占；子订单/旧版单订单只覆盖自身。"""
+    if order.checkout_order_id and not order.parent_order_id:
+        return StockReservation.objects.filter(checkout_order_id=order.checkout_order_id)
+    return StockReservation.objects.filter(order=order)
+
+
+def consume_order_reservations(order) -> int:
+    return reservations_for_order(order).filter(status=StockReservation.STATUS_HELD).update(
+        status=StockReservation.STATUS_CONSUMED,
+        updated_at=timezone.now(),
+    )
+
+
+def release_order_reservations(order, reason: str = 'order_cancelled', operator=None) -> bool:
+    """按预占记录回补订单库存。
+
+    Returns:
+        bool: 订单存在预占记录时返回 True（无论本次是否实际回补）；历史订单没有预占记录时
+        返回 False，由调用方按订单行回补。
+    """
+    reservations = list(reservations_for_order(order))
+    if not reservations:
+        return False
+    now = timezone.now()
+    for reservation in reservations:
+        if reservation.status == StockReservation.STATUS_RELEASED:
+            continue
+        claimed = StockReservation.objects.filter(
+            pk=reservation.pk,
+            status__in=[StockReservation.STATUS_HELD, StockReservation.STATUS_CONSUMED],
+        ).update(status=StockReservation.STATUS_RELEASED, updated_at=now)
+        if not claimed:
+            continue
+        increment_stock(
+            reservation.product_id,
+            reservation.quantity,
+            sku_id=reservation.sku_id,
+            bucket=reservation.bucket,
+        )
+        InventoryLog.objects.create(
+            product_id=reservation.product_id,
+            sku_id=reservation.sku_id,
+            change_type='release',
+            quantity=reservation.quantity,
+            reason=reason,
+            created_by=operator,
+        )
+    return True
+
+
+def expire_reservations(now=None, limit: int = 200) -> dict:
+    """处理已过期的预占：待支付订单自动取消，其余按订单当前状态消耗或释放。"""
+    from .state_machine import OrderStateMachine
+
+    now = now or timezone.now()
+    order_ids = list(
+        StockReservation.objects.filter(status=StockReservation.STATUS_HELD, expires_at__lte=now)
+        .order_by()
+        .values_list('order_id', flat=True)
+        .distinct()[:limit]
+    )
+    stats = {'orders': len(order_ids), 'cancelled': 0, 'consumed': 0, 'released': 0, 'errors': 0}
+    for order in Order.objects.filter(id__in=order_ids).select_related('parent_order'):
+        root = order.parent_order or order
+        try:
+            with transaction.atomic():
+                if root.status == 'pending':
+                    for pending in [root, *root.child_orders.filter(status='pending')]:
+                        OrderStateMachine.transition(
+                            pending,
+                            'cancelled',
+                            operator=None,
+                            note='库存预占过期，自动取消',
+                        )
+                    stats['cancelled'] += 1
+                elif order.status in {'paid', 'shipped', 'completed'}:
+                    consume_order_reservations(order)
+                    stats['consumed'] += 1
+                else:
+                    release_order_reservations(order, reason='reservation_expired')
+                    stats['released'] += 1
+        except Exception:
+            stats['errors'] += 1
+            logger.exception('处理过期库存预占失败', extra={'order_id': order.id})
+    return stats
+
+
+@transaction.atomic
+def split_into_buckets(product_id: int, bucket_count: int, sku_id: int = None):
+    """把商品/SKU 当前库存平均拆到 bucket_count 个分桶；主表库存保留为展示值。"""
+    if bucket_count < 1:
+        raise ValueError('分桶数必须大于0')
+    target = _stock_target(product_id, sku_id).select_for_update().first()
+    if target is None:
+        raise _missing_target(sku_id)
+    if target.stock_buckets:
+        raise ValueError('库存已分桶，请先合并')
+    base, extra = divmod(target.stock, bucket_count)
+    StockBucket.objects.bulk_create([
+        StockBucket(
+            product_id=product_id,
+            sku_id=sku_id,
+            bucket=index,
+            stock=base + (1 if index < extra else 0),
+        )
+        for index in range(bucket_count)
+    ])
+    _stock_target(product_id, sku_id).update(stock_buckets=bucket_count)
+
+
+@transaction.atomic
+def collapse_buckets(product_id: int, sku_id: int = None) -> int:
+    """合并分桶：分桶库存回写主表并删除分桶行，返回合并后的库存。"""
+    target = _stock_target(product_id, sku_id).select_for_update().first()
+    if target is None:
+        raise _missing_target(sku_id)
+    rows = _bucket_rows(product_id, sku_id)
+    total = sum(row.stock for row in rows.select_for_update())
+    rows.delete()
+    _stock_target(product_id, sku_id).update(stock=total, stock_buckets=0)
+    bump_product_content_version(product_id)
+    return total
+
+
+def refresh_bucketed_stock() -> int:
+    """把分桶合计回写到主表展示库存，供定时任务调用。"""
+    product_total = (
+        StockBucket.objects.filter(product=OuterRef('pk'), sku__isnull=True)
+        .values('product')
+        .annotate(total=Sum('stock'))
+        .values('total')
+    )
+    sku_total = (
+        StockBucket.objects.filter(sku=OuterRef('pk'))
+        .values('sku')
+        .annotate(total=Sum('stock'))
+        .values('total')
+    )
+    updated = Product.objects.filter(stock_buckets__gt=0).update(stock=Coalesce(Subquery(product_total), 0))
+    updated += ProductSKU.objects.filter(stock_buckets__gt=0).update(stock=Coalesce(Subquery(sku_total), 0))
+    store_ids = set(Product.objects.filter(stock_buckets__gt=0).values_list('store_id', flat=True))
+    store_ids |= set(ProductSKU.objects.filter(stock_buckets__gt=0).values_list('product__store_id', flat=True))
+    for store_id in store_ids:
+        bump_content_version(store_id)
+    return updated
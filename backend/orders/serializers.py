@@ -11,6 +11,7 @@ from .models import (
     Payment,
     Refund,
     Discount,
+    DiscountScope,
     DiscountTarget,
     Invoice,
     ReturnRequest,
@@ -20,8 +21,11 @@ from .models import (
     WechatProfitSharingOrder,
 )
 from .shipping_action_service import get_shipping_capabilities, is_haier_order
+from .discounts import invalidate_discount, replace_discount_scopes, replace_discount_targets, upsert_discount_targets
+from .services import PriceResolver, load_cart_items
 from catalog.models import Product
 from users.models import Address
+from catalog.image_variants import load_variant_index
 from catalog.serializers import ProductSerializer, ProductSKUSerializer
 from stores.models import Store
 from stores.permissions import is_platform_admin, is_support_user
@@ -586,23 +590,38 @@ class CartSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(CartItemSerializer(many=True))
     def get_items(self, obj: Cart):
-        items = sorted(obj.items.all(), key=lambda cart_item: cart_item.id)
-        return CartItemSerializer(items, many=True, context=self.context).data
+        return self._snapshot(obj)["items"]
 
     @extend_schema_field(serializers.ListField(child=serializers.DictField()))
     def get_store_groups(self, obj: Cart):
-        item_serializer = CartItemSerializer(context=self.context)
-        groups = OrderedDict()
+        return self._snapshot(obj)["store_groups"]
+
+    def _snapshot(self, obj: Cart):
+        """购物车快照：条目只加载、定价、序列化一次，平铺列表与店铺分组都由它派生"""
+        snapshot = getattr(obj, "_render_snapshot", None)
+        if snapshot is not None:
+            return snapshot
 
-        for item in sorted(obj.items.all(), key=lambda cart_item: cart_item.id):
-            product = item.product
-            store = product.store
+        items = load_cart_items(obj)
+        products = [item.product for item in items]
+        request = self.context.get("request")
+        context = dict(self.context)
+        context["_price_resolver"] = PriceResolver(getattr(request, "user", None), products)
+        # 整车主图衍生图一次查询
+        images = list(dict.fromkeys(image for product in products for image in (product.main_images or []) if image))
+        found = load_variant_index(images)
+        context["_image_variant_index"] = {image: found.get(image) for image in images}
+
+        rendered = CartItemSerializer(items, many=True, context=context).data
+        groups = OrderedDict()
+        for item, rep in zip(items, rendered):
+            store = item.product.store
             group = groups.setdefault(
                 store.id,
                 {
                     "store_id": store.id,
                     "store_name": store.name,
-                    "store_logo": _build_media_url(store.logo, self.context.get("request")),
+                    "store_logo": rep["store_logo"],
                     "store_type": store.store_type,
                     "store_is_main": store.is_main,
                     "item_count": 0,
@@ -612,9 +631,11 @@ class CartSerializer(serializers.ModelSerializer):
             )
             group["item_count"] += 1
             group["total_quantity"] += item.quantity
-            group["items"].append(item_serializer.to_representation(item))
+            group["items"].append(rep)
 
-        return list(groups.values())
+        snapshot = {"items": rendered, "store_groups": list(groups.values())}
+        obj._render_snapshot = snapshot
+        return snapshot
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -875,8 +896,16 @@ class DiscountTargetSerializer(serializers.ModelSerializer):
         return obj.product.dealer_price - discount_amount
 
 
+class DiscountScopeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DiscountScope
+        fields = ['id', 'user_role', 'customer_group', 'store', 'category', 'brand']
+
+
 class DiscountSerializer(serializers.ModelSerializer):
     targets = DiscountTargetSerializer(many=True, read_only=True)
+    # 定向规则（用户维度 × 商品维度），计价时实时匹配；写入时整体覆盖
+    scopes = DiscountScopeSerializer(many=True, required=False)
     # 批量设置适用范围（写入时使用）：用户与商品ID列表
     user_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True, required=False)
     product_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True, required=False)
@@ -885,7 +914,7 @@ class DiscountSerializer(serializers.ModelSerializer):
         model = Discount
         fields = [
             'id', 'name', 'discount_type', 'amount', 'effective_time', 'expiration_time', 'priority', 'created_at', 'updated_at', 'targets',
-            'user_ids', 'product_ids'
+            'scopes', 'user_ids', 'product_ids'
         ]
 
     def validate(self, attrs):
@@ -899,17 +928,14 @@ class DiscountSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        user_ids = list(set(validated_data.pop('user_ids', []) or []))
-        product_ids = list(set(validated_data.pop('product_ids', []) or []))
+        user_ids = validated_data.pop('user_ids', []) or []
+        product_ids = validated_data.pop('product_ids', []) or []
+        scopes = validated_data.pop('scopes', None)
         discount = super().create(validated_data)
         # 若同时提供用户与商品，则批量建立适用范围
-        if user_ids and product_ids:
-            targets = [
-                DiscountTarget(discount=discount, user_id=uid, product_id=pid)
-                for uid in user_ids for pid in product_ids
-            ]
-            # 忽略唯一约束冲突（理论上不会因新建而冲突）
-            DiscountTarget.objects.bulk_create(targets, ignore_conflicts=True)
+        upsert_discount_targets(discount, user_ids, product_ids)
+        if scopes:
+            replace_discount_scopes(discount, scopes)
         return discount
 
     def update(self, instance, validated_data):
@@ -918,26 +944,16 @@ class DiscountSerializer(serializers.ModelSerializer):
         # - 若只提供其一：与当前另一维的集合做笛卡尔积覆盖
         user_ids_raw = validated_data.pop('user_ids', None)
         product_ids_raw = validated_data.pop('product_ids', None)
+        scopes = validated_data.pop('scopes', None)
         discount = super().update(instance, validated_data)
+        invalidate_discount(discount)
 
         if user_ids_raw is not None or product_ids_raw is not None:
-            # 当前已有的集合
-            current_users = list(
-                DiscountTarget.objects.filter(discount=discount).values_list('user_id', flat=True).distinct()
-            )
-            current_products = list(
-                DiscountTarget.objects.filter(discount=discount).values_list('product_id', flat=True).distinct()
-            )
-
-            user_ids = list(set((user_ids_raw or current_users) or []))
-            product_ids = list(set((product_ids_raw or current_products) or []))
-
-            # 覆盖原有范围
-            DiscountTarget.objects.filter(discount=discount).delete()
-            if user_ids and product_ids:
-                targets = [
-                    DiscountTarget(discount=discount, user_id=uid, product_id=pid)
-                    for uid in user_ids for pid in product_ids
-                ]
-                DiscountTarget.objects.bulk_create(targets, ignore_conflicts=True)
+            targets = DiscountTarget.objects.filter(discount=discount)
+            user_ids = user_ids_raw or targets.values_list('user_id', flat=True).distinct()
+            product_ids = product_ids_raw or targets.values_list('product_id', flat=True).distinct()
+            # 覆盖原有范围：只删除多余组合、只补写缺少组合
+            replace_discount_targets(discount, list(user_ids), list(product_ids))
+        if scopes is not None:
+            replace_discount_scopes(discount, scopes)
         return discount
@@ -1,45 +1,23 @@
-from .models import CheckoutOrder, Order, Cart, CartItem, OrderItem, Discount, SubOrder, SubOrderItem
+from .models import CheckoutOrder, Order, Cart, CartItem, OrderItem, SubOrder, SubOrderItem
 from catalog.models import Product, InventoryLog
 from stores.models import Store
-from django.utils import timezone
-from .models import DiscountTarget
 from users.models import Address
-from django.core.cache import cache
 from django.db import transaction
-from django.db.models import F
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
+from .models import StockReservation
+from .discounts import get_best_discount_rules, resolve_rule_amount
+from .reservations import (
+    build_reservations,
+    decrement_stock,
+    increment_stock,
+    release_order_reservations,
+    reserve_stock,
+    stock_on_hand,
+)
 
 
 def _get_best_discount_rule(user, product):
-    if not user or not getattr(user, 'is_authenticated', False):
-        return None
-    cache_key = f"discount_rule:{user.id}:{product.id}"
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return cached or None
-
-    now = timezone.now()
-    dt = (
-        DiscountTarget.objects.select_related('discount')
-        .filter(
-            user=user,
-            product=product,
-            discount__effective_time__lte=now,
-            discount__expiration_time__gt=now,
-        )
-        .order_by('-discount__priority', '-discount__updated_at')
-        .first()
-    )
-    if not dt:
-        cache.set(cache_key, False, 60)
-        return None
-    rule = {
-        'type': dt.discount.discount_type,
-        'value': str(dt.discount.amount),
-        'discount_id': dt.discount_id,
-    }
-    cache.set(cache_key, rule, 60)
-    return rule
+    return get_best_discount_rules(user, [product]).get(product.id)
 
 
 def resolve_base_price(user, product, sku=None):
@@ -55,7 +33,11 @@ def resolve_base_price(user, product, sku=None):
         group_price = None
     if group_price is not None:
         return Decimal(group_price)
+    return _list_price(user, product, sku)
 
+
+def _list_price(user, product, sku=None):
+    """不考虑客户组价时的基础价"""
     is_dealer = bool(user and getattr(user, 'is_authenticated', False) and getattr(user, 'role', '') == 'dealer')
     if is_dealer:
         dealer_price = getattr(product, 'dealer_price', None)
@@ -67,6 +49,58 @@ def resolve_base_price(user, product, sku=None):
     return Decimal(product.price)
 
 
+class PriceResolver:
+    """批量解析一组商品（及其 SKU）对某用户的价格。
+
+    结果与 resolve_base_price / get_best_active_discount / get_customer_group_price_context
+    逐个调用一致，但客户归组、客户组价与折扣规则各只查询一次。
+    """
+
+    def __init__(self, user, products):
+        from stores.pricing import get_customer_group_memberships, get_customer_group_prices
+
+        products = {product.id: product for product in products if product is not None}
+        self.user = user
+        self.product_ids = frozenset(products)
+        self._memberships = get_customer_group_memberships(user, {product.store for product in products.values()})
+        self._group_prices = get_customer_group_prices(self._memberships.values(), self.product_ids)
+        self._rules = get_best_discount_rules(user, products.values())
+
+    def covers(self, product):
+        return product is not None and product.id in self.product_ids
+
+    def customer_group_price(self, product, sku=None):
+        membership = self._memberships.get(product.store_id)
+        if not membership:
+            return None
+        price = None
+        if sku is not None:
+            price = self._group_prices.get((membership.group_id, product.id, sku.id))
+        if price is None:
+            price = self._group_prices.get((membership.group_id, product.id, None))
+        return price
+
+    def base_price(self, product, sku=None):
+        group_price = self.customer_group_price(product, sku)
+        if group_price is not None:
+            return group_price
+        return _list_price(self.user, product, sku)
+
+    def discount_amount(self, product, base_price):
+        return resolve_rule_amount(self._rules.get(product.id), base_price)
+
+    def discounted_price(self, product, sku=None):
+        base_price = self.base_price(product, sku)
+        if not self.user or not self.user.is_authenticated:
+            return base_price
+        return base_price - self.discount_amount(product, base_price)
+
+    def customer_group_context(self, product):
+        from stores.pricing import customer_group_context
+
+        return customer_group_context(self._memberships.get(product.store_id))
+
+
 def get_best_active_discount(user, product, base_price=None):
     """Select the best active discount amount for a given user and product.
     Result is cached briefly to reduce DB hits during browsing.
@@ -74,24 +108,7 @@ def get_best_active_discount(user, product, base_price=None):
     rule = _get_best_discount_rule(user, product)
     if not rule:
         return Decimal('0')
-
-    base = Decimal(base_price if base_price is not None else product.price)
-    if rule['type'] == Discount.TYPE_PERCENT:
-        rate = Decimal(rule['value'])
-        if rate < 0:
-            rate = Decimal('0')
-        if rate > 10:
-            rate = Decimal('10')
-        discounted_price = (base * rate) / Decimal('10')
-        amount = base - discounted_price
-    else:
-        amount = Decimal(rule['value'])
-    if amount < 0:
-        amount = Decimal('0')
-    if amount > base:
-        amount = base
-    amount = amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    return amount
+    return resolve_rule_amount(rule, base_price if base_price is not None else product.price)
 
 
 def validate_orderable_product(product, sku=None):
@@ -182,13 +199,15 @@ def get_county_code(province, city, district):
         return '110101'
 
 
-def check_haier_stock(product, address, quantity):
+def check_haier_stock(product, address, quantity, county_code=None, use_cache=True):
     """检查海尔产品库存
     
     Args:
         product: 商品对象
         address: 地址对象
         quantity: 订单数量
+        county_code: 区域编码，未传时按地址解析
+        use_cache: 是否允许使用短时缓存的库存结果
         
     Returns:
         dict: 库存信息，包含 available（是否有货）和 stock（库存数量）
@@ -196,40 +215,27 @@ def check_haier_stock(product, address, quantity):
     Raises:
         ValueError: API调用失败或库存不足时抛出异常
     """
-    from django.conf import settings
     import logging
+    from integrations.haier_stock import fetch_haier_stock, summarize_haier_stock
     
     logger = logging.getLogger(__name__)
     
     # 获取区域编码
-    county_code = get_county_code(address.province, address.city, address.district)
-    logger.info(f'使用区域编码: {county_code} ({address.province} {address.city} {address.district})')
-    
-    # 使用真实海尔API
-    from integrations.haierapi import HaierAPI
+    if not county_code:
+        county_code = get_county_code(address.province, address.city, address.district)
+        logger.info(f'使用区域编码: {county_code} ({address.province} {address.city} {address.district})')
     
     logger.info(f'查询海尔库存: product_code={product.product_code}')
     
-    haier_api = HaierAPI.from_settings()
-    
-    # 认证
-    if not haier_api.authenticate():
-        logger.error('海尔API认证失败')
-        raise ValueError('海尔库存查询失败：认证失败')
-    
-    # 查询库存
-    stock_info = haier_api.check_stock(product.product_code, county_code)
+    stock_info = fetch_haier_stock(product.product_code, county_code, use_cache=use_cache)
     
     if not stock_info:
         logger.error(f'海尔库存查询失败: product_code={product.product_code}')
         raise ValueError('海尔库存查询失败：无法获取库存信息')
     
     # 检查库存是否充足 - data 是仓库列表，需汇总各仓库库存
-    warehouses = stock_info.get('data') or []
-    available_stock = sum(int(wh.get('stock', 0)) for wh in warehouses)
-
-    # 选择库存最多的仓库
-    best_warehouse = max(warehouses, key=lambda wh: int(wh.get('stock', 0))) if warehouses else {}
+    summary = summarize_haier_stock(stock_info)
+    available_stock = summary['stock']
 
     logger.info(f'海尔库存查询成功: product_code={product.product_code}, stock={available_stock}, required={quantity}')
 
@@ -238,13 +244,34 @@ def check_haier_stock(product, address, quantity):
 
     return {
         'available': True,
-        'stock': available_stock,
-        'warehouse_code': best_warehouse.get('secCode', ''),
-        'warehouse_grade': best_warehouse.get('warehouseGrade', ''),
-        'timeliness_data': best_warehouse.get('timelinessData', {})
+        **summary,
     }
 
 
+def check_haier_items(normalized_items, address):
+    """在开启数据库事务前校验结算单内全部海尔商品库存。
+
+    同一结算单的海尔商品先并发预取库存（同一商品合并为一次查询，数量累加校验），
+    再逐项校验，事务内不再发起第三方请求。
+    """
+    from integrations.haier_stock import prefetch_haier_stock
+
+    required = {}
+    for item in normalized_items:
+        if item['is_haier']:
+            product = item['product']
+            entry = required.setdefault(product.product_code, [product, 0])
+            entry[1] += item['quantity']
+    if not required:
+        return
+
+    county_code = get_county_code(address.province, address.city, address.district)
+    if len(required) > 1:
+        prefetch_haier_stock((product_code, county_code) for product_code in required)
+    for product, quantity in required.values():
+        check_haier_stock(product, address, quantity, county_code=county_code)
+
+
 def create_order(
     user,
     product_id=None,
@@ -349,14 +376,15 @@ def create_order(
         if not credit_account.can_place_order(actual_amount):
             raise ValueError(f'信用额度不足，可用额度: ¥{credit_account.available_credit}')
 
+    # 海尔库存在事务外预取校验，避免持锁等待第三方接口
+    check_haier_items(normalized_items, address)
+
     # 在事务中创建订单并锁定库存
     with transaction.atomic():
-        # 逐项锁定库存/校验海尔库存
+        # 逐项锁定库存
         for item in normalized_items:
-            if item['is_haier']:
-                check_haier_stock(item['product'], address, item['quantity'])
-            else:
-                InventoryService.lock_stock(
+            if not item['is_haier']:
+                item['allocations'] = reserve_stock(
                     product_id=item['product'].id,
                     sku_id=item['sku'].id if item['sku'] else None,
                     quantity=item['quantity'],
@@ -400,6 +428,7 @@ def create_order(
                 )
             )
         OrderItem.objects.bulk_create(order_items)
+        StockReservation.objects.bulk_create(_order_reservations(order, normalized_items, is_credit=is_credit))
 
         # 信用支付直接记账并标记为已支付
         if is_credit:
@@ -427,6 +456,19 @@ def get_or_create_cart(user):
     return cart
 
 
+def load_cart_items(cart):
+    """按加入顺序读出购物车条目，连同渲染所需的商品、店铺、SKU 关联一次性加载"""
+    from django.db.models import Prefetch
+    from catalog.models import ProductSKU
+
+    return list(
+        CartItem.objects.filter(cart=cart)
+        .select_related('product', 'product__store', 'product__category', 'product__brand', 'sku', 'sku__product')
+        .prefetch_related(Prefetch('product__skus', queryset=ProductSKU.objects.order_by('id')))
+        .order_by('id')
+    )
+
+
 def add_to_cart(user, product_id, quantity=1, sku_id=None):
     cart = get_or_create_cart(user)
     product = Product.objects.get(id=product_id)
@@ -459,13 +501,13 @@ class InventoryService:
     """库存管理服务
     
     负责处理库存的锁定、释放和变更记录。
-    使用数据库行锁确保并发安全。
+    扣减使用条件更新（stock >= n）保证并发安全，不持有读锁，具体实现见 orders.reservations。
     """
 
     @staticmethod
     @transaction.atomic
     def lock_stock(product_id: int, quantity: int, reason: str = 'order_created', operator=None, sku_id: int = None) -> bool:
-        """锁定库存（使用数据库行锁）
+        """锁定库存（条件扣减）
         
         Args:
             product_id: 商品ID
@@ -481,34 +523,7 @@ class InventoryService:
             ValueError: 库存不足时抛出异常
             Product.DoesNotExist: 商品不存在时抛出异常
         """
-        # 使用select_for_update锁定行，防止并发问题
-        if sku_id:
-            from catalog.models import ProductSKU
-            sku = ProductSKU.objects.select_for_update().get(id=sku_id, product_id=product_id)
-            if sku.stock < quantity:
-                raise ValueError(f'库存不足，当前库存: {sku.stock}，需要: {quantity}')
-            sku.stock = F('stock') - quantity
-            sku.save(update_fields=['stock'])
-            sku.refresh_from_db()
-            product = sku.product
-        else:
-            product = Product.objects.select_for_update().get(id=product_id)
-            if product.stock < quantity:
-                raise ValueError(f'库存不足，当前库存: {product.stock}，需要: {quantity}')
-            product.stock = F('stock') - quantity
-            product.save(update_fields=['stock'])
-            product.refresh_from_db()
-        
-        # 记录库存变更
-        InventoryLog.objects.create(
-            product=product,
-            sku_id=sku_id,
-            change_type='lock',
-            quantity=-quantity,
-            reason=reason,
-            created_by=operator
-        )
-        
+        reserve_stock(product_id, quantity, sku_id=sku_id, reason=reason, operator=operator)
         return True
 
     @staticmethod
@@ -529,22 +544,11 @@ class InventoryService:
         Raises:
             Product.DoesNotExist: 商品不存在时抛出异常
         """
-        if sku_id:
-            from catalog.models import ProductSKU
-            sku = ProductSKU.objects.select_for_update().get(id=sku_id, product_id=product_id)
-            sku.stock = F('stock') + quantity
-            sku.save(update_fields=['stock'])
-            sku.refresh_from_db()
-            product = sku.product
-        else:
-            product = Product.objects.select_for_update().get(id=product_id)
-            product.stock = F('stock') + quantity
-            product.save(update_fields=['stock'])
-            product.refresh_from_db()
+        increment_stock(product_id, quantity, sku_id=sku_id)
         
         # 记录库存变更
         InventoryLog.objects.create(
-            product=product,
+            product_id=product_id,
             sku_id=sku_id,
             change_type='release',
             quantity=quantity,
@@ -573,28 +577,18 @@ class InventoryService:
             ValueError: 调整后库存为负数时抛出异常
             Product.DoesNotExist: 商品不存在时抛出异常
         """
-        if sku_id:
-            from catalog.models import ProductSKU
-            sku = ProductSKU.objects.select_for_update().get(id=sku_id, product_id=product_id)
-            new_stock = sku.stock + quantity
-            if new_stock < 0:
-                raise ValueError(f'调整后库存不能为负数，当前库存: {sku.stock}，调整: {quantity}')
-            sku.stock = F('stock') + quantity
-            sku.save(update_fields=['stock'])
-            sku.refresh_from_db()
-            product = sku.product
+        if quantity < 0:
+            try:
+                decrement_stock(product_id, -quantity, sku_id=sku_id)
+            except ValueError:
+                current = stock_on_hand(product_id, sku_id=sku_id)
+                raise ValueError(f'调整后库存不能为负数，当前库存: {current}，调整: {quantity}')
         else:
-            product = Product.objects.select_for_update().get(id=product_id)
-            new_stock = product.stock + quantity
-            if new_stock < 0:
-                raise ValueError(f'调整后库存不能为负数，当前库存: {product.stock}，调整: {quantity}')
-            product.stock = F('stock') + quantity
-            product.save(update_fields=['stock'])
-            product.refresh_from_db()
+            increment_stock(product_id, quantity, sku_id=sku_id)
         
         # 记录库存变更
         InventoryLog.objects.create(
-            product=product,
+            product_id=product_id,
             sku_id=sku_id,
             change_type='adjust',
             quantity=quantity,
@@ -621,6 +615,24 @@ class InventoryService:
 
 
 
+def _order_reservations(order, items, checkout_order=None, is_credit=False):
+    """为已扣减库存的订单行生成预占记录；信用支付订单下单即已支付，直接记为已消耗。"""
+    status = StockReservation.STATUS_CONSUMED if is_credit else StockReservation.STATUS_HELD
+    reservations = []
+    for item in items:
+        if not item.get('allocations'):
+            continue
+        reservations.extend(build_reservations(
+            order,
+            item['product'].id,
+            item['allocations'],
+            sku_id=item['sku'].id if item['sku'] else None,
+            checkout_order=checkout_order,
+            status=status,
+        ))
+    return reservations
+
+
 def cancel_order(order):
     """取消订单并释放库存
     
@@ -638,20 +650,21 @@ def cancel_order(order):
         raise ValueError(f'订单状态为 {order.status}，不允许取消')
     
     with transaction.atomic():
-        # 释放库存
-        released = False
-        for item in order.items.select_related('product', 'sku').all():
-            released = True
-            if getattr(item.product, 'source', None) == getattr(Product, 'SOURCE_HAIER', 'haier'):
-                # 海尔库存不需要释放
-                continue
-            InventoryService.release_stock(
-                product_id=item.product_id,
-                sku_id=item.sku_id,
-                quantity=item.quantity,
-                reason='order_cancelled',
-                operator=order.user
-            )
+        # 释放库存：优先按预占记录回补，历史订单按订单行回补
+        released = release_order_reservations(order, reason='order_cancelled', operator=order.user)
+        if not released:
+            for item in order.items.select_related('product', 'sku').all():
+                released = True
+                if getattr(item.product, 'source', None) == getattr(Product, 'SOURCE_HAIER', 'haier'):
+                    # 海尔库存不需要释放
+                    continue
+                InventoryService.release_stock(
+                    product_id=item.product_id,
+                    sku_id=item.sku_id,
+                    quantity=item.quantity,
+                    reason='order_cancelled',
+                    operator=order.user
+                )
         if not released and order.product_id:
             InventoryService.release_stock(
                 product_id=order.product_id,
@@ -732,12 +745,12 @@ def create_order_with_split(user, items, address_id, note='', payment_method='on
         if not user.credit_account.can_place_order(actual_amount):
             raise ValueError(f'信用额度不足，可用额度: ¥{user.credit_account.available_credit}')
 
+    check_haier_items(normalized_items, address)
+
     with transaction.atomic():
         for item in normalized_items:
-            if item['is_haier']:
-                check_haier_stock(item['product'], address, item['quantity'])
-            else:
-                InventoryService.lock_stock(
+            if not item['is_haier']:
+                item['allocations'] = reserve_stock(
                     product_id=item['product'].id,
                     sku_id=item['sku'].id if item['sku'] else None,
                     quantity=item['quantity'],
@@ -855,6 +868,9 @@ def create_order_with_split(user, items, address_id, note='', payment_method='on
                 discount_amount=child_order.discount_amount,
                 actual_amount=child_order.actual_amount,
             )
+            StockReservation.objects.bulk_create(
+                _order_reservations(child_order, group, checkout_order=checkout, is_credit=payment_method == 'credit')
+            )
             SubOrderItem.objects.bulk_create([
                 SubOrderItem(
                     suborder=suborder,
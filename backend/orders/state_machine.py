@@ -267,22 +267,25 @@ class OrderStateMachine:
             order: Order对象
             operator: 操作人
         """
+        from .reservations import release_order_reservations
         from .services import InventoryService
         from users.credit_services import CreditAccountService
         
         try:
-            released = False
-            for item in order.items.select_related('product', 'sku').all():
-                released = True
-                if getattr(item.product, 'source', None) == getattr(item.product, 'SOURCE_HAIER', 'haier'):
-                    continue
-                InventoryService.release_stock(
-                    product_id=item.product_id,
-                    sku_id=item.sku_id,
-                    quantity=item.quantity,
-                    reason='order_cancelled',
-                    operator=operator
-                )
+            # 优先按预占记录回补（同一笔预占只回补一次），历史订单按订单行回补
+            released = release_order_reservations(order, reason='order_cancelled', operator=operator)
+            if not released:
+                for item in order.items.select_related('product', 'sku').all():
+                    released = True
+                    if getattr(item.product, 'source', None) == getattr(item.product, 'SOURCE_HAIER', 'haier'):
+                        continue
+                    InventoryService.release_stock(
+                        product_id=item.product_id,
+                        sku_id=item.sku_id,
+                        quantity=item.quantity,
+                        reason='order_cancelled',
+                        operator=operator
+                    )
             if not released and order.product_id:
                 InventoryService.release_stock(
                     product_id=order.product_id,
@@ -327,6 +330,7 @@ class OrderStateMachine:
         """
         from catalog.models import Product
         from django.db.models import F
+        from stores.content_cache import bump_content_version
 
         was_counted = old_status in cls.SALES_COUNT_STATUSES
         now_counted = new_status in cls.SALES_COUNT_STATUSES
@@ -344,6 +348,8 @@ class OrderStateMachine:
                 Product.objects.filter(id=order.product_id).update(
                     sales_count=F('sales_count') + (delta * order.quantity)
                 )
+            # 批量 update 不触发信号，手动递增店铺内容版本
+            bump_content_version(order.store_id)
         except Exception as e:
             # 记录错误但不中断流程
             print(f'更新销量失败: {str(e)}')
@@ -358,21 +364,24 @@ class OrderStateMachine:
             order: Order对象
             operator: 操作人
         """
+        from .reservations import release_order_reservations
         from .services import InventoryService
         
         try:
-            released = False
-            for item in order.items.select_related('product', 'sku').all():
-                released = True
-                if getattr(item.product, 'source', None) == getattr(item.product, 'SOURCE_HAIER', 'haier'):
-                    continue
-                InventoryService.release_stock(
-                    product_id=item.product_id,
-                    sku_id=item.sku_id,
-                    quantity=item.quantity,
-                    reason='order_refunded',
-                    operator=operator
-                )
+            # 优先按预占记录回补（同一笔预占只回补一次），历史订单按订单行回补
+            released = release_order_reservations(order, reason='order_refunded', operator=operator)
+            if not released:
+                for item in order.items.select_related('product', 'sku').all():
+                    released = True
+                    if getattr(item.product, 'source', None) == getattr(item.product, 'SOURCE_HAIER', 'haier'):
+                        continue
+                    InventoryService.release_stock(
+                        product_id=item.product_id,
+                        sku_id=item.sku_id,
+                        quantity=item.quantity,
+                        reason='order_refunded',
+                        operator=operator
+                    )
             if not released and order.product_id:
                 InventoryService.release_stock(
                     product_id=order.product_id,
@@ -393,6 +402,7 @@ class OrderStateMachine:
         Args:
             order: Order对象
         """
-        # 预留接口，可在此添加支付成功后的业务逻辑
-        # 例如：发送支付成功通知、更新用户积分等
-        pass
+        # 支付成功后预占转为已消耗，不再被过期任务释放
+        from .reservations import consume_order_reservations
+
+        consume_order_reservations(order)
@@ -0,0 +1,189 @@
+"""支付过期与未支付订单清理的批量扫描
+
+expire_payments / reconcile_payments / cancel_unpaid_orders 原先一次遍历全部命中的
+支付或订单、逐行保存并各开一个事务，积压较多时占用内存，并与在线结算争抢同一批行锁。
+
+- 按主键 keyset 分批读取（每批 chunk_size 行），不做 count()，内存占用固定；
+- 每批在一个事务里用 SELECT ... FOR UPDATE SKIP LOCKED 认领，正被结算、回调等事务锁定
+  的行本轮跳过，留待下次扫描；多个进程可同时运行而不会重复处理；
+- 支付过期用一条批量 UPDATE 写状态、一次 bulk_create 写事件流水；
+- 只有仍待支付的订单需要走状态机（回补库存、销量、状态历史），在本批事务内逐单执行，
+  每单一个保存点，单笔失败不影响同批其他订单；
+- 回调收件箱中还有未处理完（待处理/处理中/失败待重试）的支付成功回调的订单已实际付款，
+  其支付不置为过期、订单不取消，计入 skipped，等回调处理完成。
+
+每次扫描返回统计数据（扫描/认领/跳过行数、耗时、每秒处理行数），同时写入日志。
+"""
+
+import logging
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from integrations.callback_inbox import unsettled_payment_references
+
+from .models import Order, Payment
+from .payment_events import record_payment_events
+from .state_machine import OrderStateMachine
+
+logger = logging.getLogger(__name__)
+
+OPEN_PAYMENT_STATUSES = ('init', 'processing')
+DEFAULT_CHUNK_SIZE = 200
+
+
+def iter_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE, limit=0):
+    """按主键升序分批返回行（不加锁），用于试运行等只读场景"""
+    last_id = 0
+    seen = 0
+    while not limit or seen < limit:
+        size = min(chunk_size, limit - seen) if limit else chunk_size
+        rows = list(queryset.filter(pk__gt=last_id).order_by('pk')[:size])
+        if not rows:
+            return
+        yield rows
+        seen += len(rows)
+        last_id = rows[-1].pk
+
+
+def sweep(queryset, handle_chunk, chunk_size=DEFAULT_CHUNK_SIZE, limit=0, label='sweep', counters=()):
+    """
+    按主键 keyset 分批扫描 queryset，并在事务内以 SKIP LOCKED 认领每批仍满足条件的行。
+
+    handle_chunk(rows, stats) 在认领事务内执行，可累加 counters 中声明的计数；抛出异常时
+    整批回滚并计入 errors。limit 为扫描行数上限（0 表示不限）。
+    """
+    stats = {'scanned': 0, 'claimed': 0, 'skipped': 0, 'chunks': 0, 'errors': 0}
+    stats.update({name: 0 for name in counters})
+    started = time.monotonic()
+    last_id = 0
+    while not limit or stats['scanned'] < limit:
+        size = min(chunk_size, limit - stats['scanned']) if limit else chunk_size
+        ids = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:size])
+        if not ids:
+            break
+        last_id = ids[-1]
+        stats['scanned'] += len(ids)
+        stats['chunks'] += 1
+        try:
+            with transaction.atomic():
+                # 重新带条件加锁读取：期间已被其他进程处理或正被锁定的行都不会返回
+                rows = list(
+                    queryset.filter(pk__in=ids)
+                    .order_by('pk')
+                    .select_for_update(skip_locked=True, of=('self',))
+                )
+                stats['claimed'] += len(rows)
+                stats['skipped'] += len(ids) - len(rows)
+                if rows:
+                    handle_chunk(rows, stats)
+        except Exception:
+            stats['errors'] += 1
+            logger.exception('%s 批处理失败', label, extra={'first_id': ids[0], 'last_id': ids[-1]})
+    elapsed = time.monotonic() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_second'] = round(stats['claimed'] / elapsed, 1) if elapsed > 0 else float(stats['claimed'])
+    logger.info('%s 完成: %s', label, format_stats(stats))
+    return stats
+
+
+def format_stats(stats):
+    return ' '.join(f'{key}={value}' for key, value in stats.items())
+
+
+def _cancel_orders(orders, stats, note):
+    for order in orders:
+        try:
+            with transaction.atomic():
+                OrderStateMachine.transition(order, 'cancelled', operator=None, note=note)
+            stats['cancelled'] += 1
+        except Exception as exc:
+            stats['errors'] += 1
+            logger.warning('自动取消订单失败: order_id=%s, err=%s', order.id, exc)
+
+
+def _awaiting_payment_callback(order_numbers):
+    """order_numbers: {订单ID: 订单号}；返回有未处理完的支付成功回调的订单ID"""
+    paid = unsettled_payment_references(order_numbers.values())
+    return {order_id for order_id, number in order_numbers.items() if number in paid}
+
+
+def overdue_payments(now=None):
+    now = now or timezone.now()
+    return Payment.objects.filter(status__in=OPEN_PAYMENT_STATUSES, expires_at__lt=now)
+
+
+def expire_overdue_payments(
+    now=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    limit=0,
+    event='expired_by_task',
+    note='Payment expired auto cancel',
+    **event_payload,
+):
+    """
+    将已过期的待支付/支付中记录置为 expired，并取消仍待支付的订单。
+
+    订单正被其他事务锁定（如支付回调、结算），或收件箱中还有未处理完的支付成功回调时，
+    其支付本轮不处理，计入 skipped。
+    """
+    now = now or timezone.now()
+
+    def handle(payments, stats):
+        order_ids = {payment.order_id for payment in payments}
+        awaiting = _awaiting_payment_callback(
+            dict(Order.objects.filter(id__in=order_ids).values_list('id', 'order_number'))
+        )
+        if awaiting:
+            kept = [payment for payment in payments if payment.order_id not in awaiting]
+            stats['skipped'] += len(payments) - len(kept)
+            payments = kept
+            order_ids -= awaiting
+        if not payments:
+            return
+        pending_ids = set(Order.objects.filter(id__in=order_ids, status='pending').values_list('id', flat=True))
+        locked = list(
+            Order.objects.filter(id__in=pending_ids, status='pending')
+            .order_by('id')
+            .select_for_update(skip_locked=True)
+        )
+        busy = pending_ids - {order.id for order in locked}
+        if busy:
+            kept = [payment for payment in payments if payment.order_id not in busy]
+            stats['skipped'] += len(payments) - len(kept)
+            payments = kept
+        if not payments:
+            return
+        for payment in payments:
+            payment.status = 'expired'
+            payment.updated_at = now
+        record_payment_events(payments, event, at=now, **event_payload)
+        Payment.objects.bulk_update(payments, ['status', 'logs', 'updated_at'])
+        stats['expired'] += len(payments)
+        _cancel_orders(locked, stats, note)
+
+    return sweep(
+        overdue_payments(now), handle,
+        chunk_size=chunk_size, limit=limit, label='expire_payments', counters=('expired', 'cancelled'),
+    )
+
+
+def unpaid_orders(cutoff):
+    return Order.objects.filter(status='pending', created_at__lt=cutoff)
+
+
+def cancel_unpaid_orders(cutoff, chunk_size=DEFAULT_CHUNK_SIZE, limit=0, note='Automatically cancelled due to payment timeout'):
+    """取消创建时间早于 cutoff 仍未支付的订单（经状态机回补库存），支付成功回调未处理完的订单除外"""
+
+    def handle(orders, stats):
+        awaiting = _awaiting_payment_callback({order.id: order.order_number for order in orders})
+        if awaiting:
+            stats['skipped'] += len(awaiting)
+            orders = [order for order in orders if order.id not in awaiting]
+        _cancel_orders(orders, stats, note)
+
+    return sweep(
+        unpaid_orders(cutoff), handle,
+        chunk_size=chunk_size, limit=limit, label='cancel_unpaid_orders', counters=('cancelled',),
+    )
@@ -1,17 +1,26 @@
+from datetime import timedelta
 from decimal import Decimal
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.reverse import reverse
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 
-from catalog.models import Brand, Category, Product
-from orders.models import Cart, CartItem
-from stores.models import Store
+from catalog.models import Brand, Category, Product, ProductSKU
+from catalog.serializers import ProductSerializer
+from orders.discounts import upsert_discount_targets
+from orders.models import Cart, CartItem, Discount
+from stores.models import Store, StoreCustomerGroup, StoreCustomerGroupMember, StoreCustomerGroupPrice
 
 
 class CartStoreGroupTests(TestCase):
     def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
         self.user = get_user_model().objects.create_user(username="cart-buyer", password="pwd")
         self.client = APIClient()
         self.client.force_authenticate(self.user)
@@ -93,3 +102,52 @@ class CartStoreGroupTests(TestCase):
 
         self.assertEqual(response.status_code, 400)
         self.assertIn("仅展示", response.json()["detail"])
+
+    def test_cart_query_count_does_not_grow_with_items(self):
+        CartItem.objects.create(cart=self.cart, product=self.main_product, quantity=1)
+        self.client.get(reverse("cart-my-cart"))
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get(reverse("cart-my-cart"))
+
+        for index in range(4):
+            product = self._create_product(self.main_store if index % 2 else self.partner_store, f"Extra {index}")
+            sku = ProductSKU.objects.create(product=product, name=f"SKU {index}", price=Decimal("90.00"), stock=5, specs={"颜色": "白"})
+            CartItem.objects.create(cart=self.cart, product=product, sku=sku, quantity=1)
+        self.client.get(reverse("cart-my-cart"))
+        with CaptureQueriesContext(connection) as five_items:
+            response = self.client.get(reverse("cart-my-cart"))
+
+        self.assertEqual(len(response.json()["items"]), 5)
+        self.assertEqual(len(five_items), len(one_item))
+
+    def test_cart_prices_match_product_serializer(self):
+        group = StoreCustomerGroup.objects.create(store=self.main_store, name="VIP")
+        StoreCustomerGroupMember.objects.create(store=self.main_store, group=group, user=self.user)
+        sku = ProductSKU.objects.create(product=self.main_product, name="大号", price=Decimal("120.00"), stock=5)
+        StoreCustomerGroupPrice.objects.create(group=group, product=self.main_product, price=Decimal("80.00"))
+        StoreCustomerGroupPrice.objects.create(group=group, product=self.main_product, sku=sku, price=Decimal("75.00"))
+        now = timezone.now()
+        discount = Discount.objects.create(
+            amount=Decimal("5"), effective_time=now - timedelta(hours=1), expiration_time=now + timedelta(hours=1),
+        )
+        upsert_discount_targets(discount, [self.user.id], [self.main_product.id, self.partner_product.id])
+        CartItem.objects.create(cart=self.cart, product=self.main_product, sku=sku, quantity=1)
+        CartItem.objects.create(cart=self.cart, product=self.partner_product, quantity=1)
+
+        payload = self.client.post(
+            reverse("cart-update-item"), {"product_id": self.main_product.id, "sku_id": sku.id, "quantity": 2}, format="json",
+        ).json()
+
+        request = APIRequestFactory().get("/")
+        request.user = self.user
+        fields = ("display_price", "discounted_price", "customer_group_id", "skus")
+        for item in payload["items"]:
+            expected = ProductSerializer(Product.objects.get(pk=item["product_id"]), context={"request": request}).data
+            self.assertEqual({key: item["product"][key] for key in fields}, {key: expected[key] for key in fields})
+        main = next(item for item in payload["items"] if item["product_id"] == self.main_product.id)
+        self.assertEqual(main["quantity"], 2)
+        self.assertEqual(Decimal(str(main["product"]["skus"][0]["discounted_price"])), Decimal("70.00"))
+        self.assertEqual(
+            [entry["id"] for group in payload["store_groups"] for entry in group["items"]],
+            sorted(item["id"] for item in payload["items"]),
+        )
@@ -0,0 +1,151 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from catalog.models import Brand, Category, Product
+from orders.discounts import (
+    get_best_discount_rules,
+    replace_discount_targets,
+    upsert_discount_targets,
+)
+from orders.models import Discount, DiscountScope, DiscountTarget
+from orders.services import get_best_active_discount
+from stores.models import Store, StoreCustomerGroup, StoreCustomerGroupMember
+
+
+class DiscountTargetingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(username="admin", password="pwd")
+        self.dealer = User.objects.create_user(username="dealer", password="pwd", role="dealer")
+        self.buyer = User.objects.create_user(username="buyer", password="pwd")
+        self.store = Store.objects.create(name="Main", code="main-discount", store_type=Store.TYPE_SELF_OPERATED)
+        self.major = Category.objects.create(store=self.store, name="Major", level=Category.LEVEL_MAJOR)
+        self.minor = Category.objects.create(
+            store=self.store, name="Minor", level=Category.LEVEL_MINOR, parent=self.major
+        )
+        self.brand = Brand.objects.create(store=self.store, name="Brand")
+        self.products = [
+            Product.objects.create(
+                store=self.store,
+                name=f"P{index}",
+                category=self.minor,
+                brand=self.brand,
+                price=Decimal("100.00"),
+                stock=10,
+            )
+            for index in range(3)
+        ]
+
+    def _discount(self, amount="10", priority=0, **kwargs):
+        now = timezone.now()
+        return Discount.objects.create(
+            amount=Decimal(amount),
+            effective_time=now - timedelta(hours=1),
+            expiration_time=now + timedelta(hours=1),
+            priority=priority,
+            **kwargs,
+        )
+
+    def test_upsert_writes_targets_in_batches_and_ignores_duplicates(self):
+        discount = self._discount()
+        product_ids = [product.id for product in self.products]
+
+        with self.assertNumQueries(4):
+            upsert_discount_targets(discount, [self.dealer.id, self.buyer.id], product_ids, batch_size=4)
+        upsert_discount_targets(discount, [self.dealer.id], product_ids)
+
+        self.assertEqual(DiscountTarget.objects.filter(discount=discount).count(), 6)
+
+    def test_replace_only_touches_changed_pairs(self):
+        discount = self._discount()
+        upsert_discount_targets(discount, [self.dealer.id, self.buyer.id], [self.products[0].id, self.products[1].id])
+        kept = DiscountTarget.objects.get(discount=discount, user=self.dealer, product=self.products[0])
+
+        replace_discount_targets(discount, [self.dealer.id], [self.products[0].id, self.products[2].id])
+
+        self.assertEqual(
+            set(DiscountTarget.objects.filter(discount=discount).values_list("user_id", "product_id")),
+            {(self.dealer.id, self.products[0].id), (self.dealer.id, self.products[2].id)},
+        )
+        self.assertTrue(DiscountTarget.objects.filter(pk=kept.pk).exists())
+
+    def test_best_rule_for_many_products_uses_two_queries(self):
+        low = self._discount(amount="5", priority=1)
+        high = self._discount(amount="20", priority=5)
+        upsert_discount_targets(low, [self.dealer.id], [product.id for product in self.products])
+        upsert_discount_targets(high, [self.dealer.id], [self.products[0].id])
+        self.dealer.refresh_from_db()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pass
+        with self.assertNumQueries(2):
+            rules = get_best_discount_rules(self.dealer, self.products)
+        with self.assertNumQueries(0):
+            get_best_discount_rules(self.dealer, self.products)
+
+        self.assertEqual(rules[self.products[0].id]["discount_id"], high.id)
+        self.assertEqual(rules[self.products[1].id]["discount_id"], low.id)
+
+    def test_target_changes_invalidate_only_affected_users(self):
+        discount = self._discount(amount="15")
+        self.assertEqual(get_best_active_discount(self.dealer, self.products[0]), Decimal("0"))
+        self.assertEqual(get_best_active_discount(self.buyer, self.products[0]), Decimal("0"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            upsert_discount_targets(discount, [self.dealer.id], [self.products[0].id])
+
+        self.assertEqual(get_best_active_discount(self.dealer, self.products[0]), Decimal("15.00"))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_best_active_discount(self.buyer, self.products[0]), Decimal("0"))
+
+    def test_scope_rules_match_role_group_and_category_lazily(self):
+        group = StoreCustomerGroup.objects.create(store=self.store, name="VIP")
+        StoreCustomerGroupMember.objects.create(store=self.store, group=group, user=self.buyer)
+        dealer_discount = self._discount(amount="8", discount_type=Discount.TYPE_PERCENT)
+        group_discount = self._discount(amount="30", priority=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            DiscountScope.objects.create(discount=dealer_discount, user_role="dealer", category=self.major)
+            DiscountScope.objects.create(discount=group_discount, customer_group=group, brand=self.brand)
+
+        self.assertEqual(get_best_active_discount(self.dealer, self.products[0]), Decimal("20.00"))
+        self.assertEqual(get_best_active_discount(self.buyer, self.products[1]), Decimal("30.00"))
+        self.assertFalse(DiscountTarget.objects.exists())
+
+    def test_batch_set_accepts_many_users_and_serializer_update_invalidates(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        now = timezone.now()
+        response = client.post(
+            "/api/discounts/batch_set/",
+            {
+                "user_ids": [self.dealer.id, self.buyer.id],
+                "product_ids": [product.id for product in self.products] + [999999],
+                "amount": "12",
+                "effective_time": (now - timedelta(hours=1)).isoformat(),
+                "expiration_time": (now + timedelta(hours=1)).isoformat(),
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data["created_targets"], 6)
+        discount_id = response.data["discount_id"]
+        self.assertEqual(get_best_active_discount(self.buyer, self.products[0]), Decimal("12.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                f"/api/discounts/{discount_id}/",
+                {"amount": "3", "user_ids": [self.dealer.id]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self.assertEqual(get_best_active_discount(self.buyer, self.products[0]), Decimal("0"))
+        self.assertEqual(get_best_active_discount(self.dealer, self.products[0]), Decimal("3.00"))
@@ -0,0 +1,180 @@
+import threading
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from catalog.models import Brand, Category, Product
+from integrations.haier_stock import fetch_haier_stock, prefetch_haier_stock
+from orders.services import create_order_with_split
+from stores.models import Store
+from users.models import Address
+
+
+def _stock_payload(stock):
+    return {"success": True, "data": [{"secCode": "WH1", "stock": stock, "warehouseGrade": "A"}]}
+
+
+class HaierStockServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_mock = MagicMock()
+        patcher = patch("integrations.haier_stock.get_haier_client", return_value=self.client_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+
+    def test_repeat_lookup_is_served_from_cache(self):
+        self.client_mock.check_stock.return_value = _stock_payload(5)
+
+        first = fetch_haier_stock("P1", "110101")
+        second = fetch_haier_stock("P1", "110101")
+
+        self.assertEqual(first, second)
+        self.client_mock.check_stock.assert_called_once_with("P1", "110101")
+
+    def test_failed_lookup_is_not_cached(self):
+        self.client_mock.check_stock.side_effect = [None, _stock_payload(3)]
+
+        self.assertIsNone(fetch_haier_stock("P1", "110101"))
+        self.assertEqual(fetch_haier_stock("P1", "110101"), _stock_payload(3))
+
+    def test_bypassing_cache_refreshes_cached_value(self):
+        self.client_mock.check_stock.side_effect = [_stock_payload(5), _stock_payload(1)]
+        fetch_haier_stock("P1", "110101")
+
+        fetch_haier_stock("P1", "110101", use_cache=False)
+
+        self.assertEqual(fetch_haier_stock("P1", "110101"), _stock_payload(1))
+        self.assertEqual(self.client_mock.check_stock.call_count, 2)
+
+    def test_concurrent_lookups_share_one_upstream_call(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_check(product_code, county_code):
+            started.set()
+            release.wait(5)
+            return _stock_payload(7)
+
+        self.client_mock.check_stock.side_effect = slow_check
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(fetch_haier_stock("P1", "110101")))
+            for _ in range(5)
+        ]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [_stock_payload(7)] * 5)
+        self.client_mock.check_stock.assert_called_once()
+
+    def test_waiting_lookup_times_out_to_none(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_check(product_code, county_code):
+            started.set()
+            release.wait(5)
+            return _stock_payload(7)
+
+        self.client_mock.check_stock.side_effect = slow_check
+        leader = threading.Thread(target=fetch_haier_stock, args=("P1", "110101"))
+        leader.start()
+        started.wait(5)
+        try:
+            with patch("integrations.haier_stock.HAIER_STOCK_WAIT_SECONDS", 0.05):
+                self.assertIsNone(fetch_haier_stock("P1", "110101"))
+        finally:
+            release.set()
+            leader.join()
+        self.client_mock.check_stock.assert_called_once()
+
+    def test_prefetch_queries_unique_keys_and_tolerates_errors(self):
+        def check(product_code, county_code):
+            if product_code == "BAD":
+                raise RuntimeError("boom")
+            return _stock_payload(2)
+
+        self.client_mock.check_stock.side_effect = check
+
+        results = prefetch_haier_stock([("P1", "1"), ("P2", "1"), ("P1", "1"), ("BAD", "1"), ("", "1")])
+
+        self.assertEqual(set(results), {("P1", "1"), ("P2", "1"), ("BAD", "1")})
+        self.assertIsNone(results[("BAD", "1")])
+        self.assertEqual(self.client_mock.check_stock.call_count, 3)
+
+
+@override_settings(HAIER_STOCK_PREFETCH_WORKERS=2)
+class HaierCheckoutStockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = get_user_model().objects.create_user(username="buyer", password="pwd")
+        self.store = Store.objects.create(name="Main", code="main", store_type=Store.TYPE_SELF_OPERATED)
+        self.address = Address.objects.create(
+            user=self.user,
+            contact_name="Buyer",
+            phone="13800000000",
+            province="北京市",
+            city="北京市",
+            district="东城区",
+            detail="No.1 Road",
+            is_default=True,
+        )
+        category = Category.objects.create(store=self.store, name="Haier", level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(store=self.store, name="Haier")
+        self.products = [
+            Product.objects.create(
+                store=self.store,
+                name=f"Haier {code}",
+                category=category,
+                brand=brand,
+                price=Decimal("100.00"),
+                stock=0,
+                source=Product.SOURCE_HAIER,
+                product_code=code,
+            )
+            for code in ("H1", "H2")
+        ]
+        self.client_mock = MagicMock()
+        patcher = patch("integrations.haier_stock.get_haier_client", return_value=self.client_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_checkout_queries_each_haier_product_once(self):
+        self.client_mock.check_stock.return_value = _stock_payload(3)
+
+        create_order_with_split(
+            user=self.user,
+            items=[
+                {"product_id": self.products[0].id, "quantity": 1},
+                {"product_id": self.products[1].id, "quantity": 1},
+            ],
+            address_id=self.address.id,
+        )
+
+        self.assertEqual(
+            sorted(call.args[0] for call in self.client_mock.check_stock.call_args_list),
+            ["H1", "H2"],
+        )
+
+    def test_checkout_rejects_when_haier_stock_is_short(self):
+        self.client_mock.check_stock.return_value = _stock_payload(1)
+
+        with self.assertRaisesMessage(ValueError, "海尔产品库存不足"):
+            create_order_with_split(
+                user=self.user,
+                items=[
+                    {"product_id": self.products[0].id, "quantity": 2},
+                    {"product_id": self.products[1].id, "quantity": 1},
+                ],
+                address_id=self.address.id,
+            )
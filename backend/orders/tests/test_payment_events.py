@@ -0,0 +1,86 @@
+import importlib
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from catalog.models import Brand, Category, Product
+from orders.models import Order, Payment, PaymentEvent
+from orders.payment_events import PAYMENT_LOG_SUMMARY_SIZE, record_payment_event, resolve_transaction_id
+from orders.wechat_shipping_service import _build_order_key
+from orders.payment_service import PaymentService
+
+
+class PaymentEventTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='event-user', password='pass')
+        category = Category.objects.create(name='家电', level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(name='品牌A')
+        product = Product.objects.create(
+            name='测试商品',
+            category=category,
+            brand=brand,
+            price=Decimal('99.00'),
+            stock=10,
+        )
+        self.order = Order.objects.create(
+            user=self.user,
+            product=product,
+            quantity=1,
+            total_amount=Decimal('99.00'),
+            actual_amount=Decimal('99.00'),
+            status='pending',
+            snapshot_contact_name='张三',
+            snapshot_phone='13800000000',
+            snapshot_address='地址',
+        )
+        self.payment = Payment.create_for_order(self.order, method='wechat', ttl_minutes=10)
+
+    def test_events_are_appended_and_logs_stay_bounded(self):
+        PaymentService.process_payment_success(self.payment.id, transaction_id='tx-1', operator=self.user)
+        for index in range(PAYMENT_LOG_SUMMARY_SIZE + 5):
+            record_payment_event(self.payment, 'retry', attempt=index)
+        self.payment.save(update_fields=['logs'])
+
+        self.payment.refresh_from_db()
+        events = list(self.payment.events.values_list('event', flat=True))
+        self.assertEqual(events[:3], ['start', 'transaction_id_recorded', 'payment_succeeded'])
+        self.assertEqual(len(events), 3 + PAYMENT_LOG_SUMMARY_SIZE + 5)
+        self.assertEqual(len(self.payment.logs), PAYMENT_LOG_SUMMARY_SIZE)
+        self.assertEqual(self.payment.logs[-1]['attempt'], PAYMENT_LOG_SUMMARY_SIZE + 4)
+        # the transaction id has rolled out of the summary but is still found in the events
+        self.assertEqual(resolve_transaction_id(self.payment), 'tx-1')
+        self.assertEqual(PaymentService._resolve_wechat_transaction_id(self.payment), 'tx-1')
+        with override_settings(WECHAT_SHIPPING_ORDER_NUMBER_TYPE=2):
+            self.assertEqual(_build_order_key(self.order), {'order_number_type': 2, 'transaction_id': 'tx-1'})
+
+    def test_log_payment_event_does_not_rewrite_payment_row(self):
+        before = Payment.objects.values('logs', 'updated_at').get(pk=self.payment.pk)
+
+        with self.assertNumQueries(2):
+            PaymentService.log_payment_event(self.payment.id, 'callback_received', details={'status': 'SUCCESS'})
+
+        self.assertEqual(Payment.objects.values('logs', 'updated_at').get(pk=self.payment.pk), before)
+        event = self.payment.events.get(event='callback_received')
+        self.assertEqual(event.payload, {'details': {'status': 'SUCCESS'}})
+
+    def test_migration_moves_legacy_logs_into_events(self):
+        created = self.payment.created_at
+        legacy = [
+            {'t': (created + timedelta(seconds=index)).isoformat(), 'event': f'legacy-{index}', 'detail': index}
+            for index in range(PAYMENT_LOG_SUMMARY_SIZE + 2)
+        ]
+        PaymentEvent.objects.all().delete()
+        Payment.objects.filter(pk=self.payment.pk).update(logs=legacy)
+
+        migration = importlib.import_module('orders.migrations.0034_payment_event')
+        migration.move_payment_logs(apps, None)
+
+        self.payment.refresh_from_db()
+        events = list(self.payment.events.all())
+        self.assertEqual([event.event for event in events], [entry['event'] for entry in legacy])
+        self.assertEqual(events[1].payload, {'detail': 1})
+        self.assertEqual(events[1].created_at, created + timedelta(seconds=1))
+        self.assertEqual(self.payment.logs, legacy[-PAYMENT_LOG_SUMMARY_SIZE:])
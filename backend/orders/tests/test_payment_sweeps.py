@@ -0,0 +1,121 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from integrations.models import CallbackInbox
+from orders.models import Order, OrderStatusHistory, Payment, PaymentEvent
+from orders.sweeps import cancel_unpaid_orders, expire_overdue_payments
+
+
+class PaymentSweepTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='sweeper', password='x')
+        self.past = timezone.now() - timedelta(minutes=5)
+
+    def make_order(self, status='pending', age_minutes=0):
+        order = Order.objects.create(user=self.user, total_amount=Decimal('10.00'), actual_amount=Decimal('10.00'), status=status)
+        if age_minutes:
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(minutes=age_minutes))
+        return order
+
+    def make_payment(self, order, expires_at=None, status='init'):
+        payment = Payment.create_for_order(order, method='wechat', ttl_minutes=10)
+        Payment.objects.filter(pk=payment.pk).update(expires_at=expires_at or self.past, status=status)
+        return payment
+
+    def test_expires_overdue_payments_in_chunks_and_cancels_pending_orders(self):
+        pending = [self.make_order() for _ in range(3)]
+        overdue = [self.make_payment(order) for order in pending]
+        # a second overdue payment for the same order must not cancel it twice
+        overdue.append(self.make_payment(pending[0], status='processing'))
+        paid_order = self.make_order(status='paid')
+        overdue.append(self.make_payment(paid_order))
+        live = self.make_payment(self.make_order(), expires_at=timezone.now() + timedelta(minutes=5))
+
+        stats = expire_overdue_payments(chunk_size=2, note='sweep test')
+
+        self.assertEqual(
+            {key: stats[key] for key in ('scanned', 'claimed', 'expired', 'cancelled', 'chunks', 'errors', 'skipped')},
+            {'scanned': 5, 'claimed': 5, 'expired': 5, 'cancelled': 3, 'chunks': 3, 'errors': 0, 'skipped': 0},
+        )
+        self.assertIn('rows_per_second', stats)
+        self.assertEqual(Payment.objects.filter(id__in=[p.id for p in overdue], status='expired').count(), 5)
+        self.assertEqual(PaymentEvent.objects.filter(event='expired_by_task').count(), 5)
+        self.assertEqual(Payment.objects.get(pk=overdue[0].pk).logs[-1]['event'], 'expired_by_task')
+        for order in pending:
+            order.refresh_from_db()
+            self.assertEqual(order.status, 'cancelled')
+            self.assertEqual(OrderStatusHistory.objects.filter(order=order, to_status='cancelled', note='sweep test').count(), 1)
+        paid_order.refresh_from_db()
+        self.assertEqual(paid_order.status, 'paid')
+        live.refresh_from_db()
+        self.assertEqual(live.status, 'init')
+
+        # a second runner finds nothing left to claim
+        self.assertEqual(expire_overdue_payments()['scanned'], 0)
+
+    def test_limit_bounds_a_run_and_the_next_run_resumes(self):
+        orders = [self.make_order() for _ in range(5)]
+        for order in orders:
+            self.make_payment(order)
+
+        first = expire_overdue_payments(chunk_size=2, limit=3)
+        self.assertEqual((first['scanned'], first['expired']), (3, 3))
+        second = expire_overdue_payments(chunk_size=2)
+        self.assertEqual((second['scanned'], second['expired']), (2, 2))
+        self.assertFalse(Payment.objects.filter(status__in=['init', 'processing']).exists())
+
+        out = StringIO()
+        call_command('reconcile_payments', stdout=out)
+        self.assertIn('Expired: 0', out.getvalue())
+
+    def test_orders_with_unprocessed_success_callback_are_left_alone(self):
+        paid, closed, applied = self.make_order(age_minutes=120), self.make_order(age_minutes=120), self.make_order(age_minutes=120)
+        payments = [self.make_payment(order) for order in (paid, closed, applied)]
+
+        def inbox(order, trade_state, status):
+            CallbackInbox.objects.create(
+                provider=CallbackInbox.PROVIDER_WECHAT_PAY, dedup_key=f'{order.order_number}:{trade_state}',
+                event_type=trade_state, status=status,
+                payload={'transaction': {'out_trade_no': order.order_number, 'trade_state': trade_state}},
+            )
+
+        # the SUCCESS notification failed and is waiting for a retry: the order has been paid
+        inbox(paid, 'SUCCESS', CallbackInbox.STATUS_FAILED)
+        inbox(closed, 'CLOSED', CallbackInbox.STATUS_FAILED)
+        inbox(applied, 'SUCCESS', CallbackInbox.STATUS_SUCCEEDED)
+
+        stats = expire_overdue_payments()
+        self.assertEqual((stats['expired'], stats['cancelled'], stats['skipped']), (2, 2, 1))
+        self.assertEqual(Payment.objects.get(pk=payments[0].pk).status, 'init')
+        stats = cancel_unpaid_orders(timezone.now() - timedelta(minutes=60))
+        self.assertEqual((stats['cancelled'], stats['skipped']), (0, 1))
+        paid.refresh_from_db()
+        self.assertEqual(paid.status, 'pending')
+
+    def test_cancel_unpaid_orders_command_and_dry_run(self):
+        stale = [self.make_order(age_minutes=120) for _ in range(3)]
+        fresh = self.make_order(age_minutes=5)
+        paid = self.make_order(status='paid', age_minutes=120)
+
+        out = StringIO()
+        call_command('cancel_unpaid_orders', '--timeout-minutes', '60', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue().count('[DRY RUN] Would cancel order'), 3)
+        self.assertEqual(Order.objects.filter(status='cancelled').count(), 0)
+
+        out = StringIO()
+        call_command('cancel_unpaid_orders', '--timeout-minutes', '60', '--chunk-size', '2', stdout=out)
+        self.assertIn('Successfully cancelled: 3', out.getvalue())
+        self.assertEqual(
+            set(Order.objects.filter(status='cancelled').values_list('id', flat=True)),
+            {order.id for order in stale},
+        )
+        fresh.refresh_from_db()
+        paid.refresh_from_db()
+        self.assertEqual((fresh.status, paid.status), ('pending', 'paid'))
+        self.assertEqual(cancel_unpaid_orders(timezone.now() - timedelta(minutes=60))['scanned'], 0)
@@ -0,0 +1,203 @@
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from catalog.models import Brand, Category, Product
+from orders.models import CheckoutOrder, Order, Payment, StoreProfitSharingEntry, SubOrder, WechatProfitSharingOrder
+from orders.profit_sharing_settlement import ProfitSharingRejected, settle_profit_sharing
+from stores.models import Store, StoreMember, StorePaymentConfig
+
+
+class FakeProfitSharingClient:
+    """Local stand-in for the provider: keeps orders by out_order_no and answers per receiver account."""
+
+    def __init__(self, delay=0.05, closed=(), rejected=(), flaky=()):
+        self.delay = delay
+        self.closed = set(closed)
+        self.rejected = set(rejected)
+        self.flaky = set(flaky)
+        self.orders = {}
+        self.submits = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, payload):
+        receivers = [
+            {**receiver, 'result': 'CLOSED' if receiver['account'] in self.closed else 'SUCCESS',
+             'fail_reason': 'NO_RELATION' if receiver['account'] in self.closed else ''}
+            for receiver in payload['receivers']
+        ]
+        return {'out_order_no': payload['out_order_no'], 'state': 'FINISHED', 'receivers': receivers}
+
+    def submit(self, payload):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+            self.submits.append(payload)
+            account = payload['receivers'][0]['account']
+            if account in self.rejected:
+                raise ProfitSharingRejected('400 INVALID_REQUEST')
+            if payload['out_order_no'] in self.orders:
+                raise AssertionError(f"duplicate submit of {payload['out_order_no']}")
+            self.orders[payload['out_order_no']] = self._answer(payload)
+            if account in self.flaky:
+                # accepted by the provider, but the response is lost on the way back
+                self.flaky.discard(account)
+                raise ConnectionError('read timed out')
+            return self.orders[payload['out_order_no']]
+
+    def query(self, payload):
+        with self._lock:
+            return self.orders.get(payload['out_order_no'])
+
+
+class ProfitSharingSettlementTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='settle-buyer', password='x')
+
+    def make_store(self, code, ready=True):
+        store = Store.objects.create(name=f'Store {code}', code=code, store_type=Store.TYPE_PARTNER)
+        StorePaymentConfig.objects.create(
+            store=store, wechat_mch_id=f'mch-{code}', profit_sharing_enabled=True, is_active=ready,
+            profit_sharing_receiver_added=True, profit_sharing_receiver_verified=True,
+        )
+        category = Category.objects.create(store=store, name=f'{code} 分类', level=Category.LEVEL_MAJOR)
+        brand = Brand.objects.create(store=store, name=f'{code} 品牌')
+        store.product = Product.objects.create(store=store, name=f'{code} 商品', category=category, brand=brand, price=Decimal('100.00'))
+        return store
+
+    def make_payment(self, *stores, transaction_id='tx-1', status='available', available_at=None):
+        checkout = CheckoutOrder.objects.create(user=self.user, total_amount=Decimal('100.00'))
+        payment = None
+        for store in stores:
+            order = Order.objects.create(user=self.user, total_amount=Decimal('100.00'), status='paid')
+            if payment is None:
+                payment = Payment.objects.create(
+                    order=order, checkout_order=checkout, amount=Decimal('100.00'), status='succeeded',
+                    expires_at=timezone.now(), profit_sharing_required=True, profit_sharing_status='available',
+                    logs=[{'event': 'succeeded', 'transaction_id': transaction_id}] if transaction_id else [],
+                )
+            suborder = SubOrder.objects.create(
+                checkout_order=checkout, legacy_order=order, user=self.user, store=store,
+                product=store.product, total_amount=Decimal('100.00'), actual_amount=Decimal('100.00'),
+            )
+            StoreProfitSharingEntry.objects.create(
+                checkout_order=checkout, payment=payment, order=order, suborder=suborder, store=store,
+                store_type_snapshot=store.store_type, gross_amount=Decimal('100.00'),
+                sharing_amount=Decimal('90.00'), retained_amount=Decimal('10.00'),
+                receiver_type='MERCHANT_ID', receiver_account=store.payment_config.wechat_mch_id,
+                status=status, available_at=available_at,
+            )
+        return payment
+
+    def test_groups_per_payment_and_receiver_and_submits_concurrently(self):
+        alpha, beta, closed = self.make_store('alpha'), self.make_store('beta'), self.make_store('closed')
+        unready = self.make_store('unready', ready=False)
+        first = self.make_payment(alpha, alpha, beta, transaction_id='tx-1')
+        second = self.make_payment(alpha, closed, transaction_id='tx-2')
+        missing_tx = self.make_payment(beta, transaction_id='')
+        waiting = self.make_payment(unready)
+        client = FakeProfitSharingClient(closed=['mch-closed'])
+
+        stats = settle_profit_sharing(chunk_size=3, workers=3, client=client)
+
+        self.assertEqual(
+            {key: stats[key] for key in ('claimed', 'orders', 'manual', 'shared', 'failed', 'processing')},
+            {'claimed': 6, 'orders': 4, 'manual': 1, 'shared': 3, 'failed': 1, 'processing': 0},
+        )
+        self.assertGreater(client.max_in_flight, 1)
+        self.assertLessEqual(client.max_in_flight, 3)
+        alpha_order = WechatProfitSharingOrder.objects.get(payment=first, receivers__0__account='mch-alpha')
+        self.assertEqual((alpha_order.amount, alpha_order.entries.count(), alpha_order.status), (Decimal('180.00'), 2, 'shared'))
+        self.assertIn({'type': 'MERCHANT_ID', 'account': 'mch-alpha', 'name': '', 'amount': 18000,
+                       'description': 'Store alpha订单分账'}, [p['receivers'][0] for p in client.submits])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.profit_sharing_status, second.profit_sharing_status), ('shared', 'failed'))
+        failed_entry = StoreProfitSharingEntry.objects.get(payment=second, store=closed)
+        self.assertEqual((failed_entry.status, failed_entry.failure_reason), ('failed', 'NO_RELATION'))
+        self.assertEqual(StoreProfitSharingEntry.objects.get(payment=missing_tx).status, 'manual_settlement_required')
+        self.assertEqual(StoreProfitSharingEntry.objects.get(payment=waiting).status, 'available')
+
+        # nothing is left to claim; failed entries are only resubmitted on request, under a new out_order_no
+        self.assertEqual(settle_profit_sharing(client=client)['claimed'], 0)
+        client.closed.clear()
+        retry = settle_profit_sharing(client=client, retry_failed=True)
+        self.assertEqual((retry['claimed'], retry['shared']), (1, 1))
+        failed_entry.refresh_from_db()
+        self.assertEqual(failed_entry.status, 'shared')
+        self.assertEqual(failed_entry.wechat_profit_sharing_orders.values('out_order_no').distinct().count(), 2)
+
+    def test_interrupted_submission_is_resumed_by_out_order_no(self):
+        flaky, slow, rejected = self.make_store('flaky'), self.make_store('slow'), self.make_store('rejected')
+        payment = self.make_payment(flaky, slow, rejected)
+        client = FakeProfitSharingClient(delay=0, flaky=['mch-flaky', 'mch-slow'], rejected=['mch-rejected'])
+
+        stats = settle_profit_sharing(client=client)
+        self.assertEqual((stats['processing'], stats['failed']), (2, 1))
+        pending = list(WechatProfitSharingOrder.objects.filter(status='processing').order_by('id'))
+        self.assertIn('read timed out', pending[0].error_message)
+        self.assertEqual(pending[0].entries.get().status, 'processing')
+        self.assertTrue(all(len(order.out_order_no) == 34 for order in pending))
+
+        # within the lease another run leaves the orders alone
+        self.assertEqual(settle_profit_sharing(client=client)['resumed'], 0)
+
+        WechatProfitSharingOrder.objects.filter(status='processing').update(updated_at=timezone.now() - timedelta(minutes=10))
+        # limit also bounds how many stale orders one run (e.g. the share request) resumes
+        stats = settle_profit_sharing(client=client, limit=1)
+        self.assertEqual((stats['resumed'], stats['shared'], stats['claimed']), (1, 1, 0))
+        stats = settle_profit_sharing(client=client)
+        self.assertEqual((stats['resumed'], stats['shared']), (1, 1))
+        for order in pending:
+            order.refresh_from_db()
+            self.assertEqual((order.status, order.entries.get().status), ('shared', 'shared'))
+            self.assertEqual([p['out_order_no'] for p in client.submits].count(order.out_order_no), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.profit_sharing_status, 'failed')
+
+    def test_admin_actions_and_command(self):
+        store = self.make_store('admin')
+        payment = self.make_payment(store, status='frozen', available_at=timezone.now() - timedelta(minutes=1))
+        Payment.objects.filter(pk=payment.pk).update(profit_sharing_status='frozen')
+        admin = get_user_model().objects.create_user(username='settle-admin', password='x', is_staff=True)
+        StoreMember.objects.create(
+            user=admin, store=Store.objects.get(code=Store.MAIN_STORE_CODE), role=StoreMember.ROLE_PLATFORM_ADMIN,
+        )
+        api = APIClient()
+        api.force_authenticate(admin)
+
+        response = api.post('/api/profit-sharing-entries/share/')
+        self.assertEqual(response.status_code, 410)
+
+        response = api.post('/api/profit-sharing-entries/mark_available/')
+        self.assertEqual(response.data, {'updated': 1})
+        payment.refresh_from_db()
+        self.assertEqual(payment.profit_sharing_status, 'available')
+
+        out = StringIO()
+        call_command('sync_profit_sharing', stdout=out)
+        self.assertIn('settlement skipped', out.getvalue())
+
+        client = FakeProfitSharingClient(delay=0)
+        with patch('orders.views.get_profit_sharing_client', return_value=client), \
+                override_settings(PROFIT_SHARING_SHARE_LIMIT=10):
+            response = api.post('/api/profit-sharing-entries/share/', {'store': store.id}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.data['claimed'], response.data['shared']), (1, 1))
+        payment.refresh_from_db()
+        self.assertEqual(payment.profit_sharing_status, 'shared')
+        self.assertEqual(WechatProfitSharingOrder.objects.get().operator, admin)
@@ -0,0 +1,118 @@
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from orders.models import Order, OrderShippingSync
+from orders.wechat_shipping_service import (
+    SHIPPING_RETRY_LEASE_MINUTES,
+    _retry_delay,
+    claim_shipping_retries,
+    retry_failed_shipping_syncs,
+)
+
+
+class FakeShippingClient:
+    """Stands in for WeChatMiniProgramClient; answers by payload['result'] and records concurrency."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.token_threads = []
+        self._lock = threading.Lock()
+
+    def get_access_token(self):
+        self.token_threads.append(threading.current_thread())
+        return 'token'
+
+    def upload_shipping_info(self, payload):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        result = payload.get('result')
+        if result == 'ok':
+            return True, {'errcode': 0, 'errmsg': 'ok'}, ''
+        if result == 'unchanged':
+            return False, {'errcode': 10060023, 'errmsg': '发货信息未更新'}, ''
+        return False, {'errcode': -1, 'errmsg': 'system error'}, ''
+
+
+@override_settings(WECHAT_SHIPPING_RETRY_INTERVAL_MINUTES=10, WECHAT_SHIPPING_RETRY_MAX_MINUTES=720)
+class ShippingRetryWorkerTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='ship-retry', password='x')
+        self.order = Order.objects.create(user=user, total_amount=Decimal('10.00'), status='shipped')
+        self.due = timezone.now() - timedelta(minutes=1)
+
+    def make_sync(self, result, retry_count=0, next_retry_at=None):
+        return OrderShippingSync.objects.create(
+            order=self.order, status='failed', payload={'result': result},
+            retry_count=retry_count, next_retry_at=next_retry_at or self.due,
+        )
+
+    def test_uploads_concurrently_and_bulk_writes_results(self):
+        ok = [self.make_sync('ok') for _ in range(4)]
+        unchanged = self.make_sync('unchanged')
+        failing = self.make_sync('error', retry_count=2)
+        later = self.make_sync('ok', next_retry_at=timezone.now() + timedelta(hours=1))
+        client = FakeShippingClient()
+
+        with patch('orders.wechat_shipping_service.connections.close_all') as close_all:
+            stats = retry_failed_shipping_syncs(chunk_size=3, workers=3, client=client)
+
+        self.assertEqual(stats, {'total': 6, 'success': 5, 'failed': 1})
+        self.assertEqual(client.calls, 6)
+        self.assertGreater(client.max_in_flight, 1)
+        self.assertLessEqual(client.max_in_flight, 3)
+        # the token is warmed once per chunk on this thread; worker threads release their connections
+        self.assertEqual(client.token_threads, [threading.current_thread()] * 2)
+        self.assertEqual(close_all.call_count, 6)
+        for record in ok + [unchanged]:
+            record.refresh_from_db()
+            self.assertEqual((record.status, record.error), ('succeeded', ''))
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.retry_count, failing.error), ('failed', 3, 'system error'))
+        # 10 * 2**3 = 80 minutes with equal jitter: between 40 and 80 minutes from now
+        wait = failing.next_retry_at - timezone.now()
+        self.assertTrue(timedelta(minutes=39) < wait <= timedelta(minutes=80), wait)
+        later.refresh_from_db()
+        self.assertEqual(later.status, 'failed')
+
+    def test_backoff_grows_with_retry_count_and_is_capped(self):
+        with patch('orders.wechat_shipping_service.random.uniform', side_effect=lambda low, high: high):
+            delays = [_retry_delay(count) for count in (0, 1, 2, 10, 40)]
+        self.assertEqual(
+            [delay.total_seconds() / 60 for delay in delays],
+            [10, 20, 40, 720, 720],
+        )
+        with patch('orders.wechat_shipping_service.random.uniform', side_effect=lambda low, high: low):
+            self.assertEqual(_retry_delay(1), timedelta(minutes=10))
+
+    def test_claimed_rows_are_leased_away_from_other_workers(self):
+        records = [self.make_sync('error') for _ in range(5)]
+
+        first = claim_shipping_retries(chunk_size=3)
+        second = claim_shipping_retries(chunk_size=3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual({r.id for r in second}, {r.id for r in records} - {r.id for r in first})
+        self.assertEqual(claim_shipping_retries(chunk_size=3), [])
+
+        leased = OrderShippingSync.objects.get(id=first[0].id)
+        self.assertGreater(leased.next_retry_at, timezone.now() + timedelta(minutes=SHIPPING_RETRY_LEASE_MINUTES - 1))
+
+        out = StringIO()
+        call_command('retry_wechat_shipping', stdout=out)
+        self.assertIn('No failed shipping syncs to retry', out.getvalue())
@@ -0,0 +1,247 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from catalog.models import Brand, Category, InventoryLog, Product, ProductSKU, StockBucket
+from orders.models import StockReservation
+from orders.reservations import (
+    collapse_buckets,
+    decrement_stock,
+    expire_reservations,
+    increment_stock,
+    refresh_bucketed_stock,
+    split_into_buckets,
+    stock_on_hand,
+)
+from orders.services import cancel_order, create_order, create_order_with_split
+from orders.state_machine import OrderStateMachine
+from stores.models import Store
+from users.models import Address
+
+
+def _create_product(store, name, stock):
+    category = Category.objects.create(store=store, name=f"{name} Category", level=Category.LEVEL_MAJOR)
+    brand = Brand.objects.create(store=store, name=f"{name} Brand")
+    return Product.objects.create(
+        store=store,
+        name=name,
+        category=category,
+        brand=brand,
+        price=Decimal("100.00"),
+        stock=stock,
+    )
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="buyer", password="pwd")
+        self.store = Store.objects.create(name="Main", code="main", store_type=Store.TYPE_SELF_OPERATED)
+        self.address = Address.objects.create(
+            user=self.user,
+            contact_name="Buyer",
+            phone="13800000000",
+            province="Beijing",
+            city="Beijing",
+            district="Haidian",
+            detail="No.1 Road",
+            is_default=True,
+        )
+        self.product = _create_product(self.store, "Hot", stock=10)
+        self.sku = ProductSKU.objects.create(
+            product=self.product,
+            name="Red",
+            sku_code="RED",
+            specs={"color": "red"},
+            price=Decimal("100.00"),
+            stock=5,
+        )
+
+    def _stock(self, obj):
+        obj.refresh_from_db()
+        return obj.stock
+
+    def test_conditional_decrement_rejects_oversell(self):
+        self.assertEqual(decrement_stock(self.product.id, 4), [(None, 4)])
+
+        with self.assertRaises(ValueError):
+            decrement_stock(self.product.id, 7)
+
+        self.assertEqual(self._stock(self.product), 6)
+
+    def test_store_version_bumps_on_every_stock_change(self):
+        with patch("orders.reservations.bump_product_content_version") as bump:
+            decrement_stock(self.product.id, 4)
+            increment_stock(self.product.id, 1)
+            decrement_stock(self.sku.product_id, 2, sku_id=self.sku.id)
+            self.assertEqual(bump.call_count, 3)
+
+            with self.assertRaises(ValueError):
+                decrement_stock(self.product.id, 8)
+            self.assertEqual(bump.call_count, 3)
+
+            decrement_stock(self.product.id, 7)
+            increment_stock(self.product.id, 2)
+
+        self.assertEqual(bump.call_count, 5)
+        self.assertEqual(self._stock(self.product), 2)
+
+    def test_decrement_missing_sku_raises_does_not_exist(self):
+        with self.assertRaises(ProductSKU.DoesNotExist):
+            decrement_stock(self.product.id, 1, sku_id=self.sku.id + 100)
+
+    def test_create_order_records_held_reservation(self):
+        order = create_order(
+            user=self.user,
+            address_id=self.address.id,
+            items=[{"product_id": self.product.id, "sku_id": self.sku.id, "quantity": 2}],
+        )
+
+        reservation = StockReservation.objects.get(order=order)
+        self.assertEqual(reservation.status, StockReservation.STATUS_HELD)
+        self.assertEqual(reservation.sku_id, self.sku.id)
+        self.assertEqual(reservation.quantity, 2)
+        self.assertEqual(self._stock(self.sku), 3)
+
+    def test_cancel_releases_reservation_once(self):
+        order = create_order(user=self.user, product_id=self.product.id, address_id=self.address.id, quantity=3)
+        self.assertEqual(self._stock(self.product), 7)
+
+        cancel_order(order)
+        order.refresh_from_db()
+        # 状态机再次走取消/退款回补时不能重复加库存
+        OrderStateMachine._handle_order_cancelled(order, self.user)
+
+        self.assertEqual(self._stock(self.product), 10)
+        self.assertEqual(
+            StockReservation.objects.get(order=order).status,
+            StockReservation.STATUS_RELEASED,
+        )
+        self.assertEqual(InventoryLog.objects.filter(product=self.product, change_type="release").count(), 1)
+
+    def test_split_checkout_cancel_releases_every_suborder_once(self):
+        other_store = Store.objects.create(name="Other", code="other", store_type=Store.TYPE_SELF_OPERATED)
+        other = _create_product(other_store, "Other", stock=10)
+        order = create_order_with_split(
+            user=self.user,
+            items=[
+                {"product_id": self.product.id, "quantity": 2},
+                {"product_id": other.id, "quantity": 3},
+            ],
+            address_id=self.address.id,
+            payment_method="online",
+        )
+        self.assertEqual(StockReservation.objects.filter(checkout_order=order.checkout_order).count(), 2)
+
+        OrderStateMachine.transition(order, "cancelled", operator=self.user)
+        for child in order.child_orders.all():
+            OrderStateMachine.transition(child, "cancelled", operator=self.user)
+
+        self.assertEqual(self._stock(self.product), 10)
+        self.assertEqual(self._stock(other), 10)
+
+    def test_payment_consumes_reservation(self):
+        order = create_order(user=self.user, product_id=self.product.id, address_id=self.address.id, quantity=1)
+
+        OrderStateMachine.transition(order, "paid", operator=self.user)
+
+        self.assertEqual(
+            StockReservation.objects.get(order=order).status,
+            StockReservation.STATUS_CONSUMED,
+        )
+
+    def test_expired_reservation_cancels_pending_order(self):
+        order = create_order(user=self.user, product_id=self.product.id, address_id=self.address.id, quantity=4)
+        StockReservation.objects.filter(order=order).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        stats = expire_reservations()
+
+        order.refresh_from_db()
+        self.assertEqual(stats["cancelled"], 1)
+        self.assertEqual(order.status, "cancelled")
+        self.assertEqual(self._stock(self.product), 10)
+        self.assertFalse(StockReservation.objects.filter(status=StockReservation.STATUS_HELD).exists())
+
+    def test_bucketed_stock_spreads_and_collapses(self):
+        split_into_buckets(self.product.id, 4)
+        self.assertEqual(
+            list(StockBucket.objects.filter(product=self.product).order_by("bucket").values_list("stock", flat=True)),
+            [3, 3, 2, 2],
+        )
+
+        order = create_order(user=self.user, product_id=self.product.id, address_id=self.address.id, quantity=2)
+        self.assertEqual(stock_on_hand(self.product.id), 8)
+        # 单桶不够时跨桶扣减
+        allocations = decrement_stock(self.product.id, 5)
+        self.assertEqual(sum(quantity for _, quantity in allocations), 5)
+        self.assertEqual(stock_on_hand(self.product.id), 3)
+
+        cancel_order(order)
+        self.assertEqual(stock_on_hand(self.product.id), 5)
+
+        refresh_bucketed_stock()
+        self.assertEqual(self._stock(self.product), 5)
+        self.assertEqual(collapse_buckets(self.product.id), 5)
+        self.assertEqual(self._stock(self.product), 5)
+        self.assertFalse(StockBucket.objects.filter(product=self.product).exists())
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    WORKERS = 8
+    ATTEMPTS_PER_WORKER = 10
+
+    def setUp(self):
+        self.store = Store.objects.create(name="Main", code="main", store_type=Store.TYPE_SELF_OPERATED)
+        self.product = _create_product(self.store, "Flash", stock=25)
+
+    def _hammer(self, product_id):
+        successes = []
+        failures = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.WORKERS)
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(self.ATTEMPTS_PER_WORKER):
+                    try:
+                        allocations = decrement_stock(product_id, 1)
+                    except ValueError:
+                        with lock:
+                            failures.append(1)
+                    except Exception as exc:  # SQLite 写锁冲突等视为失败重试之外的异常
+                        if "locked" not in str(exc):
+                            raise
+                        with lock:
+                            failures.append(1)
+                    else:
+                        with lock:
+                            successes.append(sum(quantity for _, quantity in allocations))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(successes), len(failures)
+
+    def _assert_no_oversell(self, product_id, initial):
+        sold, _ = self._hammer(product_id)
+        remaining = stock_on_hand(product_id)
+        self.assertLessEqual(sold, initial)
+        self.assertGreaterEqual(remaining, 0)
+        self.assertEqual(sold + remaining, initial)
+
+    def test_concurrent_decrements_never_oversell(self):
+        self._assert_no_oversell(self.product.id, 25)
+
+    def test_concurrent_bucketed_decrements_never_oversell(self):
+        split_into_buckets(self.product.id, 4)
+        self._assert_no_oversell(self.product.id, 25)
@@ -2,12 +2,10 @@ from rest_framework import viewsets, permissions, status, serializers
 from rest_framework.views import APIView
 from .models import (
     Order,
-    Cart,
     CartItem,
     Payment,
     Refund,
     Discount,
-    DiscountTarget,
     Invoice,
     ReturnRequest,
     OrderShippingAction,
@@ -35,15 +33,18 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .services import create_order, create_order_with_split, get_or_create_cart, add_to_cart, remove_from_cart, resolve_base_price
 from .analytics import OrderAnalytics
+from .discounts import get_best_discount_rules, invalidate_discount, resolve_rule_amount, upsert_discount_targets
 from catalog.models import Product
+from users.models import User
 from django.utils import timezone
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Prefetch, Q
+from django.db.models import Q
 from django.db.models.deletion import ProtectedError
 from typing import Dict, Optional
 from common.permissions import IsOwnerOrAdmin, IsAdmin, IsStoreStaffOrAdmin
 from common.serializers import EmptySerializer
+from common.search import SubstringSearchFilter
 from stores.permissions import (
     PERMISSION_ORDERS_ADJUST_AMOUNT,
     PERMISSION_ORDERS_CANCEL,
@@ -60,7 +61,7 @@ from stores.permissions import (
     is_support_user,
 )
 from common.excel import build_excel_response
-from common.utils import parse_int, parse_datetime
+from common.utils import parse_int, parse_datetime, to_bool
 from common.throttles import PaymentRateThrottle
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes as OT
@@ -70,6 +71,7 @@ from common.logging import log_security
 import logging
 import json
 from decimal import Decimal, ROUND_HALF_UP
+from .payment_events import record_payment_event
 from .payment_service import PaymentService
 from .shipping_action_service import (
     ShippingActionError,
@@ -79,6 +81,7 @@ from .shipping_action_service import (
     get_shipping_context,
 )
 from .profit_sharing import ProfitSharingService
+from .profit_sharing_settlement import get_profit_sharing_client, settle_profit_sharing
 
 
 def _wechat_shipping_error_message(err: str | None, resp: Dict | None) -> str:
@@ -201,6 +204,13 @@ class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsOwnerOrAdmin]
+    # 订单号、商品名称、用户名模糊搜索（三元组索引，商品明细走 EXISTS 子查询）
+    filter_backends = [SubstringSearchFilter]
+    substring_search_fields = {
+        'order_number': ('order_number',),
+        'product_name': ('product__name', 'items__product__name'),
+        'username': ('user__username',),
+    }
 
     def get_queryset(self):
         user = self.request.user
@@ -258,27 +268,6 @@ class OrderViewSet(viewsets.ModelViewSet):
                 else:
                     qs = qs.filter(status=status_filter)
 
-        # 订单号搜索（模糊）
-        order_number = self.request.query_params.get('order_number')
-        if order_number:
-            qs = qs.filter(order_number__icontains=order_number)
-
-        # 商品名称搜索（模糊）
-        product_name = self.request.query_params.get('product_name')
-        if product_name:
-            try:
-                qs = qs.filter(Q(product__name__icontains=product_name) | Q(items__product__name__icontains=product_name))
-            except Exception:
-                pass
-
-        # 用户名搜索（管理员可用）：模糊匹配 user.username
-        username = self.request.query_params.get('username')
-        if username:
-            try:
-                qs = qs.filter(user__username__icontains=username)
-            except Exception:
-                pass
-
         # 按用户ID筛选（在已授权的数据范围内继续收窄）
         user_id = self.request.query_params.get('user_id')
         if user_id:
@@ -307,7 +296,7 @@ class OrderViewSet(viewsets.ModelViewSet):
                 except Exception:
                     pass
 
-        return qs.distinct().order_by('-created_at')
+        return qs.order_by('-created_at')
 
     @staticmethod
     def _is_shipping_operator(user) -> bool:
@@ -465,11 +454,11 @@ class OrderViewSet(viewsets.ModelViewSet):
             init_payments = order.payments.filter(status='init')
             for payment in init_payments:
                 payment.status = 'cancelled'
-                payment.logs.append({
-                    't': timezone.now().isoformat(),
-                    'event': 'cancelled_by_admin_adjust',
-                    'detail': 'cancelled due to admin amount adjustment',
-                })
+                record_payment_event(
+                    payment,
+                    'cancelled_by_admin_adjust',
+                    detail='cancelled due to admin amount adjustment',
+                )
                 payment.save(update_fields=['status', 'logs', 'updated_at'])
 
             items = list(order.items.select_for_update())
@@ -1790,20 +1779,8 @@ class CartViewSet(viewsets.ViewSet):
 
     @action(detail=False,methods=['get'])
     def my_cart(self,request):
-        base_cart = get_or_create_cart(request.user)
-        cart = Cart.objects.prefetch_related(
-            Prefetch(
-                'items',
-                queryset=CartItem.objects.select_related(
-                    'product',
-                    'product__store',
-                    'product__category',
-                    'product__brand',
-                    'sku',
-                ).order_by('id'),
-            )
-        ).get(pk=base_cart.pk)
-        # 传入请求上下文以便 ProductSerializer 计算 discounted_price
+        cart = get_or_create_cart(request.user)
+        # 传入请求上下文以便 ProductSerializer 计算 discounted_price；条目与关联由 CartSerializer 一次性加载
         serializer = CartSerializer(cart, context={'request': request})
         return Response(serializer.data)
     
@@ -2117,10 +2094,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
             # 如果因过期导致不可用，更新状态
             if '过期' in reason:
                 payment.status = 'expired'
-                payment.logs.append({
-                    't': timezone.now().isoformat(),
-                    'event': 'expired_before_start'
-                })
+                record_payment_event(payment, 'expired_before_start')
                 payment.save(update_fields=['status', 'logs', 'updated_at'])
             return Response({'detail': reason}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -2155,11 +2129,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
             return Response({'detail': msg_amount}, status=status.HTTP_400_BAD_REQUEST)
 
         payment.status = 'processing'
-        payment.logs.append({
-            't': timezone.now().isoformat(),
-            'event': 'start',
-            'detail': f'user starts {provider} payment'
-        })
+        record_payment_event(payment, 'start', detail=f'user starts {provider} payment')
         payment.save(update_fields=['status', 'logs', 'updated_at'])
 
         pay_params = None
@@ -2167,11 +2137,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
             openid = getattr(request.user, 'openid', '') or request.data.get('openid') or ''
             if not openid:
                 payment.status = 'init'
-                payment.logs.append({
-                    't': timezone.now().isoformat(),
-                    'event': 'start_failed',
-                    'detail': 'missing_openid'
-                })
+                record_payment_event(payment, 'start_failed', detail='missing_openid')
                 payment.save(update_fields=['status', 'logs', 'updated_at'])
                 return Response({'detail': '缺少 openid，无法发起微信支付'}, status=status.HTTP_400_BAD_REQUEST)
             client_ip = PaymentService.extract_client_ip(request)
@@ -2180,20 +2146,12 @@ class PaymentViewSet(viewsets.ModelViewSet):
             except Exception as exc:
                 logger.exception('微信统一下单失败', extra={'payment_id': payment.id, 'order_id': payment.order_id})
                 payment.status = 'init'
-                payment.logs.append({
-                    't': timezone.now().isoformat(),
-                    'event': 'start_failed',
-                    'detail': f'wechat_order_error: {exc}'
-                })
+                record_payment_event(payment, 'start_failed', detail=f'wechat_order_error: {exc}')
                 payment.save(update_fields=['status', 'logs', 'updated_at'])
                 return Response({'detail': f'微信支付下单失败: {exc}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             if not pay_params:
                 payment.status = 'init'
-                payment.logs.append({
-                    't': timezone.now().isoformat(),
-                    'event': 'start_failed',
-                    'detail': 'wechat_pay_params_empty'
-                })
+                record_payment_event(payment, 'start_failed', detail='wechat_pay_params_empty')
                 payment.save(update_fields=['status', 'logs', 'updated_at'])
                 return Response({'detail': '微信支付未正确配置或下单失败'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             # 确保前端可以拿到金额字段（微信JSAPI报 total_fee 缺失时兜底用）
@@ -2285,10 +2243,23 @@ class StoreProfitSharingEntryViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=False, methods=['post'])
     def share(self, request):
-        return Response(
-            {'detail': '微信分账已停用，请使用人工结算记录店铺分账。'},
-            status=status.HTTP_410_GONE,
+        """批量提交可分账流水；请求内最多认领 PROFIT_SHARING_SHARE_LIMIT 条，其余由 sync_profit_sharing 命令处理"""
+        client = get_profit_sharing_client()
+        if client is None:
+            return Response(
+                {'detail': '微信分账已停用，请使用人工结算记录店铺分账。'},
+                status=status.HTTP_410_GONE,
+            )
+        ProfitSharingService.mark_available()
+        stats = settle_profit_sharing(
+            limit=getattr(settings, 'PROFIT_SHARING_SHARE_LIMIT', 200),
+            client=client,
+            operator=request.user,
+            store_id=parse_int(request.data.get('store')),
+            retry_failed=bool(to_bool(request.data.get('retry_failed'))),
         )
+        return Response(stats)
+
     @action(detail=True, methods=['post'])
     def mark_manual_settled(self, request, pk=None):
         entry = self.get_object()
@@ -2361,6 +2332,7 @@ class DiscountViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         try:
             with transaction.atomic():
+                invalidate_discount(instance)
                 instance.targets.all().delete()
                 instance.delete()
         except ProtectedError:
@@ -2466,12 +2438,13 @@ class DiscountViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'], permission_classes=[IsAdmin])
     def batch_set(self, request):
         """批量为指定用户设置一组商品的统一折扣金额与时间窗。
-        输入: { user_id, product_ids:[], amount, discount_type, effective_time, expiration_time, priority }
+        输入: { user_id 或 user_ids:[], product_ids:[], amount, discount_type, effective_time, expiration_time, priority }
         返回: 创建/更新的目标数量
         """
         try:
-            user_id = int(request.data.get('user_id'))
-            product_ids = request.data.get('product_ids') or []
+            user_ids = request.data.get('user_ids') or [request.data.get('user_id')]
+            user_ids = [int(uid) for uid in user_ids]
+            product_ids = [int(pid) for pid in (request.data.get('product_ids') or [])]
             amount = request.data.get('amount')
             discount_type = request.data.get('discount_type', Discount.TYPE_AMOUNT)
             effective_time = request.data.get('effective_time')
@@ -2491,24 +2464,21 @@ class DiscountViewSet(viewsets.ModelViewSet):
             if amount_val <= 0 or amount_val > 10:
                 return Response({'detail': '折扣率需在 0 到 10 之间'}, status=400)
 
-        # 创建折扣规则
-        disc = Discount.objects.create(
-            name=request.data.get('name', ''),
-            amount=amount,
-            discount_type=discount_type,
-            effective_time=effective_time,
-            expiration_time=expiration_time,
-            priority=priority,
-        )
-        # 建立目标关系
-        created = 0
-        for pid in product_ids:
-            try:
-                DiscountTarget.objects.create(discount=disc, user_id=user_id, product_id=int(pid))
-                created += 1
-            except Exception:
-                # unique 冲突忽略
-                pass
+        # 过滤不存在的用户/商品，避免外键错误
+        user_ids = list(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        product_ids = list(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        with transaction.atomic():
+            # 创建折扣规则
+            disc = Discount.objects.create(
+                name=request.data.get('name', ''),
+                amount=amount,
+                discount_type=discount_type,
+                effective_time=effective_time,
+                expiration_time=expiration_time,
+                priority=priority,
+            )
+            # 建立目标关系：分批 bulk_create，唯一冲突忽略
+            created = upsert_discount_targets(disc, user_ids, product_ids)
         return Response({'discount_id': disc.id, 'created_targets': created}, status=201)
 
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
@@ -2522,27 +2492,22 @@ class DiscountViewSet(viewsets.ModelViewSet):
         if not ids:
             return Response({})
 
-        now = timezone.now()
         # 优先级排序选择一个最优折扣（最高优先级）；若同优先级按更新时间
-        qs = DiscountTarget.objects.select_related('discount', 'product').filter(
-            user=request.user,
-            product_id__in=ids,
-            discount__effective_time__lte=now,
-            discount__expiration_time__gt=now,
-        ).order_by('-discount__priority', '-discount__updated_at')
+        products = list(Product.objects.select_related('store').filter(id__in=ids))
+        rules = get_best_discount_rules(request.user, products)
 
         result: dict[int, dict] = {}
-        for dt in qs:
-            pid = dt.product_id
-            if pid in result:
+        for product in products:
+            rule = rules.get(product.id)
+            if not rule:
                 continue
-            base_price = resolve_base_price(request.user, dt.product)
-            amount = dt.discount.resolve_discount_amount(base_price)
-            result[pid] = {
+            base_price = resolve_base_price(request.user, product)
+            amount = resolve_rule_amount(rule, base_price)
+            result[product.id] = {
                 'amount': float(amount),
-                'discount_id': dt.discount_id,
-                'discount_type': dt.discount.discount_type,
-                'discount_value': float(dt.discount.amount),
+                'discount_id': rule['discount_id'],
+                'discount_type': rule['type'],
+                'discount_value': float(rule['value']),
             }
         return Response(result)
 
@@ -2711,234 +2676,46 @@ class PaymentCallbackView(APIView):
     serializer_class = EmptySerializer
 
     def post(self, request, provider: str = 'wechat'):
-        """处理支付回调
-        
+        """接收支付回调
+
+        验签解密后写入回调收件箱并立即应答；订单、支付状态的更新由收件箱 worker
+        异步完成（PaymentService.handle_wechat_callback）。服务商重复推送的同一回调
+        只记录接收次数。
+
         Args:
             request: HTTP请求对象
             provider: 支付提供商（目前仅微信）
-            
+
         Returns:
-            Response: 支付记录序列化数据或错误信息
+            Response: 应答或错误信息
         """
         from .payment_service import PaymentService
+        from integrations.callback_inbox import receive
+        from integrations.models import CallbackInbox
         import logging
-        
+
         logger = logging.getLogger(__name__)
         provider = (provider or 'wechat').lower()
         if provider != 'wechat':
             return Response({'detail': 'unsupported provider'}, status=400)
 
-        raw_body = ''
-        try:
-            raw_body = request.body.decode('utf-8')
-        except Exception:
-            raw_body = ''
-        logger.info(f'收到支付回调: provider={provider}, body={raw_body or request.data}')
-
-        payment = None
-        status_param = None
-        transaction_id = None
-        callback_amount = None
-        validation_data = None
-        data = request.data or {}
-
-        parsed, err = PaymentService.parse_wechat_callback(request)
+        event, err = PaymentService.verify_wechat_callback(request)
         if err:
             logger.error(f'微信回调解析失败: {err}')
             return Response({'code': 'FAIL', 'message': err}, status=status.HTTP_400_BAD_REQUEST)
-        payment = parsed['payment']
-        status_param = parsed.get('trade_state')
-        transaction_id = parsed.get('transaction_id')
-        callback_amount = parsed.get('amount_decimal')
-        validation_data = {'amount': parsed.get('amount_decimal')}
-        data = parsed.get('transaction') or {}
-        PaymentService.log_payment_event(
-            payment.id,
-            'signature_verified',
-            details={'provider': provider, 'channel': 'wechat_v3'}
-        )
-
-        # 防止重复处理已成功的支付
-        if payment.status == 'succeeded':
-            logger.warning(f'支付记录已处理过: payment_id={payment.id}')
-            PaymentService.log_payment_event(
-                payment.id,
-                'duplicate_callback_ignored',
-                details={'provider': provider}
-            )
-            return Response({'code': 'SUCCESS', 'message': 'OK', 'payment_id': payment.id})
-        if payment.status in ['cancelled', 'expired', 'failed']:
-            logger.warning(f'回调被拒绝，支付状态不允许更新: payment_id={payment.id}, status={payment.status}')
-            PaymentService.log_payment_event(
-                payment.id,
-                'callback_rejected_by_status',
-                details={'provider': provider, 'status': payment.status}
-            )
-            return Response({'code': 'SUCCESS', 'message': '支付状态不可更新', 'payment_id': payment.id})
-
-        # 验证回调金额与支付单一致
-        ok_amount, reason_amount = PaymentService.validate_callback_amount(payment, validation_data)
-        if not ok_amount:
-            logger.error(f'回调金额校验失败: payment_id={payment.id}, reason={reason_amount}')
-            PaymentService.log_payment_event(
-                payment.id,
-                'callback_amount_mismatch',
-                details={'provider': provider},
-                error=reason_amount
-            )
-            return Response({'detail': reason_amount}, status=400)
-
-        # 提取回调数据
-        status_param = status_param or data.get('status') or data.get('result_code') or data.get('trade_state')
-        transaction_id = transaction_id or data.get('transaction_id') or data.get('wx_transaction_id') or data.get('trans_id')
-        callback_amount = callback_amount or data.get('total_fee') or data.get('amount') or data.get('total')
-
-        # 映射支付状态
-        new_status = self._map_payment_status(provider, status_param)
-
-        # 使用事务处理支付状态更新
-        try:
-            with transaction.atomic():
-                # 锁定支付记录，避免并发回调穿透
-                from .models import Payment
-                payment = Payment.objects.select_for_update().get(id=payment.id)
-
-                # 处理支付成功
-                if new_status == 'succeeded' and payment.status in ['init', 'processing']:
-                    # 再次金额阈值/一致性校验
-                    ok_amount, reason_amt = PaymentService.check_amount_threshold(payment.order)
-                    if not ok_amount:
-                        raise ValueError(reason_amt)
-                    if callback_amount:
-                        try:
-                            cb_amount = Decimal(str(callback_amount))
-                        except Exception:
-                            cb_amount = None
-                        if cb_amount is not None and cb_amount != payment.amount:
-                            log_security('callback_amount_mismatch', '回调金额不一致', {'payment_id': payment.id, 'order_id': payment.order_id})
-                            raise ValueError('回调金额与支付单不一致')
-
-                    PaymentService.process_payment_success(
-                        payment.id,
-                        transaction_id=transaction_id,
-                        operator=None
-                    )
-                    # refresh local status to avoid后续误覆盖
-                    payment.status = 'succeeded'
-                    logger.info(f'支付成功处理: payment_id={payment.id}, transaction_id={transaction_id}')
-
-                # 处理支付失败
-                elif new_status == 'failed' and payment.status not in ['cancelled', 'expired']:
-                    payment.status = 'failed'
-                    PaymentService.log_payment_event(
-                        payment.id,
-                        'payment_failed',
-                        details={'provider': provider, 'reason': status_param}
-                    )
-                    payment.save()
-                    logger.warning(f'支付失败: payment_id={payment.id}')
-
-                # 处理支付取消
-                elif new_status == 'cancelled' and payment.status not in ['cancelled', 'expired']:
-                    payment.status = 'cancelled'
-                    PaymentService.log_payment_event(
-                        payment.id,
-                        'payment_cancelled',
-                        details={'provider': provider}
-                    )
-                    payment.save()
-                    logger.info(f'支付已取消: payment_id={payment.id}')
-
-                # 处理支付过期
-                elif new_status == 'expired' and payment.status != 'expired':
-                    payment.status = 'expired'
-                    # 使用状态机更新订单状态
-                    try:
-                        from .state_machine import OrderStateMachine
-                        OrderStateMachine.transition(
-                            payment.order,
-                            'cancelled',
-                            operator=None,
-                            note='Payment expired'
-                        )
-                    except ValueError as e:
-                        logger.error(f'订单状态转换失败: {str(e)}')
-                        payment.order.status = 'cancelled'
-                        payment.order.save()
 
-                    try:
-                        from users.services import create_notification
-                        create_notification(
-                            payment.order.user,
-                            title='支付已过期',
-                            content=f'订单 {payment.order.order_number} 支付已过期，请重新下单或再次支付',
-                            ntype='payment',
-                            metadata={
-                                'order_id': payment.order_id,
-                                'payment_id': payment.id,
-                                'order_number': payment.order.order_number,
-                                'page': f'pages/order-detail/index?id={payment.order_id}',
-                                'subscription_data': {
-                                    'thing1': {'value': f'订单 {payment.order.order_number}'[:20]},
-                                    'time2': {'value': timezone.localtime(payment.expires_at).strftime('%Y-%m-%d %H:%M') if payment.expires_at else ''},
-                                    'thing3': {'value': '支付已过期'},
-                                },
-                            }
-                        )
-                    except Exception:
-                        pass
-                    
-                    PaymentService.log_payment_event(
-                        payment.id,
-                        'payment_expired',
-                        details={'provider': provider}
-                    )
-                    payment.save()
-                    logger.info(f'支付已过期: payment_id={payment.id}')
-                
-                # 处理支付处理中
-                else:
-                    payment.status = 'processing'
-                    PaymentService.log_payment_event(
-                        payment.id,
-                        'payment_processing',
-                        details={'provider': provider}
-                    )
-                    payment.save()
-                    logger.info(f'支付处理中: payment_id={payment.id}')
-        
-        except Exception as e:
-            logger.error(f'处理支付回调异常: {str(e)}')
-            PaymentService.log_payment_event(
-                payment.id,
-                'callback_processing_error',
-                details={'provider': provider},
-                error=str(e)
-            )
-            return Response({'detail': 'callback processing failed'}, status=500)
-
-        return Response({'code': 'SUCCESS', 'message': '成功', 'payment_id': payment.id})
-
-    @staticmethod
-    def _map_payment_status(provider: str, status_param: str) -> str:
-        """映射支付状态"""
-        if provider == 'wechat':
-            val = str(status_param).upper() if status_param else ''
-            if val == 'SUCCESS':
-                return 'succeeded'
-            if val in {'CLOSED', 'REVOKED'}:
-                return 'cancelled'
-            if val in {'USERPAYING', 'NOTPAY', 'ACCEPT'}:
-                return 'processing'
-            return 'failed'
-        if provider == 'alipay':
-            val = str(status_param).lower() if status_param else ''
-            if val == 'trade_success':
-                return 'succeeded'
-            if val == 'trade_closed':
-                return 'cancelled'
-            return 'failed'
-        return 'processing'
+        trade = event['transaction']
+        entry, created = receive(
+            CallbackInbox.PROVIDER_WECHAT_PAY,
+            PaymentService.wechat_callback_dedup_key(event),
+            event,
+            event_type=trade.get('trade_state') or '',
+        )
+        logger.info(
+            f"收到支付回调: out_trade_no={trade.get('out_trade_no')}, trade_state={trade.get('trade_state')}, "
+            f"inbox_id={entry.id}, duplicate={not created}"
+        )
+        return Response({'code': 'SUCCESS', 'message': '成功'})
 
 
 @extend_schema(tags=['Refunds'])
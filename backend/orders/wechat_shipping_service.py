@@ -1,14 +1,18 @@
 import logging
 import json
+import random
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import timedelta, datetime
 from typing import Dict, Optional, Tuple
 
 from django.conf import settings
+from django.db import connections, transaction
 from django.utils import timezone
 
 from integrations.wechat import WeChatMiniProgramClient
 from .models import OrderShippingSync
+from .payment_events import resolve_transaction_id
 
 logger = logging.getLogger(__name__)
 
@@ -91,12 +95,8 @@ def _build_order_key(order) -> Optional[Dict[str, str]]:
         }
     # order_number_type == 2
     pay = order.payments.filter(status='succeeded', method='wechat').order_by('-created_at').first()
-    transaction_id = None
-    if pay:
-        for log in reversed(pay.logs or []):
-            if isinstance(log, dict) and log.get('transaction_id'):
-                transaction_id = log.get('transaction_id')
-                break
+    # logs only keeps the latest summaries; fall back to the event table for older transaction ids
+    transaction_id = resolve_transaction_id(pay) if pay else ''
     if not transaction_id:
         logger.warning('wechat shipping missing transaction_id, skip order_id=%s', order.id)
         return None
@@ -113,9 +113,17 @@ def _should_sync(order) -> bool:
     return order.payments.filter(status='succeeded', method='wechat').exists()
 
 
-def _next_retry_time() -> Optional[datetime]:
-    minutes = int(getattr(settings, 'WECHAT_SHIPPING_RETRY_INTERVAL_MINUTES', 10) or 10)
-    return timezone.now() + timedelta(minutes=minutes)
+def _retry_delay(retry_count: int = 0) -> timedelta:
+    # exponential back-off capped at WECHAT_SHIPPING_RETRY_MAX_MINUTES; "equal jitter" keeps at least
+    # half of the delay so a recovering API is not hit by every worker at the same instant
+    base = int(getattr(settings, 'WECHAT_SHIPPING_RETRY_INTERVAL_MINUTES', 10) or 10)
+    cap = int(getattr(settings, 'WECHAT_SHIPPING_RETRY_MAX_MINUTES', 720) or 720)
+    minutes = min(cap, base * (2 ** min(max(retry_count, 0), 16)))
+    return timedelta(minutes=minutes / 2 + random.uniform(0, minutes / 2))
+
+
+def _next_retry_time(retry_count: int = 0) -> Optional[datetime]:
+    return timezone.now() + _retry_delay(retry_count)
 
 
 def upload_shipping_info(
@@ -274,3 +282,80 @@ def upload_shipping_info(
 
     error_message = last_err or (last_resp.get('errmsg') if isinstance(last_resp, dict) else 'wechat_error')
     return False, last_resp, error_message
+
+
+# a claimed row is hidden from other workers this long; if the worker dies it becomes due again
+SHIPPING_RETRY_LEASE_MINUTES = 5
+
+
+def _is_upload_success(ok: bool, resp: Dict) -> bool:
+    # errcode 10060023 ("未更新") means WeChat already has this shipping info
+    return bool(ok) or (isinstance(resp, dict) and resp.get('errcode') == 10060023)
+
+
+def claim_shipping_retries(chunk_size: int = 50) -> list:
+    """Lock a chunk of due failed syncs (skipping rows other workers hold) and lease them to this worker."""
+    now = timezone.now()
+    with transaction.atomic():
+        records = list(
+            OrderShippingSync.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .filter(status='failed', next_retry_at__lte=now)
+            .order_by('next_retry_at', 'id')[:chunk_size]
+        )
+        if records:
+            OrderShippingSync.objects.filter(id__in=[record.id for record in records]).update(
+                next_retry_at=now + timedelta(minutes=SHIPPING_RETRY_LEASE_MINUTES),
+                updated_at=now,
+            )
+    return records
+
+
+def _upload_in_worker(client, payload):
+    # a rejected token is refreshed through WeChatAccessToken rows from the worker thread;
+    # close whatever connection that opened so pool threads never hold one
+    try:
+        return client.upload_shipping_info(payload)
+    finally:
+        connections.close_all()
+
+
+def retry_failed_shipping_syncs(
+    chunk_size: int = 50,
+    limit: int = 0,
+    workers: Optional[int] = None,
+    client: Optional[WeChatMiniProgramClient] = None,
+) -> Dict[str, int]:
+    """Re-upload due failed syncs chunk by chunk through one client and a bounded thread pool."""
+    workers = max(1, int(workers or getattr(settings, 'WECHAT_SHIPPING_RETRY_WORKERS', 4) or 1))
+    client = client or WeChatMiniProgramClient()
+    stats = {'total': 0, 'success': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wechat-shipping-retry') as pool:
+        while not limit or stats['total'] < limit:
+            size = min(chunk_size, limit - stats['total']) if limit else chunk_size
+            records = claim_shipping_retries(size)
+            if not records:
+                break
+            # warm the access token here so workers normally skip the token broker's database reads;
+            # results are written back on this thread
+            client.get_access_token()
+            results = list(pool.map(lambda record: _upload_in_worker(client, record.payload or {}), records))
+            now = timezone.now()
+            for record, (ok, resp, err) in zip(records, results):
+                record.response = resp or {}
+                record.updated_at = now
+                if _is_upload_success(ok, resp):
+                    record.status = 'succeeded'
+                    record.error = ''
+                    stats['success'] += 1
+                else:
+                    record.status = 'failed'
+                    record.error = err or (resp.get('errmsg') if isinstance(resp, dict) else '') or 'wechat_error'
+                    record.retry_count += 1
+                    record.next_retry_at = now + _retry_delay(record.retry_count)
+                    stats['failed'] += 1
+            OrderShippingSync.objects.bulk_update(
+                records, ['status', 'response', 'error', 'retry_count', 'next_retry_at', 'updated_at'],
+            )
+            stats['total'] += len(records)
+    return stats
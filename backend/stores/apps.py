@@ -5,3 +5,6 @@ class StoresConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stores"
     verbose_name = "店铺管理"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,77 @@
+"""店铺内容版本与店铺首页响应缓存。
+
+每个店铺维护一个 ``content_version`` 计数器，商品、SKU、分类、品牌、轮播图和专区
+写入后递增；首页展示具体库存数和销量，库存扣减/回补与销量变化同样递增。店铺首页的序列化结果按 (店铺, 版本, 访客类型) 缓存，版本变化后旧缓存
+自然失效，不需要逐条清理。
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import Store
+
+
+STOREFRONT_CACHE_PREFIX = "storefront"
+STOREFRONT_CACHE_TIMEOUT = 600
+
+VIEWER_ANONYMOUS = "anon"
+
+
+def bump_content_version(store_id) -> None:
+    """在事务提交后递增店铺内容版本。
+
+    放在 on_commit 里执行，避免在下单等长事务中持有店铺行锁；数据先提交、版本后递增，
+    读到旧版本时拿到的数据只可能更新，不会把旧数据写进新版本的缓存。回调以 robust 方式
+    注册，递增失败只记日志，不影响已提交的业务写入。
+    """
+    if not store_id:
+        return
+
+    def _bump():
+        Store.objects.filter(pk=store_id).update(content_version=F("content_version") + 1)
+
+    transaction.on_commit(_bump, robust=True)
+
+
+def bump_product_content_version(product_id) -> None:
+    """按商品递增所属店铺的内容版本，用于绕过模型信号的批量/条件更新。"""
+    if not product_id:
+        return
+
+    def _bump():
+        Store.objects.filter(products__id=product_id).update(content_version=F("content_version") + 1)
+
+    transaction.on_commit(_bump, robust=True)
+
+
+def get_viewer_class(request):
+    """返回可共享缓存的访客类型；登录用户价格因人而异，返回 None 表示不缓存。"""
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return VIEWER_ANONYMOUS
+    return None
+
+
+def build_storefront_cache_key(store: Store, request, viewer_class: str) -> str:
+    # 响应中的图片地址依赖协议和域名，查询参数影响商品筛选，一并计入缓存键
+    variant = "|".join(
+        [
+            request.scheme,
+            request.get_host(),
+            str(request.query_params.get("category_id") or ""),
+        ]
+    )
+    digest = hashlib.md5(variant.encode("utf-8")).hexdigest()
+    updated_at = int(store.updated_at.timestamp() * 1_000_000) if store.updated_at else 0
+    return f"{STOREFRONT_CACHE_PREFIX}:{store.pk}:{store.content_version}:{updated_at}:{viewer_class}:{digest}"
+
+
+def get_cached_storefront(key: str):
+    return cache.get(key)
+
+
+def set_cached_storefront(key: str, payload) -> None:
+    cache.set(key, payload, STOREFRONT_CACHE_TIMEOUT)
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stores", "0010_store_partner_entry_copy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="store",
+            name="content_version",
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name="内容版本"),
+        ),
+    ]
@@ -6,29 +6,61 @@ from django.db import models
 from django.db.models import Q
 
 
+# 主店解析结果按进程缓存，Store 保存/删除及 migrate/flush 后清空（见 stores.signals）
+_main_store_cache = {}
+
+
+def _store_column_names():
+    # 迁移过程中 stores_store 可能缺少后续迁移新增的列，创建主店前只做一次表结构检查
+    column_names = _main_store_cache.get("columns")
+    if column_names is None:
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            column_names = {
+                column.name
+                for column in connection.introspection.get_table_description(cursor, Store._meta.db_table)
+            }
+        _main_store_cache["columns"] = column_names
+    return column_names
+
+
 def get_main_store_pk():
-    from django.db import connection
-
-    table_name = Store._meta.db_table
-    column_names = {
-        column.name
-        for column in connection.introspection.get_table_description(connection.cursor(), table_name)
-    }
-    defaults = {
-        "name": Store.MAIN_STORE_CODE,
-        "status": Store.STATUS_ACTIVE,
-        "is_main": True,
-        "allow_haier": True,
-    }
-    if "store_type" in column_names:
-        defaults["store_type"] = Store.TYPE_SELF_OPERATED
-    if "show_on_home" in column_names:
-        defaults["show_on_home"] = True
-    if "is_visible" in column_names:
-        defaults["is_visible"] = True
-
-    store, _ = Store.objects.only("id").get_or_create(code=Store.MAIN_STORE_CODE, defaults=defaults)
-    return store.pk
+    pk = _main_store_cache.get("pk")
+    if pk is not None:
+        return pk
+
+    pk = Store.objects.filter(code=Store.MAIN_STORE_CODE).values_list("pk", flat=True).first()
+    if pk is None:
+        column_names = _store_column_names()
+        defaults = {
+            "name": Store.MAIN_STORE_CODE,
+            "status": Store.STATUS_ACTIVE,
+            "is_main": True,
+            "allow_haier": True,
+        }
+        if "store_type" in column_names:
+            defaults["store_type"] = Store.TYPE_SELF_OPERATED
+        if "show_on_home" in column_names:
+            defaults["show_on_home"] = True
+        if "is_visible" in column_names:
+            defaults["is_visible"] = True
+
+        store, _ = Store.objects.only("id").get_or_create(code=Store.MAIN_STORE_CODE, defaults=defaults)
+        pk = store.pk
+    _main_store_cache["pk"] = pk
+    return pk
+
+
+def get_main_store_id():
+    """is_main=True 的店铺 ID（不存在时为 None），按进程缓存"""
+    if "main_id" not in _main_store_cache:
+        _main_store_cache["main_id"] = Store.objects.filter(is_main=True).values_list("pk", flat=True).first()
+    return _main_store_cache["main_id"]
+
+
+def clear_main_store_cache():
+    _main_store_cache.clear()
 
 
 class Store(models.Model):
@@ -66,6 +98,7 @@ class Store(models.Model):
     address = models.CharField(max_length=255, blank=True, default="", verbose_name="地址")
     allow_haier = models.BooleanField(default=False, verbose_name="启用海尔能力")
     show_customer_group_name = models.BooleanField(default=False, verbose_name="小程序展示客户分组名称")
+    content_version = models.PositiveBigIntegerField(default=0, editable=False, verbose_name="内容版本")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
 
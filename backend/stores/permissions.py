@@ -1,7 +1,7 @@
 from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework.exceptions import PermissionDenied, ValidationError
 
-from .models import Store, StoreMember
+from .models import Store, StoreMember, get_main_store_id
 
 
 PERMISSION_DASHBOARD_VIEW = "dashboard.view"
@@ -58,6 +58,15 @@ ROLE_PERMISSION_PRESETS = {
 def is_platform_admin(user) -> bool:
     if not user or not getattr(user, "is_authenticated", False):
         return False
+    # 认证时已从缓存带出（users.authentication），同一请求内也只查询一次
+    cached = getattr(user, "_is_platform_admin", None)
+    if cached is None:
+        cached = compute_platform_admin(user)
+        user._is_platform_admin = cached
+    return cached
+
+
+def compute_platform_admin(user) -> bool:
     if getattr(user, "is_superuser", False):
         return True
     return StoreMember.objects.filter(
@@ -191,9 +200,9 @@ def get_requested_store(request, *, required=False, allow_public=False):
 
 
 def _filter_main_store(queryset, filter_key):
-    main_store = Store.objects.filter(is_main=True).first()
-    if main_store:
-        return queryset.filter(**{filter_key: main_store.id})
+    main_store_id = get_main_store_id()
+    if main_store_id:
+        return queryset.filter(**{filter_key: main_store_id})
     return queryset
 
 
@@ -15,46 +15,64 @@ def _normalized_phone(user) -> str:
 
 
 def get_customer_group_membership(user, store: Store):
-    if not user or not getattr(user, "is_authenticated", False) or store is None:
+    if store is None:
         return None
+    return get_customer_group_memberships(user, [store]).get(store.id)
 
-    membership = (
-        StoreCustomerGroupMember.objects.select_related("group", "store")
-        .filter(
-            store=store,
-            user=user,
-            status=StoreCustomerGroupMember.STATUS_ACTIVE,
-            group__status="active",
-            group__store__status=Store.STATUS_ACTIVE,
-        )
-        .first()
-    )
-    if membership:
-        return membership
 
-    phone = _normalized_phone(user)
-    if not phone:
-        return None
+def get_customer_group_memberships(user, stores):
+    """批量查询用户在多个店铺的有效客户归组，返回 {店铺ID: 归组}。
 
-    pending = (
-        StoreCustomerGroupMember.objects.select_related("group", "store")
-        .filter(
-            store=store,
-            user__isnull=True,
-            phone=phone,
-            status=StoreCustomerGroupMember.STATUS_ACTIVE,
-            group__status="active",
-            group__store__status=Store.STATUS_ACTIVE,
-        )
-        .first()
-    )
+    先按用户查询；未归组的店铺再按手机号匹配待认领的归组，并认领到当前用户。
+    """
+    store_ids = {store.id for store in stores if store is not None}
+    if not user or not getattr(user, "is_authenticated", False) or not store_ids:
+        return {}
+
+    active = {
+        "status": StoreCustomerGroupMember.STATUS_ACTIVE,
+        "group__status": "active",
+        "group__store__status": Store.STATUS_ACTIVE,
+    }
+    memberships = {}
+    for membership in StoreCustomerGroupMember.objects.select_related("group", "store").filter(
+        store_id__in=store_ids, user=user, **active
+    ):
+        memberships.setdefault(membership.store_id, membership)
+
+    phone = _normalized_phone(user)
+    missing = store_ids - memberships.keys()
+    if not phone or not missing:
+        return memberships
+
+    pending = {}
+    for membership in StoreCustomerGroupMember.objects.select_related("group", "store").filter(
+        store_id__in=missing, user__isnull=True, phone=phone, **active
+    ):
+        pending.setdefault(membership.store_id, membership)
     if not pending:
-        return None
+        return memberships
 
-    if not StoreCustomerGroupMember.objects.filter(store=store, user=user).exists():
-        pending.user = user
-        pending.save(update_fields=["user", "updated_at"])
-    return pending
+    claimed = set(
+        StoreCustomerGroupMember.objects.filter(store_id__in=pending.keys(), user=user).values_list("store_id", flat=True)
+    )
+    for store_id, membership in pending.items():
+        if store_id not in claimed:
+            membership.user = user
+            membership.save(update_fields=["user", "updated_at"])
+        memberships[store_id] = membership
+    return memberships
+
+
+def get_customer_group_prices(memberships, product_ids):
+    """批量读取客户组价，返回 {(分组ID, 商品ID, SKU ID 或 None): 价格}"""
+    group_ids = {membership.group_id for membership in memberships}
+    if not group_ids or not product_ids:
+        return {}
+    rows = StoreCustomerGroupPrice.objects.filter(group_id__in=group_ids, product_id__in=product_ids).values_list(
+        "group_id", "product_id", "sku_id", "price"
+    )
+    return {(group_id, product_id, sku_id): Decimal(price) for group_id, product_id, sku_id, price in rows}
 
 
 def resolve_customer_group_price(user, product, sku=None):
@@ -81,7 +99,10 @@ def resolve_customer_group_price(user, product, sku=None):
 def get_customer_group_price_context(user, product):
     if not product:
         return EMPTY_CUSTOMER_GROUP_CONTEXT.copy()
-    membership = get_customer_group_membership(user, getattr(product, "store", None))
+    return customer_group_context(get_customer_group_membership(user, getattr(product, "store", None)))
+
+
+def customer_group_context(membership):
     if not membership:
         return EMPTY_CUSTOMER_GROUP_CONTEXT.copy()
     return {
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from users.authentication import bump_token_version
+
+from .models import Store, StoreMember, clear_main_store_cache
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def invalidate_main_store_cache(sender, instance, **kwargs):
+    clear_main_store_cache()
+    if instance.is_main:
+        # 主店铺状态决定成员是否为平台管理员
+        bump_token_version(list(StoreMember.objects.filter(store=instance).values_list('user_id', flat=True)))
+
+
+@receiver(post_save, sender=StoreMember)
+@receiver(post_delete, sender=StoreMember)
+def invalidate_member_principal(sender, instance, **kwargs):
+    bump_token_version([instance.user_id])
+
+
+@receiver(post_migrate)
+def invalidate_main_store_cache_after_migrate(sender, **kwargs):
+    # migrate / flush（含 TransactionTestCase 清表）不会触发 Store 的 delete 信号
+    clear_main_store_cache()
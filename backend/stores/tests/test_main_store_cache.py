@@ -0,0 +1,50 @@
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from catalog.models import Brand, Category, Product
+from orders.models import Order
+from stores.models import Store, clear_main_store_cache, get_main_store_id, get_main_store_pk
+from stores.permissions import filter_queryset_by_store
+
+
+class MainStoreCacheTests(TestCase):
+    def setUp(self):
+        clear_main_store_cache()
+        self.addCleanup(clear_main_store_cache)
+        self.main_store = Store.objects.get(code=Store.MAIN_STORE_CODE)
+
+    def test_bulk_object_construction_issues_no_queries(self):
+        self.assertEqual(get_main_store_pk(), self.main_store.pk)
+
+        with self.assertNumQueries(0):
+            products = [Product(name=f"p{i}") for i in range(100)]
+            categories = [Category(name=f"c{i}") for i in range(20)]
+            brands = [Brand(name=f"b{i}") for i in range(20)]
+            orders = [Order() for _ in range(20)]
+
+        for obj in (products[0], categories[-1], brands[0], orders[-1]):
+            self.assertEqual(obj.store_id, self.main_store.pk)
+
+    def test_store_filter_reuses_cached_main_store(self):
+        request = Request(APIRequestFactory().get("/api/catalog/products/"))
+        get_main_store_id()
+
+        with self.assertNumQueries(0):
+            queryset = filter_queryset_by_store(Product.objects.all(), request)
+        self.assertIn(f'"store_id" = {self.main_store.pk}', str(queryset.query))
+
+    def test_store_save_and_delete_invalidate_cache(self):
+        self.assertEqual(get_main_store_id(), self.main_store.pk)
+
+        self.main_store.is_main = False
+        self.main_store.allow_haier = False
+        self.main_store.save()
+        self.assertIsNone(get_main_store_id())
+
+        other = Store.objects.create(name="Other", code="other-main", is_main=True)
+        self.assertEqual(get_main_store_id(), other.pk)
+        other.delete()
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_main_store_id())
+        self.assertEqual(get_main_store_pk(), self.main_store.pk)
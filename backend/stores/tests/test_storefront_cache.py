@@ -0,0 +1,98 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from catalog.models import Brand, Category, Product, ProductSKU
+from stores.models import Store
+from users.models import User
+
+
+class StorefrontContentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.store = Store.objects.create(
+            name="Zhibang",
+            code="zhibang",
+            store_type=Store.TYPE_PARTNER,
+            show_on_home=True,
+        )
+        major = Category.objects.create(name="major", level=Category.LEVEL_MAJOR, store=self.store)
+        self.category = Category.objects.create(
+            name="minor",
+            level=Category.LEVEL_MINOR,
+            parent=major,
+            store=self.store,
+        )
+        self.brand = Brand.objects.create(name="brand", store=self.store)
+        self.product = Product.objects.create(
+            name="Cached product",
+            category=self.category,
+            brand=self.brand,
+            store=self.store,
+            price=Decimal("100.00"),
+            stock=10,
+        )
+        self.url = f"/api/stores/public/{self.store.id}/detail/"
+
+    def tearDown(self):
+        cache.clear()
+
+    def _version(self):
+        return Store.objects.values_list("content_version", flat=True).get(pk=self.store.pk)
+
+    def test_anonymous_repeat_visit_only_queries_store_row(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+
+    def test_catalog_writes_bump_store_content_version(self):
+        start = self._version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed"
+            self.product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSKU.objects.create(product=self.product, name="SKU", sku_code="S1", price=Decimal("90.00"), stock=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand.name = "brand 2"
+            self.brand.save()
+
+        self.assertEqual(self._version(), start + 3)
+
+    def test_product_change_is_visible_after_commit(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed"
+            self.product.save()
+
+        response = self.client.get(self.url)
+
+        self.assertEqual([item["name"] for item in response.data["products"]], ["Renamed"])
+
+    def test_other_store_writes_do_not_bump_version(self):
+        other = Store.objects.create(name="Other", code="other", store_type=Store.TYPE_PARTNER)
+        start = self._version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Brand.objects.create(name="other brand", store=other)
+
+        self.assertEqual(self._version(), start)
+
+    def test_authenticated_viewers_bypass_cache(self):
+        user = User.objects.create_user(username="buyer", password="password")
+        self.client.force_authenticate(user)
+        self.client.get(self.url)
+
+        Product.objects.filter(pk=self.product.pk).update(name="Changed without signal")
+        response = self.client.get(self.url)
+
+        self.assertEqual([item["name"] for item in response.data["products"]], ["Changed without signal"])
@@ -5,6 +5,14 @@ from rest_framework.response import Response
 from django.db import transaction
 from django.db.models import Count, Q
 
+from common.utils import parse_int
+
+from .content_cache import (
+    build_storefront_cache_key,
+    get_cached_storefront,
+    get_viewer_class,
+    set_cached_storefront,
+)
 from .models import (
     PartnerEntryConfig,
     Store,
@@ -89,6 +97,20 @@ class PublicStoreDetailAPIView(generics.RetrieveAPIView):
 
     def retrieve(self, request, *args, **kwargs):
         store = self.get_object()
+        viewer_class = get_viewer_class(request)
+        cache_key = build_storefront_cache_key(store, request, viewer_class) if viewer_class else None
+        if cache_key:
+            cached = get_cached_storefront(cache_key)
+            if cached is not None:
+                return Response(cached)
+
+        payload = self._build_payload(request, store)
+        if cache_key:
+            set_cached_storefront(cache_key, payload)
+        return Response(payload)
+
+    def _build_payload(self, request, store):
+        from catalog.category_tree import subtree_q
         from catalog.models import Brand, Category, HomeBanner, Product, SpecialZone
         from catalog.serializers import BrandSerializer, CategorySerializer, HomeBannerSerializer, ProductSerializer, SpecialZoneSerializer
 
@@ -96,42 +118,37 @@ class PublicStoreDetailAPIView(generics.RetrieveAPIView):
         category_id = request.query_params.get("category_id")
         products = Product.objects.filter(store=store, is_active=True).select_related("category", "brand").order_by("id")
         if category_id:
-            products = products.filter(
-                Q(category_id=category_id)
-                | Q(category__parent_id=category_id)
-                | Q(category__parent__parent_id=category_id)
-            )
+            category_id = parse_int(category_id)
+            products = products.filter(subtree_q(category_id)) if category_id is not None else products.none()
         brand_ids = products.values_list("brand_id", flat=True).distinct()
         brands = Brand.objects.filter(store=store, is_active=True, id__in=brand_ids).order_by("order", "id")
         new_arrivals = Product.objects.filter(store=store, is_active=True).select_related("category", "brand").order_by("-created_at", "-id")[:8]
 
-        return Response(
-            {
-                "store": PublicStoreSerializer(store, context=context).data,
-                "banners": HomeBannerSerializer(
-                    HomeBanner.objects.filter(store=store, is_active=True).order_by("order", "-id"),
-                    many=True,
-                    context=context,
-                ).data,
-                "categories": CategorySerializer(
-                    Category.objects.filter(store=store, level=Category.LEVEL_MAJOR).order_by("order", "id"),
-                    many=True,
-                    context=context,
-                ).data,
-                "brands": BrandSerializer(brands, many=True, context=context).data,
-                "special_zones": SpecialZoneSerializer(
-                    SpecialZone.objects.filter(
-                        store=store,
-                        kind__in=[SpecialZone.KIND_STORE_ACTIVITY, SpecialZone.KIND_ACTIVITY],
-                        is_active=True,
-                    ).order_by("home_order", "id"),
-                    many=True,
-                    context=context,
-                ).data,
-                "products": ProductSerializer(products[:20], many=True, context=context).data,
-                "new_arrivals": ProductSerializer(new_arrivals, many=True, context=context).data,
-            }
-        )
+        return {
+            "store": PublicStoreSerializer(store, context=context).data,
+            "banners": HomeBannerSerializer(
+                HomeBanner.objects.filter(store=store, is_active=True).order_by("order", "-id"),
+                many=True,
+                context=context,
+            ).data,
+            "categories": CategorySerializer(
+                Category.objects.filter(store=store, level=Category.LEVEL_MAJOR).order_by("order", "id"),
+                many=True,
+                context=context,
+            ).data,
+            "brands": BrandSerializer(brands, many=True, context=context).data,
+            "special_zones": SpecialZoneSerializer(
+                SpecialZone.objects.filter(
+                    store=store,
+                    kind__in=[SpecialZone.KIND_STORE_ACTIVITY, SpecialZone.KIND_ACTIVITY],
+                    is_active=True,
+                ).order_by("home_order", "id"),
+                many=True,
+                context=context,
+            ).data,
+            "products": ProductSerializer(products[:20], many=True, context=context).data,
+            "new_arrivals": ProductSerializer(new_arrivals, many=True, context=context).data,
+        }
 
 
 class StoreViewSet(viewsets.ModelViewSet):
@@ -12,7 +12,7 @@ class SupportMessageInline(admin.TabularInline):
 
 @admin.register(SupportConversation)
 class SupportConversationAdmin(admin.ModelAdmin):
-    list_display = ("id", "store", "user", "updated_at", "last_user_message_at", "last_support_message_at")
+    list_display = ("id", "store", "user", "updated_at", "last_message_at", "last_message_role", "staff_unread_count")
     list_filter = ("store", "updated_at", "last_user_message_at", "last_support_message_at")
     search_fields = ("user__username", "user__phone", "user__openid")
     readonly_fields = (
@@ -23,6 +23,11 @@ class SupportConversationAdmin(admin.ModelAdmin):
         "last_user_entered_at",
         "last_support_message_at",
         "last_auto_reply_at",
+        "last_message_at",
+        "last_message_role",
+        "last_message_preview",
+        "user_unread_count",
+        "staff_unread_count",
     )
     inlines = [SupportMessageInline]
 
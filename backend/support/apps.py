@@ -5,3 +5,6 @@ class SupportConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'support'
     verbose_name = '客服管理'
+
+    def ready(self):
+        from . import signals  # noqa: F401
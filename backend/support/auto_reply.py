@@ -0,0 +1,177 @@
+"""客服自动回复规则引擎
+
+每个店铺启用的自动回复模板编译成一份规则表，只在模板变化（店铺规则版本号变化）时重建：
+- 首次联系：按排序找到第一个"首次联系"类模板，它之前的闲置类模板保留为候选；
+- 闲置联系：闲置类模板只保留"闲置分钟数比排在前面的都小"的那些，闲置分钟数严格递减，
+  匹配时二分查找即可得到排序最靠前且已满足闲置条件的模板，与模板数量无关。
+
+编译结果按进程缓存，版本号取自数据库（店铺模板数量与最近更新时间），所有 worker 都能
+立即看到模板变化。发送频率同样以数据库为准：会话每日条数记在会话行上（随自动回复的
+UPDATE 一起递增），用户冷却期由会话的最后自动回复时间判断。
+"""
+
+import bisect
+import threading
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+from django.db.models import Case, Count, F, Max, Value, When
+from django.utils import timezone
+
+from .models import SupportConversation, SupportReplyTemplate
+
+AUTO_REPLY_TZ = ZoneInfo('Asia/Shanghai')
+
+
+class AutoReplyRule:
+    """编译后的自动回复模板，字段与 SupportReplyTemplate 同名"""
+
+    __slots__ = (
+        'id', 'title', 'content', 'content_type', 'content_payload', 'trigger_event',
+        'idle_minutes', 'daily_limit', 'user_cooldown_days',
+    )
+
+    def __init__(self, template):
+        for name in self.__slots__:
+            setattr(self, name, getattr(template, name))
+
+    def debug_info(self):
+        return {
+            'id': self.id,
+            'trigger_event': self.trigger_event,
+            'idle_minutes': self.idle_minutes,
+            'daily_limit': self.daily_limit,
+            'user_cooldown_days': self.user_cooldown_days,
+        }
+
+
+class _IdleIndex:
+    """闲置分钟数严格递减的候选模板，按"已闲置分钟数"查找排序最靠前的可用模板"""
+
+    def __init__(self, rules):
+        self.rules = []
+        for rule in rules:
+            if not rule.idle_minutes:
+                continue
+            if self.rules and rule.idle_minutes >= self.rules[-1].idle_minutes:
+                continue
+            self.rules.append(rule)
+        # bisect 需要升序键
+        self._keys = [-rule.idle_minutes for rule in self.rules]
+
+    def match(self, idle_minutes):
+        index = bisect.bisect_left(self._keys, -idle_minutes)
+        return self.rules[index] if index < len(self.rules) else None
+
+
+class CompiledAutoReplyRules:
+    def __init__(self, templates):
+        templates = list(templates)
+        self.count = len(templates)
+        rules = [AutoReplyRule(template) for template in templates]
+        idle_triggers = {SupportReplyTemplate.TRIGGER_IDLE, SupportReplyTemplate.TRIGGER_BOTH}
+        first_triggers = {SupportReplyTemplate.TRIGGER_FIRST, SupportReplyTemplate.TRIGGER_BOTH}
+
+        self.first_rule = None
+        before_first = []
+        for rule in rules:
+            if rule.trigger_event in first_triggers:
+                self.first_rule = rule
+                break
+            if rule.trigger_event in idle_triggers:
+                before_first.append(rule)
+        self.first_idle = _IdleIndex(before_first)
+        self.returning_idle = _IdleIndex(rule for rule in rules if rule.trigger_event in idle_triggers)
+
+    def match(self, had_user_messages, last_user_entered_at, last_auto_reply_at, now):
+        """返回 (模板, 结果说明)"""
+        idle_index = self.returning_idle if had_user_messages else self.first_idle
+        if last_user_entered_at and idle_index.rules:
+            idle = now - last_user_entered_at
+            if last_auto_reply_at:
+                idle = min(idle, now - last_auto_reply_at)
+            rule = idle_index.match(idle / timedelta(minutes=1))
+            if rule is not None:
+                return rule, 'idle_matched'
+        if not had_user_messages and self.first_rule is not None:
+            return self.first_rule, 'first_contact_matched'
+        return None, 'no_match'
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def _rules_version(store_id):
+    """店铺模板的版本：数量变化覆盖删除，最近更新时间覆盖新增与修改"""
+    version = SupportReplyTemplate.objects.filter(store_id=store_id).aggregate(
+        count=Count('id'), changed_at=Max('updated_at'),
+    )
+    return version['count'], version['changed_at']
+
+
+def get_auto_reply_rules(store_id) -> CompiledAutoReplyRules:
+    version = _rules_version(store_id)
+    entry = _compiled.get(store_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    rules = CompiledAutoReplyRules(
+        SupportReplyTemplate.objects.filter(
+            store_id=store_id,
+            enabled=True,
+            template_type=SupportReplyTemplate.TYPE_AUTO,
+        ).order_by('sort_order', 'id')
+    )
+    with _compiled_lock:
+        _compiled[store_id] = (version, rules)
+    return rules
+
+
+# ----------------------------------------------------------------------
+# 发送频率
+# ----------------------------------------------------------------------
+
+def _local_date(value):
+    return timezone.localtime(value, AUTO_REPLY_TZ).date()
+
+
+def _daily_count(conversation, now):
+    if conversation.auto_reply_date != _local_date(now):
+        return 0
+    return conversation.auto_reply_count
+
+
+def _in_user_cooldown(conversation, days, now):
+    cutoff = now - timedelta(days=days)
+    if conversation.last_auto_reply_at and conversation.last_auto_reply_at >= cutoff:
+        return True
+    return SupportConversation.objects.filter(
+        user_id=conversation.user_id,
+        last_auto_reply_at__gte=cutoff,
+    ).exclude(pk=conversation.pk).exists()
+
+
+def is_rate_limited(conversation, rule, now):
+    if rule.daily_limit and rule.daily_limit > 0:
+        if rule.daily_limit == 1:
+            if conversation.last_auto_reply_at and _local_date(conversation.last_auto_reply_at) == _local_date(now):
+                return True
+        elif _daily_count(conversation, now) >= rule.daily_limit:
+            return True
+
+    if rule.user_cooldown_days and rule.user_cooldown_days > 0:
+        if _in_user_cooldown(conversation, rule.user_cooldown_days, now):
+            return True
+    return False
+
+
+def auto_reply_counter_fields(now):
+    """自动回复发出时随会话 UPDATE 一起写入的计数字段：同一天递增，跨天从 1 重新计数"""
+    today = _local_date(now)
+    return {
+        'auto_reply_date': today,
+        'auto_reply_count': Case(
+            When(auto_reply_date=today, then=F('auto_reply_count') + 1),
+            default=Value(1),
+        ),
+    }
@@ -0,0 +1,410 @@
+"""客服会话消息推送
+
+SupportChatViewSet.create 等写入消息后，把序列化好的消息按会话扇出给订阅者，
+stream（SSE）和 poll（长轮询）接口挂在订阅上等待，而不是由客户端反复调用 list。
+
+广播器可通过 SUPPORT_CHAT_BROKER 切换：
+- DatabaseChatBroker（默认）：本进程发布的消息直接分发，其他进程（worker/主机）写入的消息
+  通过每 SUPPORT_CHAT_DB_POLL_INTERVAL 秒比对会话上的最后消息冗余字段发现，适用于任意部署；
+- InProcessChatBroker：仅进程内分发，只适合单进程部署或开发环境；
+- LocalSocketChatBroker：同机多 worker 通过 SUPPORT_CHAT_SOCKET_DIR 下的 Unix 数据报套接字互相转发。
+
+不带 message 的 RELOAD_EVENT 只表示"会话有新消息"，订阅方据此重新按游标加载。
+
+订阅在事件循环中创建时用 asyncio.Queue（ASGI 流式响应），否则用线程队列（WSGI / 长轮询）。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+SSE_RETRY_MILLISECONDS = 3000
+RELOAD_EVENT = {'id': 0, 'reload': True}
+
+
+class ChatSubscription:
+    """单个会话的订阅，支持同步 get 和异步 aget。"""
+
+    def __init__(self, broker, conversation_id, loop=None):
+        self.broker = broker
+        self.conversation_id = conversation_id
+        self.loop = loop
+        self.queue = asyncio.Queue() if loop else queue.Queue()
+
+    def deliver(self, event):
+        if self.loop is None:
+            self.queue.put_nowait(event)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # 事件循环已关闭，连接已断开
+            self.close()
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except (queue.Empty, asyncio.QueueEmpty):
+                return events
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InProcessChatBroker:
+    """进程内广播器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, conversation_id, loop=None) -> ChatSubscription:
+        subscription = ChatSubscription(self, int(conversation_id), loop=loop)
+        with self._lock:
+            self._subscribers.setdefault(subscription.conversation_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.conversation_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.conversation_id]
+
+    def subscriber_count(self, conversation_id=None) -> int:
+        with self._lock:
+            if conversation_id is not None:
+                return len(self._subscribers.get(int(conversation_id), ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, conversation_id, event):
+        self.deliver_local(int(conversation_id), event)
+
+    def deliver_local(self, conversation_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(conversation_id, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+class _PollingChatSubscription(ChatSubscription):
+    """等待推送的同时定期比对会话状态，状态变化时返回 RELOAD_EVENT"""
+
+    def __init__(self, broker, conversation_id, loop=None):
+        super().__init__(broker, conversation_id, loop=loop)
+        self.state = broker.conversation_state(self.conversation_id) if loop is None else None
+
+    def _changed(self, state):
+        changed, self.state = state != self.state, state
+        return changed
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.broker.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            event = super().get(timeout=wait)
+            if event is not None:
+                return event
+            if self._changed(self.broker.conversation_state(self.conversation_id)):
+                return dict(RELOAD_EVENT)
+
+    async def aget(self, timeout=None):
+        from asgiref.sync import sync_to_async
+
+        # 事件循环中不能同步查询，订阅时没有取初始状态，首次比对会多触发一次重新加载
+        load_state = sync_to_async(self.broker.conversation_state)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.broker.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            event = await super().aget(timeout=wait)
+            if event is not None:
+                return event
+            if self._changed(await load_state(self.conversation_id)):
+                return dict(RELOAD_EVENT)
+
+
+class DatabaseChatBroker(InProcessChatBroker):
+    """跨进程广播器：本进程内直接分发，其他进程写入的消息靠轮询会话的最后消息字段发现
+
+    每个等待中的订阅每 poll_interval 秒执行一次按主键的会话查询，不依赖共享内存或
+    同机套接字，多 worker、多主机部署都能收到消息。
+    """
+
+    def __init__(self, poll_interval=None):
+        super().__init__()
+        self.poll_interval = float(
+            poll_interval or getattr(settings, 'SUPPORT_CHAT_DB_POLL_INTERVAL', 2)
+        )
+
+    def subscribe(self, conversation_id, loop=None) -> ChatSubscription:
+        subscription = _PollingChatSubscription(self, int(conversation_id), loop=loop)
+        with self._lock:
+            self._subscribers.setdefault(subscription.conversation_id, set()).add(subscription)
+        return subscription
+
+    @staticmethod
+    def conversation_state(conversation_id):
+        from .models import SupportConversation
+
+        # 未读数每条新消息都会递增，即使两条消息时间戳相同也能发现变化
+        return SupportConversation.objects.filter(pk=conversation_id).values_list(
+            'last_message_at', 'user_unread_count', 'staff_unread_count',
+        ).first()
+
+
+class LocalSocketChatBroker(InProcessChatBroker):
+    """同机多进程广播器
+
+    每个进程在 socket_dir 下绑定一个 Unix 数据报套接字并用后台线程接收；发布时除了
+    本进程直接分发，还向目录下其他进程的套接字各发送一份，连不上的套接字视为已退出并清理。
+    """
+
+    def __init__(self, socket_dir=None):
+        super().__init__()
+        self.socket_dir = socket_dir or getattr(settings, 'SUPPORT_CHAT_SOCKET_DIR', '/tmp/support-chat')
+        self._sock = None
+        self._path = None
+        self._start_lock = threading.Lock()
+
+    def subscribe(self, conversation_id, loop=None) -> ChatSubscription:
+        self._ensure_listener()
+        return super().subscribe(conversation_id, loop=loop)
+
+    def publish(self, conversation_id, event):
+        conversation_id = int(conversation_id)
+        self.deliver_local(conversation_id, event)
+        data = json.dumps(
+            {'conversation_id': conversation_id, 'event': event}, cls=DjangoJSONEncoder
+        ).encode('utf-8')
+        try:
+            names = os.listdir(self.socket_dir)
+        except FileNotFoundError:
+            return
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            for name in names:
+                if not name.endswith('.sock'):
+                    continue
+                path = os.path.join(self.socket_dir, name)
+                if path == self._path:
+                    continue
+                try:
+                    sender.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    self._remove_stale(path)
+                except OSError as exc:
+                    logger.warning(f'客服消息转发失败: {path}: {exc}')
+        finally:
+            sender.close()
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+        if self._path:
+            self._remove_stale(self._path)
+            self._path = None
+
+    def _ensure_listener(self):
+        if self._sock is not None:
+            return
+        with self._start_lock:
+            if self._sock is not None:
+                return
+            os.makedirs(self.socket_dir, exist_ok=True)
+            path = os.path.join(self.socket_dir, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            self._path = path
+            self._sock = sock
+            threading.Thread(target=self._listen, args=(sock,), name='support-chat-broker', daemon=True).start()
+
+    def _listen(self, sock):
+        while True:
+            try:
+                data = sock.recv(256 * 1024)
+            except OSError:
+                return
+            try:
+                payload = json.loads(data)
+                self.deliver_local(int(payload['conversation_id']), payload['event'])
+            except (ValueError, KeyError, TypeError):
+                logger.warning('客服消息转发数据无法解析')
+
+    @staticmethod
+    def _remove_stale(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_chat_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, 'SUPPORT_CHAT_BROKER', 'support.events.DatabaseChatBroker')
+                _broker = import_string(path)()
+    return _broker
+
+
+def reset_chat_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is not None and hasattr(_broker, 'close'):
+            _broker.close()
+        _broker = None
+
+
+def publish_message(message, request=None):
+    """事务提交后把消息推送给该会话的订阅者。"""
+    from .serializers import SupportMessageSerializer
+
+    event = {
+        'id': message.id,
+        'message': json.loads(
+            json.dumps(SupportMessageSerializer(message, context={'request': request}).data, cls=DjangoJSONEncoder)
+        ),
+    }
+    conversation_id = message.conversation_id
+    transaction.on_commit(lambda: get_chat_broker().publish(conversation_id, event), robust=True)
+
+
+# ----------------------------------------------------------------------
+# 事件流
+# ----------------------------------------------------------------------
+
+def format_sse(event) -> str:
+    data = json.dumps(event['message'], cls=DjangoJSONEncoder, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: message\ndata: {data}\n\n"
+
+
+def _stream_settings(wsgi=False):
+    max_seconds = getattr(settings, 'SUPPORT_CHAT_STREAM_MAX_SECONDS', 300)
+    if wsgi:
+        # WSGI 下每条连接占用一个 worker 线程，单次连接时长单独限制
+        max_seconds = min(max_seconds, getattr(settings, 'SUPPORT_CHAT_WSGI_STREAM_MAX_SECONDS', 25))
+    return getattr(settings, 'SUPPORT_CHAT_STREAM_HEARTBEAT', 15), max_seconds
+
+
+def iter_message_events(conversation_id, load_after, after_id):
+    """同步 SSE 事件流（WSGI）。
+
+    先订阅再补发 after_id 之后的历史消息，之后只等待推送；空闲时发送心跳注释，
+    连接保持 SUPPORT_CHAT_WSGI_STREAM_MAX_SECONDS 后结束，由客户端带 Last-Event-ID 重连。
+    """
+    heartbeat, max_seconds = _stream_settings(wsgi=True)
+    with get_chat_broker().subscribe(conversation_id) as subscription:
+        yield f'retry: {SSE_RETRY_MILLISECONDS}\n\n'
+        for event in load_after(after_id):
+            after_id = event['id']
+            yield format_sse(event)
+        deadline = time.monotonic() + max_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            event = subscription.get(timeout=min(heartbeat, remaining))
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            if event.get('reload'):
+                for event in load_after(after_id):
+                    after_id = event['id']
+                    yield format_sse(event)
+                continue
+            if event['id'] <= after_id:
+                continue
+            after_id = event['id']
+            yield format_sse(event)
+
+
+async def aiter_message_events(conversation_id, load_after, after_id):
+    """异步 SSE 事件流（ASGI），等待推送时不占用线程。"""
+    from asgiref.sync import sync_to_async
+
+    heartbeat, max_seconds = _stream_settings()
+    loop = asyncio.get_running_loop()
+    with get_chat_broker().subscribe(conversation_id, loop=loop) as subscription:
+        yield f'retry: {SSE_RETRY_MILLISECONDS}\n\n'
+        for event in await sync_to_async(load_after)(after_id):
+            after_id = event['id']
+            yield format_sse(event)
+        deadline = time.monotonic() + max_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            event = await subscription.aget(timeout=min(heartbeat, remaining))
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            if event.get('reload'):
+                for event in await sync_to_async(load_after)(after_id):
+                    after_id = event['id']
+                    yield format_sse(event)
+                continue
+            if event['id'] <= after_id:
+                continue
+            after_id = event['id']
+            yield format_sse(event)
+
+
+def wait_for_messages(conversation_id, load_after, after_id, timeout):
+    """长轮询：有 after_id 之后的消息立即返回，否则最多等待 timeout 秒。"""
+    with get_chat_broker().subscribe(conversation_id) as subscription:
+        events = load_after(after_id)
+        if events or timeout <= 0:
+            return events
+        if subscription.get(timeout=timeout) is None:
+            return []
+        subscription.drain()
+        return load_after(after_id)
@@ -0,0 +1,94 @@
+"""
+Backfill the denormalized last-message state on support conversations.
+
+Fills last_message_at / last_message_role / last_message_preview from each
+conversation's latest message, and staff_unread_count from the user messages
+sent after the last support reply. user_unread_count starts at 0 because read
+receipts were never recorded.
+
+Only conversations whose last_message_at is still empty are touched, so the
+command is safe to re-run, and a row that a new message has updated meanwhile
+is left alone. An interrupted run can be resumed from the last reported id.
+
+Usage:
+    python manage.py backfill_support_conversations
+    python manage.py backfill_support_conversations --chunk-size 1000 --after-id 50000
+"""
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+
+from support.models import SupportConversation, SupportMessage
+
+
+class Command(BaseCommand):
+    help = 'Fill last-message fields and unread counters on support conversations in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Conversations per chunk / transaction')
+        parser.add_argument('--after-id', type=int, default=0, help='Resume after this conversation id')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size <= 0:
+            raise CommandError('--chunk-size must be positive')
+
+        after_id = options['after_id']
+        total = 0
+        started = monotonic()
+        while True:
+            ids = list(
+                SupportConversation.objects
+                .filter(id__gt=after_id, last_message_at__isnull=True)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            chunk_started = monotonic()
+            updated = self._backfill(ids)
+            total += updated
+            after_id = ids[-1]
+            self.stdout.write(
+                f'  conversations {ids[0]}-{after_id}: {updated}/{len(ids)} updated '
+                f'in {monotonic() - chunk_started:.2f}s'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {total} conversations in {monotonic() - started:.2f}s'))
+
+    def _backfill(self, ids):
+        latest_ids = (
+            SupportMessage.objects
+            .filter(conversation_id__in=ids)
+            .values('conversation_id')
+            .annotate(last_id=Max('id'))
+            .values_list('last_id', flat=True)
+        )
+        latest = SupportMessage.objects.only(
+            'conversation_id', 'role', 'content', 'attachment_type', 'order_id', 'product_id', 'created_at',
+        ).in_bulk(list(latest_ids))
+        unread = dict(
+            SupportMessage.objects
+            .filter(conversation_id__in=ids, role='user')
+            .filter(
+                Q(conversation__last_support_message_at__isnull=True)
+                | Q(created_at__gt=F('conversation__last_support_message_at'))
+            )
+            .values('conversation_id')
+            .annotate(count=Count('id'))
+            .values_list('conversation_id', 'count')
+        )
+
+        updated = 0
+        with transaction.atomic():
+            for message in latest.values():
+                updated += SupportConversation.objects.filter(
+                    pk=message.conversation_id, last_message_at__isnull=True,
+                ).update(
+                    last_message_at=message.created_at,
+                    last_message_role=message.role,
+                    last_message_preview=message.preview_text(),
+                    staff_unread_count=unread.get(message.conversation_id, 0),
+                )
+        return updated
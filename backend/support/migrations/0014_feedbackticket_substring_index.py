@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from common.search import AddSubstringIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support', '0013_reply_template_store'),
+    ]
+
+    operations = [
+        AddSubstringIndex(model_name='feedbackticket', fields=['ticket_number', 'title', 'content', 'contact_phone']),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support', '0014_feedbackticket_substring_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supportconversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最后消息时间'),
+        ),
+        migrations.AddField(
+            model_name='supportconversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=120, verbose_name='最后消息摘要'),
+        ),
+        migrations.AddField(
+            model_name='supportconversation',
+            name='last_message_role',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='最后消息角色'),
+        ),
+        migrations.AddField(
+            model_name='supportconversation',
+            name='staff_unread_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='客服未读数'),
+        ),
+        migrations.AddField(
+            model_name='supportconversation',
+            name='user_unread_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='用户未读数'),
+        ),
+        migrations.AddIndex(
+            model_name='supportconversation',
+            index=models.Index(fields=['store', 'last_message_role', 'last_message_at'], name='support_conv_store_last_idx'),
+        ),
+    ]
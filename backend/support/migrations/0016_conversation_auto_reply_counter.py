@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('support', '0015_conversation_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supportconversation',
+            name='auto_reply_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='当日自动回复数'),
+        ),
+        migrations.AddField(
+            model_name='supportconversation',
+            name='auto_reply_date',
+            field=models.DateField(blank=True, null=True, verbose_name='自动回复计数日期'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Case, F, Q, Value, When
 from django.conf import settings
 from orders.models import Order
 from catalog.models import Product
@@ -17,6 +18,14 @@ class SupportConversation(models.Model):
     last_user_entered_at = models.DateTimeField(null=True, blank=True, verbose_name='用户最后进入时间')
     last_support_message_at = models.DateTimeField(null=True, blank=True, verbose_name='客服最后消息时间')
     last_auto_reply_at = models.DateTimeField(null=True, blank=True, verbose_name='最后自动回复时间')
+    # 自动回复每日条数（按上海时区自然日计数，见 support.auto_reply）
+    auto_reply_date = models.DateField(null=True, blank=True, verbose_name='自动回复计数日期')
+    auto_reply_count = models.PositiveIntegerField(default=0, verbose_name='当日自动回复数')
+    last_message_at = models.DateTimeField(null=True, blank=True, verbose_name='最后消息时间')
+    last_message_role = models.CharField(max_length=20, blank=True, default='', verbose_name='最后消息角色')
+    last_message_preview = models.CharField(max_length=120, blank=True, default='', verbose_name='最后消息摘要')
+    user_unread_count = models.PositiveIntegerField(default=0, verbose_name='用户未读数')
+    staff_unread_count = models.PositiveIntegerField(default=0, verbose_name='客服未读数')
 
     class Meta:
         verbose_name = '客服会话'
@@ -27,8 +36,31 @@ class SupportConversation(models.Model):
             models.Index(fields=['user', 'store'], name='support_conv_user_store_idx'),
             models.Index(fields=['store', 'updated_at'], name='support_conv_store_updated_idx'),
             models.Index(fields=['updated_at'], name='support_conv_updated_idx'),
+            models.Index(fields=['store', 'last_message_role', 'last_message_at'], name='support_conv_store_last_idx'),
         ]
 
+    @classmethod
+    def record_message(cls, message):
+        """新消息写入后更新会话的最后消息与对方未读数（单条 UPDATE，并发写入时以时间最新的消息为准）"""
+        is_newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.created_at)
+
+        def latest(field, value):
+            return Case(When(is_newer, then=Value(value)), default=F(field))
+
+        unread_field = 'staff_unread_count' if message.role == 'user' else 'user_unread_count'
+        return cls.objects.filter(pk=message.conversation_id).update(
+            last_message_at=latest('last_message_at', message.created_at),
+            last_message_role=latest('last_message_role', message.role),
+            last_message_preview=latest('last_message_preview', message.preview_text()),
+            **{unread_field: F(unread_field) + 1},
+        )
+
+    @classmethod
+    def mark_read(cls, conversation_id, by_user):
+        """清零一方的未读数；已为 0 时不写库"""
+        field = 'user_unread_count' if by_user else 'staff_unread_count'
+        return cls.objects.filter(pk=conversation_id, **{f'{field}__gt': 0}).update(**{field: 0})
+
 
 class SupportReplyTemplate(models.Model):
     TYPE_AUTO = 'auto'
@@ -115,6 +147,19 @@ class SupportMessage(models.Model):
             models.Index(fields=['product'], name='support_sup_product_cd2223_idx'),
         ]
 
+    def preview_text(self):
+        """会话列表展示的消息摘要"""
+        if self.attachment_type == 'image':
+            return '[图片]'
+        if self.attachment_type == 'video':
+            return '[视频]'
+        if self.order_id:
+            return '[订单]'
+        if self.product_id:
+            return '[商品]'
+        max_length = SupportConversation._meta.get_field('last_message_preview').max_length
+        return ' '.join((self.content or '').split())[:max_length]
+
 
 class FeedbackTicket(models.Model):
     TYPE_QUESTION = 'question'
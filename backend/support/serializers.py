@@ -158,7 +158,6 @@ class SupportConversationSerializer(serializers.ModelSerializer):
     user_username = serializers.CharField(source='user.username', read_only=True)
     store_name = serializers.CharField(source='store.name', read_only=True)
     last_message = serializers.SerializerMethodField()
-    last_message_at = serializers.SerializerMethodField()
 
     class Meta:
         model = SupportConversation
@@ -172,34 +171,22 @@ class SupportConversationSerializer(serializers.ModelSerializer):
             'updated_at',
             'last_message',
             'last_message_at',
+            'last_message_role',
+            'last_message_preview',
+            'user_unread_count',
+            'staff_unread_count',
         ]
-        read_only_fields = [
-            'id',
-            'store',
-            'store_name',
-            'user',
-            'user_username',
-            'created_at',
-            'updated_at',
-            'last_message',
-            'last_message_at',
-        ]
-
-    def _get_last_message(self, obj):
-        cached = getattr(obj, 'last_message_list', None)
-        if cached:
-            return cached[0]
-        return obj.messages.order_by('-created_at').first()
+        read_only_fields = fields
 
     def get_last_message(self, obj):
-        msg = self._get_last_message(obj)
-        if not msg:
+        # 取自会话上冗余的最后消息字段，附件/订单/商品消息的 content 为 [图片] 等摘要
+        if not obj.last_message_at:
             return None
-        return SupportMessageSerializer(msg, context=self.context).data
-
-    def get_last_message_at(self, obj):
-        msg = self._get_last_message(obj)
-        return getattr(msg, 'created_at', None)
+        return {
+            'role': obj.last_message_role,
+            'content': obj.last_message_preview,
+            'created_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
 
 
 class SupportReplyTemplateSerializer(serializers.ModelSerializer):
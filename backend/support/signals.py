@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import SupportConversation, SupportMessage
+
+
+@receiver(post_save, sender=SupportMessage)
+def update_conversation_last_message(sender, instance: SupportMessage, created, raw=False, **kwargs):
+    if created and not raw:
+        SupportConversation.record_message(instance)
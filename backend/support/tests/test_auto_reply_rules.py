@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from stores.models import Store
+from support.auto_reply import get_auto_reply_rules
+from support.models import SupportConversation, SupportMessage, SupportReplyTemplate
+from support.views import _maybe_send_auto_reply_with_debug
+from users.models import User
+
+
+class AutoReplyRuleEngineTests(TestCase):
+    def setUp(self):
+        self.store = Store.objects.get(code=Store.MAIN_STORE_CODE)
+        self.user = User.objects.create_user(username="customer-rules", password="password")
+        User.objects.create_user(username="support-rules", password="password", role="support")
+        self.conversation = SupportConversation.objects.create(user=self.user, store=self.store)
+
+    def _template(self, trigger, sort_order, idle_minutes=None, **kwargs):
+        kwargs.setdefault("user_cooldown_days", 0)
+        return SupportReplyTemplate.objects.create(
+            store=self.store,
+            template_type=SupportReplyTemplate.TYPE_AUTO,
+            title=f"{trigger}-{sort_order}",
+            content=f"{trigger}-{sort_order}",
+            trigger_event=trigger,
+            idle_minutes=idle_minutes,
+            sort_order=sort_order,
+            **kwargs,
+        )
+
+    def test_rules_compile_once_and_rebuild_after_template_change(self):
+        first = self._template(SupportReplyTemplate.TRIGGER_FIRST, 1)
+        rules = get_auto_reply_rules(self.store.id)
+
+        # only the version check runs while the templates are unchanged
+        with self.assertNumQueries(1):
+            self.assertIs(get_auto_reply_rules(self.store.id), rules)
+        self.assertEqual(rules.count, 1)
+
+        self._template(SupportReplyTemplate.TRIGGER_IDLE, 2, idle_minutes=30)
+        self.assertEqual(get_auto_reply_rules(self.store.id).count, 2)
+
+        # changes written by another process are picked up from the database as well
+        SupportReplyTemplate.objects.filter(pk=first.pk).update(enabled=False, updated_at=timezone.now())
+        self.assertEqual(get_auto_reply_rules(self.store.id).count, 1)
+        SupportReplyTemplate.objects.filter(pk=first.pk).delete()
+        self.assertEqual(get_auto_reply_rules(self.store.id).count, 1)
+
+    def test_idle_match_picks_first_template_in_sort_order_that_is_due(self):
+        self._template(SupportReplyTemplate.TRIGGER_IDLE, 1, idle_minutes=120)
+        due = self._template(SupportReplyTemplate.TRIGGER_BOTH, 2, idle_minutes=30)
+        self._template(SupportReplyTemplate.TRIGGER_IDLE, 3, idle_minutes=10)
+        self._template(SupportReplyTemplate.TRIGGER_IDLE, 4, idle_minutes=60)
+        rules = get_auto_reply_rules(self.store.id)
+        now = timezone.now()
+
+        rule, reason = rules.match(True, now - timedelta(minutes=45), None, now)
+        self.assertEqual((rule.id, reason), (due.id, "idle_matched"))
+        rule, _ = rules.match(True, now - timedelta(minutes=45), now - timedelta(minutes=20), now)
+        self.assertEqual(rule.content, "idle_contact-3")
+        self.assertEqual(rules.match(True, now - timedelta(minutes=5), None, now), (None, "no_match"))
+
+    def test_first_contact_keeps_earlier_idle_templates_ahead(self):
+        self._template(SupportReplyTemplate.TRIGGER_IDLE, 1, idle_minutes=10)
+        first = self._template(SupportReplyTemplate.TRIGGER_FIRST, 2)
+        self._template(SupportReplyTemplate.TRIGGER_IDLE, 3, idle_minutes=1)
+        rules = get_auto_reply_rules(self.store.id)
+        now = timezone.now()
+
+        self.assertEqual(rules.match(False, now - timedelta(minutes=5), None, now)[0].id, first.id)
+        self.assertEqual(rules.match(False, now - timedelta(minutes=15), None, now)[0].content, "idle_contact-1")
+
+    def test_daily_limit_uses_conversation_counter_instead_of_message_history(self):
+        self._template(SupportReplyTemplate.TRIGGER_BOTH, 1, idle_minutes=1, daily_limit=2)
+        now = timezone.now()
+
+        message, debug = _maybe_send_auto_reply_with_debug(self.conversation, False, now, now)
+        self.assertEqual(debug["result"], "sent")
+        self.conversation.refresh_from_db()
+
+        later = now + timedelta(minutes=5)
+        message, debug = _maybe_send_auto_reply_with_debug(self.conversation, True, now, later)
+        self.assertEqual(debug["result"], "sent")
+        self.conversation.refresh_from_db()
+
+        self.assertEqual(self.conversation.auto_reply_count, 2)
+
+        even_later = later + timedelta(minutes=5)
+        # the rules version check is the only query; the count comes from the conversation row
+        with self.assertNumQueries(1):
+            message, debug = _maybe_send_auto_reply_with_debug(self.conversation, True, now, even_later)
+        self.assertIsNone(message)
+        self.assertEqual(debug["result"], "rate_limited")
+        self.assertEqual(SupportMessage.objects.filter(conversation=self.conversation).count(), 2)
+
+        next_day = now + timedelta(days=1)
+        message, debug = _maybe_send_auto_reply_with_debug(self.conversation, True, now, next_day)
+        self.assertEqual(debug["result"], "sent")
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.auto_reply_count, 1)
+
+    def test_user_cooldown_spans_conversations(self):
+        self._template(SupportReplyTemplate.TRIGGER_FIRST, 1, user_cooldown_days=1)
+        other_store = Store.objects.create(name="Partner", code="partner-rules", status=Store.STATUS_ACTIVE)
+        SupportReplyTemplate.objects.create(
+            store=other_store,
+            template_type=SupportReplyTemplate.TYPE_AUTO,
+            title="partner",
+            content="partner",
+            trigger_event=SupportReplyTemplate.TRIGGER_FIRST,
+            user_cooldown_days=1,
+        )
+        other = SupportConversation.objects.create(user=self.user, store=other_store)
+        now = timezone.now()
+
+        _, debug = _maybe_send_auto_reply_with_debug(self.conversation, False, now, now)
+        self.assertEqual(debug["result"], "sent")
+        _, debug = _maybe_send_auto_reply_with_debug(other, False, now, now + timedelta(hours=1))
+        self.assertEqual(debug["result"], "rate_limited")
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import tempfile
+import threading
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from stores.models import Store
+from support.events import (
+    DatabaseChatBroker,
+    InProcessChatBroker,
+    LocalSocketChatBroker,
+    aiter_message_events,
+    get_chat_broker,
+    iter_message_events,
+    reset_chat_broker,
+)
+from support.models import SupportConversation, SupportMessage
+from users.models import User
+
+
+def _data(chunk):
+    lines = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+    return int(lines["id"]), json.loads(lines["data"])
+
+
+class SupportChatStreamTests(TestCase):
+    def setUp(self):
+        reset_chat_broker()
+        self.addCleanup(reset_chat_broker)
+        self.client = APIClient()
+        self.store = Store.objects.get(code=Store.MAIN_STORE_CODE)
+        self.user = User.objects.create_user(username="customer-stream", password="password")
+        self.support = User.objects.create_user(username="support-stream", password="password", role="support")
+        self.conversation = SupportConversation.objects.create(user=self.user, store=self.store)
+
+    def test_stream_delivers_created_message_without_polling(self):
+        old = SupportMessage.objects.create(conversation=self.conversation, sender=self.user, role="user", content="old")
+        self.client.force_authenticate(self.user)
+        response = self.client.get(
+            "/api/support/chat/stream/",
+            {"conversation_id": self.conversation.id},
+            HTTP_LAST_EVENT_ID=str(old.id - 1),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = iter(response.streaming_content)
+
+        self.assertTrue(next(stream).decode().startswith("retry:"))
+        self.assertEqual(_data(next(stream).decode())[0], old.id)
+        self.assertEqual(get_chat_broker().subscriber_count(self.conversation.id), 1)
+
+        support_client = APIClient()
+        support_client.force_authenticate(self.support)
+        with self.captureOnCommitCallbacks(execute=True):
+            reply = support_client.post(
+                "/api/support/chat/",
+                {"conversation_id": self.conversation.id, "content": "客服已收到"},
+                format="json",
+            )
+        self.assertEqual(reply.status_code, 201, reply.content)
+
+        event_id, payload = _data(next(stream).decode())
+        self.assertEqual(event_id, reply.data["id"])
+        self.assertEqual(payload["content"], "客服已收到")
+        self.assertEqual(payload["role"], "support")
+        response.close()
+        self.assertEqual(get_chat_broker().subscriber_count(), 0)
+
+    def test_stream_rejects_foreign_conversation(self):
+        other = User.objects.create_user(username="other-stream", password="password")
+        self.client.force_authenticate(other)
+
+        response = self.client.get("/api/support/chat/stream/", {"conversation_id": self.conversation.id})
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_poll_returns_backlog_immediately_and_times_out_when_idle(self):
+        message = SupportMessage.objects.create(conversation=self.conversation, sender=self.user, role="user", content="hi")
+        self.client.force_authenticate(self.user)
+
+        backlog = self.client.get(
+            "/api/support/chat/poll/",
+            {"conversation_id": self.conversation.id, "after_id": 0, "timeout": 5},
+        )
+        idle = self.client.get(
+            "/api/support/chat/poll/",
+            {"conversation_id": self.conversation.id, "timeout": 0.05},
+        )
+
+        self.assertEqual(backlog.status_code, 200, backlog.content)
+        self.assertEqual([item["id"] for item in backlog.data["results"]], [message.id])
+        self.assertEqual(backlog.data["last_id"], message.id)
+        self.assertEqual(idle.data, {"results": [], "last_id": message.id})
+
+
+    @override_settings(SUPPORT_CHAT_DB_POLL_INTERVAL=0.01)
+    def test_default_broker_sees_messages_written_by_other_processes(self):
+        self.assertIsInstance(get_chat_broker(), DatabaseChatBroker)
+        loaded = []
+        stream = iter_message_events(
+            self.conversation.id, lambda after_id: [event for event in loaded if event["id"] > after_id], 0,
+        )
+        self.assertTrue(next(stream).startswith("retry:"))
+
+        # written by another worker: nothing is published to this process
+        message = SupportMessage.objects.create(conversation=self.conversation, sender=self.support, role="support", content="hi")
+        loaded.append({"id": message.id, "message": {"content": "hi"}})
+
+        self.assertEqual(_data(next(stream)), (message.id, {"content": "hi"}))
+        stream.close()
+        self.assertEqual(get_chat_broker().subscriber_count(), 0)
+
+    @override_settings(SUPPORT_CHAT_STREAM_MAX_SECONDS=300, SUPPORT_CHAT_WSGI_STREAM_MAX_SECONDS=0)
+    def test_wsgi_stream_duration_is_capped_separately(self):
+        stream = iter_message_events(self.conversation.id, lambda after_id: [], 0)
+        self.assertEqual(list(stream), ["retry: 3000\n\n"])
+
+
+class ChatBrokerTests(SimpleTestCase):
+    def test_async_stream_wakes_on_publish_from_another_thread(self):
+        broker = InProcessChatBroker()
+
+        async def consume():
+            events = aiter_message_events(7, lambda after_id: [], 0)
+            self.assertTrue((await events.__anext__()).startswith("retry:"))
+            pending = asyncio.ensure_future(events.__anext__())
+            await asyncio.sleep(0.05)
+            threading.Thread(target=broker.publish, args=(7, {"id": 3, "message": {"content": "hi"}})).start()
+            chunk = await asyncio.wait_for(pending, 2)
+            await events.aclose()
+            return chunk
+
+        with patch("support.events.get_chat_broker", return_value=broker):
+            chunk = asyncio.run(consume())
+
+        self.assertEqual(_data(chunk), (3, {"content": "hi"}))
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    def test_local_socket_broker_fans_out_across_processes(self):
+        with tempfile.TemporaryDirectory() as socket_dir:
+            listener = LocalSocketChatBroker(socket_dir)
+            publisher = LocalSocketChatBroker(socket_dir)
+            try:
+                with listener.subscribe(9) as subscription:
+                    publisher.publish(9, {"id": 1, "message": {"content": "跨进程"}})
+                    event = subscription.get(timeout=2)
+            finally:
+                listener.close()
+
+        self.assertEqual(event, {"id": 1, "message": {"content": "跨进程"}})
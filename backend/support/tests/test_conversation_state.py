@@ -0,0 +1,108 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from stores.models import Store, StoreMember
+from support.models import SupportConversation, SupportMessage
+from users.models import User
+
+
+class ConversationStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.store = Store.objects.create(name="State", code="state-chat", status=Store.STATUS_ACTIVE)
+        self.user = User.objects.create_user(username="state-customer", password="password")
+        self.admin = User.objects.create_user(username="state-admin", password="password", role="admin")
+        StoreMember.objects.create(user=self.admin, store=self.store, role=StoreMember.ROLE_STORE_ADMIN)
+
+    def conversation(self, username=None):
+        user = User.objects.create_user(username=username, password="password") if username else self.user
+        return SupportConversation.objects.create(user=user, store=self.store)
+
+    def test_message_updates_last_message_and_unread_counters(self):
+        conversation = self.conversation()
+        SupportMessage.objects.create(conversation=conversation, sender=self.user, role="user", content="  冰箱\n不制冷 ")
+        SupportMessage.objects.create(conversation=conversation, sender=self.user, role="user", content="", attachment_type="image")
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_role, "user")
+        self.assertEqual(conversation.last_message_preview, "[图片]")
+        self.assertEqual(conversation.staff_unread_count, 2)
+        self.assertEqual(conversation.user_unread_count, 0)
+
+        reply = SupportMessage.objects.create(conversation=conversation, sender=self.admin, role="support", content="已收到")
+        # an older message recorded late does not replace the latest one
+        late = SupportMessage(conversation=conversation, sender=self.user, role="user", content="迟到")
+        late.created_at = reply.created_at - timedelta(minutes=1)
+        SupportConversation.record_message(late)
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_at, reply.created_at)
+        self.assertEqual((conversation.last_message_role, conversation.last_message_preview), ("support", "已收到"))
+        self.assertEqual((conversation.staff_unread_count, conversation.user_unread_count), (3, 1))
+
+    def test_open_inbox_is_a_single_query_and_reading_clears_unread(self):
+        waiting = self.conversation()
+        answered = self.conversation("state-answered")
+        SupportMessage.objects.create(conversation=waiting, sender=self.user, role="user", content="在吗")
+        SupportMessage.objects.create(conversation=answered, sender=answered.user, role="user", content="你好")
+        SupportMessage.objects.create(conversation=answered, sender=self.admin, role="support", content="您好")
+
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/support/chat/conversations/", {"status": "open", "store_id": self.store.id})
+        self.assertEqual(response.status_code, 200, response.content)
+        rows = response.data["results"] if isinstance(response.data, dict) else response.data
+        self.assertEqual([row["id"] for row in rows], [waiting.id])
+        self.assertEqual(rows[0]["last_message"]["content"], "在吗")
+        self.assertEqual(rows[0]["staff_unread_count"], 1)
+        self.assertFalse(any('"support_supportmessage"' in q["sql"] for q in queries.captured_queries))
+
+        response = self.client.get("/api/support/chat/", {"conversation_id": waiting.id})
+        self.assertEqual(response.status_code, 200, response.content)
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.staff_unread_count, 0)
+
+        # a forbidden request reads nothing
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/support/chat/", {"conversation_id": answered.id}).status_code, 403)
+        answered.refresh_from_db()
+        self.assertEqual(answered.user_unread_count, 1)
+
+        self.client.force_authenticate(answered.user)
+        self.client.get("/api/support/chat/", {"conversation_id": answered.id})
+        answered.refresh_from_db()
+        self.assertEqual((answered.user_unread_count, answered.staff_unread_count), (0, 1))
+
+    def test_backfill_command_fills_existing_conversations(self):
+        conversation = self.conversation()
+        empty = self.conversation("state-empty")
+        SupportMessage.objects.create(conversation=conversation, sender=self.user, role="user", content="旧消息")
+        reply = SupportMessage.objects.create(conversation=conversation, sender=self.admin, role="support", content="回复")
+        SupportMessage.objects.create(conversation=conversation, sender=self.user, role="user", content="还有问题")
+        SupportConversation.objects.filter(pk=conversation.pk).update(last_support_message_at=reply.created_at)
+        # as if the rows predate the denormalized columns
+        SupportConversation.objects.update(
+            last_message_at=None, last_message_role="", last_message_preview="", staff_unread_count=0, user_unread_count=0,
+        )
+        SupportMessage.objects.filter(content="还有问题").update(created_at=reply.created_at + timedelta(seconds=1))
+
+        out = StringIO()
+        call_command("backfill_support_conversations", chunk_size=1, stdout=out)
+        call_command("backfill_support_conversations", stdout=out)
+
+        conversation.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(conversation.last_message_preview, "还有问题")
+        self.assertEqual(conversation.last_message_role, "user")
+        self.assertEqual(conversation.staff_unread_count, 1)
+        self.assertIsNone(empty.last_message_at)
+        self.assertIn("Backfilled 0 conversations", out.getvalue().splitlines()[-1])
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase
 from rest_framework.test import APIClient
 
@@ -8,6 +9,8 @@ from users.models import User
 
 class StoreSupportChatTests(TestCase):
     def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
         self.client = APIClient()
         self.main_store = Store.objects.get(code=Store.MAIN_STORE_CODE)
         self.store = Store.objects.create(name="Partner", code="partner-chat", status=Store.STATUS_ACTIVE)
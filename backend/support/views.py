@@ -1,11 +1,13 @@
 import json
 import logging
 import uuid
-from datetime import timedelta, datetime, time
-from zoneinfo import ZoneInfo
+from datetime import timedelta
+from django.conf import settings
 from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
 from django.db import models
-from django.db.models import Prefetch, Subquery, OuterRef, Q
+from django.db.models import Max, Prefetch, Q
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from rest_framework import status, viewsets, serializers
@@ -18,7 +20,10 @@ from rest_framework.views import APIView
 from catalog.models import Product
 from common.serializers import AttachmentFileValidator, ImageFileValidator
 from common.serializers import EmptySerializer
+from common.search import SubstringSearchFilter
 from orders.models import Order
+from .auto_reply import auto_reply_counter_fields, get_auto_reply_rules, is_rate_limited
+from .events import aiter_message_events, iter_message_events, publish_message, wait_for_messages
 from .models import FeedbackTicket, FeedbackTicketReply, SupportConversation, SupportMessage, SupportReplyTemplate
 from .serializers import (
     FeedbackTicketSerializer,
@@ -153,46 +158,6 @@ def _resolve_template_content(template, content_override=None):
     return content
 
 
-def _is_auto_reply_rate_limited(conversation, template, now):
-    if template.daily_limit and template.daily_limit > 0:
-        tz = ZoneInfo('Asia/Shanghai')
-        now_local = timezone.localtime(now, tz)
-        if template.daily_limit == 1:
-            if conversation.last_auto_reply_at:
-                last_local = timezone.localtime(conversation.last_auto_reply_at, tz)
-                if last_local.date() == now_local.date():
-                    return True
-        else:
-            today = now_local.date()
-            day_start_local = datetime.combine(today, time.min, tzinfo=tz)
-            day_end_local = day_start_local + timedelta(days=1)
-            day_start_utc = day_start_local.astimezone(timezone.get_fixed_timezone(0))
-            day_end_utc = day_end_local.astimezone(timezone.get_fixed_timezone(0))
-            count = SupportMessage.objects.filter(
-                conversation=conversation,
-                template__template_type=SupportReplyTemplate.TYPE_AUTO,
-                created_at__gte=day_start_utc,
-                created_at__lt=day_end_utc
-            ).count()
-            if count >= template.daily_limit:
-                return True
-
-    if template.user_cooldown_days and template.user_cooldown_days > 0:
-        cutoff = now - timedelta(days=template.user_cooldown_days)
-        latest = (
-            SupportConversation.objects.filter(
-                user_id=conversation.user_id,
-                last_auto_reply_at__isnull=False
-            )
-            .order_by('-last_auto_reply_at')
-            .values_list('last_auto_reply_at', flat=True)
-            .first()
-        )
-        if latest and latest >= cutoff:
-            return True
-    return False
-
-
 def _send_template_message(conversation, sender, template, now, content_override=None):
     message = SupportMessage.objects.create(
         conversation=conversation,
@@ -201,7 +166,7 @@ def _send_template_message(conversation, sender, template, now, content_override
         content=_resolve_template_content(template, content_override),
         content_type=template.content_type,
         content_payload=template.content_payload,
-        template=template,
+        template_id=template.id,
         created_at=now,
     )
     SupportReplyTemplate.objects.filter(id=template.id).update(
@@ -212,6 +177,7 @@ def _send_template_message(conversation, sender, template, now, content_override
         updated_at=now,
         last_support_message_at=now,
         last_auto_reply_at=now,
+        **auto_reply_counter_fields(now),
     )
     return message
 
@@ -256,83 +222,39 @@ def _resolve_conversation_by_user_id(user_id_raw, store, ensure_conversation):
 
 
 def _maybe_send_auto_reply_with_debug(conversation, had_user_messages, last_user_entered_at, now_override=None):
-    templates = SupportReplyTemplate.objects.filter(
-        store=conversation.store,
-        enabled=True,
-        template_type=SupportReplyTemplate.TYPE_AUTO,
-    ).order_by('sort_order', 'id')
+    rules = get_auto_reply_rules(conversation.store_id)
     now = now_override or timezone.now()
     debug = {
         'now': now.isoformat(),
         'had_user_messages': had_user_messages,
         'last_user_entered_at': last_user_entered_at.isoformat() if last_user_entered_at else None,
         'last_auto_reply_at': conversation.last_auto_reply_at.isoformat() if conversation.last_auto_reply_at else None,
-        'templates_count': templates.count(),
+        'templates_count': rules.count,
         'templates': [],
     }
-    if not templates.exists():
+    if not rules.count:
         debug['result'] = 'no_templates'
         return None, debug
 
+    rule, reason = rules.match(had_user_messages, last_user_entered_at, conversation.last_auto_reply_at, now)
+    if rule is None:
+        debug['result'] = reason
+        return None, debug
+
+    template_debug = rule.debug_info()
+    template_debug['matched'] = reason
+    debug['templates'].append(template_debug)
+    if is_rate_limited(conversation, rule, now):
+        template_debug['result'] = debug['result'] = 'rate_limited'
+        return None, debug
+
     sender = _get_support_sender()
     if not sender:
         debug['result'] = 'no_sender'
         return None, debug
     debug['sender_id'] = sender.id
-
-    def _record(template_debug, result):
-        template_debug['result'] = result
-        debug['templates'].append(template_debug)
-
-    def _finish(template_debug, result, msg=None):
-        _record(template_debug, result)
-        debug['result'] = result
-        return msg, debug
-
-    def _idle_skip_reason(template):
-        if not last_user_entered_at or not template.idle_minutes:
-            return 'skipped_missing_idle_conditions'
-        if now - last_user_entered_at < timedelta(minutes=template.idle_minutes):
-            return 'skipped_idle_not_reached'
-        if conversation.last_auto_reply_at and now - conversation.last_auto_reply_at < timedelta(minutes=template.idle_minutes):
-            return 'skipped_auto_reply_recent'
-        return None
-
-    def _send_or_rate_limit(template, template_debug):
-        if _is_auto_reply_rate_limited(conversation, template, now):
-            return _finish(template_debug, 'rate_limited')
-        return _finish(template_debug, 'sent', _send_template_message(conversation, sender, template, now))
-
-    for template in templates:
-        template_debug = {
-            'id': template.id,
-            'trigger_event': template.trigger_event,
-            'idle_minutes': template.idle_minutes,
-            'daily_limit': template.daily_limit,
-            'user_cooldown_days': template.user_cooldown_days,
-        }
-        if template.trigger_event == SupportReplyTemplate.TRIGGER_FIRST:
-            if not had_user_messages:
-                return _send_or_rate_limit(template, template_debug)
-            _record(template_debug, 'skipped_had_user_messages')
-            continue
-        if template.trigger_event == SupportReplyTemplate.TRIGGER_IDLE:
-            skip_reason = _idle_skip_reason(template)
-            if skip_reason:
-                _record(template_debug, skip_reason)
-                continue
-            return _send_or_rate_limit(template, template_debug)
-        if template.trigger_event == SupportReplyTemplate.TRIGGER_BOTH:
-            if not had_user_messages:
-                return _send_or_rate_limit(template, template_debug)
-            skip_reason = _idle_skip_reason(template)
-            if skip_reason:
-                _record(template_debug, skip_reason)
-                continue
-            return _send_or_rate_limit(template, template_debug)
-        _record(template_debug, 'skipped_unknown_trigger')
-    debug['result'] = 'no_match'
-    return None, debug
+    template_debug['result'] = debug['result'] = 'sent'
+    return _send_template_message(conversation, sender, rule, now), debug
 
 
 def _maybe_send_auto_reply(conversation, had_user_messages, last_user_entered_at, now_override=None):
@@ -340,6 +262,53 @@ def _maybe_send_auto_reply(conversation, had_user_messages, last_user_entered_at
     return msg
 
 
+def _visible_messages(conversation):
+    return conversation.messages.select_related('order', 'product', 'sender', 'template').filter(
+        Q(template__isnull=True)
+        | ~Q(template__template_type=SupportReplyTemplate.TYPE_AUTO)
+        | Q(template__store=conversation.store)
+    )
+
+
+def _parse_after(value):
+    dt = parse_datetime(value) if value else None
+    if dt is not None and timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, timezone.get_current_timezone())
+    return dt
+
+
+def _message_cursor(request, conversation):
+    """推送接口的起点消息ID：Last-Event-ID > after_id > after（时间） > 当前最新消息"""
+    raw = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('after_id')
+    if raw:
+        try:
+            return int(raw), None
+        except (TypeError, ValueError):
+            return None, _bad_request('invalid after_id')
+    messages = SupportMessage.objects.filter(conversation=conversation)
+    after = _parse_after(request.query_params.get('after'))
+    if after is not None:
+        messages = messages.filter(created_at__lte=after)
+    return messages.aggregate(last_id=Max('id'))['last_id'] or 0, None
+
+
+def _mark_read(request, conversation):
+    SupportConversation.mark_read(conversation.id, by_user=conversation.user_id == request.user.id)
+
+
+def _message_loader(request, conversation):
+    limit = getattr(settings, 'SUPPORT_CHAT_STREAM_BATCH_SIZE', 100)
+
+    def load_after(after_id):
+        qs = _visible_messages(conversation).filter(id__gt=after_id).order_by('id')[:limit]
+        data = SupportMessageSerializer(qs, many=True, context={'request': request}).data
+        if data:
+            _mark_read(request, conversation)
+        return [{'id': item['id'], 'message': item} for item in data]
+
+    return load_after
+
+
 def _log_auto_reply_debug(context, conversation, request_user, triggered, debug_info):
     logger.info(
         '[SUPPORT_AUTO_REPLY_DEBUG] %s',
@@ -400,17 +369,8 @@ class SupportChatViewSet(viewsets.GenericViewSet):
         if not (_is_support_backend_user(request.user) or _is_store_backend_user(request.user)):
             return Response({'detail': 'forbidden'}, status=status.HTTP_403_FORBIDDEN)
 
-        last_message_prefetch = Prefetch(
-            'messages',
-            queryset=SupportMessage.objects.select_related('sender').order_by('-created_at')[:1],
-            to_attr='last_message_list',
-        )
-
-        qs = (
-            SupportConversation.objects.select_related('user', 'store')
-            .prefetch_related(last_message_prefetch)
-            .order_by('-updated_at', '-id')
-        )
+        # 最后消息与未读数在会话上冗余维护，列表不再关联消息表
+        qs = SupportConversation.objects.select_related('user', 'store').order_by('-updated_at', '-id')
         if not _is_support_backend_user(request.user):
             qs = qs.filter(store_id__in=get_accessible_stores(request.user).values('id'))
 
@@ -430,10 +390,8 @@ class SupportChatViewSet(viewsets.GenericViewSet):
 
         status_param = request.query_params.get('status')
         if status_param == 'open':
-            last_msg_role = SupportMessage.objects.filter(
-                conversation=OuterRef('pk')
-            ).order_by('-created_at').values('role')[:1]
-            qs = qs.annotate(last_msg_role=Subquery(last_msg_role)).filter(last_msg_role='user')
+            # 走 (store, last_message_role, last_message_at) 索引的范围扫描
+            qs = qs.filter(last_message_role='user').order_by('-last_message_at', '-id')
 
         page = self.paginate_queryset(qs)
         serializer = SupportConversationSerializer(page or qs, many=True, context={'request': request})
@@ -456,6 +414,7 @@ class SupportChatViewSet(viewsets.GenericViewSet):
         had_user_messages = SupportMessage.objects.filter(conversation=conversation, role='user').exists()
         msg, debug_info = _maybe_send_auto_reply_with_debug(conversation, had_user_messages, base_entered_at, now)
         if msg:
+            publish_message(msg, request)
             _log_auto_reply_debug('user_auto_reply', conversation, request.user, True, debug_info)
             payload = {'triggered': True, 'message': SupportMessageSerializer(msg, context={'request': request}).data}
             payload['debug'] = debug_info
@@ -465,17 +424,51 @@ class SupportChatViewSet(viewsets.GenericViewSet):
         payload['debug'] = debug_info
         return Response(payload, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'])
+    def stream(self, request):
+        """SSE 推送会话新消息，支持 Last-Event-ID 断线续传"""
+        conversation, error = self._resolve_conversation(request)
+        if error:
+            return error
+        after_id, error = _message_cursor(request, conversation)
+        if error:
+            return error
+        load_after = _message_loader(request, conversation)
+        if isinstance(request._request, ASGIRequest):
+            events = aiter_message_events(conversation.id, load_after, after_id)
+        else:
+            events = iter_message_events(conversation.id, load_after, after_id)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def poll(self, request):
+        """长轮询：返回 after_id 之后的消息，没有新消息时最多等待 timeout 秒"""
+        conversation, error = self._resolve_conversation(request)
+        if error:
+            return error
+        after_id, error = _message_cursor(request, conversation)
+        if error:
+            return error
+        max_timeout = getattr(settings, 'SUPPORT_CHAT_POLL_TIMEOUT', 25)
+        try:
+            timeout = min(float(request.query_params.get('timeout', max_timeout)), max_timeout)
+        except ValueError:
+            return _bad_request('invalid timeout')
+        events = wait_for_messages(conversation.id, _message_loader(request, conversation), after_id, timeout)
+        return Response({
+            'results': [event['message'] for event in events],
+            'last_id': events[-1]['id'] if events else after_id,
+        })
+
     def list(self, request):
         conversation, error = self._resolve_conversation(request)
         if error:
             return error
 
-        qs = conversation.messages.select_related('order', 'product', 'sender', 'template').order_by('created_at')
-        qs = qs.filter(
-            Q(template__isnull=True)
-            | ~Q(template__template_type=SupportReplyTemplate.TYPE_AUTO)
-            | Q(template__store=conversation.store)
-        )
+        qs = _visible_messages(conversation).order_by('created_at')
         after = request.query_params.get('after')
         limit = request.query_params.get('limit')
 
@@ -493,6 +486,7 @@ class SupportChatViewSet(viewsets.GenericViewSet):
             except ValueError:
                 pass
 
+        _mark_read(request, conversation)
         return Response(SupportMessageSerializer(qs, many=True, context={'request': request}).data)
 
     def create(self, request):
@@ -613,9 +607,13 @@ class SupportChatViewSet(viewsets.GenericViewSet):
             update_fields['last_support_message_at'] = now
         SupportConversation.objects.filter(id=conversation.id).update(**update_fields)
 
+        publish_message(msg, request)
+
         if role == 'user':
             auto_reply_now = _normalize_auto_reply_time(msg.created_at)
-            _maybe_send_auto_reply(conversation, had_user_messages, base_entered_at, auto_reply_now)
+            auto_msg = _maybe_send_auto_reply(conversation, had_user_messages, base_entered_at, auto_reply_now)
+            if auto_msg:
+                publish_message(auto_msg, request)
 
         return Response(SupportMessageSerializer(msg, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
@@ -654,6 +652,7 @@ class SupportConversationAutoReplyView(APIView):
         base_entered_at = conversation.last_user_entered_at or conversation.last_user_message_at or conversation.updated_at or conversation.created_at
         msg, debug_info = _maybe_send_auto_reply_with_debug(conversation, had_user_messages, base_entered_at)
         if msg:
+            publish_message(msg, request)
             _log_auto_reply_debug('staff_auto_reply', conversation, request.user, True, debug_info)
             payload = {'triggered': True, 'message': SupportMessageSerializer(msg, context={'request': request}).data}
             payload['debug'] = debug_info
@@ -673,6 +672,8 @@ class SupportApiRootView(APIView):
         return Response({
             'chat': base + 'chat/',
             'conversations': base + 'chat/conversations/',
+            'chat_stream': base + 'chat/stream/',
+            'chat_poll': base + 'chat/poll/',
             'reply_templates': base + 'reply-templates/',
             'feedback_tickets': base + 'feedback-tickets/',
             'conversation_auto_reply': base + 'conversations/{id}/auto-reply/',
@@ -684,6 +685,17 @@ class FeedbackTicketViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = FeedbackTicketSerializer
     http_method_names = ['get', 'post', 'head', 'options']
+    filter_backends = [SubstringSearchFilter]
+    substring_search_fields = {
+        ('search', 'keyword'): (
+            'ticket_number',
+            'title',
+            'content',
+            'user__username',
+            'user__phone',
+            'contact_phone',
+        ),
+    }
 
     def get_queryset(self):
         user = self.request.user
@@ -746,17 +758,6 @@ class FeedbackTicketViewSet(viewsets.ModelViewSet):
                     dt = timezone.make_aware(dt, timezone.get_current_timezone())
                 qs = qs.filter(created_at__lte=dt)
 
-        keyword = self.request.query_params.get('search') or self.request.query_params.get('keyword')
-        if keyword:
-            qs = qs.filter(
-                Q(ticket_number__icontains=keyword)
-                | Q(title__icontains=keyword)
-                | Q(content__icontains=keyword)
-                | Q(user__username__icontains=keyword)
-                | Q(user__phone__icontains=keyword)
-                | Q(contact_phone__icontains=keyword)
-            )
-
         return qs
 
     def create(self, request, *args, **kwargs):
@@ -835,7 +836,7 @@ class FeedbackTicketViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='stats')
     def stats(self, request):
-        pending_count = self.get_queryset().filter(status=FeedbackTicket.STATUS_PENDING).count()
+        pending_count = self.filter_queryset(self.get_queryset()).filter(status=FeedbackTicket.STATUS_PENDING).count()
         return Response({'pending_count': pending_count})
 
     @action(detail=True, methods=['post'], url_path='supplement')
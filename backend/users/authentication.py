@@ -0,0 +1,99 @@
+"""JWT 认证：缓存用户认证信息
+
+access token 有效期较长，simplejwt 默认每个请求都按 token 查询一次用户表。这里把
+认证所需的精简信息（id、是否启用、角色与管理标记、令牌版本、是否平台管理员）缓存
+AUTH_PRINCIPAL_CACHE_TTL 秒，命中时直接构造 User 实例，首次访问其他字段时
+一次查询加载全部其余字段（见 User.refresh_from_db）。
+
+停用账号、修改角色/管理权限或平台管理员成员关系变化时调用 bump_token_version：
+令牌版本递增并删除缓存，其他进程的本地缓存最迟在 TTL 后失效。
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+PRINCIPAL_FIELDS = ('id', 'role', 'is_active', 'is_staff', 'is_superuser', 'token_version')
+# 这些字段变化会影响鉴权结果，保存时自动递增令牌版本
+SECURITY_FIELDS = ('role', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _cache():
+    return caches[getattr(settings, 'AUTH_PRINCIPAL_CACHE_ALIAS', 'default')]
+
+
+def principal_cache_key(user_id):
+    return f'auth:principal:{user_id}'
+
+
+def invalidate_principals(user_ids):
+    keys = [principal_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        _cache().delete_many(keys)
+
+
+def bump_token_version(user_ids):
+    """递增令牌版本并删除缓存的认证信息（事务提交后再删一次，避免并发请求回填旧值）"""
+    user_ids = [user_id for user_id in user_ids if user_id]
+    if not user_ids:
+        return 0
+    updated = User.objects.filter(pk__in=user_ids).update(token_version=F('token_version') + 1)
+    invalidate_principals(user_ids)
+    transaction.on_commit(lambda: invalidate_principals(user_ids), robust=True)
+    return updated
+
+
+def load_principal(user_id):
+    """从数据库读取认证信息，返回 (user, principal)；用户不存在返回 (None, None)"""
+    from stores.permissions import compute_platform_admin
+
+    user = User.objects.only(*PRINCIPAL_FIELDS).filter(pk=user_id).first()
+    if user is None:
+        return None, None
+    principal = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+    principal['is_platform_admin'] = compute_platform_admin(user) if user.is_active else False
+    user._is_platform_admin = principal['is_platform_admin']
+    return user, principal
+
+
+def user_from_principal(principal):
+    # from_db 要求取值按模型字段顺序排列
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in principal]
+    user = User.from_db(router.db_for_read(User), fields, [principal[field] for field in fields])
+    user._is_platform_admin = principal['is_platform_admin']
+    user._principal_values = principal
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """与 JWTAuthentication 行为一致，但用户信息走缓存"""
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_FIELD != 'id':
+            # 需要比对密码哈希或按其他字段查找用户时退回默认实现
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        cache = _cache()
+        key = principal_cache_key(user_id)
+        principal = cache.get(key)
+        if principal is not None:
+            user = user_from_principal(principal)
+        else:
+            user, principal = load_principal(user_id)
+            if user is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(key, principal, getattr(settings, 'AUTH_PRINCIPAL_CACHE_TTL', 60))
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
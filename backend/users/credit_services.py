@@ -1,17 +1,133 @@
 """
 Credit account service layer for business logic
+
+欠款余额只在数据库中用 F() 表达式调整（条件 UPDATE 会锁住账户行直到事务提交），
+随后在同一事务内回读余额写入 AccountTransaction.balance_after，保证并发下单/付款
+不会丢失更新，流水上的余额也是连续的。
 """
 from decimal import Decimal
-from django.db import transaction
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Greatest
 from django.utils import timezone
-from datetime import timedelta, date
+from datetime import datetime, time, timedelta, date
+from time import monotonic
 from .models import CreditAccount, AccountStatement, AccountTransaction
 
+ZERO = Decimal('0.00')
+_MONEY = models.DecimalField(max_digits=12, decimal_places=2)
+
 
 def _last_day_of_month(d: date) -> date:
     return ((d.replace(day=28) + timedelta(days=4)).replace(day=1)) - timedelta(days=1)
 
 
+def _period_transactions(period_start, period_end):
+    # 账期按本地日期闭区间，转成时间范围以便使用 (credit_account, created_at) 索引
+    tz = timezone.get_current_timezone()
+    return AccountTransaction.objects.filter(
+        created_at__gte=datetime.combine(period_start, time.min, tzinfo=tz),
+        created_at__lt=datetime.combine(period_end + timedelta(days=1), time.min, tzinfo=tz),
+    )
+
+
+def _statement_figures(account_ids, period_start, period_end):
+    """按账户汇总账期金额，返回 {账户id: 对账单金额字段}，三条分组查询覆盖任意数量的账户"""
+    previous = dict(
+        CreditAccount.objects.filter(pk__in=account_ids).annotate(
+            previous_balance=Subquery(
+                AccountStatement.objects.filter(
+                    credit_account=OuterRef('pk'),
+                    period_end__lt=period_start,
+                ).order_by('-period_end').values('period_end_balance')[:1]
+            )
+        ).values_list('pk', 'previous_balance')
+    )
+    
+    totals = {
+        row['credit_account']: row
+        for row in _period_transactions(period_start, period_end)
+        .filter(credit_account_id__in=account_ids)
+        .values('credit_account')
+        .annotate(
+            purchases=Sum('amount', filter=Q(transaction_type='purchase')),
+            payments=Sum('amount', filter=Q(transaction_type='payment')),
+            refunds=Sum('amount', filter=Q(transaction_type='refund')),
+        )
+        .order_by()
+    }
+    
+    terms = {
+        row['credit_account']: row
+        for row in AccountTransaction.objects.filter(
+            credit_account_id__in=account_ids,
+            transaction_type='purchase',
+        )
+        .values('credit_account')
+        .annotate(
+            due=Sum('amount', filter=Q(
+                payment_status='unpaid',
+                due_date__gte=period_start,
+                due_date__lte=period_end,
+            )),
+            paid=Sum('amount', filter=Q(
+                payment_status='paid',
+                paid_date__gte=period_start,
+                paid_date__lte=period_end,
+            )),
+            overdue=Sum('amount', filter=Q(
+                payment_status='overdue',
+                due_date__lte=period_end,
+            )),
+        )
+        .order_by()
+    }
+    
+    figures = {}
+    for pk in account_ids:
+        total = totals.get(pk, {})
+        term = terms.get(pk, {})
+        previous_balance = previous.get(pk) or ZERO
+        current_purchases = total.get('purchases') or ZERO
+        current_payments = total.get('payments') or ZERO
+        current_refunds = total.get('refunds') or ZERO
+        figures[pk] = {
+            'previous_balance': previous_balance,
+            'current_purchases': current_purchases,
+            'current_payments': current_payments,
+            'current_refunds': current_refunds,
+            'period_end_balance': previous_balance + current_purchases - current_payments - current_refunds,
+            'due_within_term': term.get('due') or ZERO,
+            'paid_within_term': term.get('paid') or ZERO,
+            'overdue_amount': term.get('overdue') or ZERO,
+        }
+    return figures
+
+
+def _change_outstanding_debt(credit_account, delta, enforce_limit=False):
+    """原子地调整欠款并返回调整后的余额，需在事务内调用。
+
+    enforce_limit=True 时额度检查和扣减在同一条 UPDATE 中完成，额度不足或账户停用返回 None；
+    否则欠款减到 0 为止。
+    """
+    accounts = CreditAccount.objects.filter(pk=credit_account.pk)
+    if enforce_limit:
+        updated = accounts.filter(
+            is_active=True,
+            outstanding_debt__lte=F('credit_limit') - delta,
+        ).update(outstanding_debt=F('outstanding_debt') + delta, updated_at=timezone.now())
+    else:
+        updated = accounts.update(
+            outstanding_debt=Greatest(F('outstanding_debt') + delta, Value(ZERO), output_field=_MONEY),
+            updated_at=timezone.now(),
+        )
+    if not updated:
+        return None
+    balance = accounts.values_list('outstanding_debt', flat=True).get()
+    credit_account.outstanding_debt = balance
+    return balance
+
+
 class CreditAccountService:
     """信用账户业务逻辑服务"""
     
@@ -37,14 +153,10 @@ class CreditAccountService:
     def record_purchase(credit_account, amount, order_id, description=""):
         """记录采购交易（增加欠款）"""
         with transaction.atomic():
-            # Check if can place order
-            if not credit_account.can_place_order(amount):
+            balance = _change_outstanding_debt(credit_account, amount, enforce_limit=True)
+            if balance is None:
                 raise ValueError("信用额度不足或账户已停用")
             
-            # Update outstanding debt
-            credit_account.outstanding_debt += amount
-            credit_account.save()
-            
             target_date = timezone.now().date() + timedelta(days=credit_account.payment_term_days)
             due_date = _last_day_of_month(target_date)
             
@@ -53,7 +165,7 @@ class CreditAccountService:
                 credit_account=credit_account,
                 transaction_type='purchase',
                 amount=amount,
-                balance_after=credit_account.outstanding_debt,
+                balance_after=balance,
                 order_id=order_id,
                 due_date=due_date,
                 payment_status='unpaid',
@@ -63,43 +175,42 @@ class CreditAccountService:
             return trans
     
     @staticmethod
-    def record_payment(credit_account, amount, description=""):
+    def record_payment(credit_account, amount, description="", statement=None):
         """记录付款交易（减少欠款）"""
         with transaction.atomic():
-            # Update outstanding debt
-            credit_account.outstanding_debt -= amount
-            if credit_account.outstanding_debt < 0:
-                credit_account.outstanding_debt = 0
-            credit_account.save()
+            balance = _change_outstanding_debt(credit_account, -amount)
+            today = timezone.now().date()
             
             # Create transaction record
             trans = AccountTransaction.objects.create(
                 credit_account=credit_account,
+                statement=statement,
                 transaction_type='payment',
                 amount=amount,
-                balance_after=credit_account.outstanding_debt,
-                paid_date=timezone.now().date(),
+                balance_after=balance,
+                paid_date=today,
                 payment_status='paid',
                 description=description
             )
             
             # Mark unpaid transactions as paid (FIFO)
-            unpaid_transactions = AccountTransaction.objects.filter(
+            unpaid_transactions = AccountTransaction.objects.select_for_update().filter(
                 credit_account=credit_account,
                 transaction_type='purchase',
                 payment_status='unpaid'
-            ).order_by('created_at')
+            ).order_by('created_at', 'id').values_list('id', 'amount')
             
             remaining_payment = amount
-            for unpaid_trans in unpaid_transactions:
+            paid_ids = []
+            for trans_id, trans_amount in unpaid_transactions:
                 if remaining_payment <= 0:
                     break
                 
-                if unpaid_trans.amount <= remaining_payment:
-                    unpaid_trans.payment_status = 'paid'
-                    unpaid_trans.paid_date = timezone.now().date()
-                    unpaid_trans.save()
-                    remaining_payment -= unpaid_trans.amount
+                if trans_amount <= remaining_payment:
+                    paid_ids.append(trans_id)
+                    remaining_payment -= trans_amount
+            if paid_ids:
+                AccountTransaction.objects.filter(id__in=paid_ids).update(payment_status='paid', paid_date=today)
             
             return trans
     
@@ -107,18 +218,14 @@ class CreditAccountService:
     def record_refund(credit_account, amount, order_id, description=""):
         """记录退款交易（减少欠款）"""
         with transaction.atomic():
-            # Update outstanding debt
-            credit_account.outstanding_debt -= amount
-            if credit_account.outstanding_debt < 0:
-                credit_account.outstanding_debt = 0
-            credit_account.save()
+            balance = _change_outstanding_debt(credit_account, -amount)
             
             # Create transaction record
             trans = AccountTransaction.objects.create(
                 credit_account=credit_account,
                 transaction_type='refund',
                 amount=amount,
-                balance_after=credit_account.outstanding_debt,
+                balance_after=balance,
                 order_id=order_id,
                 payment_status='paid',
                 description=description
@@ -127,15 +234,15 @@ class CreditAccountService:
             return trans
     
     @staticmethod
-    def update_overdue_status():
-        """更新逾期状态（定时任务调用）"""
-        today = timezone.now().date()
+    def update_overdue_status(cutoff=None):
+        """更新逾期状态（定时任务调用）：到期日早于 cutoff（默认今天）的未付采购，一条 UPDATE 完成"""
+        cutoff = cutoff or timezone.localdate()
         
         # Find all unpaid transactions past due date
         overdue_transactions = AccountTransaction.objects.filter(
             transaction_type='purchase',
             payment_status='unpaid',
-            due_date__lt=today
+            due_date__lt=cutoff
         )
         
         # Update to overdue status
@@ -151,81 +258,84 @@ class AccountStatementService:
     def generate_statement(credit_account, period_start, period_end):
         """生成对账单"""
         with transaction.atomic():
-            # Get previous statement
-            previous_statement = AccountStatement.objects.filter(
-                credit_account=credit_account,
-                period_end__lt=period_start
-            ).order_by('-period_end').first()
-            
-            previous_balance = previous_statement.period_end_balance if previous_statement else Decimal('0.00')
-            
-            transactions = AccountTransaction.objects.filter(
-                credit_account=credit_account,
-                created_at__date__gte=period_start,
-                created_at__date__lte=period_end
-            )
-            
-            # Calculate amounts
-            current_purchases = sum(
-                t.amount for t in transactions if t.transaction_type == 'purchase'
-            ) or Decimal('0.00')
-            
-            current_payments = sum(
-                t.amount for t in transactions if t.transaction_type == 'payment'
-            ) or Decimal('0.00')
-            
-            current_refunds = sum(
-                t.amount for t in transactions if t.transaction_type == 'refund'
-            ) or Decimal('0.00')
-            
-            period_end_balance = previous_balance + current_purchases - current_payments - current_refunds
-            
-            due_qs = AccountTransaction.objects.filter(
-                credit_account=credit_account,
-                transaction_type='purchase',
-                payment_status='unpaid',
-                due_date__gte=period_start,
-                due_date__lte=period_end,
-            )
-            paid_qs = AccountTransaction.objects.filter(
-                credit_account=credit_account,
-                transaction_type='purchase',
-                payment_status='paid',
-                paid_date__gte=period_start,
-                paid_date__lte=period_end,
-            )
-            overdue_qs = AccountTransaction.objects.filter(
-                credit_account=credit_account,
-                transaction_type='purchase',
-                payment_status='overdue',
-                due_date__lte=period_end,
-            )
-
-            due_within_term = sum(t.amount for t in due_qs) or Decimal('0.00')
-            paid_within_term = sum(t.amount for t in paid_qs) or Decimal('0.00')
-            overdue_amount = sum(t.amount for t in overdue_qs) or Decimal('0.00')
+            figures = _statement_figures([credit_account.pk], period_start, period_end)[credit_account.pk]
             
             # Create statement
             statement = AccountStatement.objects.create(
                 credit_account=credit_account,
                 period_start=period_start,
                 period_end=period_end,
-                previous_balance=previous_balance,
-                current_purchases=current_purchases,
-                current_payments=current_payments,
-                current_refunds=current_refunds,
-                period_end_balance=period_end_balance,
-                due_within_term=due_within_term,
-                paid_within_term=paid_within_term,
-                overdue_amount=overdue_amount,
-                status='draft'
+                status='draft',
+                **figures
             )
             
             # Link transactions to statement
-            transactions.update(statement=statement)
+            _period_transactions(period_start, period_end).filter(
+                credit_account=credit_account
+            ).update(statement=statement)
             
             return statement
     
+    @staticmethod
+    def generate_statements(period_start, period_end, chunk_size=200, after_id=0):
+        """按账户 id 分批为所有经销商生成账期对账单（月结任务调用）
+
+        每批一个事务：已有该账期对账单的账户跳过，无发生额且无结余的账户不生成，
+        其余账户批量汇总、批量写入并用一条 UPDATE 关联交易。可重复执行，也可用
+        after_id 从上次中断的位置继续。逐批 yield 进度统计。
+        """
+        last_id = after_id
+        while True:
+            started = monotonic()
+            ids = list(
+                CreditAccount.objects.filter(user__role='dealer', pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return
+            with transaction.atomic():
+                existing = set(AccountStatement.objects.filter(
+                    credit_account_id__in=ids,
+                    period_start=period_start,
+                    period_end=period_end,
+                ).values_list('credit_account_id', flat=True))
+                pending = [pk for pk in ids if pk not in existing]
+                figures = _statement_figures(pending, period_start, period_end) if pending else {}
+                statements = [
+                    AccountStatement(
+                        credit_account_id=pk,
+                        period_start=period_start,
+                        period_end=period_end,
+                        status='draft',
+                        **values
+                    )
+                    for pk, values in figures.items()
+                    if any(values.values())
+                ]
+                if statements:
+                    # 并发执行时由唯一约束兜底，冲突的账户沿用已生成的对账单
+                    AccountStatement.objects.bulk_create(statements, ignore_conflicts=True)
+                    _period_transactions(period_start, period_end).filter(
+                        credit_account_id__in=[statement.credit_account_id for statement in statements],
+                    ).update(statement=Subquery(
+                        AccountStatement.objects.filter(
+                            credit_account=OuterRef('credit_account'),
+                            period_start=period_start,
+                            period_end=period_end,
+                        ).values('pk')[:1]
+                    ))
+            last_id = ids[-1]
+            yield {
+                'first_id': ids[0],
+                'last_id': last_id,
+                'accounts': len(ids),
+                'created': len(statements),
+                'existing': len(existing),
+                'empty': len(pending) - len(statements),
+                'seconds': monotonic() - started,
+            }
+    
     @staticmethod
     def confirm_statement(statement):
         """确认对账单"""
@@ -240,20 +350,24 @@ class AccountStatementService:
     
     @staticmethod
     def settle_statement(statement):
-        """结清对账单"""
-        if statement.status == 'settled':
-            raise ValueError("对账单已结清")
-        
+        """结清对账单：按期末未付记一笔付款并扣减欠款"""
         with transaction.atomic():
+            now = timezone.now()
+            settled = AccountStatement.objects.filter(pk=statement.pk).exclude(status='settled').update(
+                status='settled',
+                settled_at=now,
+                updated_at=now,
+            )
+            if not settled:
+                raise ValueError("对账单已结清")
             statement.status = 'settled'
-            statement.settled_at = timezone.now()
-            statement.save()
+            statement.settled_at = now
             
-            # Update credit account outstanding debt
-            credit_account = statement.credit_account
-            credit_account.outstanding_debt -= statement.period_end_balance
-            if credit_account.outstanding_debt < 0:
-                credit_account.outstanding_debt = 0
-            credit_account.save()
+            CreditAccountService.record_payment(
+                statement.credit_account,
+                statement.period_end_balance,
+                description=f'对账单结算: {statement.period_start} 至 {statement.period_end}',
+                statement=statement,
+            )
         
         return statement
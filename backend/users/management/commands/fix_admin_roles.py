@@ -3,6 +3,7 @@ Management command to fix admin user roles.
 This command updates all users with is_staff=True to have role='admin'.
 """
 from django.core.management.base import BaseCommand
+from users.authentication import bump_token_version
 from users.models import User
 
 
@@ -19,7 +20,9 @@ class Command(BaseCommand):
             return
         
         # Update their roles
+        user_ids = list(staff_users.values_list('id', flat=True))
         updated = staff_users.update(role='admin')
+        bump_token_version(user_ids)
         
         self.stdout.write(
             self.style.SUCCESS(
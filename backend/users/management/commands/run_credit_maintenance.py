@@ -0,0 +1,89 @@
+"""
+Month-end credit maintenance: mark overdue purchases, then generate statements for every dealer.
+
+Safe to re-run: accounts that already have a statement for the period are skipped.
+An interrupted run can be resumed from the last reported account id.
+
+Usage:
+    python manage.py run_credit_maintenance
+    python manage.py run_credit_maintenance --period-start 2026-09-01 --period-end 2026-09-30
+    python manage.py run_credit_maintenance --chunk-size 500 --after-id 12000
+    python manage.py run_credit_maintenance --skip-statements
+"""
+from datetime import date, timedelta
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from users.credit_services import AccountStatementService, CreditAccountService
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'{name} must be YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Mark overdue credit purchases and generate period statements for all dealer accounts in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period-start', help='Statement period start (default: first day of last month)')
+        parser.add_argument('--period-end', help='Statement period end (default: last day of last month)')
+        parser.add_argument('--cutoff', help='Purchases due before this date become overdue (default: today)')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Accounts per chunk / transaction')
+        parser.add_argument('--after-id', type=int, default=0, help='Resume after this credit account id')
+        parser.add_argument('--skip-overdue', action='store_true', help='Do not update overdue status')
+        parser.add_argument('--skip-statements', action='store_true', help='Do not generate statements')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        last_month_end = today.replace(day=1) - timedelta(days=1)
+        period_start = (
+            _parse_date(options['period_start'], '--period-start')
+            if options['period_start'] else last_month_end.replace(day=1)
+        )
+        period_end = (
+            _parse_date(options['period_end'], '--period-end')
+            if options['period_end'] else last_month_end
+        )
+        if period_start > period_end:
+            raise CommandError('--period-start must not be after --period-end')
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be positive')
+
+        # overdue first: statements report overdue amounts
+        if not options['skip_overdue']:
+            cutoff = _parse_date(options['cutoff'], '--cutoff') if options['cutoff'] else today
+            started = monotonic()
+            count = CreditAccountService.update_overdue_status(cutoff)
+            self.stdout.write(
+                f'Overdue: {count} transactions due before {cutoff} marked overdue '
+                f'in {monotonic() - started:.2f}s'
+            )
+
+        if options['skip_statements']:
+            return
+
+        self.stdout.write(f'Statements for {period_start} ~ {period_end}, chunk size {options["chunk_size"]}')
+        totals = {'accounts': 0, 'created': 0, 'existing': 0, 'empty': 0}
+        started = monotonic()
+        chunks = AccountStatementService.generate_statements(
+            period_start,
+            period_end,
+            chunk_size=options['chunk_size'],
+            after_id=options['after_id'],
+        )
+        for index, chunk in enumerate(chunks, start=1):
+            for key in totals:
+                totals[key] += chunk[key]
+            self.stdout.write(
+                'Chunk {index}: accounts {first_id}-{last_id} created={created} existing={existing} '
+                'empty={empty} in {seconds:.2f}s (resume with --after-id {last_id})'.format(index=index, **chunk)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Statements: accounts={accounts} created={created} existing={existing} empty={empty} '
+            'in {seconds:.2f}s'.format(seconds=monotonic() - started, **totals)
+        ))
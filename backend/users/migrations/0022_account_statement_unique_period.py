@@ -0,0 +1,93 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:05
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+ZERO = Decimal('0.00')
+
+
+def _recompute_totals(AccountStatement, AccountTransaction, statement):
+    """按关联交易重算对账单的本期发生额和期末未付。"""
+    totals = AccountTransaction.objects.filter(statement_id=statement.id).aggregate(
+        purchases=Sum('amount', filter=Q(transaction_type='purchase')),
+        payments=Sum('amount', filter=Q(transaction_type='payment')),
+        refunds=Sum('amount', filter=Q(transaction_type='refund')),
+    )
+    purchases = totals['purchases'] or ZERO
+    payments = totals['payments'] or ZERO
+    refunds = totals['refunds'] or ZERO
+    AccountStatement.objects.filter(id=statement.id).update(
+        current_purchases=purchases,
+        current_payments=payments,
+        current_refunds=refunds,
+        period_end_balance=statement.previous_balance + purchases - payments - refunds,
+    )
+
+
+def merge_duplicate_statements(apps, schema_editor):
+    """合并同一账期的重复对账单。
+
+    只删除草稿：账期内有一张已确认/已结清的对账单时保留它，否则保留最新的草稿；被删草稿的
+    交易改挂到保留的对账单并按交易重算金额。同一账期有多张非草稿对账单时无法自动判断，
+    列出冲突后中止迁移，需人工处理。
+    """
+    AccountStatement = apps.get_model('users', 'AccountStatement')
+    AccountTransaction = apps.get_model('users', 'AccountTransaction')
+    duplicated = (
+        AccountStatement.objects
+        .values('credit_account_id', 'period_start', 'period_end')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .order_by('credit_account_id', 'period_start', 'period_end')
+    )
+    groups = []
+    conflicts = []
+    for group in duplicated:
+        statements = list(
+            AccountStatement.objects
+            .filter(
+                credit_account_id=group['credit_account_id'],
+                period_start=group['period_start'],
+                period_end=group['period_end'],
+            )
+            .only('id', 'status', 'previous_balance')
+            .order_by('id')
+        )
+        finalized = [s for s in statements if s.status != 'draft']
+        if len(finalized) > 1:
+            conflicts.append((
+                group['credit_account_id'],
+                f"{group['period_start']}~{group['period_end']}",
+                [s.id for s in finalized],
+            ))
+            continue
+        groups.append((finalized[0] if finalized else statements[-1], statements))
+
+    if conflicts:
+        detail = '; '.join(
+            f'account={account_id} period={period} ids={ids}' for account_id, period, ids in conflicts
+        )
+        raise RuntimeError(f'同一账期存在多张非草稿对账单，请人工合并后重新迁移: {detail}')
+
+    for keeper, statements in groups:
+        draft_ids = [s.id for s in statements if s.id != keeper.id]
+        AccountTransaction.objects.filter(statement_id__in=draft_ids).update(statement_id=keeper.id)
+        AccountStatement.objects.filter(id__in=draft_ids, status='draft').delete()
+        _recompute_totals(AccountStatement, AccountTransaction, keeper)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_companyinfo_status_withdrawn'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_statements, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='accountstatement',
+            constraint=models.UniqueConstraint(fields=('credit_account', 'period_start', 'period_end'), name='uniq_statement_account_period'),
+        ),
+    ]
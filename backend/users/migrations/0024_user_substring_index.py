@@ -0,0 +1,15 @@
+from django.db import migrations
+
+from common.search import AddSubstringIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0023_user_token_version'),
+    ]
+
+    operations = [
+        AddSubstringIndex(model_name='user', fields=['username', 'openid', 'phone']),
+        AddSubstringIndex(model_name='companyinfo', fields=['company_name']),
+    ]
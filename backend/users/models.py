@@ -69,6 +69,8 @@ class User(AbstractUser, PermissionsMixin):
     )
     
     last_login_at = models.DateTimeField(null=True, blank=True, verbose_name='最后登录时间')
+    # 停用、角色或管理权限变化时递增，使缓存的认证信息失效（见 users.authentication）
+    token_version = models.PositiveIntegerField(default=0, verbose_name='令牌版本')
 
     objects = UserManager()
 
@@ -80,6 +82,29 @@ class User(AbstractUser, PermissionsMixin):
     def __str__(self):
         return self.username or self.openid
 
+    def save(self, *args, **kwargs):
+        # 认证缓存构造的实例（users.authentication）：未改动的缓存字段不回写，
+        # 避免用 TTL 内的旧角色/启用状态覆盖数据库
+        principal = getattr(self, '_principal_values', None)
+        if principal and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.attname
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname in self.__dict__
+                and not (field.attname in principal and self.__dict__[field.attname] == principal[field.attname])
+            ]
+        super().save(*args, **kwargs)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        # 认证缓存构造的实例只带认证字段：首次访问其他字段时一次性加载全部延迟字段，
+        # 而不是每个字段各查一次
+        if fields is not None and getattr(self, '_principal_values', None):
+            deferred = self.get_deferred_fields()
+            if deferred.intersection(fields):
+                fields = set(fields) | deferred
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
 
 class Notification(models.Model):
     STATUS_CHOICES = [
@@ -362,6 +387,12 @@ class AccountStatement(models.Model):
             models.Index(fields=['credit_account', 'period_start', 'period_end']),
             models.Index(fields=['status']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['credit_account', 'period_start', 'period_end'],
+                name='uniq_statement_account_period',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.credit_account.user.username} - {self.period_start} 至 {self.period_end}"
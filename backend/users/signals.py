@@ -0,0 +1,28 @@
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from .authentication import SECURITY_FIELDS, bump_token_version
+from .models import User
+
+
+def _security_snapshot(instance):
+    # 只读已加载的字段，避免触发延迟字段的查询
+    return {field: instance.__dict__[field] for field in SECURITY_FIELDS if field in instance.__dict__}
+
+
+@receiver(post_init, sender=User)
+def remember_security_fields(sender, instance, **kwargs):
+    instance._security_snapshot = _security_snapshot(instance)
+
+
+@receiver(post_save, sender=User)
+def bump_token_version_on_security_change(sender, instance, created, **kwargs):
+    snapshot = _security_snapshot(instance)
+    previous = getattr(instance, '_security_snapshot', {})
+    instance._security_snapshot = snapshot
+    if created:
+        return
+    if any(field in previous and previous[field] != value for field, value in snapshot.items()):
+        bump_token_version([instance.pk])
+        # 以数据库中递增后的值为准，下次访问时重新加载
+        instance.__dict__.pop('token_version', None)
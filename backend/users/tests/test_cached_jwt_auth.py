@@ -0,0 +1,92 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from stores.models import Store, StoreMember
+from stores.permissions import is_platform_admin
+from users.authentication import CachedJWTAuthentication
+from users.models import User
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cached-auth', password='x', role='individual', phone='13800000000')
+        self.token = AccessToken.for_user(self.user)
+        self.factory = APIRequestFactory()
+
+    def authenticate(self):
+        request = self.factory.get('/api/users/me/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        return user
+
+    def test_cache_hit_needs_no_queries(self):
+        self.authenticate()
+
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.role, 'individual')
+            self.assertFalse(is_platform_admin(user))
+
+        # other fields are still available, all loaded together on first access
+        with self.assertNumQueries(1):
+            self.assertEqual(user.phone, '13800000000')
+            self.assertEqual(user.username, 'cached-auth')
+            self.assertIsNone(user.email)
+
+    def test_profile_with_cached_principal_loads_user_once(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(client.get('/api/user/profile/').status_code, 200)
+
+        # deferred user fields in one query, plus the company info lookup
+        with self.assertNumQueries(2):
+            response = client.get('/api/user/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['phone'], '13800000000')
+
+    def test_role_change_and_deactivation_invalidate_principal(self):
+        self.authenticate()
+
+        self.user.role = 'dealer'
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 1)
+        self.assertEqual(self.authenticate().role, 'dealer')
+
+        self.user.last_login_at = None
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.token_version, 1)
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_saving_cached_user_does_not_write_back_stale_flags(self):
+        self.authenticate()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        cached = self.authenticate()
+        cached.phone = '13900000000'
+        cached.save()
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(self.user.phone, '13900000000')
+
+    def test_membership_change_refreshes_platform_admin_flag(self):
+        self.assertFalse(is_platform_admin(self.authenticate()))
+
+        StoreMember.objects.create(
+            user=self.user,
+            store=Store.objects.get(code=Store.MAIN_STORE_CODE),
+            role=StoreMember.ROLE_PLATFORM_ADMIN,
+            status=StoreMember.STATUS_ACTIVE,
+        )
+
+        self.assertTrue(is_platform_admin(self.authenticate()))
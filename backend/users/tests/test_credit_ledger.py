@@ -0,0 +1,196 @@
+import io
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from users.credit_services import AccountStatementService, CreditAccountService
+from users.models import AccountStatement, AccountTransaction, CreditAccount, User
+
+
+def _retry_locked(fn, attempts=200):
+    # SQLite 共享缓存的内存测试库上并发写会直接报 "table is locked"（不走 busy timeout），
+    # 事务已整体回滚，重试即可；PostgreSQL 上不会触发。
+    for _ in range(attempts):
+        try:
+            return fn()
+        except OperationalError as exc:
+            if 'locked' not in str(exc):
+                raise
+            time.sleep(0.002)
+    raise AssertionError('database stayed locked')
+
+
+class CreditLedgerConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ledger-dealer', password='x', role='dealer')
+        self.account = CreditAccount.objects.create(
+            user=self.user,
+            credit_limit=Decimal('100000.00'),
+            payment_term_days=30,
+        )
+
+    def test_concurrent_purchases_do_not_lose_updates(self):
+        threads, per_thread = 6, 10
+        errors = []
+
+        def worker(index):
+            try:
+                for n in range(per_thread):
+                    # 每个线程持有自己的过期实例，模拟多个请求并发记账
+                    account = _retry_locked(lambda: CreditAccount.objects.get(pk=self.account.pk))
+                    _retry_locked(lambda: CreditAccountService.record_purchase(
+                        account, Decimal('10.00'), order_id=index * 100 + n,
+                    ))
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.outstanding_debt, Decimal('10.00') * threads * per_thread)
+        balances = list(
+            AccountTransaction.objects.filter(credit_account=self.account)
+            .order_by('id')
+            .values_list('balance_after', flat=True)
+        )
+        self.assertEqual(balances, [Decimal('10.00') * (i + 1) for i in range(threads * per_thread)])
+
+
+class CreditLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ledger-buyer', password='x', role='dealer')
+        self.account = CreditAccount.objects.create(
+            user=self.user,
+            credit_limit=Decimal('500.00'),
+            payment_term_days=30,
+        )
+
+    def test_stale_instances_apply_both_changes(self):
+        first = CreditAccount.objects.get(pk=self.account.pk)
+        second = CreditAccount.objects.get(pk=self.account.pk)
+
+        CreditAccountService.record_purchase(first, Decimal('120.00'), order_id=1)
+        trans = CreditAccountService.record_purchase(second, Decimal('80.00'), order_id=2)
+        refund = CreditAccountService.record_refund(first, Decimal('500.00'), order_id=1)
+
+        self.assertEqual(trans.balance_after, Decimal('200.00'))
+        self.assertEqual(refund.balance_after, Decimal('0.00'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.outstanding_debt, Decimal('0.00'))
+
+    def test_purchase_over_limit_is_rejected_atomically(self):
+        CreditAccountService.record_purchase(self.account, Decimal('450.00'), order_id=1)
+        stale = CreditAccount.objects.get(pk=self.account.pk)
+        stale.outstanding_debt = Decimal('0.00')
+
+        with self.assertRaises(ValueError):
+            CreditAccountService.record_purchase(stale, Decimal('60.00'), order_id=2)
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.outstanding_debt, Decimal('450.00'))
+        self.assertEqual(AccountTransaction.objects.filter(credit_account=self.account).count(), 1)
+
+    def test_statement_totals_and_settlement(self):
+        CreditAccountService.record_purchase(self.account, Decimal('300.00'), order_id=1)
+        CreditAccountService.record_purchase(self.account, Decimal('100.00'), order_id=2)
+        CreditAccountService.record_refund(self.account, Decimal('50.00'), order_id=2)
+        CreditAccountService.record_payment(self.account, Decimal('300.00'))
+
+        today = timezone.localdate()
+        with self.assertNumQueries(7):
+            statement = AccountStatementService.generate_statement(self.account, today.replace(day=1), today)
+
+        self.assertEqual(statement.current_purchases, Decimal('400.00'))
+        self.assertEqual(statement.current_refunds, Decimal('50.00'))
+        self.assertEqual(statement.current_payments, Decimal('300.00'))
+        self.assertEqual(statement.period_end_balance, Decimal('50.00'))
+        self.assertEqual(statement.paid_within_term, Decimal('300.00'))
+
+        AccountStatementService.settle_statement(statement)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.outstanding_debt, Decimal('0.00'))
+        self.assertTrue(
+            AccountTransaction.objects.filter(statement=statement, transaction_type='payment').exists()
+        )
+        with self.assertRaises(ValueError):
+            AccountStatementService.settle_statement(statement)
+
+
+class CreditMaintenanceCommandTests(TestCase):
+    def setUp(self):
+        self.accounts = [
+            CreditAccount.objects.create(
+                user=User.objects.create_user(username=f'month-end-{i}', password='x', role='dealer'),
+                credit_limit=Decimal('1000.00'),
+                payment_term_days=30,
+            )
+            for i in range(4)
+        ]
+        self.today = timezone.localdate()
+        self.period = (self.today.replace(day=1), self.today)
+
+    def run_job(self, *extra):
+        out = io.StringIO()
+        call_command(
+            'run_credit_maintenance',
+            '--period-start', str(self.period[0]),
+            '--period-end', str(self.period[1]),
+            '--chunk-size', '2',
+            *extra,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def test_marks_overdue_and_generates_statements_idempotently(self):
+        busy, paid_up, already, idle = self.accounts
+        late = CreditAccountService.record_purchase(busy, Decimal('200.00'), order_id=1)
+        AccountTransaction.objects.filter(pk=late.pk).update(due_date=self.today - timedelta(days=1))
+        CreditAccountService.record_purchase(paid_up, Decimal('80.00'), order_id=2)
+        CreditAccountService.record_payment(paid_up, Decimal('80.00'))
+        existing = AccountStatementService.generate_statement(already, *self.period)
+
+        output = self.run_job()
+
+        late.refresh_from_db()
+        self.assertEqual(late.payment_status, 'overdue')
+        self.assertIn('Overdue: 1 transactions', output)
+        self.assertIn('Chunk 2: accounts', output)
+        self.assertIn('created=2 existing=1 empty=1', output)
+
+        statement = AccountStatement.objects.get(credit_account=busy, period_start=self.period[0])
+        self.assertEqual(statement.current_purchases, Decimal('200.00'))
+        self.assertEqual(statement.overdue_amount, Decimal('200.00'))
+        self.assertEqual(statement.transactions.get(), late)
+        self.assertEqual(
+            AccountStatement.objects.get(credit_account=paid_up).period_end_balance,
+            Decimal('0.00'),
+        )
+        self.assertFalse(AccountStatement.objects.filter(credit_account=idle).exists())
+        self.assertEqual(AccountStatement.objects.filter(credit_account=already).get(), existing)
+
+        self.assertIn('created=0 existing=3 empty=1', self.run_job('--skip-overdue'))
+        self.assertEqual(AccountStatement.objects.count(), 3)
+
+    def test_resumes_after_account_id(self):
+        for account in self.accounts:
+            CreditAccountService.record_purchase(account, Decimal('10.00'), order_id=account.pk)
+
+        self.run_job('--skip-overdue', '--after-id', str(self.accounts[1].pk))
+
+        self.assertEqual(
+            set(AccountStatement.objects.values_list('credit_account_id', flat=True)),
+            {self.accounts[2].pk, self.accounts[3].pk},
+        )
@@ -5,6 +5,8 @@ from django.test import TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from common.throttle_store import get_throttle_store
+from integrations.wechat_token import WeChatAccessTokenBroker, reset_access_token_brokers
 from users.models import User
 
 
@@ -22,6 +24,12 @@ class WeChatExplicitLoginTests(TestCase):
 
     def setUp(self):
         cache.clear()
+        get_throttle_store().clear()
+        reset_access_token_brokers()
+        self.addCleanup(reset_access_token_brokers)
+        token_patcher = patch.object(WeChatAccessTokenBroker, "_fetch", return_value=("access-token", 7200))
+        self.token_fetch = token_patcher.start()
+        self.addCleanup(token_patcher.stop)
         self.client = APIClient()
 
     @patch("users.views.requests.get")
@@ -43,9 +51,7 @@ class WeChatExplicitLoginTests(TestCase):
     ):
         mock_get.side_effect = [
             MockWechatResponse({"openid": "openid-1", "session_key": "session-key"}),
-            MockWechatResponse({"access_token": "access-token", "expires_in": 7200}),
             MockWechatResponse({"openid": "openid-1", "session_key": "session-key"}),
-            MockWechatResponse({"access_token": "access-token", "expires_in": 7200}),
         ]
         mock_post.return_value = MockWechatResponse(
             {"errcode": 0, "phone_info": {"phoneNumber": "13800138000"}}
@@ -64,6 +70,7 @@ class WeChatExplicitLoginTests(TestCase):
 
         self.assertEqual(first.status_code, status.HTTP_200_OK)
         self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.token_fetch.call_count, 1)
         self.assertIn("access", first.data)
         self.assertIn("refresh", first.data)
         self.assertEqual(first.data["user"]["phone"], "13800138000")
@@ -80,9 +87,7 @@ class WeChatExplicitLoginTests(TestCase):
     ):
         mock_get.side_effect = [
             MockWechatResponse({"openid": "openid-old", "session_key": "session-key"}),
-            MockWechatResponse({"access_token": "access-token", "expires_in": 7200}),
             MockWechatResponse({"openid": "openid-new", "session_key": "session-key"}),
-            MockWechatResponse({"access_token": "access-token", "expires_in": 7200}),
         ]
         mock_post.return_value = MockWechatResponse(
             {"errcode": 0, "phone_info": {"phoneNumber": "13800138000"}}
@@ -124,7 +129,6 @@ class WeChatExplicitLoginTests(TestCase):
         )
         mock_get.side_effect = [
             MockWechatResponse({"openid": "openid-current", "session_key": "session-key"}),
-            MockWechatResponse({"access_token": "access-token", "expires_in": 7200}),
         ]
         mock_post.return_value = MockWechatResponse(
             {"errcode": 0, "phone_info": {"phoneNumber": "13800138000"}}
@@ -153,7 +157,6 @@ class WeChatExplicitLoginTests(TestCase):
     ):
         mock_get.side_effect = [
             MockWechatResponse({"openid": "openid-default-name", "session_key": "session-key"}),
-            MockWechatResponse({"access_token": "access-token", "expires_in": 7200}),
         ]
         mock_post.return_value = MockWechatResponse(
             {"errcode": 0, "phone_info": {"phoneNumber": "13900139000"}}
@@ -176,6 +179,7 @@ class WeChatExplicitLoginDevelopmentTests(TestCase):
 
     def setUp(self):
         cache.clear()
+        get_throttle_store().clear()
         self.client = APIClient()
 
     def test_debug_mode_without_wechat_credentials_returns_service_unavailable(self):
@@ -32,10 +32,12 @@ from common.address_parser import address_parser
 from common.utils import to_bool
 from common.excel import build_excel_response
 from common.pagination import SmallResultsSetPagination
+from common.search import SubstringSearchFilter, substring_q
 from common.serializers import EmptySerializer
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes as OT
 from stores.permissions import is_platform_admin
+from integrations.wechat_token import WeChatAccessTokenError, get_access_token_broker
 
 
 # Create your views here.
@@ -228,12 +230,17 @@ class WeChatMiniProgramAuthService:
                 status.HTTP_503_SERVICE_UNAVAILABLE,
             )
 
-        access_token = self._get_access_token()
-        response = requests.post(
-            f"https://api.weixin.qq.com/wxa/business/getuserphonenumber?access_token={access_token}",
-            json={"code": phone_code},
-            timeout=10,
-        )
+        broker = self._token_broker()
+        try:
+            response = broker.call(
+                lambda access_token: requests.post(
+                    f"https://api.weixin.qq.com/wxa/business/getuserphonenumber?access_token={access_token}",
+                    json={"code": phone_code},
+                    timeout=10,
+                )
+            )
+        except WeChatAccessTokenError as exc:
+            raise self._token_error(exc)
         data = response.json()
         self._raise_for_wechat_error(data, "WeChat phone API error")
 
@@ -247,32 +254,27 @@ class WeChatMiniProgramAuthService:
             )
         return phone_number
 
-    def _get_access_token(self):
+    def _token_broker(self):
         if not self.appid or not self.secret:
             raise WeChatAuthError(
                 "WeChat credentials are not configured",
                 status.HTTP_503_SERVICE_UNAVAILABLE,
             )
+        return get_access_token_broker(self.appid, self.secret)
 
-        response = requests.get(
-            "https://api.weixin.qq.com/cgi-bin/token",
-            params={
-                "grant_type": "client_credential",
-                "appid": self.appid,
-                "secret": self.secret,
-            },
-            timeout=10,
-        )
-        data = response.json()
-        self._raise_for_wechat_error(data, "WeChat access token API error")
-        access_token = data.get("access_token")
-        if not access_token:
-            raise WeChatAuthError(
-                "Invalid WeChat access token response",
-                status.HTTP_502_BAD_GATEWAY,
-                {"response": data},
+    def _token_error(self, exc):
+        errcode = exc.data.get("errcode")
+        if errcode not in (None, 0, "0"):
+            return WeChatAuthError(
+                "WeChat access token API error",
+                status.HTTP_400_BAD_REQUEST,
+                {"errcode": errcode, "errmsg": exc.data.get("errmsg", "Unknown error")},
             )
-        return access_token
+        return WeChatAuthError(
+            "Invalid WeChat access token response",
+            status.HTTP_502_BAD_GATEWAY,
+            {"response": exc.data},
+        )
 
     def _raise_for_wechat_error(self, data, message):
         errcode = data.get("errcode")
@@ -770,23 +772,21 @@ class AdminUserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
+    # 统一搜索：在用户名或 OpenID 上模糊匹配；支持按手机号模糊查询
+    filter_backends = [SubstringSearchFilter]
+    substring_search_fields = {
+        'search': ('username', 'openid'),
+        'phone': ('phone',),
+    }
 
     def get_queryset(self):
         qs = super().get_queryset()
-        # 统一搜索：在用户名或 OpenID 上模糊匹配
-        search = self.request.query_params.get('search')
-        if search:
-            qs = qs.filter(Q(username__icontains=search) | Q(openid__icontains=search))
-        # 新增：支持按手机号模糊查询
-        phone = self.request.query_params.get('phone')
-        if phone:
-            qs = qs.filter(phone__icontains=phone)
         # 公司名筛选
         company_name = self.request.query_params.get('company_name')
         if company_name:
             qs = qs.filter(
+                substring_q(User, ('company_info__company_name',), company_name),
                 company_info__status='approved',
-                company_info__company_name__icontains=company_name,
             )
         # 管理员筛选：支持 true/false/1/0/布尔
         is_staff = self.request.query_params.get('is_staff')
@@ -892,6 +892,7 @@ class AdminUserViewSet(viewsets.ModelViewSet):
             CartItem,
             DiscountTarget,
         )
+        from orders.discounts import invalidate_discount_rules
         from support.models import SupportConversation, SupportMessage
         from catalog.models import SearchLog, InventoryLog
 
@@ -926,6 +927,7 @@ class AdminUserViewSet(viewsets.ModelViewSet):
                 Notification.objects.filter(user=user).delete()
                 Address.objects.filter(user=user).delete()
                 DiscountTarget.objects.filter(user=user).delete()
+                invalidate_discount_rules([user.id])
 
                 # 购物车
                 CartItem.objects.filter(cart__user=user).delete()
@@ -1964,36 +1966,18 @@ class AccountStatementViewSet(viewsets.ModelViewSet):
         """结清对账单"""
         from django.utils import timezone
         
+        from .credit_services import AccountStatementService
+        
         statement = self.get_object()
         
-        if statement.status == 'settled':
+        try:
+            AccountStatementService.settle_statement(statement)
+        except ValueError as e:
             return Response(
-                {"error": "对账单已结清"},
+                {"error": str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        statement.status = 'settled'
-        statement.settled_at = timezone.now()
-        statement.save()
-        
-        # Update credit account outstanding debt
         credit_account = statement.credit_account
-        credit_account.outstanding_debt -= statement.period_end_balance
-        if credit_account.outstanding_debt < 0:
-            credit_account.outstanding_debt = 0
-        credit_account.save()
-        
-        # Create payment transaction
-        AccountTransaction.objects.create(
-            credit_account=credit_account,
-            statement=statement,
-            transaction_type='payment',
-            amount=statement.period_end_balance,
-            balance_after=credit_account.outstanding_debt,
-            payment_status='paid',
-            paid_date=timezone.now().date(),
-            description=f'对账单结算: {statement.period_start} 至 {statement.period_end}'
-        )
 
         try:
             from users.services import create_notification
@@ -83,7 +83,7 @@ export const productService = {
 
   // 获取推荐商品
   async getRecommendations(params?: {
-    type?: 'popular' | 'category' | 'trending'
+    type?: 'personal' | 'popular' | 'category' | 'trending'
     limit?: number
     category_id?: number
   }): Promise<Product[]> {
@@ -92,7 +92,8 @@ export const productService = {
   
   // 获取相关商品
   async getRelatedProducts(id: number, limit = 10): Promise<Product[]> {
-    return http.get<Product[]>(`/catalog/products/${id}/related/`, { limit })
+    const res = await http.get<{ results: Product[]; next_cursor: string | null }>(`/catalog/products/${id}/related/`, { limit })
+    return res.results || []
   },
   
 
@@ -413,18 +413,10 @@ export default function Support() {
     },
     {
       title: '最新消息',
-      dataIndex: 'last_message',
+      dataIndex: 'last_message_preview',
       ellipsis: true,
       search: false,
-      render: (_, record) => {
-        const msg = record.last_message;
-        if (!msg) return '-';
-        if (msg.attachment_type === 'image') return '[图片]';
-        if (msg.attachment_type === 'video') return '[视频]';
-        if (msg.order_info) return '[订单]';
-        if (msg.product_info) return '[商品]';
-        return msg.content;
-      }
+      render: (_, record) => record.last_message_preview || '-',
     },
     {
       title: '更新时间',
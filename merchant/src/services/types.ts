@@ -509,8 +509,12 @@ export interface SupportConversation {
   user_username: string;
   created_at: string;
   updated_at: string;
-  last_message?: SupportMessage;
-  last_message_at?: string;
+  last_message?: Pick<SupportMessage, 'role' | 'content' | 'created_at'> | null;
+  last_message_at?: string | null;
+  last_message_role?: string;
+  last_message_preview?: string;
+  user_unread_count?: number;
+  staff_unread_count?: number;
 }
 
 export type SupportTicket = SupportConversation; // Alias for backward compatibility during refactor